@@ -11,11 +11,173 @@
 
 from __future__ import absolute_import, division, print_function
 
+import hashlib
+import json
+import logging
+import os
+import struct
+import sys
+
+logger = logging.getLogger(__name__)
+
+# The identifier at the start of a mapped model file
+MAPPED_MODEL_MAGIC = b"DIALSGM1"
+
+
+def content_hash(filename, chunk_size=1 << 20):
+    """
+    Compute the sha256 hash of the content of a file
+
+    """
+    h = hashlib.sha256()
+    with open(filename, "rb") as infile:
+        for chunk in iter(lambda: infile.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def write_mapped_model(model, filename, source_hash=None):
+    """
+    Write a static background model as raw arrays which can be memory mapped.
+
+    The file has an 8 byte identifier, the 8 byte length of a json header
+    giving the byte offset and shape of each panel's data, and then the
+    data itself as native doubles aligned to 8 bytes. The file is written to a
+    temporary name and renamed, so processes reading it never see it partially
+    written.
+
+    :param model: The StaticBackgroundModel
+    :param filename: The output filename
+    :param source_hash: The content hash of the file the model came from
+
+    """
+    shapes = [model.data(i).all() for i in range(len(model))]
+    header = {
+        "byteorder": sys.byteorder,
+        "source_hash": source_hash,
+        "shapes": shapes,
+        "offsets": [0] * len(shapes),
+    }
+
+    # Compute the offsets of the data for each panel, leaving room in the
+    # header for the offsets themselves
+    header_size = len(json.dumps(header)) + 20 * len(shapes)
+    offset = len(MAPPED_MODEL_MAGIC) + 8 + header_size
+    offset += -offset % 8
+    for i, (ysize, xsize) in enumerate(shapes):
+        header["offsets"][i] = offset
+        offset += ysize * xsize * 8
+    text = json.dumps(header).encode("ascii")
+    assert len(text) <= header_size
+    text += b" " * (header_size - len(text))
+
+    temp_filename = "%s.%d.tmp" % (filename, os.getpid())
+    with open(temp_filename, "wb") as outfile:
+        outfile.write(MAPPED_MODEL_MAGIC)
+        outfile.write(struct.pack("<Q", len(text)))
+        outfile.write(text)
+        for i, offset in enumerate(header["offsets"]):
+            outfile.write(b"\0" * (offset - outfile.tell()))
+            outfile.write(model.data(i).copy_to_byte_str())
+    os.rename(temp_filename, filename)
+
+
+def read_mapped_model_header(infile):
+    """
+    Read the header of a mapped model file, or return None if the file is not
+    a mapped model
+
+    """
+    if infile.read(len(MAPPED_MODEL_MAGIC)) != MAPPED_MODEL_MAGIC:
+        return None
+    (length,) = struct.unpack("<Q", infile.read(8))
+    return json.loads(infile.read(length).decode("ascii"))
+
+
+def load_mapped_model(filename, source_hash=None):
+    """
+    Memory map a mapped model file read-only, so all processes share the same
+    pages of memory. Return None if the file is not a valid mapped model for
+    the given source hash, or cannot be mapped.
+
+    """
+    from dials.algorithms.background.gmodel import MappedBackgroundModel
+
+    with open(filename, "rb") as infile:
+        header = read_mapped_model_header(infile)
+        if header is None or header["byteorder"] != sys.byteorder:
+            return None
+        if source_hash is not None and header["source_hash"] != source_hash:
+            return None
+        end = max(
+            [o + y * x * 8 for o, (y, x) in zip(header["offsets"], header["shapes"])]
+            + [0]
+        )
+        if os.fstat(infile.fileno()).st_size < end:
+            return None
+    try:
+        return MappedBackgroundModel(
+            filename, list(header["offsets"]), [tuple(s) for s in header["shapes"]]
+        )
+    except RuntimeError as e:
+        logger.warning("Unable to map background model %s: %s", filename, e)
+        return None
+
+
+def is_mapped_model(filename):
+    """
+    Return True if the file is a mapped model file
+
+    """
+    with open(filename, "rb") as infile:
+        return infile.read(len(MAPPED_MODEL_MAGIC)) == MAPPED_MODEL_MAGIC
+
+
+def mapped_model_filename(name):
+    """
+    Get the name of a mapped model file for a model, creating the mapped copy
+    of a pickled model if it is missing or stale. This hashes the pickle, so
+    it is done once in the parent process and the name of the mapped file
+    passed to the workers, which map it directly. If the mapped copy cannot be
+    written the name of the pickle is returned.
+
+    """
+    import six.moves.cPickle as pickle
+
+    if is_mapped_model(name):
+        return name
+
+    # A pickle with a valid mapped copy
+    source_hash = content_hash(name)
+    mapped_name = name + ".mapped"
+    if os.path.exists(mapped_name):
+        with open(mapped_name, "rb") as infile:
+            header = read_mapped_model_header(infile)
+        if header is not None and header["source_hash"] == source_hash:
+            return mapped_name
+
+    with open(name, "rb") as infile:
+        model = pickle.load(infile)
+
+    # Create the mapped copy for later processes
+    try:
+        write_mapped_model(model, mapped_name, source_hash)
+    except (IOError, OSError) as e:
+        logger.warning("Unable to write mapped background model: %s", e)
+        return name
+    return mapped_name
+
 
 class ModelCache(object):
     """
     A class to cache the model
 
+    Pickled models are converted once to a mapped model file next to the
+    pickle, named with the extension .mapped, and this is memory mapped by each
+    process instead of unpickling a copy of the model. The mapped file records
+    the content hash of the pickle and is recreated if this does not match.
+    Mapped model files can also be given directly as the model.
+
     """
 
     def __init__(self):
@@ -35,13 +197,30 @@ def get(self, name):
         try:
             model = self.model[name]
         except KeyError:
-            import six.moves.cPickle as pickle
-
-            with open(name, "rb") as infile:
-                model = pickle.load(infile)
-                self.model[name] = model
+            model = self.load(name)
+            self.model[name] = model
         return model
 
+    def load(self, name):
+        """
+        Load the model from a mapped model file or from a pickle
+
+        """
+        import six.moves.cPickle as pickle
+
+        # A mapped model file given directly, or the mapped copy of a pickle,
+        # falling back to unpickling the model if it cannot be mapped
+        mapped_name = mapped_model_filename(name)
+        if is_mapped_model(mapped_name):
+            model = load_mapped_model(mapped_name)
+            if model is not None:
+                return model
+            if mapped_name == name:
+                raise RuntimeError("Unable to load background model %s" % name)
+
+        with open(name, "rb") as infile:
+            return pickle.load(infile)
+
 
 # Instance of the model cache
 global_model_cache = ModelCache()
@@ -8,8 +8,11 @@
  *  This code is distributed under the BSD license, a copy of which is
  *  included in the root directory of this package.
  */
+#include <string>
 #include <boost/python.hpp>
 #include <boost/python/def.hpp>
+#include <boost/interprocess/file_mapping.hpp>
+#include <boost/interprocess/mapped_region.hpp>
 #include <dials/algorithms/background/gmodel/creator.h>
 #include <dials/algorithms/background/gmodel/model.h>
 #include <dials/algorithms/background/gmodel/polar_transform.h>
@@ -44,6 +47,41 @@ namespace dials { namespace algorithms { namespace background {
     }
   };
 
+  /**
+   * A mapped background model viewing the data in a file mapped read-only
+   * into memory, so all processes mapping the same file share the same pages.
+   * The file is mapped until the model is destroyed.
+   */
+  class FileBackgroundModel : public MappedBackgroundModel {
+  public:
+
+    FileBackgroundModel(
+          const std::string &filename,
+          boost::python::list offsets,
+          boost::python::list shapes)
+      : file_(filename.c_str(), boost::interprocess::read_only),
+        region_(file_, boost::interprocess::read_only) {
+      DIALS_ASSERT(boost::python::len(offsets) == boost::python::len(shapes));
+      const char *begin = static_cast<const char*>(region_.get_address());
+      std::size_t size = region_.get_size();
+      for (std::size_t i = 0; i < boost::python::len(offsets); ++i) {
+        std::size_t offset = boost::python::extract<std::size_t>(offsets[i]);
+        std::size_t ysize = boost::python::extract<std::size_t>(shapes[i][0]);
+        std::size_t xsize = boost::python::extract<std::size_t>(shapes[i][1]);
+        if (offset % sizeof(double) != 0 ||
+            offset + ysize * xsize * sizeof(double) > size) {
+          DIALS_ERROR("Background model data outside of file");
+        }
+        add(reinterpret_cast<const double*>(begin + offset), ysize, xsize);
+      }
+    }
+
+  private:
+
+    boost::interprocess::file_mapping file_;
+    boost::interprocess::mapped_region region_;
+  };
+
   BOOST_PYTHON_MODULE(dials_algorithms_background_gmodel_ext)
   {
     class_<PolarTransformResult>("PolarTransfrormResult", no_init)
@@ -75,6 +113,20 @@ namespace dials { namespace algorithms { namespace background {
       .def_pickle(StaticBackgroundModelPickleSuite())
       ;
 
+    class_< FileBackgroundModel,
+            bases<BackgroundModel>,
+            boost::noncopyable >("MappedBackgroundModel", no_init)
+      .def(init<
+          const std::string&,
+          boost::python::list,
+          boost::python::list>((
+              arg("filename"),
+              arg("offsets"),
+              arg("shapes"))))
+      .def("__len__", &FileBackgroundModel::size)
+      .def("data", &FileBackgroundModel::data)
+      ;
+
     class_<GModelBackgroundCreator> creator("Creator", no_init);
     creator
       .def(init<
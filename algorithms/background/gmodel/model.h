@@ -12,6 +12,7 @@
 #ifndef DIALS_ALGORITHMS_BACKGROUND_GLM_MODEL_H
 #define DIALS_ALGORITHMS_BACKGROUND_GLM_MODEL_H
 
+#include <vector>
 #include <dials/array_family/scitbx_shared_and_versa.h>
 #include <dials/error.h>
 
@@ -29,6 +30,43 @@ namespace dials { namespace algorithms {
   };
 
 
+  /**
+   * Extract a shoebox from a static background model image
+   * @param data The model image for the panel
+   * @param bbox The bounding box
+   * @returns The model data
+   */
+  inline
+  af::versa< double, af::c_grid<3> > extract_static_model(
+      const af::const_ref< double, af::c_grid<2> > &data,
+      int6 bbox) {
+    DIALS_ASSERT(bbox[1] > bbox[0]);
+    DIALS_ASSERT(bbox[3] > bbox[2]);
+    DIALS_ASSERT(bbox[5] > bbox[4]);
+    af::c_grid<3> grid(
+        bbox[5]-bbox[4],
+        bbox[3]-bbox[2],
+        bbox[1]-bbox[0]);
+    af::versa< double, af::c_grid<3> > result(grid, 0);
+    for (std::size_t j = 0; j < result.accessor()[1]; ++j) {
+      for (std::size_t i = 0; i < result.accessor()[2]; ++i) {
+        int ii = bbox[0] + i;
+        int jj = bbox[2] + j;
+        if (ii >= 0 &&
+            jj >= 0 &&
+            ii < data.accessor()[1] &&
+            jj < data.accessor()[0]) {
+          double value = data(jj,ii);
+          for (std::size_t k = 0; k < result.accessor()[0]; ++k) {
+            result(k,j,i) = value;
+          }
+        }
+      }
+    }
+    return result;
+  }
+
+
   /**
    * A simple static background model
    */
@@ -45,31 +83,7 @@ namespace dials { namespace algorithms {
     virtual
     af::versa< double, af::c_grid<3> > extract(std::size_t panel, int6 bbox) const {
       DIALS_ASSERT(panel < data_.size());
-      DIALS_ASSERT(bbox[1] > bbox[0]);
-      DIALS_ASSERT(bbox[3] > bbox[2]);
-      DIALS_ASSERT(bbox[5] > bbox[4]);
-      af::c_grid<3> grid(
-          bbox[5]-bbox[4],
-          bbox[3]-bbox[2],
-          bbox[1]-bbox[0]);
-      af::versa< double, af::c_grid<3> > result(grid, 0);
-      af::const_ref< double, af::c_grid<2> > data = data_[panel].const_ref();
-      for (std::size_t j = 0; j < result.accessor()[1]; ++j) {
-        for (std::size_t i = 0; i < result.accessor()[2]; ++i) {
-          int ii = bbox[0] + i;
-          int jj = bbox[2] + j;
-          if (ii >= 0 &&
-              jj >= 0 &&
-              ii < data.accessor()[1] &&
-              jj < data.accessor()[0]) {
-            double value = data(jj,ii);
-            for (std::size_t k = 0; k < result.accessor()[0]; ++k) {
-              result(k,j,i) = value;
-            }
-          }
-        }
-      }
-      return result;
+      return extract_static_model(data_[panel].const_ref(), bbox);
     }
 
     /**
@@ -104,6 +118,65 @@ namespace dials { namespace algorithms {
 
   };
 
+
+  /**
+   * A static background model which does not own its data. The model images
+   * are views of memory owned elsewhere, such as a read-only memory mapped
+   * file shared by several processes. The owner must outlive the model.
+   */
+  class MappedBackgroundModel : public BackgroundModel {
+  public:
+
+    MappedBackgroundModel() {}
+
+    /**
+     * Extract a shoebox
+     * @param bbox The bounding box
+     * @returns The model data
+     */
+    virtual
+    af::versa< double, af::c_grid<3> > extract(std::size_t panel, int6 bbox) const {
+      DIALS_ASSERT(panel < data_.size());
+      return extract_static_model(data_[panel], bbox);
+    }
+
+    /**
+     * Add a view of the background model for a panel
+     * @param data Pointer to the model data
+     * @param ysize The number of rows
+     * @param xsize The number of columns
+     */
+    void add(const double *data, std::size_t ysize, std::size_t xsize) {
+      DIALS_ASSERT(data != NULL);
+      data_.push_back(
+          af::const_ref< double, af::c_grid<2> >(
+            data, af::c_grid<2>(ysize, xsize)));
+    }
+
+    /**
+     * The number of panels
+     */
+    std::size_t size() const {
+      return data_.size();
+    }
+
+    /**
+     * Get a copy of the data array
+     * @returns The data array
+     */
+    af::versa< double, af::c_grid<2> > data(std::size_t panel) const {
+      DIALS_ASSERT(panel < size());
+      af::versa< double, af::c_grid<2> > result(data_[panel].accessor());
+      std::copy(data_[panel].begin(), data_[panel].end(), result.begin());
+      return result;
+    }
+
+  protected:
+
+    std::vector< af::const_ref< double, af::c_grid<2> > > data_;
+
+  };
+
 }} // namespace dials::algorithms
 
 #endif // DIALS_ALGORITHMS_BACKGROUND_GLM_MODEL_H
@@ -1,5 +1,6 @@
 from __future__ import absolute_import, division, print_function
 import random
+import pytest
 from cctbx import sgtbx
 from scitbx.array_family import flex
 from dials.algorithms.clustering.unit_cell import UnitCellCluster
@@ -17,3 +18,48 @@ def test_unit_cell():
         crystal_symmetries, lattice_ids=lattice_ids
     )
     clusters, dendrogram, _ = ucs.ab_cluster(write_file_lists=False, doplot=False)
+
+
+def test_unit_cell_sparse():
+    # the clusters are unchanged by calculating single linkage from a spanning
+    # tree of the unit cells
+    sgi = sgtbx.space_group_info("P1")
+    crystal_symmetries = [
+        sgi.any_compatible_crystal_symmetry(volume=random.uniform(990, 1010))
+        for i in range(20)
+    ]
+    lattice_ids = flex.int_range(0, len(crystal_symmetries)).as_string()
+    ucs = UnitCellCluster.from_crystal_symmetries(
+        crystal_symmetries, lattice_ids=lattice_ids
+    )
+    expected, _, _ = ucs.ab_cluster(threshold=10, write_file_lists=False, doplot=False)
+    for approximate in (False, True):
+        clusters, dendrogram, _ = ucs.ab_cluster(
+            threshold=10,
+            write_file_lists=False,
+            doplot=False,
+            approximate=approximate,
+            storage="sparse",
+        )
+        assert sorted(len(c.members) for c in clusters) == sorted(
+            len(c.members) for c in expected
+        )
+
+
+def test_unit_cell_sparse_requires_single_linkage():
+    sgi = sgtbx.space_group_info("P1")
+    crystal_symmetries = [
+        sgi.any_compatible_crystal_symmetry(volume=random.uniform(990, 1010))
+        for i in range(5)
+    ]
+    lattice_ids = flex.int_range(0, len(crystal_symmetries)).as_string()
+    ucs = UnitCellCluster.from_crystal_symmetries(
+        crystal_symmetries, lattice_ids=lattice_ids
+    )
+    with pytest.raises(ValueError):
+        ucs.ab_cluster(
+            linkage_method="average",
+            write_file_lists=False,
+            doplot=False,
+            storage="sparse",
+        )
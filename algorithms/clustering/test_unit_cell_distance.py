@@ -0,0 +1,144 @@
+from __future__ import absolute_import, division, print_function
+
+import math
+import time
+
+import numpy as np
+import pytest
+
+from cctbx import sgtbx, uctbx
+from cctbx.uctbx.determine_unit_cell import NCDist
+from dials.algorithms.clustering import unit_cell_distance
+
+
+def g6_cells(n, seed=0):
+    """Random Niggli-reduced cells in G6 form, about three unit cells"""
+    rs = np.random.RandomState(seed)
+    cells = [
+        sgtbx.space_group_info(symbol)
+        .any_compatible_crystal_symmetry(volume=volume)
+        .unit_cell()
+        .parameters()
+        for symbol, volume in (("P212121", 2e5), ("C2", 3e5), ("I23", 5e5))
+    ]
+    g6 = []
+    for i in rs.randint(len(cells), size=n):
+        a, b, c, alpha, beta, gamma = (
+            uctbx.unit_cell([p * (1 + rs.normal(0, 0.005)) for p in cells[i]])
+            .niggli_cell()
+            .parameters()
+        )
+        alpha, beta, gamma = (math.radians(x) for x in (alpha, beta, gamma))
+        g6.append(
+            (
+                a * a,
+                b * b,
+                c * c,
+                2 * b * c * math.cos(alpha),
+                2 * a * c * math.cos(beta),
+                2 * a * b * math.cos(gamma),
+            )
+        )
+    return np.array(g6)
+
+
+def same_clusters(a, b):
+    return len(set(a)) == len(set(b)) == len(set(zip(a, b)))
+
+
+def test_lower_bounds():
+    g6 = g6_cells(100)
+    i, j = np.triu_indices(len(g6), 1)
+    bounds = unit_cell_distance.lower_bounds(g6, i, j)
+    distances = np.array([NCDist(g6[a], g6[b]) for a, b in zip(i, j)])
+    assert (bounds <= distances * (1 + 1e-12)).all()
+
+
+@pytest.mark.parametrize("nproc", [1, 2])
+def test_ncdist_condensed(nproc, monkeypatch):
+    hierarchy = pytest.importorskip("scipy.cluster.hierarchy")
+    from scipy.spatial.distance import pdist
+
+    g6 = g6_cells(120)
+    expected = pdist(g6, metric=lambda a, b: NCDist(a, b))
+    monkeypatch.setattr(unit_cell_distance, "PAIRS_PER_CHUNK", 500)
+    distances = unit_cell_distance.ncdist_condensed(g6, nproc=nproc)
+    assert distances == pytest.approx(expected)
+
+    # The clusters at the threshold are unchanged by the approximation
+    approximate = unit_cell_distance.ncdist_condensed(g6, nproc=nproc, threshold=500)
+    assert approximate[expected <= 500] == pytest.approx(expected[expected <= 500])
+    assert (approximate <= expected * (1 + 1e-12)).all()
+    for method in ("single", "complete"):
+        assert same_clusters(
+            hierarchy.fcluster(hierarchy.linkage(expected, method), 500, "distance"),
+            hierarchy.fcluster(hierarchy.linkage(approximate, method), 500, "distance"),
+        )
+
+
+@pytest.mark.parametrize("nproc", [1, 2])
+def test_single_linkage(nproc, monkeypatch):
+    hierarchy = pytest.importorskip("scipy.cluster.hierarchy")
+    from scipy.spatial.distance import pdist
+
+    g6 = g6_cells(120)
+    expected = hierarchy.linkage(pdist(g6, metric=lambda a, b: NCDist(a, b)), "single")
+    monkeypatch.setattr(unit_cell_distance, "MIN_PAIRS_PER_PROCESS", 10)
+    monkeypatch.setattr(unit_cell_distance, "NEAREST_NEIGHBOURS", 3)
+
+    # The minimum spanning tree gives the same linkage
+    linkage = unit_cell_distance.single_linkage(
+        len(g6), unit_cell_distance.ncdist_minimum_spanning_tree(g6, nproc=nproc)
+    )
+    assert hierarchy.is_valid_linkage(linkage)
+    assert linkage[:, 2] == pytest.approx(expected[:, 2])
+    for threshold in (100, 500, 5000):
+        assert same_clusters(
+            hierarchy.fcluster(expected, threshold, "distance"),
+            hierarchy.fcluster(linkage, threshold, "distance"),
+        )
+
+    # The tree of the clusters at a threshold gives the same clusters at the
+    # threshold
+    for threshold in (100, 500, 5000):
+        linkage = unit_cell_distance.single_linkage(
+            len(g6),
+            unit_cell_distance.ncdist_threshold_tree(g6, threshold, nproc=nproc),
+        )
+        assert hierarchy.is_valid_linkage(linkage)
+        assert same_clusters(
+            hierarchy.fcluster(expected, threshold, "distance"),
+            hierarchy.fcluster(linkage, threshold, "distance"),
+        )
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("n", [1000, 10000, 50000])
+def test_unit_cell_distance_benchmark(n):
+    """Time the clustering of many unit cells at the threshold, and for 1000
+    cells the calculation of all the distances and the minimum spanning tree"""
+    hierarchy = pytest.importorskip("scipy.cluster.hierarchy")
+    from libtbx.introspection import number_of_processors
+
+    nproc = number_of_processors(return_value_if_unknown=1)
+    g6 = g6_cells(n)
+    timings = []
+    if n <= 1000:
+        t0 = time.time()
+        linkage = hierarchy.linkage(
+            unit_cell_distance.ncdist_condensed(g6, nproc=nproc), "single"
+        )
+        timings.append("%.1fs condensed" % (time.time() - t0))
+        t0 = time.time()
+        unit_cell_distance.ncdist_minimum_spanning_tree(g6, nproc=nproc)
+        timings.append("%.1fs minimum spanning tree" % (time.time() - t0))
+    t0 = time.time()
+    tree = unit_cell_distance.ncdist_threshold_tree(g6, 1000, nproc=nproc)
+    clusters = hierarchy.fcluster(
+        unit_cell_distance.single_linkage(n, tree), 1000, "distance"
+    )
+    timings.append("%.1fs clusters at the threshold" % (time.time() - t0))
+    assert len(set(clusters)) == 3
+    if n <= 1000:
+        assert same_clusters(clusters, hierarchy.fcluster(linkage, 1000, "distance"))
+    print("%d cells (%d processes): %s" % (n, nproc, ", ".join(timings)))
@@ -20,6 +20,9 @@ def ab_cluster(
         schnell=False,
         doplot=True,
         labels="default",
+        nproc=1,
+        approximate=False,
+        storage="condensed",
     ):
         """
     Hierarchical clustering using the unit cell dimentions.
@@ -34,6 +37,9 @@ def ab_cluster(
     :param doplot: Boolean flag for if the plotting should be done at all.
     Runs faster if switched off.
     :param labels: 'default' will not display any labels for more than 100 images, but will display file names for fewer. This can be manually overidden with a boolean flag.
+    :param nproc: the number of processes to calculate the Andrews-Bernstein distances with.
+    :param approximate: if True, skip the Andrews-Bernstein distances for pairs of cells whose Niggli cell edges put them further apart than the threshold. The clusters are unchanged for single (and for condensed storage, complete) linkage with the 'distance' method, but the dendrogram is approximate.
+    :param storage: 'condensed' to calculate the full condensed distance matrix, or 'sparse' to calculate single linkage from a spanning tree of the cells, in memory proportional to the number of cells.
     :return: A list of Clusters ordered by largest Cluster to smallest
 
     .. note::
@@ -43,7 +49,7 @@ def ab_cluster(
 
         import numpy as np
         from xfel.clustering.singleframe import SingleFrame
-        from cctbx.uctbx.determine_unit_cell import NCDist
+        from dials.algorithms.clustering import unit_cell_distance
 
         logger.info("Hierarchical clustering of unit cells")
         import scipy.spatial.distance as dist
@@ -53,27 +59,44 @@ def ab_cluster(
         g6_cells = np.array([SingleFrame.make_g6(image.uc) for image in self.members])
 
         # 2. Do hierarchichal clustering, using the find_distance method above.
+        this_linkage = None
         if schnell:
             logger.info("Using Euclidean distance")
             pair_distances = dist.pdist(g6_cells, metric="euclidean")
-            metric = "euclidean"
         else:
             logger.info(
                 "Using Andrews-Bernstein distance from Andrews & Bernstein "
                 "J Appl Cryst 47:346 (2014)"
             )
-            pair_distances = dist.pdist(g6_cells, metric=lambda a, b: NCDist(a, b))
-            metric = lambda a, b: NCDist(a, b)
+            if storage == "sparse":
+                if linkage_method != "single":
+                    raise ValueError(
+                        "Sparse storage is only possible for single linkage, "
+                        "not %s linkage" % linkage_method
+                    )
+                if approximate:
+                    edges = unit_cell_distance.ncdist_threshold_tree(
+                        g6_cells, threshold, nproc=nproc
+                    )
+                else:
+                    edges = unit_cell_distance.ncdist_minimum_spanning_tree(
+                        g6_cells, nproc=nproc
+                    )
+                pair_distances = edges[2]
+                this_linkage = unit_cell_distance.single_linkage(len(g6_cells), edges)
+            else:
+                pair_distances = unit_cell_distance.ncdist_condensed(
+                    g6_cells, nproc=nproc, threshold=threshold if approximate else None
+                )
         if len(pair_distances) > 0:
             logger.info("Distances have been calculated")
-            this_linkage = hcluster.linkage(
-                pair_distances, method=linkage_method, metric=metric
-            )
+            if this_linkage is None:
+                this_linkage = hcluster.linkage(pair_distances, method=linkage_method)
             cluster_ids = hcluster.fcluster(this_linkage, threshold, criterion=method)
             logger.debug("Clusters have been calculated")
         else:
             logger.debug("No distances were calculated. Aborting clustering.")
-            return [], None
+            return [], None, None
 
         # 3. Create an array of sub-cluster objects from the clustering
         sub_clusters = []
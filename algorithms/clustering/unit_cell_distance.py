@@ -0,0 +1,506 @@
+"""
+Andrews-Bernstein distances between many Niggli-reduced unit cells in G6 form,
+for the hierarchical clustering of unit cells.
+
+NCDist is expensive. So that it can be used for thousands of cells:
+
+- the distances are calculated in chunks of rows of the condensed distance
+  matrix in worker processes;
+- the distance between the first three components of the G6 vectors (the
+  squared edges of the Niggli cells) is a cheap lower bound on NCDist, as the
+  squared lengths of the three shortest lattice vectors change continuously
+  across the boundaries of the Niggli-reduced region. The distance need not be
+  calculated for pairs of cells which the bound puts further apart than a
+  threshold;
+- single linkage is calculated from a spanning tree of the cells, which
+  stores n - 1 distances rather than the distance matrix: either the minimum
+  spanning tree, found with Prim's algorithm, for which the bound skips the
+  distances which cannot shorten the tree, or a tree which only connects the
+  clusters at a threshold, for which the distances between two clusters need
+  only be calculated until a pair of cells is within the threshold.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import logging
+import multiprocessing
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# The number of pairs of cells in each task of the condensed distance matrix
+PAIRS_PER_CHUNK = 20000
+
+# The minimum number of distances for each worker process, when a set of
+# distances is shared between them
+MIN_PAIRS_PER_PROCESS = 200
+
+# The number of nearest neighbours of each cell for which the distance may be
+# calculated first, for the tree of the clusters at a threshold
+NEAREST_NEIGHBOURS = 10
+
+# State inherited by the forked worker processes
+_worker_state = {}
+
+
+def lower_bounds(g6_cells, i, j):
+    """A lower bound on the NCDist between the cells i and j, which may be
+    indices or arrays of indices"""
+    return np.sqrt(np.sum((g6_cells[i, :3] - g6_cells[j, :3]) ** 2, axis=-1))
+
+
+def _ncdist(i, j):
+    """NCDist between the cells i and j, arrays of indices of the same length,
+    or the lower bound where this exceeds the threshold"""
+    from cctbx.uctbx.determine_unit_cell import NCDist
+
+    g6_cells = _worker_state["g6_cells"]
+    threshold = _worker_state.get("threshold")
+    if threshold is None:
+        distances = np.empty(len(i))
+        calculate = range(len(i))
+    else:
+        distances = lower_bounds(g6_cells, i, j)
+        calculate = np.flatnonzero(distances <= threshold)
+    cells = _worker_state["cells"]
+    for k in calculate:
+        distances[k] = NCDist(cells[i[k]], cells[j[k]])
+    return distances
+
+
+def _condensed_rows(rows):
+    """The distances in rows [start, stop) of the condensed distance matrix"""
+    start, stop = rows
+    n = len(_worker_state["g6_cells"])
+    counts = n - 1 - np.arange(start, stop)
+    i = np.repeat(np.arange(start, stop), counts)
+    # the column index runs from i + 1 to n - 1 in each row
+    row_offsets = np.repeat(np.cumsum(counts) - counts, counts)
+    j = np.arange(len(i)) - row_offsets + i + 1
+    return _ncdist(i, j)
+
+
+def _pair_distances(pairs):
+    return _ncdist(*pairs)
+
+
+def _row_chunks(n, pairs_per_chunk):
+    """Split the rows of the condensed distance matrix of n cells into ranges
+    with about pairs_per_chunk pairs"""
+    chunks = []
+    start = size = 0
+    for row in range(n - 1):
+        size += n - 1 - row
+        if size >= pairs_per_chunk:
+            chunks.append((start, row + 1))
+            start, size = row + 1, 0
+    if start < n - 1:
+        chunks.append((start, n - 1))
+    return chunks
+
+
+class _Workers(object):
+    """A pool of worker processes, forked with the state to calculate
+    distances, or the calculation in this process if nproc is 1 or fork is
+    not available"""
+
+    def __init__(self, g6_cells, nproc, threshold=None):
+        self._state = dict(
+            g6_cells=g6_cells, cells=[tuple(c) for c in g6_cells], threshold=threshold
+        )
+        self.nproc = nproc if hasattr(os, "fork") else 1
+        self._pool = None
+        if self.nproc > 1:
+            _worker_state.update(self._state)
+            try:
+                self._pool = multiprocessing.Pool(processes=self.nproc)
+            finally:
+                _worker_state.clear()
+
+    def imap(self, function, tasks):
+        """Iterate over the results of the function for the tasks, in order"""
+        if self._pool is not None:
+            return self._pool.imap(function, tasks, chunksize=1)
+        return self._imap_serial(function, tasks)
+
+    def _imap_serial(self, function, tasks):
+        for task in tasks:
+            _worker_state.update(self._state)
+            try:
+                result = function(task)
+            finally:
+                _worker_state.clear()
+            yield result
+
+    def distances(self, i, j):
+        """NCDist between the cells i and j, arrays of indices of the same
+        length, shared between the processes if there are enough"""
+        n_chunks = max(1, min(self.nproc, len(i) // MIN_PAIRS_PER_PROCESS))
+        tasks = zip(np.array_split(i, n_chunks), np.array_split(j, n_chunks))
+        return np.concatenate(list(self.imap(_pair_distances, tasks)))
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+
+
+def _find(parent, a):
+    """The root of a in a union-find forest, compressing the path to it"""
+    root = a
+    while parent[root] != root:
+        root = parent[root]
+    while parent[a] != root:
+        parent[a], a = root, parent[a]
+    return root
+
+
+def _roots(parent):
+    """The roots of all the elements of a union-find forest, compressing all
+    the paths"""
+    while True:
+        grandparent = parent[parent]
+        if (grandparent == parent).all():
+            return parent
+        parent[:] = grandparent
+
+
+def ncdist_condensed(g6_cells, nproc=1, threshold=None):
+    """
+    The condensed matrix of NCDist between each pair of cells, as used by
+    scipy.cluster.hierarchy.linkage.
+
+    :param g6_cells: An array of the Niggli-reduced cells in G6 form
+    :param nproc: The number of processes to calculate the distances with
+    :param threshold: If not None, the lower bound on the distance is used for
+                      the pairs for which it is greater than the threshold.
+                      The flat clusters at the threshold are unchanged for
+                      single and complete linkage.
+    :return: The condensed distance matrix, a numpy array
+
+    """
+    g6_cells = np.asarray(g6_cells, dtype=np.float64)
+    n = len(g6_cells)
+    distances = np.empty(n * (n - 1) // 2)
+    workers = _Workers(g6_cells, nproc, threshold=threshold)
+    try:
+        offset = 0
+        for chunk in workers.imap(_condensed_rows, _row_chunks(n, PAIRS_PER_CHUNK)):
+            distances[offset : offset + len(chunk)] = chunk
+            offset += len(chunk)
+    finally:
+        workers.close()
+    return distances
+
+
+def ncdist_minimum_spanning_tree(g6_cells, nproc=1):
+    """
+    The minimum spanning tree of the cells, with NCDist as the weights, by
+    Prim's algorithm.
+
+    The distance from each cell added to the tree to a cell not yet in the
+    tree is only calculated if the lower bound on the distance is less than
+    the distance from the cell to the tree.
+
+    :param g6_cells: An array of the Niggli-reduced cells in G6 form
+    :param nproc: The number of processes to calculate the distances with
+    :return: The n - 1 edges of the tree, as numpy arrays of the index of the
+             cell in the tree, the index of the cell added and the distance,
+             in the order added
+
+    """
+    g6_cells = np.asarray(g6_cells, dtype=np.float64)
+    n = len(g6_cells)
+    edges_i = np.empty(n - 1, dtype=np.int64)
+    edges_j = np.empty(n - 1, dtype=np.int64)
+    edges_d = np.empty(n - 1)
+    # the cells not in the tree, their distance to the tree and nearest cell
+    # in the tree, compacted by moving the last cell into the place of each
+    # cell added
+    remaining = np.arange(1, n)
+    best = np.full(n - 1, np.inf)
+    nearest = np.zeros(n - 1, dtype=np.int64)
+    n_calculated = 0
+    workers = _Workers(g6_cells, nproc)
+    try:
+        u = 0
+        for step in range(n - 1):
+            m = n - 1 - step
+            candidates = np.flatnonzero(
+                lower_bounds(g6_cells, u, remaining[:m]) < best[:m]
+            )
+            if len(candidates):
+                distances = workers.distances(
+                    np.full(len(candidates), u), remaining[candidates]
+                )
+                n_calculated += len(candidates)
+                shorter = distances < best[candidates]
+                best[candidates[shorter]] = distances[shorter]
+                nearest[candidates[shorter]] = u
+            k = np.argmin(best[:m])
+            u = remaining[k]
+            edges_i[step], edges_j[step], edges_d[step] = nearest[k], u, best[k]
+            remaining[k], best[k], nearest[k] = (
+                remaining[m - 1],
+                best[m - 1],
+                nearest[m - 1],
+            )
+    finally:
+        workers.close()
+    logger.debug(
+        "Calculated %d of %d distances for the minimum spanning tree",
+        n_calculated,
+        n * (n - 1) // 2,
+    )
+    return edges_i, edges_j, edges_d
+
+
+def _connect(workers, parent, i, j, threshold, edges):
+    """Join the clusters of the pairs of cells i and j within the threshold,
+    calculating the distances in batches in the order of the pairs, and not
+    for the pairs already in the same cluster at the start of a batch"""
+    n_calculated = 0
+    batch_size = workers.nproc * MIN_PAIRS_PER_PROCESS
+    for start in range(0, len(i), batch_size):
+        roots = _roots(parent)
+        bi, bj = i[start : start + batch_size], j[start : start + batch_size]
+        apart = roots[bi] != roots[bj]
+        bi, bj = bi[apart], bj[apart]
+        if not len(bi):
+            continue
+        distances = workers.distances(bi, bj)
+        n_calculated += len(bi)
+        for k in np.flatnonzero(distances <= threshold):
+            a, b = _find(parent, bi[k]), _find(parent, bj[k])
+            if a != b:
+                parent[b] = a
+                edges.append((bi[k], bj[k], distances[k]))
+    return n_calculated
+
+
+def _connect_clusters(workers, parent, i, j, bounds, threshold, edges):
+    """Join the clusters of the pairs of cells i and j within the threshold,
+    calculating the distances between each two clusters in order of the lower
+    bound, in rounds of a doubling number of pairs, until one is within the
+    threshold"""
+    n_calculated = 0
+    untested = np.ones(len(i), dtype=bool)
+    per_cluster_pair = 1
+    while True:
+        roots = _roots(parent)
+        pairs = np.flatnonzero(untested & (roots[i] != roots[j]))
+        if not len(pairs):
+            return n_calculated
+        a = np.minimum(roots[i[pairs]], roots[j[pairs]])
+        b = np.maximum(roots[i[pairs]], roots[j[pairs]])
+        order = np.lexsort((bounds[pairs], b, a))
+        pairs, a, b = pairs[order], a[order], b[order]
+        new_group = np.ones(len(pairs), dtype=bool)
+        new_group[1:] = (a[1:] != a[:-1]) | (b[1:] != b[:-1])
+        rank = np.arange(len(pairs)) - np.maximum.accumulate(
+            np.where(new_group, np.arange(len(pairs)), 0)
+        )
+        pairs = pairs[rank < per_cluster_pair]
+        distances = workers.distances(i[pairs], j[pairs])
+        n_calculated += len(pairs)
+        untested[pairs] = False
+        for k in np.flatnonzero(distances <= threshold):
+            a, b = _find(parent, i[pairs[k]]), _find(parent, j[pairs[k]])
+            if a != b:
+                parent[b] = a
+                edges.append((i[pairs[k]], j[pairs[k]], distances[k]))
+        per_cluster_pair *= 2
+
+
+def _unique_pairs(i, j):
+    """The unique pairs of cells, as (i, j) with i < j"""
+    i, j = np.minimum(i, j), np.maximum(i, j)
+    pairs = np.unique(np.stack((i, j), axis=1)[i != j], axis=0)
+    return pairs[:, 0], pairs[:, 1]
+
+
+def _pairs_between_clusters(g6_cells, parent, threshold):
+    """The pairs of cells in different clusters for which the lower bound on
+    the distance is within the threshold. The pairs of clusters that may be
+    within the threshold are found with a k-d tree of the centres of their
+    bounding boxes, then the pairs of cells with a k-d tree of each cluster"""
+    from scipy.spatial import cKDTree
+
+    edges = g6_cells[:, :3]
+    roots = _roots(parent)
+    _, clusters = np.unique(roots, return_inverse=True)
+    members = np.split(
+        np.argsort(clusters, kind="mergesort"), np.cumsum(np.bincount(clusters))[:-1]
+    )
+    lower = np.array([edges[m].min(axis=0) for m in members])
+    upper = np.array([edges[m].max(axis=0) for m in members])
+    centres = (lower + upper) / 2
+    radii = np.sqrt(np.sum((upper - lower) ** 2, axis=1)) / 2
+
+    # two clusters may only be within the threshold if their centres are within
+    # the sum of their radii and the threshold, so each pair is found from the
+    # cluster with the larger radius, by the rank of the radii
+    rank = np.empty(len(members), dtype=np.int64)
+    rank[np.lexsort((np.arange(len(members)), radii))] = np.arange(len(members))
+    centre_tree = cKDTree(centres)
+    trees = {}
+
+    def tree(c):
+        if c not in trees:
+            trees[c] = cKDTree(edges[members[c]])
+        return trees[c]
+
+    i, j = [], []
+    for a in range(len(members)):
+        near = np.array(
+            centre_tree.query_ball_point(centres[a], 2 * radii[a] + threshold),
+            dtype=np.int64,
+        )
+        near = near[rank[near] < rank[a]]
+        # the clusters whose bounding boxes are within the threshold
+        gaps = np.maximum(0, np.maximum(lower[near] - upper[a], lower[a] - upper[near]))
+        for b in near[np.sum(gaps ** 2, axis=1) <= threshold ** 2]:
+            for k, neighbours in enumerate(tree(a).query_ball_tree(tree(b), threshold)):
+                i.extend([members[a][k]] * len(neighbours))
+                j.extend(members[b][neighbours])
+    return np.array(i, dtype=np.int64), np.array(j, dtype=np.int64)
+
+
+def _bounds_spanning_tree(g6_cells, cells, threshold):
+    """The minimum spanning tree of the cells by the lower bounds on their
+    distances, raised to just beyond the threshold, by Prim's algorithm as in
+    ncdist_minimum_spanning_tree, without storing the matrix of the bounds"""
+    floor = np.nextafter(threshold, np.inf)
+    m = len(cells)
+    edges = []
+    remaining = cells[1:].copy()
+    best = np.full(m - 1, np.inf)
+    nearest = np.zeros(m - 1, dtype=np.int64)
+    u = cells[0]
+    for step in range(m - 1):
+        r = m - 1 - step
+        bounds = np.maximum(lower_bounds(g6_cells, u, remaining[:r]), floor)
+        shorter = np.flatnonzero(bounds < best[:r])
+        best[shorter] = bounds[shorter]
+        nearest[shorter] = u
+        k = np.argmin(best[:r])
+        u = remaining[k]
+        edges.append((nearest[k], u, best[k]))
+        remaining[k], best[k], nearest[k] = (
+            remaining[r - 1],
+            best[r - 1],
+            nearest[r - 1],
+        )
+    return edges
+
+
+def ncdist_threshold_tree(g6_cells, threshold, nproc=1):
+    """
+    A spanning tree of the cells, in which the edges within the threshold
+    connect the same clusters of cells as single linkage at the threshold.
+
+    Only the distances of the pairs of cells for which the lower bound is
+    within the threshold are calculated, which are found with a k-d tree of
+    the squared edges of the Niggli cells, and not all of them:
+
+    - the cells are first joined to their nearest neighbours by the lower
+      bound, in order of the lower bound, skipping the pairs already in the
+      same cluster, which joins the cells of dense clusters;
+    - then the remaining pairs of cells in different clusters are found with
+      k-d trees of the clusters, and the distances between the cells of each
+      two clusters are calculated in order of the lower bound until one is
+      within the threshold.
+
+    The clusters are then joined by the minimum spanning tree of the lower
+    bounds between a cell of each, which are raised to just beyond the
+    threshold. The flat clusters at the threshold are those of single
+    linkage, but the heights of the joins are not.
+
+    :param g6_cells: An array of the Niggli-reduced cells in G6 form
+    :param threshold: The distance threshold for the clusters
+    :param nproc: The number of processes to calculate the distances with
+    :return: The n - 1 edges of the tree, as numpy arrays of the indices of
+             the cells and the distance
+
+    """
+    from scipy.spatial import cKDTree
+
+    g6_cells = np.asarray(g6_cells, dtype=np.float64)
+    n = len(g6_cells)
+    edges = []
+    parent = np.arange(n)
+    tree = cKDTree(g6_cells[:, :3])
+    workers = _Workers(g6_cells, nproc)
+    try:
+        # the nearest neighbours, in order of the lower bound
+        _, j = tree.query(
+            g6_cells[:, :3],
+            k=list(range(1, min(NEAREST_NEIGHBOURS + 1, n) + 1)),
+            distance_upper_bound=threshold,
+        )
+        i = np.repeat(np.arange(n), j.shape[1])
+        i, j = _unique_pairs(i[j.ravel() < n], j.ravel()[j.ravel() < n])
+        order = np.argsort(lower_bounds(g6_cells, i, j), kind="mergesort")
+        n_calculated = _connect(workers, parent, i[order], j[order], threshold, edges)
+
+        # the pairs between the clusters
+        i, j = _pairs_between_clusters(g6_cells, parent, threshold)
+        bounds = lower_bounds(g6_cells, i, j)
+        within = bounds <= threshold
+        n_calculated += _connect_clusters(
+            workers, parent, i[within], j[within], bounds[within], threshold, edges
+        )
+    finally:
+        workers.close()
+    logger.debug(
+        "Calculated %d of %d distances for the clusters at the threshold",
+        n_calculated,
+        n * (n - 1) // 2,
+    )
+
+    # join the clusters by the minimum spanning tree of the lower bounds
+    cells = np.flatnonzero(_roots(parent) == np.arange(n))
+    if len(cells) > 1:
+        edges.extend(_bounds_spanning_tree(g6_cells, cells, threshold))
+
+    edges_i, edges_j, edges_d = zip(*edges) if edges else ((), (), ())
+    return (
+        np.array(edges_i, dtype=np.int64),
+        np.array(edges_j, dtype=np.int64),
+        np.array(edges_d, dtype=np.float64),
+    )
+
+
+def single_linkage(n, edges):
+    """
+    The single linkage of n cells, in the form of the linkage matrix of
+    scipy.cluster.hierarchy, from the edges of their minimum spanning tree.
+
+    :param n: The number of cells
+    :param edges: The edges of the minimum spanning tree, as returned by
+                  ncdist_minimum_spanning_tree or ncdist_threshold_tree
+    :return: The linkage matrix
+
+    """
+    edges_i, edges_j, edges_d = edges
+    linkage = np.empty((n - 1, 4))
+    # union-find of the cells, with the linkage cluster of each root
+    parent = np.arange(n)
+    cluster = np.arange(n)
+    size = np.ones(n, dtype=np.int64)
+    for k, e in enumerate(np.argsort(edges_d, kind="mergesort")):
+        a, b = _find(parent, edges_i[e]), _find(parent, edges_j[e])
+        if size[a] < size[b]:
+            a, b = b, a
+        linkage[k] = (
+            min(cluster[a], cluster[b]),
+            max(cluster[a], cluster[b]),
+            edges_d[e],
+            size[a] + size[b],
+        )
+        parent[b] = a
+        size[a] += size[b]
+        cluster[a] = n + k
+    return linkage
@@ -11,12 +11,55 @@
 #include <boost/python.hpp>
 #include <boost/python/def.hpp>
 #include <dials/algorithms/integration/corrections.h>
+#include <dials/algorithms/integration/reflection_geometry.h>
 
 using namespace boost::python;
 
 namespace dials { namespace algorithms { namespace boost_python {
 
+  /**
+   * Release the GIL while the reflection geometry is computed
+   */
+  ReflectionGeometryResult reflection_geometry_compute(
+      const ReflectionGeometry &self,
+      const af::const_ref<int> &id,
+      const af::const_ref< vec3<double> > &s1,
+      const af::const_ref<std::size_t> &panel,
+      const af::const_ref< cctbx::miller::index<> > &miller_index,
+      const af::const_ref< mat3<double> > &UB,
+      const af::const_ref<double> &phi,
+      bool psi,
+      bool direction_cosines,
+      std::size_t nthreads) {
+    PyThreadState *state = PyEval_SaveThread();
+    try {
+      ReflectionGeometryResult result = self.compute(
+          id, s1, panel, miller_index, UB, phi, psi, direction_cosines, nthreads);
+      PyEval_RestoreThread(state);
+      return result;
+    } catch (...) {
+      PyEval_RestoreThread(state);
+      throw;
+    }
+  }
+
+  af::shared<double> result_lp(const ReflectionGeometryResult &self) {
+    return self.lp;
+  }
+
+  af::shared<double> result_qe(const ReflectionGeometryResult &self) {
+    return self.qe;
+  }
+
+  af::shared<double> result_psi(const ReflectionGeometryResult &self) {
+    return self.psi;
+  }
 
+  boost::python::tuple result_direction_cosines(
+      const ReflectionGeometryResult &self) {
+    const af::shared<double> *c = self.direction_cosines;
+    return boost::python::make_tuple(c[0], c[1], c[2], c[3], c[4], c[5]);
+  }
 
   void export_corrections() {
 
@@ -58,6 +101,47 @@ namespace dials { namespace algorithms { namespace boost_python {
       .def("lp", &CorrectionsMulti::lp)
       .def("qe", &CorrectionsMulti::qe)
       ;
+
+    class_<ReflectionGeometryModel>("ReflectionGeometryModel", no_init)
+      .def(init< vec3<double>,
+                 vec3<double>,
+                 vec3<double>,
+                 double,
+                 mat3<double>,
+                 mat3<double>,
+                 vec3<double>,
+                 const Detector& >((
+            arg("s0"),
+            arg("beam_direction"),
+            arg("polarization_normal"),
+            arg("polarization_fraction"),
+            arg("fixed_rotation"),
+            arg("setting_rotation"),
+            arg("rotation_axis"),
+            arg("detector"))))
+      ;
+
+    class_<ReflectionGeometryResult>("ReflectionGeometryResult", no_init)
+      .add_property("lp", &result_lp)
+      .add_property("qe", &result_qe)
+      .add_property("psi", &result_psi)
+      .add_property("direction_cosines", &result_direction_cosines)
+      ;
+
+    class_<ReflectionGeometry>("ReflectionGeometry")
+      .def("append", &ReflectionGeometry::push_back)
+      .def("__len__", &ReflectionGeometry::size)
+      .def("compute", &reflection_geometry_compute, (
+            arg("id"),
+            arg("s1"),
+            arg("panel"),
+            arg("miller_index"),
+            arg("UB"),
+            arg("phi"),
+            arg("psi"),
+            arg("direction_cosines"),
+            arg("nthreads")))
+      ;
   }
 
 }}} // namespace = dials::algorithms::boost_python
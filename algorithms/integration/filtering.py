@@ -80,14 +80,22 @@ def __call__(self, d):
         :return: True/False in powder ring
 
         """
+        import numpy as np
         from dials.array_family import flex
         from cctbx import uctbx
 
-        result = flex.bool(len(d), False)
-        d_star_sq = uctbx.d_as_d_star_sq(d)
-        for ds2 in self.d_star_sq:
-            result = result | (flex.abs(d_star_sq - ds2) < self.half_width)
-        return result
+        d_star_sq = uctbx.d_as_d_star_sq(d).as_numpy_array()
+        rings = self.d_star_sq.as_numpy_array()
+        if len(rings) == 0:
+            return flex.bool(len(d), False)
+
+        # Only the nearest rings, either side of each d_star_sq, need be tested
+        upper = np.minimum(np.searchsorted(rings, d_star_sq), len(rings) - 1)
+        lower = np.maximum(upper - 1, 0)
+        return flex.bool(
+            (np.abs(d_star_sq - rings[lower]) < self.half_width)
+            | (np.abs(d_star_sq - rings[upper]) < self.half_width)
+        )
 
     @classmethod
     def from_params(cls, params):
@@ -184,6 +184,14 @@ def generate_phil_scope():
         nproc = 1
           .type = int(value_min=1)
           .help = "The number of processes to use per cluster job"
+
+        ntasks = 1
+          .type = int(value_min=1)
+          .help = "For the threaded integrator, the number of tasks (see njobs)"
+                  "to process at the same time in separate processes, each"
+                  "using nproc threads. This is reduced if the tasks together"
+                  "would need more than block.max_memory_usage of the memory."
+          .expert_level = 2
       }
 
       summation {
@@ -1649,6 +1657,19 @@ def create(params, experiments, reflections):
             params.integration.centroid.algorithm
         )
 
+        # Convert a gmodel background model once here, so the workers map the
+        # file rather than each hashing the model
+        gmodel = params.integration.background.gmodel
+        if (
+            params.integration.background.algorithm == "gmodel"
+            and gmodel.model is not None
+        ):
+            from dials.algorithms.background.gmodel.algorithm import (
+                mapped_model_filename,
+            )
+
+            gmodel.model = mapped_model_filename(gmodel.model)
+
         # Set the algorithms in the reflection table
         flex.reflection_table._background_algorithm = flex.strategy(
             BackgroundAlgorithm, params
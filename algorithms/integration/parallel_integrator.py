@@ -286,6 +286,88 @@ def assert_enough_memory(required_memory, max_memory_usage):
         logger.info("")
 
 
+def compute_max_concurrent_tasks(manager, params):
+    """
+    Compute the number of tasks which can be processed at the same time
+
+    Each task needs memory for a block of images, so the number of tasks is
+    reduced until the memory needed by the largest tasks together fits within
+    the limit checked for each single task by assert_enough_memory.
+
+    :param manager: The integration or reference calculator manager
+    :param params: The processing parameters
+    :return: The number of tasks to run at once
+
+    """
+    from libtbx.introspection import machine_memory_info
+
+    ntasks = min(params.integration.mp.ntasks, len(manager))
+    if ntasks <= 1:
+        return 1
+
+    # Compute the memory needed by each task
+    frame_memory = MultiThreadedIntegrator.compute_required_memory(
+        manager.experiments[0].imageset, 1
+    )
+    block_size = params.integration.block.size
+    required_memory = []
+    for i in range(len(manager)):
+        frame0, frame1 = manager.manager.job(i)
+        required_memory.append(frame_memory * min(block_size, frame1 - frame0))
+    required_memory.sort(reverse=True)
+
+    # Reduce the number of tasks until they fit in memory together
+    total_memory = machine_memory_info().memory_total()
+    if total_memory is None:
+        raise RuntimeError("Inspection of system memory failed")
+    limit_memory = total_memory * params.integration.block.max_memory_usage
+    while ntasks > 1 and sum(required_memory[:ntasks]) > limit_memory:
+        ntasks -= 1
+    if ntasks < params.integration.mp.ntasks:
+        logger.info(
+            " Running %d tasks at once to limit memory usage (%d requested)"
+            % (ntasks, params.integration.mp.ntasks)
+        )
+    return ntasks
+
+
+def execute_tasks(manager, ntasks=1):
+    """
+    Execute the tasks of a manager and accumulate the results
+
+    The tasks are independent, so if ntasks > 1 they are run ntasks at a time
+    in separate processes, with the log messages of each passed back to the
+    main process.
+
+    :param manager: The integration manager
+    :param ntasks: The number of tasks to run at once
+
+    """
+    if ntasks > 1:
+        from libtbx import easy_mp
+        from dials.algorithms.integration.processor import ExecuteParallelTask
+
+        logger.info(" Running %d tasks at once in separate processes\n" % ntasks)
+
+        def process_output(result):
+            for message in result[1]:
+                logger.log(message.levelno, message.msg)
+            manager.accumulate(result[0])
+
+        easy_mp.parallel_map(
+            func=ExecuteParallelTask(),
+            iterable=list(manager.tasks()),
+            processes=ntasks,
+            method="multiprocessing",
+            callback=process_output,
+            preserve_order=True,
+            preserve_exception_message=True,
+        )
+    else:
+        for task in manager.tasks():
+            manager.accumulate(task())
+
+
 class Result(object):
     """
     A class representing a processing result.
@@ -1329,10 +1411,10 @@ def __init__(self, experiments, reflections, params=None):
         # Print some output
         logger.info(reference_manager.summary())
 
-        # Execute each task
-        for task in reference_manager.tasks():
-            result = task()
-            reference_manager.accumulate(result)
+        # Execute each task. The reference calculator accumulating the profiles
+        # of each task cannot be pickled, so these tasks are always run in this
+        # process.
+        execute_tasks(reference_manager)
 
         # Finalize the processing
         reference_manager.finalize()
@@ -1381,9 +1463,10 @@ def __init__(self, experiments, reflections, reference=None, params=None):
         logger.info(integration_manager.summary())
 
         # Execute each task
-        for task in integration_manager.tasks():
-            result = task()
-            integration_manager.accumulate(result)
+        execute_tasks(
+            integration_manager,
+            compute_max_concurrent_tasks(integration_manager, params),
+        )
 
         # Finalize the processing
         integration_manager.finalize()
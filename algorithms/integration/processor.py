@@ -17,6 +17,7 @@
 import boost.python
 import libtbx
 from dials_algorithms_integration_integrator_ext import *
+from dials.util import frame_cache
 
 logger = logging.getLogger(__name__)
 
@@ -493,11 +494,13 @@ def __call__(self):
                 logger.info("  Required shoebox memory: %g GB" % (sbox_memory / 1e9))
                 logger.info("")
 
-        # Loop through the imageset, extract pixels and process reflections
+        # Loop through the imageset, extract pixels and process reflections,
+        # counting the frame cache hits and misses of this task
+        frame_cache_stats = frame_cache.frame_cache().stats()
         read_time = 0.0
         for i in range(len(imageset)):
             st = time()
-            image = imageset.get_corrected_data(i)
+            image = frame_cache.get_corrected_data(imageset, i)
             if imageset.is_marked_for_rejection(i):
                 mask = tuple(flex.bool(im.accessor(), False) for im in image)
             else:
@@ -516,6 +519,9 @@ def __call__(self):
             del image
             del mask
         assert processor.finished(), "Data processor is not finished"
+        frame_cache.frame_cache().log_stats(
+            frame_cache.frame_cache().stats(since=frame_cache_stats)
+        )
 
         # Optionally save the shoeboxes
         if self.params.debug.output and self.params.debug.separate_files:
@@ -0,0 +1,358 @@
+/*
+ * reflection_geometry.h
+ *
+ *  Copyright (C) 2013 Diamond Light Source
+ *
+ *  This code is distributed under the BSD license, a copy of which is
+ *  included in the root directory of this package.
+ */
+
+#ifndef DIALS_ALGORITHMS_INTEGRATION_REFLECTION_GEOMETRY_H
+#define DIALS_ALGORITHMS_INTEGRATION_REFLECTION_GEOMETRY_H
+
+#include <algorithm>
+#include <cmath>
+#include <string>
+#include <vector>
+#include <boost/bind.hpp>
+#include <scitbx/vec3.h>
+#include <scitbx/mat3.h>
+#include <scitbx/constants.h>
+#include <cctbx/miller.h>
+#include <dxtbx/model/detector.h>
+#include <dials/array_family/scitbx_shared_and_versa.h>
+#include <dials/algorithms/integration/corrections.h>
+#include <dials/util/thread_pool.h>
+#include <dials/error.h>
+
+namespace dials { namespace algorithms {
+
+  using scitbx::vec3;
+  using scitbx::mat3;
+  using dxtbx::model::Detector;
+
+  /**
+   * The models of a single experiment needed to compute the geometry of its
+   * reflections. The laboratory frame reciprocal lattice vector of a
+   * reflection with miller index h at rotation angle phi is
+   *
+   *   S * R(axis, phi) * F * UB * h
+   *
+   * A zero length rotation axis means there is no rotation, in which case
+   * the stills Lorentz-polarization correction is used.
+   */
+  class ReflectionGeometryModel {
+  public:
+
+    /**
+     * @param s0 The incident beam vector
+     * @param beam_direction The beam direction used for the direction cosines
+     * @param pn The polarization plane normal
+     * @param pf The polarization fraction
+     * @param fixed_rotation The goniometer fixed rotation F
+     * @param setting_rotation The goniometer setting rotation S
+     * @param rotation_axis The rotation axis datum
+     * @param detector The detector model
+     */
+    ReflectionGeometryModel(
+          vec3<double> s0,
+          vec3<double> beam_direction,
+          vec3<double> pn,
+          double pf,
+          mat3<double> fixed_rotation,
+          mat3<double> setting_rotation,
+          vec3<double> rotation_axis,
+          const Detector &detector)
+      : s0_(s0),
+        beam_direction_(beam_direction),
+        pn_(pn),
+        pf_(pf),
+        F_(fixed_rotation),
+        S_(setting_rotation),
+        axis_(0, 0, 0),
+        m2_(0, 0, 0),
+        rotation_(rotation_axis.length() > 0) {
+      DIALS_ASSERT(s0.length() > 0);
+      if (rotation_) {
+        axis_ = rotation_axis.normalize();
+        m2_ = setting_rotation * rotation_axis;
+      }
+      mu_.reserve(detector.size());
+      thickness_.reserve(detector.size());
+      normal_.reserve(detector.size());
+      for (std::size_t i = 0; i < detector.size(); ++i) {
+        mu_.push_back(detector[i].get_mu());
+        thickness_.push_back(detector[i].get_thickness());
+        normal_.push_back(detector[i].get_normal());
+      }
+    }
+
+    /** @returns The number of detector panels */
+    std::size_t num_panels() const {
+      return normal_.size();
+    }
+
+    /** @returns The Lorentz-polarization correction */
+    double lp(vec3<double> s1) const {
+      if (rotation_) {
+        return lp_correction(s0_, pn_, pf_, m2_, s1);
+      }
+      return stills_lp_correction(s0_, pn_, pf_, s1);
+    }
+
+    /** @returns The detector quantum efficiency */
+    double qe(vec3<double> s1, std::size_t panel) const {
+      return qe_correction(mu_[panel], thickness_[panel], s1, normal_[panel]);
+    }
+
+    /** @returns S * R(axis, phi) * F * v */
+    vec3<double> rotate(vec3<double> v, double phi) const {
+      v = F_ * v;
+      if (rotation_) {
+        v = v.unit_rotate_around_origin(axis_, phi);
+      }
+      return S_ * v;
+    }
+
+    /**
+     * The azimuthal angle psi (in degrees) of a reflection about its
+     * scattering vector, measured from the plane containing the incident and
+     * diffracted beams, as given in XDS_ASCII.HKL
+     */
+    double psi(cctbx::miller::index<> const &hkl,
+               mat3<double> const &UB,
+               double phi) const {
+      double h = hkl[0], k = hkl[1], l = hkl[2];
+      vec3<double> s = s0_ + rotate(UB * vec3<double>(h, k, l), phi);
+      vec3<double> g = s.cross(s0_).normalize();
+      vec3<double> e = -(s + s0_).normalize();
+
+      // find component of beam perpendicular to f, e
+      vec3<double> u = (h == k && k == l)
+        ? vec3<double>(h, -h, 0)
+        : vec3<double>(k - l, l - h, h - k);
+      vec3<double> q = rotate((UB.inverse().transpose() * u).normalize(), phi);
+      double cos_psi = (q * g) / std::sqrt((q * q) * (g * g));
+      cos_psi = std::max(-1.0, std::min(1.0, cos_psi));
+      double psi = std::acos(cos_psi) * 180.0 / scitbx::constants::pi;
+      return (q * e) < 0 ? -psi : psi;
+    }
+
+    /**
+     * The direction cosines of the incident and diffracted beams with respect
+     * to the reciprocal lattice axes, as ix, dx, iy, dy, iz, dz.
+     */
+    void direction_cosines(cctbx::miller::index<> const &hkl,
+                           mat3<double> const &UB,
+                           double phi,
+                           double *result) const {
+      vec3<double> s = (s0_ + rotate(UB * vec3<double>(hkl[0], hkl[1], hkl[2]), phi))
+        .normalize();
+      for (std::size_t j = 0; j < 3; ++j) {
+        vec3<double> axis_hkl(0, 0, 0);
+        axis_hkl[j] = 1;
+        vec3<double> astar = rotate(UB * axis_hkl, phi).normalize();
+        result[2*j] = beam_direction_ * astar;
+        result[2*j+1] = s * astar;
+      }
+    }
+
+  private:
+
+    vec3<double> s0_;
+    vec3<double> beam_direction_;
+    vec3<double> pn_;
+    double pf_;
+    mat3<double> F_;
+    mat3<double> S_;
+    vec3<double> axis_;
+    vec3<double> m2_;
+    bool rotation_;
+    std::vector<double> mu_;
+    std::vector<double> thickness_;
+    std::vector< vec3<double> > normal_;
+  };
+
+
+  /**
+   * The columns computed by ReflectionGeometry. A column has zero length if
+   * the inputs it needs were not given.
+   */
+  struct ReflectionGeometryResult {
+    af::shared<double> lp;
+    af::shared<double> qe;
+    af::shared<double> psi;
+    af::shared<double> direction_cosines[6];
+  };
+
+
+  /**
+   * Compute the Lorentz-polarization and quantum efficiency corrections, the
+   * psi angles and the direction cosines of a set of reflections in a single
+   * pass, split between threads.
+   */
+  class ReflectionGeometry {
+  public:
+
+    /**
+     * Add the models of another experiment
+     * @param model The experiment models
+     */
+    void push_back(const ReflectionGeometryModel &model) {
+      models_.push_back(model);
+    }
+
+    /**
+     * @returns The number of experiments
+     */
+    std::size_t size() const {
+      return models_.size();
+    }
+
+    /**
+     * Compute the geometry of each reflection. The optional inputs may be
+     * empty, in which case the columns that need them are not computed.
+     * @param id The experiment of each reflection (or empty if only one)
+     * @param s1 The diffracted beam vectors, needed for lp and qe
+     * @param panel The panels, needed for qe
+     * @param miller_index The miller indices, needed for psi and cosines
+     * @param UB The UB matrices (one for all reflections or one each)
+     * @param phi The rotation angles in radians
+     * @param psi Compute the psi angles
+     * @param direction_cosines Compute the direction cosines
+     * @param nthreads The number of threads
+     */
+    ReflectionGeometryResult compute(
+        const af::const_ref<int> &id,
+        const af::const_ref< vec3<double> > &s1,
+        const af::const_ref<std::size_t> &panel,
+        const af::const_ref< cctbx::miller::index<> > &miller_index,
+        const af::const_ref< mat3<double> > &UB,
+        const af::const_ref<double> &phi,
+        bool psi,
+        bool direction_cosines,
+        std::size_t nthreads) const {
+
+      DIALS_ASSERT(models_.size() > 0);
+      DIALS_ASSERT(nthreads > 0);
+
+      // Find the number of reflections and check the inputs
+      std::size_t n = std::max(s1.size(), miller_index.size());
+      DIALS_ASSERT(id.size() == 0 || id.size() == n);
+      DIALS_ASSERT(id.size() > 0 || models_.size() == 1);
+      DIALS_ASSERT(s1.size() == 0 || s1.size() == n);
+      DIALS_ASSERT(panel.size() == 0 || (panel.size() == n && s1.size() == n));
+      for (std::size_t i = 0; i < id.size(); ++i) {
+        DIALS_ASSERT(id[i] >= 0 && id[i] < models_.size());
+      }
+      for (std::size_t i = 0; i < panel.size(); ++i) {
+        std::size_t m = id.size() > 0 ? id[i] : 0;
+        DIALS_ASSERT(panel[i] < models_[m].num_panels());
+      }
+      if (psi || direction_cosines) {
+        DIALS_ASSERT(miller_index.size() == n);
+        DIALS_ASSERT(UB.size() == 1 || UB.size() == n);
+        DIALS_ASSERT(phi.size() == n);
+      }
+
+      // Allocate the results
+      ReflectionGeometryResult result;
+      if (s1.size() > 0) {
+        result.lp = af::shared<double>(n);
+      }
+      if (panel.size() > 0) {
+        result.qe = af::shared<double>(n);
+      }
+      if (psi) {
+        result.psi = af::shared<double>(n);
+      }
+      if (direction_cosines) {
+        for (std::size_t j = 0; j < 6; ++j) {
+          result.direction_cosines[j] = af::shared<double>(n);
+        }
+      }
+
+      Inputs inputs = { id, s1, panel, miller_index, UB, phi };
+
+      // Split the reflections into one block per thread. Errors are recorded
+      // for each block and raised once all the threads have finished
+      nthreads = std::max<std::size_t>(1, std::min(nthreads, n));
+      std::size_t block_size = (n + nthreads - 1) / nthreads;
+      std::vector<std::string> errors(nthreads);
+      if (nthreads == 1) {
+        compute_block(0, n, &inputs, &result, &errors[0]);
+      } else {
+        dials::util::ThreadPool pool(nthreads);
+        for (std::size_t i = 0; i < nthreads; ++i) {
+          std::size_t first = std::min(n, i * block_size);
+          std::size_t last = std::min(n, first + block_size);
+          pool.post(boost::bind(
+                &ReflectionGeometry::compute_block, this, first, last,
+                &inputs, &result, &errors[i]));
+        }
+        pool.wait();
+      }
+      for (std::size_t i = 0; i < errors.size(); ++i) {
+        if (!errors[i].empty()) {
+          throw DIALS_ERROR(errors[i]);
+        }
+      }
+      return result;
+    }
+
+  private:
+
+    struct Inputs {
+      af::const_ref<int> id;
+      af::const_ref< vec3<double> > s1;
+      af::const_ref<std::size_t> panel;
+      af::const_ref< cctbx::miller::index<> > miller_index;
+      af::const_ref< mat3<double> > UB;
+      af::const_ref<double> phi;
+    };
+
+    void compute_block(
+        std::size_t first,
+        std::size_t last,
+        const Inputs *inputs,
+        ReflectionGeometryResult *result,
+        std::string *error) const {
+      const af::const_ref<int> &id = inputs->id;
+      const af::const_ref< vec3<double> > &s1 = inputs->s1;
+      const af::const_ref<std::size_t> &panel = inputs->panel;
+      const af::const_ref< cctbx::miller::index<> > &miller_index = inputs->miller_index;
+      const af::const_ref< mat3<double> > &UB = inputs->UB;
+      const af::const_ref<double> &phi = inputs->phi;
+      try {
+        for (std::size_t i = first; i < last; ++i) {
+          const ReflectionGeometryModel &model = models_[id.size() > 0 ? id[i] : 0];
+          if (result->lp.size() > 0) {
+            result->lp[i] = model.lp(s1[i]);
+          }
+          if (result->qe.size() > 0) {
+            result->qe[i] = model.qe(s1[i], panel[i]);
+          }
+          if (result->psi.size() > 0) {
+            result->psi[i] = model.psi(
+                miller_index[i], UB[UB.size() == 1 ? 0 : i], phi[i]);
+          }
+          if (result->direction_cosines[0].size() > 0) {
+            double cosines[6];
+            model.direction_cosines(
+                miller_index[i], UB[UB.size() == 1 ? 0 : i], phi[i], cosines);
+            for (std::size_t j = 0; j < 6; ++j) {
+              result->direction_cosines[j][i] = cosines[j];
+            }
+          }
+        }
+      } catch (const std::exception &e) {
+        *error = e.what();
+      }
+    }
+
+    std::vector<ReflectionGeometryModel> models_;
+  };
+
+}}
+
+#endif // DIALS_ALGORITHMS_INTEGRATION_REFLECTION_GEOMETRY_H
@@ -0,0 +1,138 @@
+"""
+Compute per-reflection geometric quantities (Lorentz-polarization and detector
+quantum efficiency corrections, psi angles and direction cosines) for a
+reflection table in a single compiled pass over the reflections.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+from dials.algorithms.integration import ReflectionGeometry, ReflectionGeometryModel
+from dials.array_family import flex
+from scitbx import matrix
+
+_identity = matrix.identity(3).elems
+
+
+def reflection_geometry_model(
+    experiment, fixed_rotation=None, setting_rotation=None, rotation_axis=None
+):
+    """Create the ReflectionGeometryModel for an experiment.
+
+    :param experiment: The experiment
+    :param fixed_rotation: Override the goniometer fixed rotation
+    :param setting_rotation: Override the goniometer setting rotation
+    :param rotation_axis: Override the goniometer rotation axis datum
+    :return: The ReflectionGeometryModel
+    """
+    beam = experiment.beam
+    goniometer = experiment.goniometer
+    if goniometer is not None:
+        if fixed_rotation is None:
+            fixed_rotation = goniometer.get_fixed_rotation()
+        if setting_rotation is None:
+            setting_rotation = goniometer.get_setting_rotation()
+        if rotation_axis is None:
+            rotation_axis = goniometer.get_rotation_axis_datum()
+    return ReflectionGeometryModel(
+        s0=beam.get_s0(),
+        beam_direction=beam.get_direction(),
+        polarization_normal=beam.get_polarization_normal(),
+        polarization_fraction=beam.get_polarization_fraction(),
+        fixed_rotation=fixed_rotation or _identity,
+        setting_rotation=setting_rotation or _identity,
+        rotation_axis=rotation_axis or (0, 0, 0),
+        detector=experiment.detector,
+    )
+
+
+def scan_point_UB_matrices(experiment, z):
+    """Return the UB matrix for each reflection, taken from the scan point
+    nearest to its z position in images for a scan varying crystal model,
+    otherwise the scan static UB matrix.
+
+    :param experiment: The experiment
+    :param z: The z position (in images, relative to the scan start)
+    :return: The flex.mat3_double of UB matrices
+    """
+    crystal = experiment.crystal
+    if not crystal.num_scan_points:
+        return flex.mat3_double(1, crystal.get_A())
+    A = flex.mat3_double(
+        [crystal.get_A_at_scan_point(i) for i in range(crystal.num_scan_points)]
+    )
+    index = z.iround()
+    index.set_selected(index < 0, 0)
+    index.set_selected(index >= len(A), len(A) - 1)
+    return A.select(index)
+
+
+def compute_reflection_geometry(
+    reflections,
+    experiments,
+    lp=True,
+    qe=True,
+    psi=False,
+    direction_cosines=False,
+    UB=None,
+    phi=None,
+    nthreads=1,
+):
+    """Compute the geometry of the reflections in a single pass.
+
+    The Lorentz-polarization and quantum efficiency corrections use the "s1"
+    column and the experiment of each reflection. The psi angles and direction
+    cosines are for a single experiment, using the "miller_index" column.
+
+    :param reflections: The reflection table
+    :param experiments: The list of experiments
+    :param lp: Compute the Lorentz-polarization correction
+    :param qe: Compute the quantum efficiency correction
+    :param psi: Compute the psi angles
+    :param direction_cosines: Compute the direction cosines
+    :param UB: The UB matrices (by default from the scan point nearest each
+               reflection, or the scan static UB matrix)
+    :param phi: The rotation angles in radians (by default from "xyzcal.mm")
+    :param nthreads: The number of threads
+    :return: The ReflectionGeometryResult
+    """
+    compute = ReflectionGeometry()
+    for experiment in experiments:
+        compute.append(reflection_geometry_model(experiment))
+
+    if len(experiments) > 1:
+        assert not (psi or direction_cosines)
+        id = reflections["id"]
+    else:
+        id = flex.int()
+    if lp or qe:
+        s1 = reflections["s1"]
+    else:
+        s1 = flex.vec3_double()
+    panel = reflections["panel"] if qe else flex.size_t()
+
+    if psi or direction_cosines:
+        miller_index = reflections["miller_index"]
+        if phi is None:
+            phi = reflections["xyzcal.mm"].parts()[2]
+        if UB is None:
+            experiment = experiments[0]
+            z = reflections["xyzcal.px"].parts()[2]
+            if experiment.scan is not None:
+                z = z - experiment.scan.get_array_range()[0]
+            UB = scan_point_UB_matrices(experiment, z)
+    else:
+        miller_index = flex.miller_index()
+        UB = flex.mat3_double()
+        phi = flex.double()
+
+    return compute.compute(
+        id=id,
+        s1=s1,
+        panel=panel,
+        miller_index=miller_index,
+        UB=UB,
+        phi=phi,
+        psi=psi,
+        direction_cosines=direction_cosines,
+        nthreads=nthreads,
+    )
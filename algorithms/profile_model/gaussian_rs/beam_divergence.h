@@ -0,0 +1,215 @@
+/*
+ * beam_divergence.h
+ *
+ *  Copyright (C) 2013 Diamond Light Source
+ *
+ *  This code is distributed under the BSD license, a copy of which is
+ *  included in the root directory of this package.
+ */
+#ifndef DIALS_ALGORITHMS_PROFILE_MODEL_GAUSSIAN_RS_BEAM_DIVERGENCE_H
+#define DIALS_ALGORITHMS_PROFILE_MODEL_GAUSSIAN_RS_BEAM_DIVERGENCE_H
+
+#include <cmath>
+#include <algorithm>
+#include <string>
+#include <vector>
+#include <boost/bind.hpp>
+#include <scitbx/vec2.h>
+#include <scitbx/vec3.h>
+#include <dxtbx/model/detector.h>
+#include <dials/model/data/shoebox.h>
+#include <dials/array_family/scitbx_shared_and_versa.h>
+#include <dials/util/thread_pool.h>
+#include <dials/error.h>
+
+namespace dials {
+namespace algorithms {
+namespace profile_model {
+namespace gaussian_rs {
+
+  using scitbx::vec2;
+  using scitbx::vec3;
+  using dxtbx::model::Detector;
+  using dials::model::Shoebox;
+
+  /**
+   * Compute the variance in beam direction for a batch of shoeboxes. The
+   * calculation for each reflection is the same as that done in the python
+   * ComputeEsdBeamDivergence class, namely the intensity weighted sum of the
+   * squared angle between each valid pixel and the centroid beam vector,
+   * divided by the total intensity minus one.
+   */
+  class BeamDivergenceVarianceCalculator {
+  public:
+
+    /**
+     * @param detector The detector model
+     */
+    BeamDivergenceVarianceCalculator(const Detector &detector)
+      : detector_(detector) {}
+
+    /**
+     * Compute the variances using the given centroid beam vectors
+     * @param shoebox The shoeboxes
+     * @param s1 The centroid beam vectors
+     * @param nthreads The number of threads to use
+     * @returns The list of variances for reflections with enough counts
+     */
+    af::shared<double> with_s1(
+        const af::const_ref< Shoebox<> > &shoebox,
+        const af::const_ref< vec3<double> > &s1,
+        std::size_t nthreads) const {
+      DIALS_ASSERT(shoebox.size() == s1.size());
+      return compute(shoebox, s1, nthreads);
+    }
+
+    /**
+     * Compute the variances using the centre of mass of the observed
+     * centroid to define the centroid beam vector.
+     * @param shoebox The shoeboxes
+     * @param xyz The observed pixel centroids
+     * @param nthreads The number of threads to use
+     * @returns The list of variances for reflections with enough counts
+     */
+    af::shared<double> with_com(
+        const af::const_ref< Shoebox<> > &shoebox,
+        const af::const_ref< vec3<double> > &xyz,
+        std::size_t nthreads) const {
+      DIALS_ASSERT(shoebox.size() == xyz.size());
+      af::shared< vec3<double> > s1(shoebox.size());
+      for (std::size_t i = 0; i < shoebox.size(); ++i) {
+        std::size_t panel = shoebox[i].panel;
+        DIALS_ASSERT(panel < detector_.size());
+        s1[i] = detector_[panel].get_pixel_lab_coord(
+            vec2<double>(xyz[i][0], xyz[i][1]));
+      }
+      return compute(shoebox, s1.const_ref(), nthreads);
+    }
+
+  protected:
+
+    /**
+     * Do the calculation over all reflections and compact the result
+     */
+    af::shared<double> compute(
+        const af::const_ref< Shoebox<> > &shoebox,
+        const af::const_ref< vec3<double> > &s1,
+        std::size_t nthreads) const {
+      DIALS_ASSERT(nthreads > 0);
+
+      // Compute the variance for each reflection, in one block per thread.
+      // Errors are recorded for each block and raised once all the threads
+      // have finished
+      af::shared<double> variance(shoebox.size(), 0.0);
+      af::shared<bool> success(shoebox.size(), false);
+      std::vector<std::string> errors;
+      if (nthreads == 1 || shoebox.size() < nthreads) {
+        errors.resize(1);
+        compute_range(shoebox, s1, variance.ref(), success.ref(),
+                      0, shoebox.size(), &errors[0]);
+      } else {
+        std::size_t chunk = (shoebox.size() + nthreads - 1) / nthreads;
+        errors.resize((shoebox.size() + chunk - 1) / chunk);
+        dials::util::ThreadPool pool(nthreads);
+        for (std::size_t b = 0; b < errors.size(); ++b) {
+          std::size_t i0 = b * chunk;
+          std::size_t i1 = std::min(i0 + chunk, shoebox.size());
+          pool.post(
+            boost::bind(
+              &BeamDivergenceVarianceCalculator::compute_range,
+              this,
+              shoebox,
+              s1,
+              variance.ref(),
+              success.ref(),
+              i0,
+              i1,
+              &errors[b]));
+        }
+        pool.wait();
+      }
+      for (std::size_t b = 0; b < errors.size(); ++b) {
+        if (!errors[b].empty()) {
+          throw DIALS_ERROR(errors[b]);
+        }
+      }
+
+      // Only return the variances of the reflections with enough counts
+      af::shared<double> result;
+      for (std::size_t i = 0; i < variance.size(); ++i) {
+        if (success[i]) {
+          result.push_back(variance[i]);
+        }
+      }
+      return result;
+    }
+
+    /**
+     * Compute the variances for a range of reflections, recording the message
+     * of any error rather than throwing it out of the thread
+     */
+    void compute_range(
+        af::const_ref< Shoebox<> > shoebox,
+        af::const_ref< vec3<double> > s1,
+        af::ref<double> variance,
+        af::ref<bool> success,
+        std::size_t i0,
+        std::size_t i1,
+        std::string *error) const {
+      try {
+        for (std::size_t r = i0; r < i1; ++r) {
+          success[r] = single(shoebox[r], s1[r], variance[r]);
+        }
+      } catch (const std::exception &e) {
+        *error = e.what();
+      }
+    }
+
+    /**
+     * Compute the variance for a single reflection
+     * @returns True/False whether the reflection had enough counts
+     */
+    bool single(
+        const Shoebox<> &sbox,
+        const vec3<double> &s1,
+        double &variance) const {
+      DIALS_ASSERT(sbox.is_consistent());
+      DIALS_ASSERT(sbox.panel < detector_.size());
+      const dxtbx::model::Panel &panel = detector_[sbox.panel];
+      double s1_length = s1.length();
+      double sum_values = 0.0;
+      double sum_angles = 0.0;
+      for (std::size_t k = 0; k < sbox.zsize(); ++k) {
+        for (std::size_t j = 0; j < sbox.ysize(); ++j) {
+          for (std::size_t i = 0; i < sbox.xsize(); ++i) {
+            if (sbox.mask(k, j, i) != 0) {
+              double x = i + sbox.xoffset() + 0.5;
+              double y = j + sbox.yoffset() + 0.5;
+              vec3<double> s = panel.get_pixel_lab_coord(vec2<double>(x, y));
+              double value = sbox.data(k, j, i);
+              double angle = 0.0;
+              double den = s.length() * s1_length;
+              if (den > 0) {
+                double c = (s * s1) / den;
+                c = std::max(-1.0, std::min(1.0, c));
+                angle = std::acos(c);
+              }
+              sum_values += value;
+              sum_angles += value * angle * angle;
+            }
+          }
+        }
+      }
+      if (sum_values > 1) {
+        variance = sum_angles / (sum_values - 1);
+        return true;
+      }
+      return false;
+    }
+
+    Detector detector_;
+  };
+
+}}}} // namespace dials::algorithms::profile_model::gaussian_rs
+
+#endif // DIALS_ALGORITHMS_PROFILE_MODEL_GAUSSIAN_RS_BEAM_DIVERGENCE_H
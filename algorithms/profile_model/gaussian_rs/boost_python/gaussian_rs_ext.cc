@@ -17,6 +17,7 @@
 #include <dials/algorithms/profile_model/gaussian_rs/ideal_profile.h>
 #include <dials/algorithms/profile_model/gaussian_rs/coordinate_system.h>
 #include <dials/algorithms/profile_model/gaussian_rs/modeller.h>
+#include <dials/algorithms/profile_model/gaussian_rs/beam_divergence.h>
 #include <dials/algorithms/profile_model/modeller/boost_python/empirical_profile_modeller_wrapper.h>
 
 namespace dials {
@@ -354,6 +355,20 @@ namespace boost_python {
       .def("__call__", &MaskMultiCalculator::operator())
       ;
 
+    class_<BeamDivergenceVarianceCalculator>(
+        "BeamDivergenceVarianceCalculator", no_init)
+      .def(init<const Detector&>((
+        arg("detector"))))
+      .def("with_s1", &BeamDivergenceVarianceCalculator::with_s1, (
+        arg("shoebox"),
+        arg("s1"),
+        arg("nthreads") = 1))
+      .def("with_com", &BeamDivergenceVarianceCalculator::with_com, (
+        arg("shoebox"),
+        arg("xyz"),
+        arg("nthreads") = 1))
+      ;
+
     def("ideal_profile_float", &ideal_profile<float>);
     def("ideal_profile_double", &ideal_profile<double>);
 
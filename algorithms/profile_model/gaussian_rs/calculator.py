@@ -29,20 +29,21 @@
 class ComputeEsdBeamDivergence(object):
     """Calculate the E.s.d of the beam divergence."""
 
-    def __init__(self, detector, reflections, centroid_definition="s1"):
+    def __init__(self, detector, reflections, centroid_definition="s1", nthreads=1):
         """Calculate the E.s.d of the beam divergence.
 
         Params:
             detector The detector class
             reflections The reflections
             centroid_definition ENUM com or s1
+            nthreads The number of threads to use
 
         """
         from scitbx.array_family import flex
 
         # Calculate the beam direction variances
         variance = self._beam_direction_variance_list(
-            detector, reflections, centroid_definition
+            detector, reflections, centroid_definition, nthreads
         )
 
         # Calculate and return the e.s.d of the beam divergence
@@ -53,10 +54,45 @@ def sigma(self):
         return self._sigma
 
     def _beam_direction_variance_list(
+        self, detector, reflections, centroid_definition="s1", nthreads=1
+    ):
+        """Calculate the variance in beam direction for each spot.
+
+        The calculation is done in a single compiled pass over all the
+        shoeboxes, split over the requested number of threads.
+
+        Params:
+            detector The detector model
+            reflections The list of reflections
+            centroid_definition ENUM com or s1
+            nthreads The number of threads to use
+
+        Returns:
+            The list of variances
+
+        """
+        from dials.algorithms.profile_model.gaussian_rs import (
+            BeamDivergenceVarianceCalculator,
+        )
+
+        # FIXME maybe I note in Kabsch (2010) s3.1 step (v) is
+        # background subtraction, appears to be missing here.
+        calculator = BeamDivergenceVarianceCalculator(detector)
+        if centroid_definition == "com":
+            # Use the beam vector at the centre of mass of the spot
+            return calculator.with_com(
+                reflections["shoebox"], reflections["xyzobs.px.value"], nthreads
+            )
+        return calculator.with_s1(reflections["shoebox"], reflections["s1"], nthreads)
+
+    def _beam_direction_variance_list_py(
         self, detector, reflections, centroid_definition="s1"
     ):
         """Calculate the variance in beam direction for each spot.
 
+        This is the reference python implementation which loops over all the
+        reflections one at a time.
+
         Params:
             detector The detector model
             reflections The list of reflections
@@ -70,7 +106,6 @@ def _beam_direction_variance_list(
 
         # Get the reflection columns
         shoebox = reflections["shoebox"]
-        bbox = reflections["bbox"]
         xyz = reflections["xyzobs.px.value"]
 
         # Loop through all the reflections
@@ -88,10 +123,7 @@ def _beam_direction_variance_list(
         for r in range(len(reflections)):
 
             # Get the coordinates and values of valid shoebox pixels
-            # FIXME maybe I note in Kabsch (2010) s3.1 step (v) is
-            # background subtraction, appears to be missing here.
             mask = shoebox[r].mask != 0
-            coords = shoebox[r].coords(mask)
             values = shoebox[r].values(mask)
             s1 = shoebox[r].beam_vectors(detector, mask)
 
@@ -537,6 +569,7 @@ def __init__(
         min_zeta=0.05,
         algorithm="basic",
         centroid_definition="s1",
+        nthreads=1,
     ):
         """ Calculate the profile model. """
         from dxtbx.model.experiment_list import Experiment
@@ -555,7 +588,7 @@ def __init__(
         # Calculate the E.S.D of the beam divergence
         logger.info("Calculating E.S.D Beam Divergence.")
         beam_divergence = ComputeEsdBeamDivergence(
-            detector, reflections, centroid_definition
+            detector, reflections, centroid_definition, nthreads
         )
 
         # Set the sigma b
@@ -621,6 +654,7 @@ def __init__(
         min_zeta=0.05,
         algorithm="basic",
         centroid_definition="s1",
+        nthreads=1,
     ):
         """ Calculate the profile model. """
         from copy import deepcopy
@@ -685,7 +719,9 @@ def __init__(
             self._num.append(len(reflections))
 
             # Calculate the E.S.D of the beam divergence
-            beam_divergence = ComputeEsdBeamDivergence(detector, reflections)
+            beam_divergence = ComputeEsdBeamDivergence(
+                detector, reflections, nthreads=nthreads
+            )
 
             # Set the sigma b
             sigma_b.append(beam_divergence.sigma())
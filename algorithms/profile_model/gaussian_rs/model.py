@@ -48,6 +48,10 @@
       .type = choice
       .help = "The centroid to use as beam divergence (centre of mass or s1)"
 
+    nthreads = 1
+      .type = int(value_min=1)
+      .help = "The number of threads to use when computing the beam divergence"
+
     parameters {
 
       n_sigma = 3.0
@@ -405,6 +409,7 @@ def create_from_reflections(
             params.gaussian_rs.filter.min_zeta,
             algorithm=params.gaussian_rs.sigma_m_algorithm,
             centroid_definition=params.gaussian_rs.centroid_definition,
+            nthreads=params.gaussian_rs.nthreads,
         )
         return cls(
             params=params,
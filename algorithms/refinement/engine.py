@@ -19,6 +19,10 @@
 from libtbx import easy_mp
 from libtbx.phil import parse
 from scitbx import lbfgs
+from dials.algorithms.refinement.worker_pool import (
+    TargetWorkerPool,
+    worker_pool_available,
+)
 from scitbx.array_family import flex
 
 # use lstbx classes
@@ -228,13 +232,19 @@ def __init__(
         # number of processes to use, for engines that support multiprocessing
         self._nproc = 1
 
+        # optional persistent worker processes for the target calculation
+        self._persistent_workers = False
+        self._worker_pool = None
+
         self.prepare_for_step()
 
     def get_num_steps(self):
         return self.history.get_nrows() - 1
 
-    def prepare_for_step(self):
-        """Update the parameterisation and prepare the target function"""
+    def prepare_for_step(self, predict=True):
+        """Update the parameterisation and prepare the target function. The
+        prediction may be skipped if it is done by a persistent worker pool, which
+        passes the predictions back to the target"""
 
         x = self.x
         if self._constr_manager is not None:
@@ -244,7 +254,8 @@ def prepare_for_step(self):
         self._parameters.set_param_vals(x)
 
         # do reflection prediction
-        self._target.predict()
+        if predict:
+            self._target.predict()
 
         return
 
@@ -460,6 +471,36 @@ def set_nproc(self, nproc):
         self._nproc = nproc
         return
 
+    def set_persistent_workers(self, persistent_workers=True):
+        """Choose whether multiprocessing uses a pool of worker processes that
+        persists between steps, so that for each step only the parameter vector
+        is sent to the workers"""
+        self._persistent_workers = persistent_workers
+        return
+
+    def get_worker_pool(self):
+        """Return the persistent worker pool, starting it if necessary, or None
+        if one is not to be used"""
+
+        if self._nproc < 2 or not self._persistent_workers:
+            return None
+        if not worker_pool_available():
+            return None
+        if self._worker_pool is not None and not self._worker_pool.is_current():
+            self.close_worker_pool()
+        if self._worker_pool is None:
+            self._worker_pool = TargetWorkerPool(
+                self._target, self._parameters, self._nproc
+            )
+        return self._worker_pool
+
+    def close_worker_pool(self):
+        """Stop any persistent worker processes"""
+        if self._worker_pool is not None:
+            self._worker_pool.close()
+            self._worker_pool = None
+        return
+
     def run(self):
         """
         To be implemented by derived class. It is expected that each step of
@@ -503,11 +544,17 @@ def compute_functional_and_gradients(self):
 
     def compute_functional_gradients_and_curvatures(self):
 
-        self.prepare_for_step()
+        # the workers of a persistent pool do the prediction
+        pool = self.get_worker_pool()
+        self.prepare_for_step(predict=pool is None)
 
         # observation terms
-        blocks = self._target.split_matches_into_blocks(nproc=self._nproc)
-        if self._nproc > 1:
+        if pool is not None:
+            task_results = pool.compute_functional_gradients_and_curvatures(
+                self._parameters.get_param_vals()
+            )
+        elif self._nproc > 1:
+            blocks = self._target.split_matches_into_blocks(nproc=self._nproc)
             task_results = easy_mp.parallel_map(
                 func=self._target.compute_functional_gradients_and_curvatures,
                 iterable=blocks,
@@ -517,6 +564,7 @@ def compute_functional_gradients_and_curvatures(self):
             )
 
         else:
+            blocks = self._target.split_matches_into_blocks(nproc=self._nproc)
             task_results = [
                 self._target.compute_functional_gradients_and_curvatures(block)
                 for block in blocks
@@ -683,8 +731,10 @@ def build_up(self, objective_only=False):
         # observations... See http://en.wikipedia.org/wiki/Non-linear_least_squares
         # at 'diagonal weight matrix'
 
-        # set current parameter values
-        self.prepare_for_step()
+        # set current parameter values. The workers of a persistent pool do the
+        # prediction
+        pool = None if objective_only else self.get_worker_pool()
+        self.prepare_for_step(predict=pool is None)
 
         # Reset the state to construction time, i.e. no equations accumulated
         self.reset()
@@ -694,9 +744,22 @@ def build_up(self, objective_only=False):
             residuals, weights = self._target.compute_residuals()
             self.add_residuals(residuals, weights)
         else:
-            blocks = self._target.split_matches_into_blocks(nproc=self._nproc)
+            if pool is None:
+                blocks = self._target.split_matches_into_blocks(nproc=self._nproc)
+
+            if pool is not None:
+
+                # ensure the jacobian is not tracked
+                self._jacobian = None
+
+                for residuals, j, weights in pool.compute_residuals_and_gradients(
+                    self._parameters.get_param_vals()
+                ):
+                    if self._constr_manager is not None:
+                        j = self._constr_manager.constrain_jacobian(j)
+                    self.add_equations(residuals, j, weights)
 
-            if self._nproc > 1:
+            elif self._nproc > 1:
 
                 # ensure the jacobian is not tracked
                 self._jacobian = None
@@ -23,6 +23,8 @@ class MCD(CentroidOutlier):
     calculated using the robust location and scatter estimate from the Minimum
     Covariance Determinant estimate."""
 
+    _randomised = True
+
     def __init__(
         self,
         cols=None,
@@ -38,6 +40,7 @@ def __init__(
         k2=2,
         k3=100,
         threshold_probability=0.975,
+        nproc=1,
     ):
 
         if cols is None:
@@ -49,6 +52,7 @@ def __init__(
             separate_experiments=separate_experiments,
             separate_panels=separate_panels,
             block_width=block_width,
+            nproc=nproc,
         )
 
         # Keep the FastMCD options here
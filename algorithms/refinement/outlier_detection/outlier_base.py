@@ -4,6 +4,7 @@
 from math import pi
 
 from dials.array_family import flex
+from libtbx import easy_mp
 from libtbx.phil import parse
 from libtbx.table_utils import simple_table
 
@@ -15,6 +16,9 @@
 class CentroidOutlier(object):
     """Base class for centroid outlier detection algorithms"""
 
+    # whether the algorithm draws random numbers
+    _randomised = False
+
     def __init__(
         self,
         cols=None,
@@ -22,6 +26,7 @@ def __init__(
         separate_experiments=True,
         separate_panels=True,
         block_width=None,
+        nproc=1,
     ):
 
         # column names of the data in which to look for outliers
@@ -41,6 +46,9 @@ def __init__(
         # block width for splitting scans over phi, or None for no split
         self._block_width = block_width
 
+        # number of processes over which to share the outlier detection jobs
+        self._nproc = nproc
+
         # the number of rejections
         self.nreject = 0
 
@@ -75,6 +83,41 @@ def _detect_outliers(cols):
         # to be implemented by derived classes
         raise NotImplementedError()
 
+    def _detect_outliers_with_seed(self, seed_and_cols):
+        """Perform outlier detection on a job in a worker process, after seeding
+        the random number generator if a seed is given, so that randomised
+        algorithms give the same result whichever process runs the job"""
+
+        seed, cols = seed_and_cols
+        if seed is not None:
+            flex.set_random_seed(seed)
+        return self._detect_outliers(cols)
+
+    def _detect_outliers_in_jobs(self, job_cols):
+        """Perform outlier detection for each of a list of jobs, given as lists of
+        cols, and return the list of flex.bool results in the same order. If nproc
+        > 1 the jobs are shared between processes. For a randomised algorithm each
+        job is then seeded from its index, offset by a number drawn from the random
+        number generator of this process, whose state is then restored, so the
+        results do not depend on nproc and the random numbers drawn afterwards are
+        unchanged"""
+
+        if self._nproc > 1 and len(job_cols) > 1:
+            seeds = [None] * len(job_cols)
+            if self._randomised:
+                state = flex.random_generator.getstate()
+                base_seed = int(flex.random_double() * 2 ** 30)
+                flex.random_generator.setstate(state)
+                seeds = [base_seed + i for i in range(len(job_cols))]
+            return easy_mp.parallel_map(
+                func=self._detect_outliers_with_seed,
+                iterable=list(zip(seeds, job_cols)),
+                processes=self._nproc,
+                method="multiprocessing",
+                preserve_exception_message=True,
+            )
+        return [self._detect_outliers(cols) for cols in job_cols]
+
     def __call__(self, reflections):
         """Identify outliers in the input and set the centroid_outlier flag.
         Return True if any outliers were detected, otherwise False"""
@@ -202,10 +245,18 @@ def __call__(self, reflections):
         header.extend(["Nref", "Nout", "%out"])
         rows = []
 
+        # determine the position of outliers for all jobs with enough reflections.
+        # The jobs are independent, so may be run in parallel
+        to_detect = [job for job in jobs3 if len(job["indices"]) >= self._min_num_obs]
+        results = self._detect_outliers_in_jobs(
+            [[job["data"][col] for col in self._cols] for job in to_detect]
+        )
+        for job, outliers in zip(to_detect, results):
+            job["outliers"] = outliers
+
         # now loop over the lowest level of splits
         for i, job in enumerate(jobs3):
 
-            data = job["data"]
             indices = job["indices"]
             iexp = job["id"]
             ipanel = job["panel"]
@@ -213,14 +264,8 @@ def __call__(self, reflections):
 
             if nref >= self._min_num_obs:
 
-                # get the subset of data as a list of columns
-                cols = [data[col] for col in self._cols]
-
-                # determine the position of outliers on this sub-dataset
-                outliers = self._detect_outliers(cols)
-
                 # get positions of outliers from the original matches
-                ioutliers = indices.select(outliers)
+                ioutliers = indices.select(job["outliers"])
 
             elif nref > 0:
                 # too few reflections in the job
@@ -324,6 +369,13 @@ def __call__(self, reflections):
     .type = float(value_min=1.0)
     .expert_level = 1
 
+  nproc = 1
+    .help = "The number of processes to use for outlier rejection. The jobs"
+            "for each experiment, panel and block are independent and are"
+            "shared between the processes."
+    .type = int(value_min=1)
+    .expert_level = 2
+
   tukey
     .help = "Options for the tukey outlier rejector"
     .expert_level = 1
@@ -455,6 +507,7 @@ def from_parameters_and_colnames(cls, params, colnames, verbosity=0):
             separate_experiments=params.outlier.separate_experiments,
             separate_panels=params.outlier.separate_panels,
             block_width=params.outlier.block_width,
+            nproc=params.outlier.nproc,
             **kwargs
         )
         od.set_verbosity(verbosity)
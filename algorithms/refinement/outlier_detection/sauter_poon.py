@@ -30,6 +30,7 @@ def __init__(
         px_sz=(1, 1),
         verbose=False,
         pdf=None,
+        nproc=1,
     ):
 
         # here the column names are fixed by the algorithm, so what's passed in is
@@ -41,6 +42,7 @@ def __init__(
             separate_experiments=separate_experiments,
             separate_panels=separate_panels,
             block_width=block_width,
+            nproc=nproc,
         )
 
         self._px_sz = px_sz
@@ -29,6 +29,7 @@ def __init__(
         separate_panels=True,
         block_width=None,
         iqr_multiplier=1.5,
+        nproc=1,
     ):
 
         if cols is None:
@@ -40,6 +41,7 @@ def __init__(
             separate_experiments=separate_experiments,
             block_width=block_width,
             separate_panels=separate_panels,
+            nproc=nproc,
         )
 
         self._iqr_multiplier = iqr_multiplier
@@ -265,7 +265,10 @@
     }
 
     sparse = Auto
-      .help = "Calculate gradients using sparse data structures."
+      .help = "Calculate gradients using sparse data structures. By default"
+              "this is used for multiple experiments and for scan-varying"
+              "refinement, where each reflection depends on only a few of the"
+              "parameters."
       .type = bool
       .expert_level = 1
 
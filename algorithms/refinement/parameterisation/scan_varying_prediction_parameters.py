@@ -86,6 +86,45 @@ def build_gradients(self, parameterisation, isel=None, imatch=None):
 
             yield ds_dp
 
+    def build_sparse_gradients(self, parameterisation, row_map=None):
+        """Return a generator giving, for each free parameter of the
+        parameterisation, a tuple of the state gradients and the reflections they
+        refer to. Unlike build_gradients, only reflections with a non-null state
+        derivative are included, which for a scan-varying parameter are those
+        within reach of the smoother for that parameter. The reflections are
+        given as indices into the list used when the cache was filled, or, if
+        row_map is set, as positions in the current gradient calculation block.
+        row_map is a tuple of a flex.bool marking which reflections of the
+        original list are in the block, and a flex.size_t of their positions."""
+
+        # Get the data from the cache
+        entry = self._cache[parameterisation]
+
+        for p_data in entry:
+
+            ds_dp = None
+            rows = flex.size_t()
+            for pair in p_data:
+                isel = pair.iselection
+                if row_map is not None:
+                    present, position = row_map
+                    isel = position.select(isel.select(present.select(isel)))
+                if len(isel) == 0:
+                    continue
+                if pair.derivative.n == (3, 1):
+                    der = flex.vec3_double(len(isel), pair.derivative.elems)
+                elif pair.derivative.n == (3, 3):
+                    der = flex.mat3_double(len(isel), pair.derivative.elems)
+                else:
+                    raise TypeError("Unrecognised model state derivative type")
+                if ds_dp is None:
+                    ds_dp = der
+                else:
+                    ds_dp.extend(der)
+                rows.extend(isel)
+
+            yield ds_dp, rows
+
     def clear(self):
         """Clear all cached values"""
 
@@ -691,4 +730,144 @@ def set_model_state_uncertainties(self, u_cov_list, b_cov_list, experiment_id=No
 class ScanVaryingPredictionParameterisationSparse(
     SparseGradientVectorMixin, ScanVaryingPredictionParameterisation
 ):
-    pass
+    """A version of ScanVaryingPredictionParameterisation that uses sparse
+    vectors for the gradients. For the scan-varying model types, the gradients
+    of each parameter are only calculated for the reflections with a non-null
+    state derivative, so the work and storage scale with the number of non-zero
+    smoother weights rather than with the number of parameters times the number
+    of reflections"""
+
+    def _local_setup(self, reflections):
+        """Map reflections of the list used to fill the derivative cache onto
+        rows of the current gradient calculation, if these differ"""
+
+        super(ScanVaryingPredictionParameterisationSparse, self)._local_setup(
+            reflections
+        )
+
+        if "imatch" in reflections:
+            imatch = reflections["imatch"]
+            nref = self._derivative_cache.nref
+            present = flex.bool(nref, False)
+            present.set_selected(imatch, True)
+            position = flex.size_t(nref, 0)
+            position.set_selected(imatch, flex.size_t_range(len(imatch)))
+            self._row_map = (present, position)
+        else:
+            self._row_map = None
+
+    def _grads_from_cache_loop(self, parameterisations, derivatives, results, callback):
+        """Loop over parameterisations whose state derivatives are in the cache,
+        calculate sparse gradients and extend the results. derivatives is a
+        function taking the reflection indices, the parameterisation and the state
+        derivatives of a single parameter and returning the derivatives of pv and
+        of the angle (or None)"""
+
+        for p in parameterisations:
+
+            results = self._extend_gradient_vectors(
+                results, self._nref, p.num_free(), keys=self._grad_names
+            )
+
+            for ds_dp, rows in self._derivative_cache.build_sparse_gradients(
+                p, self._row_map
+            ):
+                if len(rows) > 0:
+                    dpv, dAngle = derivatives(rows, p, ds_dp)
+                    dX, dY = self._calc_dX_dp_and_dY_dp_from_dpv_dp(
+                        self._w_inv.select(rows),
+                        self._u_w_inv.select(rows),
+                        self._v_w_inv.select(rows),
+                        [dpv],
+                    )
+                    result = results[self._iparam]
+                    result[self._grad_names[0]].set_selected(rows, dX[0])
+                    result[self._grad_names[1]].set_selected(rows, dY[0])
+                    if dAngle is not None:
+                        result[self._grad_names[2]].set_selected(rows, dAngle)
+                if callback is not None:
+                    results[self._iparam] = callback(results[self._iparam])
+                # increment the parameter index pointer
+                self._iparam += 1
+
+        return results
+
+    def _grads_detector_loop(self, reflections, results, callback=None):
+        if not self._varying_detectors:
+            return super(
+                ScanVaryingPredictionParameterisationSparse, self
+            )._grads_detector_loop(reflections, results, callback)
+
+        def derivatives(rows, p, dd):
+            dpv = super(
+                ScanVaryingPredictionParameterisation, self
+            )._detector_derivatives(rows, None, p, [dd])
+            return dpv[0], None
+
+        return self._grads_from_cache_loop(
+            self._detector_parameterisations, derivatives, results, callback
+        )
+
+    def _grads_beam_loop(self, reflections, results, callback=None):
+        if not self._varying_beams:
+            return super(
+                ScanVaryingPredictionParameterisationSparse, self
+            )._grads_beam_loop(reflections, results, callback)
+
+        def derivatives(rows, p, ds0):
+            dpv, dphi = super(
+                ScanVaryingPredictionParameterisation, self
+            )._beam_derivatives(rows, p, [ds0])
+            return dpv[0], dphi[0]
+
+        return self._grads_from_cache_loop(
+            self._beam_parameterisations, derivatives, results, callback
+        )
+
+    def _grads_xl_orientation_loop(self, reflections, results, callback=None):
+        if not self._varying_xl_orientations:
+            return super(
+                ScanVaryingPredictionParameterisationSparse, self
+            )._grads_xl_orientation_loop(reflections, results, callback)
+
+        def derivatives(rows, p, dU):
+            dpv, dphi = super(
+                ScanVaryingPredictionParameterisation, self
+            )._xl_orientation_derivatives(rows, p, [dU])
+            return dpv[0], dphi[0]
+
+        return self._grads_from_cache_loop(
+            self._xl_orientation_parameterisations, derivatives, results, callback
+        )
+
+    def _grads_xl_unit_cell_loop(self, reflections, results, callback=None):
+        if not self._varying_xl_unit_cells:
+            return super(
+                ScanVaryingPredictionParameterisationSparse, self
+            )._grads_xl_unit_cell_loop(reflections, results, callback)
+
+        def derivatives(rows, p, dB):
+            dpv, dphi = super(
+                ScanVaryingPredictionParameterisation, self
+            )._xl_unit_cell_derivatives(rows, p, [dB])
+            return dpv[0], dphi[0]
+
+        return self._grads_from_cache_loop(
+            self._xl_unit_cell_parameterisations, derivatives, results, callback
+        )
+
+    def _grads_goniometer_loop(self, reflections, results, callback=None):
+        if not self._varying_goniometers:
+            return super(
+                ScanVaryingPredictionParameterisationSparse, self
+            )._grads_goniometer_loop(reflections, results, callback)
+
+        def derivatives(rows, p, dS):
+            dpv, dphi = super(
+                ScanVaryingPredictionParameterisation, self
+            )._goniometer_derivatives(rows, p, [dS])
+            return dpv[0], dphi[0]
+
+        return self._grads_from_cache_loop(
+            self._goniometer_parameterisations, derivatives, results, callback
+        )
@@ -65,6 +65,14 @@
               "engine support nproc > 1. Where multiprocessing is possible,"
               "it is helpful only in certain circumstances, so this is not"
               "recommended for typical use."
+
+    persistent_workers = True
+      .type = bool
+      .help = "If nproc > 1, keep a pool of worker processes for the whole"
+              "refinement run. Each worker predicts its own block of"
+              "reflections, so only the parameter vector is sent to the workers"
+              "at each step. Otherwise, the blocks of reflections are sent to"
+              "new processes at each step."
   }
 
   verbosity = 0
@@ -374,7 +382,7 @@ def config_sparse(params, experiments):
         """Configure whether to use sparse datatypes"""
         # Automatic selection for sparse parameter
         if params.refinement.parameterisation.sparse == libtbx.Auto:
-            if len(experiments) > 1:
+            if len(experiments) > 1 or params.refinement.parameterisation.scan_varying:
                 params.refinement.parameterisation.sparse = True
             else:
                 params.refinement.parameterisation.sparse = False
@@ -552,6 +560,7 @@ def config_refinery(params, target, pred_param, constraints_manager, verbosity):
             nproc = params.refinement.mp.nproc
             try:
                 engine.set_nproc(nproc)
+                engine.set_persistent_workers(params.refinement.mp.persistent_workers)
             except NotImplementedError:
                 logger.warning(
                     "Could not set nproc={0} for refinement engine of type {1}".format(
@@ -991,7 +1000,10 @@ def run(self):
             for i, crystal in enumerate(self._experiments.crystals()):
                 logger.debug(ordinal_number(i) + " " + str(crystal))
 
-        self._refinery.run()
+        try:
+            self._refinery.run()
+        finally:
+            self._refinery.close_worker_pool()
 
         # These involve calculation, so skip them when verbosity is zero
         if self._verbosity > 0:
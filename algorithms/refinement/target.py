@@ -144,6 +144,22 @@ class Target(object):
     rmsd_names = ["RMSD_X", "RMSD_Y", "RMSD_Phi"]
     rmsd_units = ["mm", "mm", "rad"]
 
+    # columns set by _predict_core, for predictions made by worker processes
+    _predicted_keys = [
+        "xyzcal.mm",
+        "xyzcal.px",
+        "s1",
+        "delpsical.rad",
+        "x_resid",
+        "x_resid2",
+        "y_resid",
+        "y_resid2",
+        "phi_resid",
+        "phi_resid2",
+        "delpsical2",
+        "flags",
+    ]
+
     def __init__(
         self,
         experiments,
@@ -287,6 +303,11 @@ def calculate_gradients(self, reflections=None, callback=None):
 
         return gradients
 
+    def get_obs(self):
+        """return the observations held by the reflection manager"""
+
+        return self._reflection_manager.get_obs()
+
     def get_num_matches(self):
         """return the number of reflections currently used in the calculation"""
 
@@ -419,26 +440,87 @@ def split_matches_into_blocks(self, nproc=1):
         # expensive) way to do this is to add an index column to the matches table
         self._matches["imatch"] = flex.size_t_range(len(self._matches))
 
+        return self._split_into_blocks(self._matches, nproc)
+
+    def split_observations_into_blocks(self, nproc=1):
+        """Return a list of the observations held by the reflection manager, split
+        into blocks in the same way as split_matches_into_blocks. Each block can
+        then be predicted independently with matches_for_block"""
+
+        return self._split_into_blocks(self.get_obs(), nproc)
+
+    def _split_into_blocks(self, reflections, nproc):
+        """Split a reflection table into blocks of consecutive reflections"""
+
         if self._gradient_calculation_blocksize:
             nblocks = int(
-                floor(len(self._matches) * nproc / self._gradient_calculation_blocksize)
+                floor(len(reflections) * nproc / self._gradient_calculation_blocksize)
             )
         else:
             nblocks = nproc
         # ensure at least 100 reflections per block
-        nblocks = min(nblocks, int(len(self._matches) / 100))
+        nblocks = min(nblocks, int(len(reflections) / 100))
         nblocks = max(nblocks, 1)
-        blocksize = int(floor(len(self._matches) / nblocks))
+        blocksize = int(floor(len(reflections) / nblocks))
         blocks = []
         for block_num in range(nblocks - 1):
             start = block_num * blocksize
             end = (block_num + 1) * blocksize
-            blocks.append(self._matches[start:end])
+            blocks.append(reflections[start:end])
         start = (nblocks - 1) * blocksize
-        end = len(self._matches)
-        blocks.append(self._matches[start:end])
+        end = len(reflections)
+        blocks.append(reflections[start:end])
         return blocks
 
+    def matches_for_block(self, block):
+        """Predict the observations in a block from split_observations_into_blocks
+        using the current model states and return those with predictions. The
+        result is equivalent to the matches for the block after a call to predict,
+        so it can be passed to compute_functional_gradients_and_curvatures or
+        compute_residuals_and_gradients"""
+
+        block = self._predict_core(block)
+        sel = block.get_flags(block.flags.predicted)
+        matches = block.select(sel)
+
+        # index into the block for scan-varying gradient calculations, as any
+        # model state derivatives were cached for the whole block
+        matches["imatch"] = sel.iselection()
+        return matches
+
+    def predictions_for_block(self, block):
+        """return a table of the columns set by prediction for a block that has
+        been predicted by matches_for_block"""
+
+        predictions = type(block)()
+        for key in self._predicted_keys:
+            if key in block:
+                predictions[key] = block[key]
+        return predictions
+
+    def set_predictions_for_blocks(self, predictions):
+        """update the observations held by the reflection manager with the
+        results of predictions_for_block for each block, in the order of the
+        blocks from split_observations_into_blocks, then collect the matches in
+        the same way as predict"""
+
+        reflections = self._reflection_manager.get_obs()
+        start = 0
+        for block in predictions:
+            end = start + len(block)
+            reflections.set_selected(flex.size_t_range(start, end), block)
+            start = end
+        assert start == len(reflections)
+
+        # reset the 'use' flag for all observations
+        self._reflection_manager.reset_accepted_reflections()
+
+        mask = reflections.get_flags(reflections.flags.predicted)
+        reflections.set_flags(mask, reflections.flags.used_in_refinement)
+        self.update_matches(force=True)
+
+        return
+
     def compute_residuals_and_gradients(self, block=None):
         """return the vector of residuals plus their gradients and weights for
         non-linear least squares methods"""
@@ -473,9 +555,11 @@ def compute_restraints_residuals_and_gradients(self):
         weights for non-linear least squares methods"""
 
         if self._restraints_parameterisation:
-            residuals, jacobian, weights = (
-                self._restraints_parameterisation.get_residuals_gradients_and_weights()
-            )
+            (
+                residuals,
+                jacobian,
+                weights,
+            ) = self._restraints_parameterisation.get_residuals_gradients_and_weights()
             return (residuals, jacobian, weights)
 
         else:
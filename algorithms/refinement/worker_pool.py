@@ -0,0 +1,130 @@
+"""A persistent pool of worker processes for evaluating the refinement target
+in blocks of reflections.
+
+The workers are forked once, when the pool is started, and each inherits a copy
+of the target, the prediction parameterisation and the observations split into
+blocks. For each step of refinement only the parameter vector is sent to the
+workers. A worker sets the parameters on its own copy of the models, predicts
+the reflections of one block and returns the blockwise target quantities with
+the predicted columns of the block. The parent then sets the predictions on
+its observations rather than predicting them again, and neither the
+observations nor the model parameterisations are pickled again."""
+
+from __future__ import absolute_import, division, print_function
+
+import logging
+import multiprocessing
+import os
+
+logger = logging.getLogger(__name__)
+
+# State inherited by the forked worker processes
+_worker_state = {}
+
+
+def _matches_for_block(iblock, param_vals):
+    target = _worker_state["target"]
+    _worker_state["prediction_parameterisation"].set_param_vals(param_vals)
+    block = _worker_state["blocks"][iblock]
+    matches = target.matches_for_block(block)
+    return matches, target.predictions_for_block(block)
+
+
+def _compute_functional_gradients_and_curvatures(args):
+    iblock, param_vals = args
+    matches, predictions = _matches_for_block(iblock, param_vals)
+    target = _worker_state["target"]
+    return target.compute_functional_gradients_and_curvatures(matches), predictions
+
+
+def _compute_residuals_and_gradients(args):
+    iblock, param_vals = args
+    matches, predictions = _matches_for_block(iblock, param_vals)
+    return _worker_state["target"].compute_residuals_and_gradients(matches), predictions
+
+
+def worker_pool_available():
+    """Return True if a TargetWorkerPool can be used on this platform, which
+    requires workers to be started with fork"""
+
+    return hasattr(os, "fork")
+
+
+class TargetWorkerPool(object):
+    """Persistent worker processes for evaluating a refinement Target"""
+
+    def __init__(self, target, prediction_parameterisation, nproc):
+
+        assert worker_pool_available()
+        self._target = target
+        self._nproc = nproc
+
+        # split the observations once. The pool must be restarted if the
+        # reflection manager changes its table of observations
+        self._obs = target.get_obs()
+        self._nobs = len(self._obs)
+        blocks = target.split_observations_into_blocks(nproc=nproc)
+        self._nblocks = len(blocks)
+
+        _worker_state.update(
+            target=target,
+            prediction_parameterisation=prediction_parameterisation,
+            blocks=blocks,
+        )
+        try:
+            self._pool = multiprocessing.Pool(processes=nproc)
+        finally:
+            # the parent has no further need of the blocks
+            _worker_state.clear()
+
+        logger.debug(
+            "Started %d refinement worker processes for %d blocks of %d reflections",
+            nproc,
+            self._nblocks,
+            self._nobs,
+        )
+
+    def is_current(self):
+        """Check that the pool was started with the current observations"""
+
+        obs = self._target.get_obs()
+        return obs is self._obs and len(obs) == self._nobs
+
+    def _tasks(self, param_vals):
+        param_vals = list(param_vals)
+        return [(iblock, param_vals) for iblock in range(self._nblocks)]
+
+    def compute_functional_gradients_and_curvatures(self, param_vals):
+        """Return the list of blockwise results of
+        Target.compute_functional_gradients_and_curvatures for the parameter
+        values (in the same order as set_param_vals). The predictions made by
+        the workers are passed back to the target, in place of Target.predict"""
+
+        results = self._pool.map(
+            _compute_functional_gradients_and_curvatures,
+            self._tasks(param_vals),
+            chunksize=1,
+        )
+        task_results, predictions = zip(*results)
+        self._target.set_predictions_for_blocks(predictions)
+        return list(task_results)
+
+    def compute_residuals_and_gradients(self, param_vals):
+        """Iterate over the blockwise results of
+        Target.compute_residuals_and_gradients for the parameter values, in
+        block order. Once all blocks have been returned, the predictions made by
+        the workers are passed back to the target, in place of Target.predict"""
+
+        predictions = []
+        for result, block_predictions in self._pool.imap(
+            _compute_residuals_and_gradients, self._tasks(param_vals), chunksize=1
+        ):
+            predictions.append(block_predictions)
+            yield result
+        self._target.set_predictions_for_blocks(predictions)
+
+    def close(self):
+        """Stop the worker processes"""
+
+        self._pool.close()
+        self._pool.join()
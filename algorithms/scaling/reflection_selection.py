@@ -62,6 +62,7 @@
 intra-dataset connectedness.
 """
 from __future__ import absolute_import, division, print_function
+import heapq
 import logging
 from math import pi, floor
 import libtbx
@@ -227,10 +228,90 @@ def assign_segment_index(reflections):
     return reflections
 
 
-def _build_class_matrix(reflections, class_matrix, offset=0):
-    for (i, val) in enumerate(reflections["class_index"], start=offset):
-        class_matrix[val, i] = 1.0
-    return class_matrix
+def _run_bounds(sorted_values):
+    """Return the start and end indices of the runs of equal values."""
+    is_start = flex.bool(1, True)
+    is_start.extend(sorted_values[1:] != sorted_values[:-1])
+    starts = is_start.iselection()
+    ends = starts[1:]
+    ends.append(sorted_values.size())
+    return starts, ends
+
+
+class _ClassGroupIndex(object):
+    """
+    The class vs symmetry group matrix described above, stored sparsely by
+    group and by class.
+
+    The groups are ranked by the number of classes they cover (highest first,
+    ties in group order), i.e. the order of the columns of the sorted matrix.
+    For each class, the ranks of the groups with a reflection in that class are
+    held in increasing order (an inverted index), with a pointer to the first
+    that has not been used, so that the most connected unused group for a
+    class is found without searching through the columns of the matrix.
+    """
+
+    def __init__(self, class_index, group_index, n_classes, n_groups):
+        # count the reflections in each (group, class) pair, sorted by group
+        keys = group_index.as_double() * n_classes + class_index.as_double()
+        perm = flex.sort_permutation(keys)
+        starts, ends = _run_bounds(keys.select(perm))
+        first = perm.select(starts)
+        groups = group_index.select(first)
+        classes = class_index.select(first)
+        counts = (ends - starts).as_double()
+
+        # each group has at least one reflection
+        group_starts, group_ends = _run_bounds(groups)
+        assert group_starts.size() == n_groups
+        n_classes_in_group = (group_ends - group_starts).as_double()
+        self.perm = flex.sort_permutation(n_classes_in_group, reverse=True, stable=True)
+        rank = flex.size_t(n_groups, 0)
+        rank.set_selected(self.perm, flex.size_t_range(n_groups))
+        self._group_starts = list(group_starts.select(self.perm))
+        self._group_ends = list(group_ends.select(self.perm))
+        self._classes = list(classes)
+        self._counts = list(counts)
+
+        # the inverted index, sorted by class then group rank
+        rank = list(rank)
+        ranks = flex.size_t([rank[g] for g in groups])
+        class_perm = flex.sort_permutation(
+            classes.as_double() * n_groups + ranks.as_double()
+        )
+        sorted_classes = classes.select(class_perm)
+        self._class_ranks = list(ranks.select(class_perm))
+        self._next = [0] * n_classes
+        self._end = [0] * n_classes
+        for start, end in zip(*_run_bounds(sorted_classes)):
+            self._next[sorted_classes[start]] = start
+            self._end[sorted_classes[start]] = end
+
+        self.n_classes = n_classes
+        self.n_groups = n_groups
+
+    def column(self, rank):
+        """Return the (class, count) pairs of the group of a given rank."""
+        start, end = self._group_starts[rank], self._group_ends[rank]
+        return zip(self._classes[start:end], self._counts[start:end])
+
+    def next_column(self, class_, used):
+        """Return the rank of the most connected unused group with a reflection
+        in a class, or None if there are none left."""
+        i, end = self._next[class_], self._end[class_]
+        while i < end and used[self._class_ranks[i]]:
+            i += 1
+        self._next[class_] = i
+        if i == end:
+            return None
+        return self._class_ranks[i]
+
+
+def _group_index(Ih_table_block):
+    """Return the index of the symmetry group of each reflection."""
+    n_groups = Ih_table_block.h_index_matrix.n_cols
+    group_ids = flex.size_t_range(n_groups).as_double()
+    return (group_ids * Ih_table_block.h_expand_matrix).iround()
 
 
 def select_highly_connected_reflections(
@@ -360,30 +441,20 @@ def select_connected_reflections_across_datasets(
         max_total,
     )
 
-    from scitbx import sparse
-
-    class_matrix = sparse.matrix(n_datasets, sel_Ih_table.Ih_table.size())
-
     sel_Ih_table.Ih_table["class_index"] = sel_Ih_table.Ih_table["dataset_id"]
 
-    class_matrix = _build_class_matrix(sel_Ih_table.Ih_table, class_matrix)
-    segments_in_groups = class_matrix * sel_Ih_table.h_index_matrix
-
-    total = flex.double(segments_in_groups.n_cols, 0)
-    for i, col in enumerate(segments_in_groups.cols()):
-        total[i] = col.non_zeroes
-    perm = flex.sort_permutation(total, reverse=True, stable=True)
-    sorted_class_matrix = segments_in_groups.select_columns(perm)
-    # matrix of segment index vs asu groups
+    class_index = _ClassGroupIndex(
+        sel_Ih_table.Ih_table["class_index"],
+        _group_index(sel_Ih_table),
+        n_datasets,
+        sel_Ih_table.h_index_matrix.n_cols,
+    )
 
     # now want to fill up until good coverage across board
-    total_in_classes, cols_not_used = _loop_over_class_matrix(
-        sorted_class_matrix, min_per_class, min_total, max_total
+    total_in_classes, cols_used = _loop_over_class_matrix(
+        class_index, min_per_class, min_total, max_total
     )
-
-    cols_used = flex.bool(sorted_class_matrix.n_cols, True)
-    cols_used.set_selected(cols_not_used, False)
-    actual_cols_used = perm.select(cols_used)
+    actual_cols_used = class_index.perm.select(cols_used)
 
     # now need to get reflection selection
     reduced_Ih = sel_Ih_table.select_on_groups_isel(actual_cols_used)
@@ -411,28 +482,18 @@ def select_highly_connected_reflections_in_bin(
     Ih_table_block.Ih_table["loc_indices"] = flex.size_t(range(0, Ih_table_block.size))
     Ih_table_block = Ih_table_block.select_on_groups(sel)
 
-    from scitbx import sparse
-
-    class_matrix = sparse.matrix(12, Ih_table_block.size)
-
-    class_matrix = _build_class_matrix(Ih_table_block.Ih_table, class_matrix)
-    segments_in_groups = class_matrix * Ih_table_block.h_index_matrix
-
-    total = flex.int(segments_in_groups.n_cols, 0)
-    for i, col in enumerate(segments_in_groups.cols()):
-        total[i] = col.non_zeroes
-    perm = flex.sort_permutation(total, reverse=True, stable=True)
-    sorted_class_matrix = segments_in_groups.select_columns(perm)
-    # matrix of segment index vs asu groups
+    class_index = _ClassGroupIndex(
+        Ih_table_block.Ih_table["class_index"],
+        _group_index(Ih_table_block),
+        12,
+        Ih_table_block.h_index_matrix.n_cols,
+    )
 
     # now want to fill up until good coverage across board
-    total_in_classes, cols_not_used = _loop_over_class_matrix(
-        sorted_class_matrix, min_per_class, min_total, max_total
+    total_in_classes, cols_used = _loop_over_class_matrix(
+        class_index, min_per_class, min_total, max_total
     )
-
-    cols_used = flex.bool(sorted_class_matrix.n_cols, True)
-    cols_used.set_selected(cols_not_used, False)
-    actual_cols_used = perm.select(cols_used)
+    actual_cols_used = class_index.perm.select(cols_used)
 
     # now need to get reflection selection
     reduced_Ih = Ih_table_block.select_on_groups_isel(actual_cols_used)
@@ -440,58 +501,84 @@ def select_highly_connected_reflections_in_bin(
     return indices, total_in_classes
 
 
-def _get_next_row_needed(total_in_classes):
-    current_min = flex.min(total_in_classes)
-    for i, val in enumerate(total_in_classes):
-        if val == current_min:
-            row_needed = i
-            break
-    return row_needed
-
-
-def _add_next_column(cols_not_used, row_needed, sorted_class_matrix, total_in_classes):
-    for i, col in enumerate(cols_not_used):
-        if sorted_class_matrix.col(col)[row_needed] != 0.0:
-            total_in_classes += sorted_class_matrix.col(col).as_dense_vector()
-            del cols_not_used[i]
-            return cols_not_used, total_in_classes, True
-    # else couldn't find enough of this one!
-    return cols_not_used, total_in_classes, False
-
-
-def _loop_over_class_matrix(
-    sorted_class_matrix, min_per_area, min_per_bin, max_per_bin
-):
-    """Build up the reflectio set by looping over the class matrix."""
-    total_in_classes = sorted_class_matrix.col(0).as_dense_vector()
-    defecit = flex.double(sorted_class_matrix.n_rows, 0)
-    cols_not_used = flex.size_t(range(1, sorted_class_matrix.n_cols))
+class _ClassTotals(object):
+    """The number of reflections chosen in each class, with a heap to find the
+    first class with the fewest reflections."""
+
+    def __init__(self, n_classes):
+        self.totals = [0.0] * n_classes
+        self.sum = 0.0
+        self._heap = [(0.0, i) for i in range(n_classes)]
+
+    def __getitem__(self, class_):
+        return self.totals[class_]
+
+    def __setitem__(self, class_, value):
+        self.sum += value - self.totals[class_]
+        self.totals[class_] = value
+        # old entries are discarded when they reach the top of the heap
+        heapq.heappush(self._heap, (value, class_))
+
+    def min(self):
+        """Return the minimum total and the first class with that total."""
+        while self._heap[0][0] != self.totals[self._heap[0][1]]:
+            heapq.heappop(self._heap)
+        return self._heap[0]
+
+
+def _loop_over_class_matrix(class_index, min_per_area, min_per_bin, max_per_bin):
+    """Build up the reflection set by looping over the class matrix.
+
+    Returns the number of reflections chosen in each class and a selection of
+    the groups used, in order of group rank."""
+    total_in_classes = _ClassTotals(class_index.n_classes)
+    cols_used = [False] * class_index.n_groups
+    n_cols_not_used = [class_index.n_groups]
+
+    def add_next_column(row_needed):
+        # add the most-connected unused column that includes that class
+        col = class_index.next_column(row_needed, cols_used)
+        if col is None:
+            # couldn't find enough of this one!
+            return False
+        for i, count in class_index.column(col):
+            total_in_classes[i] += count
+        cols_used[col] = True
+        n_cols_not_used[0] -= 1
+        return True
+
+    def result(defecit):
+        totals = flex.double(total_in_classes.totals) - flex.double(defecit)
+        return totals, flex.bool(cols_used)
+
+    for i, count in class_index.column(0):
+        total_in_classes[i] += count
+    cols_used[0] = True
+    n_cols_not_used[0] -= 1
+
+    defecit = [0.0] * class_index.n_classes
     total_deficit = 0
     while (
-        flex.min(total_in_classes) < min_per_area
-        and (flex.sum(total_in_classes) - total_deficit) < max_per_bin
+        total_in_classes.min()[0] < min_per_area
+        and (total_in_classes.sum - total_deficit) < max_per_bin
     ):
         # first find which class need most of
-        row_needed = _get_next_row_needed(total_in_classes)
-        # now try to add the most-connected column that includes that class
-        cols_not_used, total_in_classes, success = _add_next_column(
-            cols_not_used, row_needed, sorted_class_matrix, total_in_classes
-        )
-        # return whether successful, updated totals and which cols are left.
-        if not success:
+        row_needed = total_in_classes.min()[1]
+        if not add_next_column(row_needed):
             # want to stop looking for that class as no more left
             current_in_row = total_in_classes[row_needed]
             defecit[row_needed] = min_per_area - current_in_row
             total_deficit += min_per_area - current_in_row
             total_in_classes[row_needed] = min_per_area
-        if flex.sum(total_in_classes) > max_per_bin:
+        if total_in_classes.sum > max_per_bin:
             # if we have reached the maximum, then finish there
-            return total_in_classes - defecit, cols_not_used
-    total_in_classes -= defecit
-    n = flex.sum(total_in_classes)
+            return result(defecit)
+    for i, d in enumerate(defecit):
+        total_in_classes[i] -= d
+    n = total_in_classes.sum
     # if we haven't reached the minimum total, then need to add more until we
     # reach it or run out of reflections
-    if n < min_per_bin and cols_not_used:
+    if n < min_per_bin and n_cols_not_used[0]:
         multiplier = int(floor(min_per_bin / n) + 1)
         new_limit = min_per_area * multiplier
         for i, d in enumerate(defecit):
@@ -499,17 +586,14 @@ def _loop_over_class_matrix(
                 # don't want to be searching for those classes that we know dont have any left
                 total_in_classes[i] = new_limit
                 defecit[i] = d + new_limit - min_per_area
-        while cols_not_used and flex.min(total_in_classes) < new_limit:
-            row_needed = _get_next_row_needed(total_in_classes)
-            cols_not_used, total_in_classes, success = _add_next_column(
-                cols_not_used, row_needed, sorted_class_matrix, total_in_classes
-            )
-            if not success:
+        while n_cols_not_used[0] and total_in_classes.min()[0] < new_limit:
+            row_needed = total_in_classes.min()[1]
+            if not add_next_column(row_needed):
                 current_in_row = total_in_classes[row_needed]
                 defecit[row_needed] = new_limit - current_in_row
                 total_in_classes[row_needed] = new_limit
-        return total_in_classes - defecit, cols_not_used
-    return total_in_classes, cols_not_used
+        return result(defecit)
+    return result([0.0] * class_index.n_classes)
 
 
 def calculate_scaling_subset_connected(
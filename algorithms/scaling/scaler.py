@@ -201,6 +201,8 @@ def perform_scaling(
                 refinery.run()
             except Exception as e:
                 logger.error(e, exc_info=True)
+            finally:
+                refinery.close_worker_pool()
             ft = time.time()
             logger.info("Time taken for refinement %s", (ft - st))
             refinery.return_scaler()
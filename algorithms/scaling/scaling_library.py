@@ -14,7 +14,6 @@
 import pkg_resources
 from libtbx import phil
 from mock import Mock
-import iotbx.merging_statistics
 from iotbx import cif, mtz
 from cctbx import miller, crystal, uctbx
 from dxtbx.model import Experiment
@@ -30,6 +29,7 @@
     select_datasets_on_ids,
 )
 from dials.util.multi_dataset_handling import get_next_unique_id
+from dials.report import merging_statistics
 
 logger = logging.getLogger("dials")
 
@@ -341,8 +341,14 @@ def calculate_merging_statistics(reflection_table, experiments, use_internal_var
         )
         ids.append(dataset_ids[0])
     else:
+        # the statistics need only a few columns of the reflections of each
+        # dataset, which are read from views rather than copies of all columns
+        views = reflection_table.split_views_by_experiment_id()
         for dataset_id in dataset_ids:
-            refls = reflection_table.select(reflection_table["id"] == dataset_id)
+            if dataset_id in views:
+                refls = views[dataset_id]
+            else:
+                refls = reflection_table.select(reflection_table["id"] == dataset_id)
             results.append(
                 calculate_single_merging_stats(
                     refls, experiments[0], use_internal_variance
@@ -453,11 +459,10 @@ def calculate_single_merging_stats(
         i_obs = intensities_anom.map_to_asu().customized_copy(
             info=intensities_anom.info()
         )
-    result = iotbx.merging_statistics.dataset_statistics(
+    result = merging_statistics.dataset_statistics(
         i_obs=i_obs,
         n_bins=n_bins,
         anomalous=anomalous,
-        sigma_filtering=None,
         use_internal_variance=use_internal_variance,
         eliminate_sys_absent=False,
         cc_one_half_significance_level=0.01,
@@ -12,6 +12,10 @@
     LBFGScurvs,
 )
 from dials.algorithms.scaling.scaling_utilities import log_memory_usage
+from dials.algorithms.scaling.worker_pool import (
+    ScalingWorkerPool,
+    worker_pool_available,
+)
 from libtbx.phil import parse
 from libtbx.table_utils import simple_table
 from scitbx.array_family import flex
@@ -208,6 +212,11 @@ def __init__(self, scaler, target, prediction_parameterisation, *args, **kwargs)
         self._scaler = scaler
         self._rmsd_tolerance = scaler.params.scaling_refinery.rmsd_tolerance
         self._parameters = prediction_parameterisation
+        self._worker_pool = None
+        # the parameter values and the (sum of weighted squared residuals,
+        # number of reflections) of the work blocks, as last evaluated by the
+        # worker pool
+        self._work_residuals = None
 
     def test_rmsd_convergence(self):
         """Test for convergence of RMSDs"""
@@ -238,15 +247,76 @@ def prepare_for_step(self):
 
         return
 
+    def work_block_ids(self):
+        """Return the ids of the blocks of the Ih_table used for minimisation,
+        i.e. excluding any free set block"""
+        n_blocks = len(self._scaler.Ih_table.blocked_data_list)
+        if self._scaler.Ih_table.free_Ih_table:
+            n_blocks -= 1
+        return list(range(n_blocks))
+
+    def get_worker_pool(self):
+        """Return the pool of worker processes evaluating the work blocks,
+        starting it if necessary, or None if the blocks are to be evaluated in
+        this process (if scaling_options.nproc is 1 or there is one block)"""
+        nproc = self._scaler.params.scaling_options.nproc
+        block_ids = self.work_block_ids()
+        if nproc < 2 or len(block_ids) < 2 or not worker_pool_available():
+            return None
+        if self._worker_pool is None:
+            self._worker_pool = ScalingWorkerPool(
+                self._scaler,
+                self._target,
+                self._parameters,
+                block_ids,
+                min(nproc, len(block_ids)),
+            )
+        return self._worker_pool
+
+    def close_worker_pool(self):
+        """Stop any worker processes, and update the work blocks held by this
+        process for the current parameter values"""
+        if self._worker_pool is None:
+            return
+        self._worker_pool.close()
+        self._worker_pool = None
+        self._work_residuals = None
+        self.prepare_for_step()
+        self._update_work_blocks()
+
+    def _update_work_blocks(self):
+        for block_id in self.work_block_ids():
+            self._scaler.update_for_minimisation(self._parameters, block_id)
+            self._scaler.clear_memory_from_derivs(block_id)
+
+    def _set_work_residuals(self, sum_of_squares, n_reflections):
+        self._work_residuals = (
+            list(self._parameters.get_param_vals()),
+            (sum_of_squares, n_reflections),
+        )
+
+    def rmsds(self):
+        """Calculate the RMSDs for the current parameter values, using the
+        residuals calculated by the worker pool if available"""
+        work_residuals = None
+        if self._work_residuals is not None:
+            param_vals, work_residuals = self._work_residuals
+            if param_vals != list(self._parameters.get_param_vals()):
+                work_residuals = None
+        if work_residuals is None and self._worker_pool is not None:
+            # the work blocks held by this process are out of date
+            self._update_work_blocks()
+        return self._target.rmsds(
+            self._scaler.Ih_table, self._parameters, work_residuals
+        )
+
     def update_journal(self):
         """Append latest step information to the journal attributes"""
 
         # add step quantities to journal
         self.history.add_row()
         self.history.set_last_cell("num_reflections", self._scaler.Ih_table.size)
-        self.history.set_last_cell(
-            "rmsd", self._target.rmsds(self._scaler.Ih_table, self._parameters)
-        )
+        self.history.set_last_cell("rmsd", self.rmsds())
         self.history.set_last_cell(
             "parameter_vector", self._parameters.get_param_vals()
         )
@@ -381,37 +451,24 @@ def compute_functional_gradients_and_curvatures(self):
         else:
             blocks = self._scaler.Ih_table.blocked_data_list
 
-        # if self._scaler.params.scaling_options.nproc > 1:
-        f = []
-        gi = []
-        for block_id, block in enumerate(blocks):
-            self._scaler.update_for_minimisation(self._parameters, block_id)
-            fb, gb = self._target.compute_functional_gradients(block)
-            f.append(fb)
-            gi.append(gb)
-            self._scaler.clear_memory_from_derivs(block_id)
-        """task_results = easy_mp.parallel_map(
-      func=self._target.compute_functional_gradients,
-      iterable=blocks,
-      processes=self._scaler.params.scaling_options.nproc,
-      method="multiprocessing",
-      preserve_exception_message=True
-      )
-    f, gi = zip(*task_results)"""
+        pool = self.get_worker_pool()
+        if pool is not None:
+            task_results = pool.compute_functional_gradients(self.x)
+            f, gi, sizes = zip(*task_results)
+            self._set_work_residuals(sum(f), sum(sizes))
+        else:
+            f = []
+            gi = []
+            for block_id, block in enumerate(blocks):
+                self._scaler.update_for_minimisation(self._parameters, block_id)
+                fb, gb = self._target.compute_functional_gradients(block)
+                f.append(fb)
+                gi.append(gb)
+                self._scaler.clear_memory_from_derivs(block_id)
         f = sum(f)
         g = gi[0]
         for i in range(1, len(gi)):
             g += gi[i]
-        """else:
-      f = 0.0
-      g = None
-      for block in blocks:
-        fi, gi = self._target.compute_functional_gradients(block)
-        f += fi
-        if g:
-          g += gi
-        else:
-          g = gi"""
 
         restraints = self._target.compute_restraints_functional_gradients_and_curvatures(
             self._parameters
@@ -501,15 +558,15 @@ def build_up(self, objective_only=False):
             blocks = self._scaler.Ih_table.blocked_data_list
 
         # observation terms
-        if objective_only:
-            # if self._scaler.params.scaling_options.nproc > 1: #no mp option yet
+        pool = self.get_worker_pool()
+        if pool is not None:
+            self._build_up_in_workers(pool, objective_only)
+        elif objective_only:
             for block_id, block in enumerate(blocks):
                 self._scaler.update_for_minimisation(self._parameters, block_id)
                 residuals, weights = self._target.compute_residuals(block)
                 self.add_residuals(residuals, weights)
         else:
-            # if self._scaler.params.scaling_options.nproc: #no mp option yet
-
             self._jacobian = None
 
             for block_id, block in enumerate(blocks):
@@ -518,13 +575,6 @@ def build_up(self, objective_only=False):
                     block
                 )
                 self.add_equations(residuals, jacobian, weights)
-            """task_results = easy_mp.pool_map(
-        fixed_func=self._target.compute_residuals_and_gradients,
-        iterable=blocks,
-        processes=self._scaler.params.scaling_options.nproc
-        )
-      for result in task_results:
-        self.add_equations(result[0], result[1], result[2])"""
 
         restraints = self._target.compute_restraints_residuals_and_gradients(
             self._parameters
@@ -539,6 +589,34 @@ def build_up(self, objective_only=False):
         logger.debug("\n")
         return
 
+    def _build_up_in_workers(self, pool, objective_only=False):
+        """Add the residuals, or the normal equations, of the work blocks as
+        evaluated by the worker pool"""
+        sum_of_squares = 0.0
+        n_reflections = 0
+        if objective_only:
+            for residuals, weights in pool.compute_residuals(self.x):
+                self.add_residuals(residuals, weights)
+                sum_of_squares += flex.sum(residuals * residuals * weights)
+                n_reflections += residuals.size()
+        else:
+            self._jacobian = None
+
+            # The sparse Jacobians are not returned by the workers, only their
+            # contributions to the normal matrix and right hand side, which are
+            # added to those of the step equations in place
+            step_equations = self.step_equations()
+            normal_matrix = step_equations.normal_matrix_packed_u()
+            right_hand_side = step_equations.right_hand_side()
+            for result in pool.compute_normal_equations(self.x):
+                residuals, weights, block_normal_matrix, block_rhs = result
+                self.add_residuals(residuals, weights)
+                normal_matrix += block_normal_matrix
+                right_hand_side += block_rhs
+                sum_of_squares += flex.sum(residuals * residuals * weights)
+                n_reflections += residuals.size()
+        self._set_work_residuals(sum_of_squares, n_reflections)
+
 
 class ScalingGaussNewtonIterations(ScalingLstbxBuildUpMixin, GaussNewtonIterations):
     """Refinery implementation, using lstbx Gauss Newton iterations"""
@@ -34,8 +34,13 @@ def __init__(self, curvatures=False):
         # returned, then this is set to False and restraints calculations are not
         # attempted for the remainder of the minimisation with this target function.
 
-    def rmsds(self, Ih_table, apm):
-        """Calculate RMSDs for the matches. Also calculate R-factors."""
+    def rmsds(self, Ih_table, apm, work_residuals=None):
+        """Calculate RMSDs for the matches. Also calculate R-factors.
+
+        If the sum of the weighted squared residuals of the work blocks and
+        their number of reflections are already known (e.g. from worker
+        processes), they can be given as the tuple work_residuals, in which
+        case the work blocks are not used."""
         R = flex.double([])
         n = 0
         if Ih_table.free_Ih_table:
@@ -47,9 +52,13 @@ def rmsds(self, Ih_table, apm):
             work_blocks = Ih_table.blocked_data_list
             self.rmsd_names = ["RMSD_I"]
             self.rmsd_units = ["a.u"]
-        for block in work_blocks:
-            R.extend((self.calculate_residuals(block) ** 2) * block.weights)
-            n += block.size
+        if work_residuals is not None:
+            R.append(work_residuals[0])
+            n = work_residuals[1]
+        else:
+            for block in work_blocks:
+                R.extend((self.calculate_residuals(block) ** 2) * block.weights)
+                n += block.size
         unrestr_R = copy(R)
         if self.param_restraints:
             restraints = self.restraints_calculator.calculate_restraints(apm)
@@ -4,6 +4,8 @@
 from __future__ import absolute_import, division, print_function
 import os
 import itertools
+import time
+import pytest
 from libtbx import phil
 from cctbx import sgtbx
 from dxtbx.serialize import load
@@ -101,6 +103,55 @@ def make_refl_table(n_list, class_idx=0):
     assert list(datset_ids) == [0] * 8 + [1] * 7 + [2] * 7
 
 
+def _random_reflections(n_refl, n_groups, n_classes, seed=0):
+    """Make a reflection table with random symmetry groups and classes."""
+    flex.set_random_seed(seed)
+    r1 = flex.reflection_table()
+    h = (flex.random_double(n_refl) * n_groups - 0.5).iround() + 1
+    r1["miller_index"] = flex.miller_index([(0, 0, k) for k in h])
+    r1["class_index"] = (flex.random_double(n_refl) * n_classes - 0.5).iround()
+    r1["intensity"] = flex.double(n_refl, 1)
+    r1["variance"] = flex.double(n_refl, 1)
+    r1["inverse_scale_factor"] = flex.double(n_refl, 1)
+    return r1
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("n_refl", [10 ** 5, 10 ** 6])
+def test_reflection_selection_benchmark(n_refl):
+    """Time the selection in a resolution bin and across datasets for a large
+    number of reflections, with on average four reflections per group."""
+    sg = sgtbx.space_group("P1")
+
+    r1 = _random_reflections(n_refl, n_refl // 4, 12)
+    Ih_table_block = IhTable([r1], sg).Ih_table_blocks[0]
+    Ih_table_block.Ih_table["class_index"] = r1["class_index"].select(
+        Ih_table_block.Ih_table["loc_indices"]
+    )
+    t0 = time.time()
+    indices, total_in_classes = select_highly_connected_reflections_in_bin(
+        Ih_table_block,
+        min_per_class=n_refl // 100,
+        min_total=n_refl // 10,
+        max_total=n_refl // 2,
+    )
+    t1 = time.time()
+    assert flex.min(total_in_classes) >= n_refl // 100
+    print("In bin, %d reflections: %.2fs" % (n_refl, t1 - t0))
+
+    reflections = [
+        _random_reflections(n_refl // 4, n_refl // 16, 1, seed=i) for i in range(4)
+    ]
+    table = IhTable(reflections, sg)
+    t0 = time.time()
+    indices, _, total_in_classes = select_connected_reflections_across_datasets(
+        table, min_per_class=n_refl // 100, Isigma_cutoff=0.0
+    )
+    t1 = time.time()
+    assert flex.min(total_in_classes) >= n_refl // 100
+    print("Across datasets, %d reflections: %.2fs" % (n_refl, t1 - t0))
+
+
 def generated_param():
     """Generate a param phil scope."""
     phil_scope = phil.parse(
@@ -807,3 +807,63 @@ def test_scale_cross_validate(dials_regression, run_in_tmpdir):
     args = ["dials.scale"] + [pickle_path] + [sweep_path] + extra_args
     command = " ".join(args)
     _ = easy_run.fully_buffered(command=command).raise_if_errors()
+
+
+def _run_proteinase_k_scaling(location, extra_args):
+    command = ["dials.scale", "d_min=1.4", "optimise_errors=False"] + extra_args
+    for i in [1, 2, 3, 4]:
+        command.append(location.join("experiments_" + str(i) + ".json").strpath)
+        command.append(location.join("reflections_" + str(i) + ".pickle").strpath)
+    result = procrunner.run(command)
+    assert result["exitcode"] == 0
+    assert result["stderr"] == ""
+    return flex.reflection_table.from_pickle("scaled.pickle")
+
+
+@pytest.mark.parametrize(
+    "engine_args",
+    [
+        ["scaling_refinery.engine=SimpleLBFGS", "full_matrix=False"],
+        ["scaling_refinery.engine=GaussNewton", "full_matrix=False"],
+        ["scaling_refinery.engine=SimpleLBFGS", "full_matrix_engine=LevMar"],
+    ],
+)
+def test_scale_blocks_in_parallel(dials_data, tmpdir, engine_args):
+    """Scaling with the Ih_table blocks evaluated in worker processes should
+    give the same scales as scaling in a single process."""
+    location = dials_data("multi_crystal_proteinase_k")
+    scales = []
+    for nproc in (1, 3):
+        with tmpdir.mkdir("nproc_%d" % nproc).as_cwd():
+            table = _run_proteinase_k_scaling(
+                location, engine_args + ["scaling_options.nproc=%d" % nproc]
+            )
+            scales.append(table["inverse_scale_factor"])
+    assert scales[0].all_approx_equal(scales[1], 1e-4)
+
+
+@pytest.mark.slow
+def test_scale_blocks_in_parallel_benchmark(dials_data, tmpdir):
+    """Report the time taken for the scaling minimisation against nproc."""
+    location = dials_data("multi_crystal_proteinase_k")
+    for engine in ("SimpleLBFGS", "GaussNewton"):
+        for nproc in (1, 2, 4, 8):
+            with tmpdir.mkdir("%s_%d" % (engine, nproc)).as_cwd():
+                _run_proteinase_k_scaling(
+                    location,
+                    [
+                        "scaling_refinery.engine=%s" % engine,
+                        "full_matrix=False",
+                        "scaling_options.nproc=%d" % nproc,
+                    ],
+                )
+                with open("dials.scale.log") as f:
+                    times = [
+                        float(line.split()[-1])
+                        for line in f
+                        if line.startswith("Time taken for refinement")
+                    ]
+            print(
+                "%s nproc=%d: %.2fs in %d rounds of minimisation"
+                % (engine, nproc, sum(times), len(times))
+            )
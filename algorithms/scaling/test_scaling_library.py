@@ -303,7 +303,7 @@ def test_calculate_single_merging_stats(test_experiments):
         flex.bool([True, False, False, False]), reflection_table.flags.bad_for_scaling
     )
     with patch(
-        "iotbx.merging_statistics.dataset_statistics",
+        "dials.report.merging_statistics.dataset_statistics",
         side_effect=return_data_side_effect,
     ):
         res = calculate_single_merging_stats(
@@ -0,0 +1,129 @@
+"""A persistent pool of worker processes for evaluating the scaling target in
+the blocks of the Ih_table.
+
+The workers are forked once, when the pool is started, and each inherits a copy
+of the scaler (with its Ih_table split into blocks by ranges of asu index), the
+target and the active parameter manager. For each step of minimisation only
+the parameter vector is sent to the workers. A worker sets the parameters on
+its own copy of the scaling models, updates the scales, weights and Ih values
+of one block and returns the blockwise functional and gradients (LBFGS), or
+the contributions of the block to the normal equations (Gauss-Newton and
+Levenberg-Marquardt), so neither the blocks nor the sparse Jacobians are
+pickled.
+
+As the blocks are updated in the workers, the blocks held by the parent
+process are not; ScalingRefinery brings them up to date when the pool is
+closed."""
+
+from __future__ import absolute_import, division, print_function
+
+import logging
+import multiprocessing
+import os
+
+from scitbx.array_family import flex
+
+logger = logging.getLogger("dials")
+
+# State inherited by the forked worker processes
+_worker_state = {}
+
+
+def _update_block(block_id, param_vals):
+    scaler = _worker_state["scaler"]
+    apm = _worker_state["apm"]
+    apm.set_param_vals(param_vals)
+    scaler.update_for_minimisation(apm, block_id)
+    return scaler.Ih_table.blocked_data_list[block_id]
+
+
+def _compute_functional_gradients(args):
+    block_id, param_vals = args
+    block = _update_block(block_id, param_vals)
+    f, g = _worker_state["target"].compute_functional_gradients(block)
+    _worker_state["scaler"].clear_memory_from_derivs(block_id)
+    return f, g, block.size
+
+
+def _compute_residuals(args):
+    block_id, param_vals = args
+    block = _update_block(block_id, param_vals)
+    residuals, weights = _worker_state["target"].compute_residuals(block)
+    _worker_state["scaler"].clear_memory_from_derivs(block_id)
+    return residuals, weights
+
+
+def _compute_normal_equations(args):
+    block_id, param_vals = args
+    block = _update_block(block_id, param_vals)
+    residuals, jacobian, weights = _worker_state[
+        "target"
+    ].compute_residuals_and_gradients(block)
+    _worker_state["scaler"].clear_memory_from_derivs(block_id)
+    # the contributions to the normal matrix and (negated) right hand side, as
+    # accumulated by lstbx non_linear_ls.add_equations
+    normal_matrix = jacobian.self_transpose_times_diagonal_times_self_in_packed_u(
+        weights
+    )
+    right_hand_side = -((weights * residuals) * jacobian)
+    return residuals, weights, normal_matrix, right_hand_side
+
+
+def worker_pool_available():
+    """Return True if a ScalingWorkerPool can be used on this platform, which
+    requires workers to be started with fork"""
+
+    return hasattr(os, "fork")
+
+
+class ScalingWorkerPool(object):
+    """Persistent worker processes for evaluating a scaling target"""
+
+    def __init__(self, scaler, target, apm, block_ids, nproc):
+
+        assert worker_pool_available()
+        self._block_ids = list(block_ids)
+
+        _worker_state.update(scaler=scaler, target=target, apm=apm)
+        try:
+            self._pool = multiprocessing.Pool(processes=nproc)
+        finally:
+            _worker_state.clear()
+
+        logger.debug(
+            "Started %d scaling worker processes for %d blocks",
+            nproc,
+            len(self._block_ids),
+        )
+
+    def _tasks(self, param_vals):
+        param_vals = flex.double(param_vals)
+        return [(block_id, param_vals) for block_id in self._block_ids]
+
+    def compute_functional_gradients(self, param_vals):
+        """Return the list of (functional, gradients, size) for each block, for
+        the parameter values (in the same order as set_param_vals)"""
+
+        return self._pool.map(
+            _compute_functional_gradients, self._tasks(param_vals), chunksize=1
+        )
+
+    def compute_residuals(self, param_vals):
+        """Iterate over the (residuals, weights) of each block, in block order"""
+
+        return self._pool.imap(_compute_residuals, self._tasks(param_vals), chunksize=1)
+
+    def compute_normal_equations(self, param_vals):
+        """Iterate over the (residuals, weights, normal matrix, right hand side)
+        of each block, in block order. The normal matrix is in packed upper
+        triangular form"""
+
+        return self._pool.imap(
+            _compute_normal_equations, self._tasks(param_vals), chunksize=1
+        )
+
+    def close(self):
+        """Stop the worker processes"""
+
+        self._pool.close()
+        self._pool.join()
@@ -10,6 +10,8 @@
  */
 #include <boost/python.hpp>
 #include <boost/python/def.hpp>
+#include <algorithm>
+#include <cmath>
 #include <scitbx/array_family/tiny_types.h>
 #include <scitbx/vec3.h>
 #include <dials/algorithms/spatial_indexing/octree.h>
@@ -89,6 +91,71 @@ namespace boost_python {
     return result;
   }
 
+  /**
+   * Release the GIL for the lifetime of the object
+   */
+  struct ScopedGILRelease {
+    ScopedGILRelease() : state_(PyEval_SaveThread()) {}
+    ~ScopedGILRelease() { PyEval_RestoreThread(state_); }
+    PyThreadState *state_;
+  };
+
+  /**
+   * For each point, find the nearest object in the tree within a maximum
+   * distance. Ties are resolved in favour of the object with the lowest index.
+   * The GIL is released during the search, so separate trees may be queried
+   * from several threads at once.
+   * @returns A tuple of the indices of the points with a match, the indices of
+   *          the matching objects and the distances
+   */
+  template <typename ObjectType>
+  boost::python::tuple octree_query_nearest(
+      const Octree< OctreeObject<ObjectType> > &tree,
+      const af::const_ref<ObjectType> &points,
+      double max_distance) {
+    DIALS_ASSERT(max_distance >= 0);
+    af::shared<std::size_t> index;
+    af::shared<std::size_t> nearest;
+    af::shared<double> distance;
+    {
+      ScopedGILRelease release;
+      double max_distance_sq = max_distance * max_distance;
+      af::shared< OctreeObject<ObjectType> > temp;
+      for (std::size_t i = 0; i < points.size(); ++i) {
+        vec3<double> p(points[i]);
+        Box3d range(
+          (int)std::floor(p[0] - max_distance),
+          (int)std::floor(p[1] - max_distance),
+          (int)std::floor(p[2] - max_distance),
+          (int)std::ceil(p[0] + max_distance) + 1,
+          (int)std::ceil(p[1] + max_distance) + 1,
+          (int)std::ceil(p[2] + max_distance) + 1);
+        temp.clear();
+        if (!tree.query_range(range, temp)) {
+          continue;
+        }
+        bool found = false;
+        std::size_t best_index = 0;
+        double best_distance_sq = max_distance_sq;
+        for (std::size_t j = 0; j < temp.size(); ++j) {
+          double d2 = (vec3<double>(temp[j].object) - p).length_sq();
+          if (d2 < best_distance_sq ||
+              (d2 == best_distance_sq && (!found || temp[j].index < best_index))) {
+            found = true;
+            best_index = temp[j].index;
+            best_distance_sq = d2;
+          }
+        }
+        if (found) {
+          index.push_back(i);
+          nearest.push_back(best_index);
+          distance.push_back(std::sqrt(best_distance_sq));
+        }
+      }
+    }
+    return boost::python::make_tuple(index, nearest, distance);
+  }
+
   template <typename ObjectType>
   Octree< OctreeObject<ObjectType> > *make_octree_from_list(
       af::const_ref<ObjectType> a,
@@ -106,8 +173,13 @@ namespace boost_python {
       if (a[i][2] < zmin) zmin = a[i][2];
       if (a[i][2] > zmax) zmax = a[i][2];
     }
-    af::int6 box((int)xmin, (int)xmax+1, (int)ymin,
-                 (int)ymax+1, (int)zmin, (int)zmax+1);
+    // Make the box a cube. The depth of the tree is limited by the smallest
+    // side, so this allows e.g. points on a few images to be subdivided in x
+    // and y.
+    int size = std::max((int)xmax - (int)xmin,
+               std::max((int)ymax - (int)ymin, (int)zmax - (int)zmin)) + 1;
+    af::int6 box((int)xmin, (int)xmin+size, (int)ymin,
+                 (int)ymin+size, (int)zmin, (int)zmin+size);
     Octree< OctreeObject<ObjectType> > *qt =
       make_octree<ObjectType>(box, max_bucket_size);
     for (std::size_t i = 0; i < a.size(); ++i) {
@@ -131,6 +203,9 @@ namespace boost_python {
           arg("max_bucket_size") = 10)))
       .def("max_depth", &octree_type::max_depth)
       .def("query_range", &octree_query_range<ObjectType>)
+      .def("query_nearest", &octree_query_nearest<ObjectType>, (
+          arg("points"),
+          arg("max_distance")))
       ;//.def("query_collision", &octree_query_collision<ObjectType>);
 
     def("make_spatial_index",
@@ -119,6 +119,19 @@ def generate_phil_scope():
         .type = int(value_min=1)
         .help = "When chunksize is auto, this is the minimum chunksize"
     }
+
+    cache
+      .expert_level = 1
+    {
+      directory = None
+        .type = path
+        .help = "A directory in which to cache the strong pixels found on each"
+                "image. The cache is keyed by the image data, the mask, the"
+                "threshold parameters, the region of interest and the maximum"
+                "fraction of strong pixels, so rerunning spot finding with changed"
+                "spot filtering parameters (e.g. min_spot_size) reuses the"
+                "cached strong pixels rather than thresholding the images again."
+    }
   }
 
   """,
@@ -496,6 +509,22 @@ def from_parameters(params=None, experiments=None):
         else:
             no_shoeboxes_2d = False
 
+        # The parameters read when extracting the strong pixels identify the
+        # cached pixels: the threshold parameters, the region of interest and
+        # the maximum fraction of strong pixels. The image data and masks are
+        # part of the cache key computed for each image.
+        cache_key = ""
+        if params.spotfinder.cache.directory is not None:
+            working_phil = phil_scope.format(python_object=params)
+            cache_key = "".join(
+                working_phil.get(path).as_str()
+                for path in (
+                    "spotfinder.threshold",
+                    "spotfinder.region_of_interest",
+                    "spotfinder.filter.max_strong_pixel_fraction",
+                )
+            )
+
         # Read in the lookup files
         mask = SpotFinderFactory.load_image(params.spotfinder.lookup.mask)
         params.spotfinder.lookup.mask = mask
@@ -533,6 +562,8 @@ def from_parameters(params=None, experiments=None):
             max_spot_size=params.spotfinder.filter.max_spot_size,
             no_shoeboxes_2d=no_shoeboxes_2d,
             min_chunksize=params.spotfinder.mp.min_chunksize,
+            cache_directory=params.spotfinder.cache.directory,
+            cache_key=cache_key,
         )
 
     @staticmethod
@@ -10,11 +10,13 @@
 
 from __future__ import absolute_import, division, print_function
 
+import collections
 import logging
 import math
 import os
 
 from dials.util import Sorry
+from dials.util import frame_cache
 import libtbx
 
 logger = logging.getLogger(__name__)
@@ -37,14 +39,107 @@ class Result(object):
     When doing multi processing, we can process the result of
     each thread as it comes in instead of waiting for all results.
     The purpose of this class is to allow us to set the pixel list
-    to None after each image to lower memory usage.
+    to None after each image to lower memory usage. The hits and misses of the
+    frame cache when reading the image are kept, since the image may be read
+    in another process.
     """
 
-    def __init__(self, pixel_list):
+    def __init__(self, pixel_list, frame_cache_stats=None):
         """
-        Set the pixel list
+        Set the pixel list and the frame cache stats
         """
         self.pixel_list = pixel_list
+        self.frame_cache_stats = frame_cache_stats
+
+
+class PixelListCache(object):
+    """
+    An on-disk cache of the strong pixel lists found on each image.
+
+    The pixel lists for an image are stored in a file named by a hash of the
+    image data, the image mask and a key describing the threshold parameters.
+    When spot finding is repeated with the same thresholding but e.g. a
+    different spot size filter, the thresholding of each image is replaced by
+    reading the pixel lists from the cache.
+    """
+
+    def __init__(self, directory, key=""):
+        """
+        Initialise the cache
+
+        :param directory: The cache directory
+        :param key: A string identifying the threshold parameters
+        """
+        self.directory = directory
+        self.key = key
+        if not os.path.exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Created by another process in the meantime
+                if not os.path.isdir(directory):
+                    raise
+
+    def hash(self, frame, image, mask):
+        """
+        Compute the hash identifying the pixel lists for an image
+
+        :param frame: The frame number
+        :param image: The tuple of per-panel image data
+        :param mask: The tuple of per-panel image masks
+        :return: The hex digest
+        """
+        import hashlib
+
+        h = hashlib.sha1()
+        h.update(("%s\n%d\n" % (self.key, frame)).encode("utf-8"))
+        for im, mk in zip(image, mask):
+            h.update(("%s\n" % str(im.all())).encode("utf-8"))
+            h.update(im.copy_to_byte_str())
+            h.update(mk.as_int().copy_to_byte_str())
+        return h.hexdigest()
+
+    def filename(self, digest):
+        """
+        :return: The filename for the given hash
+        """
+        return os.path.join(self.directory, "%s.pickle" % digest)
+
+    def get(self, digest):
+        """
+        Get the pixel lists from the cache
+
+        :param digest: The hash of the image
+        :return: The list of pixel lists or None if not cached
+        """
+        import six.moves.cPickle as pickle
+
+        filename = self.filename(digest)
+        if not os.path.exists(filename):
+            return None
+        try:
+            with open(filename, "rb") as infile:
+                return pickle.load(infile)
+        except Exception:
+            logger.debug("Unable to read cached pixel lists from %s" % filename)
+            return None
+
+    def put(self, digest, pixel_list):
+        """
+        Add the pixel lists to the cache. The file is written under a temporary
+        name and then moved into place, so that a concurrent reader never sees
+        a partially written file.
+
+        :param digest: The hash of the image
+        :param pixel_list: The list of pixel lists
+        """
+        import six.moves.cPickle as pickle
+
+        filename = self.filename(digest)
+        tmp_filename = "%s.%d.tmp" % (filename, os.getpid())
+        with open(tmp_filename, "wb") as outfile:
+            pickle.dump(pixel_list, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_filename, filename)
 
 
 class ExtractPixelsFromImage(object):
@@ -60,6 +155,7 @@ def __init__(
         region_of_interest,
         max_strong_pixel_fraction,
         compute_mean_background,
+        cache=None,
     ):
         """
         Initialise the class
@@ -69,8 +165,10 @@ def __init__(
         :param mask: The image mask
         :param region_of_interest: A region of interest to process
         :param max_strong_pixel_fraction: The maximum fraction of pixels allowed
+        :param cache: A PixelListCache to read and write the pixel lists
         """
         self.threshold_function = threshold_function
+        self.cache = cache
         self.imageset = imageset
         self.mask = mask
         self.region_of_interest = region_of_interest
@@ -87,9 +185,7 @@ def __call__(self, index):
 
         :param index: The index of the image
         """
-        from dials.model.data import PixelList
         from dxtbx.imageset import ImageSweep
-        from dials.array_family import flex
 
         # Parallel reading of HDF5 from the same handle is not allowed. Python
         # multiprocessing is a bit messed up and used fork on linux so need to
@@ -108,12 +204,43 @@ def __call__(self, index):
                 assert all(i1 + 1 == i2 for i1, i2 in zip(ind[0:-1], ind[1:-1]))
             frame = ind[index]
 
-        # Create the list of pixel lists
-        pixel_list = []
-
-        # Get the image and mask
-        image = self.imageset.get_corrected_data(index)
+        # Get the image and mask, counting the frame cache hits and misses
+        before = frame_cache.frame_cache().stats()
+        image = frame_cache.get_corrected_data(self.imageset, index)
         mask = self.imageset.get_mask(index)
+        stats = frame_cache.frame_cache().stats(since=before)
+
+        # Extract the strong pixels, reusing the cached pixel lists if the image,
+        # mask and threshold parameters are unchanged
+        if self.cache is None:
+            result = self.extract(frame, image, mask)
+            result.frame_cache_stats = stats
+            return result
+        if self.mask is not None:
+            mask = tuple(m1 & m2 for m1, m2 in zip(mask, self.mask))
+        digest = self.cache.hash(frame, image, mask)
+        pixel_list = self.cache.get(digest)
+        if pixel_list is not None:
+            logger.info(
+                "Found %d strong pixels on image %d (cached)"
+                % (sum(len(p) for p in pixel_list), frame + 1)
+            )
+            return Result(pixel_list, stats)
+        result = self.extract(frame, image, mask)
+        self.cache.put(digest, result.pixel_list)
+        result.frame_cache_stats = stats
+        return result
+
+    def extract(self, frame, image, mask):
+        """
+        Extract strong pixels from image data that is already in memory
+
+        :param frame: The frame number
+        :param image: The tuple of per-panel image data
+        :param mask: The tuple of per-panel image masks
+        """
+        from dials.model.data import PixelList
+        from dials.array_family import flex
 
         # Set the mask
         if self.mask is not None:
@@ -122,10 +249,11 @@ def __call__(self, index):
 
         logger.debug(
             "Number of masked pixels for image %i: %i"
-            % (index, sum(m.count(False) for m in mask))
+            % (frame, sum(m.count(False) for m in mask))
         )
 
         # Add the images to the pixel lists
+        pixel_list = []
         num_strong = 0
         average_background = 0
         for im, mk in zip(image, mask):
@@ -258,8 +386,8 @@ def __call__(self, index):
         # Delete the shoeboxes
         del reflections["shoeboxes"]
 
-        # Return the reflections
-        return [reflections]
+        # Return the reflections and the frame cache stats
+        return [reflections, result.frame_cache_stats]
 
 
 class ExtractSpotsParallelTask(object):
@@ -440,6 +568,8 @@ def __init__(
         no_shoeboxes_2d=False,
         min_chunksize=50,
         write_hot_pixel_mask=False,
+        cache_directory=None,
+        cache_key="",
     ):
         """
         Initialise the class with the strategy
@@ -449,6 +579,8 @@ def __init__(
         :param mp_method: The multi processing method
         :param nproc: The number of processors
         :param max_strong_pixel_fraction: The maximum number of strong pixels
+        :param cache_directory: The directory in which to cache pixel lists
+        :param cache_key: A string identifying the pixel extraction parameters
         """
         # Set the required strategies
         self.threshold_function = threshold_function
@@ -466,6 +598,8 @@ def __init__(
         self.no_shoeboxes_2d = no_shoeboxes_2d
         self.min_chunksize = min_chunksize
         self.write_hot_pixel_mask = write_hot_pixel_mask
+        self.cache_directory = cache_directory
+        self.cache_key = cache_key
 
     def __call__(self, imageset):
         """
@@ -534,6 +668,12 @@ def _find_spots(self, imageset):
         assert mp_njobs == 1 or mp_method is not None, "Invalid cluster method"
         assert mp_chunksize > 0, "Invalid chunk size"
 
+        # The cache of pixel lists
+        cache = None
+        if self.cache_directory is not None:
+            cache = PixelListCache(self.cache_directory, self.cache_key)
+            logger.info("Using cached pixel lists in %s" % self.cache_directory)
+
         # The extract pixels function
         function = ExtractPixelsFromImage(
             imageset=imageset,
@@ -542,6 +682,7 @@ def _find_spots(self, imageset):
             max_strong_pixel_fraction=self.max_strong_pixel_fraction,
             compute_mean_background=self.compute_mean_background,
             region_of_interest=self.region_of_interest,
+            cache=cache,
         )
 
         # The indices to iterate over
@@ -551,6 +692,9 @@ def _find_spots(self, imageset):
         num_panels = len(imageset.get_detector())
         pixel_labeller = [PixelListLabeller() for p in range(num_panels)]
 
+        # The frame cache hits and misses, summed over the processes
+        frame_cache_stats = collections.Counter()
+
         # Do the processing
         logger.info("Extracting strong pixels from images")
         if mp_njobs > 1:
@@ -571,6 +715,7 @@ def process_output(result):
                 for plabeller, plist in zip(pixel_labeller, result[0].pixel_list):
                     plabeller.add(plist)
                 result[0].pixel_list = None
+                frame_cache_stats.update(result[0].frame_cache_stats)
 
             batch_multi_node_parallel_map(
                 func=ExtractSpotsParallelTask(function),
@@ -590,6 +735,8 @@ def process_output(result):
                 for plabeller, plist in zip(pixel_labeller, result.pixel_list):
                     plabeller.add(plist)
                     result.pixel_list = None
+                frame_cache_stats.update(result.frame_cache_stats)
+        frame_cache.frame_cache().log_stats(frame_cache_stats)
 
         # Create shoeboxes from pixel list
         converter = PixelListToReflectionTable(
@@ -657,6 +804,9 @@ def _find_spots_2d_no_shoeboxes(self, imageset):
         # The resulting reflections
         reflections = flex.reflection_table()
 
+        # The frame cache hits and misses, summed over the processes
+        frame_cache_stats = collections.Counter()
+
         # Do the processing
         logger.info("Extracting strong spots from images")
         if mp_njobs > 1:
@@ -673,6 +823,7 @@ def process_output(result):
                     logger.log(message.levelno, message.msg)
                 reflections.extend(result[0][0])
                 result[0][0] = None
+                frame_cache_stats.update(result[0][1])
 
             batch_multi_node_parallel_map(
                 func=ExtractSpotsParallelTask(function),
@@ -685,7 +836,10 @@ def process_output(result):
             )
         else:
             for task in indices:
-                reflections.extend(function(task)[0])
+                result = function(task)
+                reflections.extend(result[0])
+                frame_cache_stats.update(result[1])
+        frame_cache.frame_cache().log_stats(frame_cache_stats)
 
         # Return the reflections
         return reflections, None
@@ -716,6 +870,8 @@ def __init__(
         max_spot_size=20,
         no_shoeboxes_2d=False,
         min_chunksize=50,
+        cache_directory=None,
+        cache_key="",
     ):
         """
         Initialise the class.
@@ -723,6 +879,8 @@ def __init__(
         :param find_spots: The spot finding algorithm
         :param filter_spots: The spot filtering algorithm
         :param scan_range: The scan range to find spots over
+        :param cache_directory: The directory in which to cache pixel lists
+        :param cache_key: A string identifying the pixel extraction parameters
         """
 
         # Set the filter and some other stuff
@@ -744,6 +902,8 @@ def __init__(
         self.mp_njobs = mp_njobs
         self.no_shoeboxes_2d = no_shoeboxes_2d
         self.min_chunksize = min_chunksize
+        self.cache_directory = cache_directory
+        self.cache_key = cache_key
 
     def __call__(self, experiments):
         """
@@ -831,6 +991,8 @@ def _find_spots_in_imageset(self, imageset):
             no_shoeboxes_2d=self.no_shoeboxes_2d,
             min_chunksize=self.min_chunksize,
             write_hot_pixel_mask=self.write_hot_mask,
+            cache_directory=self.cache_directory,
+            cache_key=self.cache_key,
         )
 
         # Get the max scan range
@@ -0,0 +1,497 @@
+#
+# incremental.py
+#
+#  Copyright (C) 2019 Diamond Light Source
+#
+#  This code is distributed under the BSD license, a copy of which is
+#  included in the root directory of this package.
+
+"""
+Incremental spot finding on an imageset that grows between invocations.
+
+During live data collection the images of a sweep arrive one at a time. Rather
+than repeat the spot finding from the first image each time an update is
+wanted, the state of the spot finding is kept between invocations. On each
+invocation only the newly arrived images are read and thresholded. Spots
+which ended before the last image processed are complete and are kept as
+reflections; only the pixels of the spots still open on the last image are
+kept, and these are labelled again with the pixels of the new images, so that
+spots crossing the boundary between the old and new images are joined
+correctly without relabelling the whole sweep.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import logging
+import os
+
+import six.moves.cPickle as pickle
+
+from dials.util import Sorry
+
+logger = logging.getLogger(__name__)
+
+
+class IncrementalSpotFinderState(object):
+    """
+    The state saved between invocations of the incremental spot finder.
+
+    The state file is a sequence of pickled records which is only appended
+    to: a header identifying the parameters and the imageset, followed by a
+    record for each invocation holding the reflections completed and the
+    per-image statistics computed. The pixel lists of the spots open on the
+    last image are rewritten on each invocation in a second file, with the
+    suffix .open, which spans only the images of the open spots.
+    """
+
+    def __init__(self, key, first_frame, num_panels):
+        """
+        Initialise an empty state
+
+        :param key: A string identifying the threshold parameters
+        :param first_frame: The first frame of the imageset
+        :param num_panels: The number of detector panels
+        """
+        self.key = key
+        self.first_frame = first_frame
+        self.num_panels = num_panels
+        self.reflections = None
+        self.stats = []
+        self.open_from = 0
+        self.open_pixel_lists = []
+        self._num_frames = 0
+
+    def num_frames(self):
+        """
+        :return: The number of frames processed so far
+        """
+        return self._num_frames
+
+    @staticmethod
+    def from_file(filename):
+        """
+        Load the state from file
+
+        :param filename: The state filename
+        :return: The state
+        """
+        with open(filename, "rb") as infile:
+            header = pickle.load(infile)
+            state = IncrementalSpotFinderState(
+                header["key"], header["first_frame"], header["num_panels"]
+            )
+            while True:
+                try:
+                    record = pickle.load(infile)
+                except EOFError:
+                    break
+                state._apply(record)
+        with open(filename + ".open", "rb") as infile:
+            record = pickle.load(infile)
+        if record["num_frames"] != state.num_frames():
+            raise Sorry(
+                "The spot finding state in %s is incomplete: remove it and %s.open "
+                "to start again" % (filename, filename)
+            )
+        state.open_from = record["open_from"]
+        state.open_pixel_lists = record["pixel_lists"]
+        return state
+
+    def _apply(self, record):
+        if self.reflections is None:
+            self.reflections = record["reflections"]
+        else:
+            self.reflections.extend(record["reflections"])
+        del self.stats[record["stats_from"] :]
+        self.stats.extend(record["stats"])
+        self._num_frames = record["num_frames"]
+
+    def update(
+        self,
+        filename,
+        num_frames,
+        reflections,
+        stats_from,
+        stats,
+        open_from,
+        open_pixel_lists,
+    ):
+        """
+        Add the results of processing the new images, appending them to the
+        state file. The open pixel lists are written to a temporary file which
+        is then moved into place, and the record appended to the state file
+        after, so that an interrupted update is detected when loading.
+
+        :param filename: The state filename
+        :param num_frames: The number of frames processed
+        :param reflections: The reflections completed by the new images
+        :param stats_from: The first image of the per-image statistics
+        :param stats: The per-image statistics from that image
+        :param open_from: The first image of the open spots
+        :param open_pixel_lists: The per-panel pixel lists of the open spots
+                                 on each image from that image
+        """
+        record = {
+            "num_frames": num_frames,
+            "reflections": reflections,
+            "stats_from": stats_from,
+            "stats": stats,
+        }
+        tmp_filename = filename + ".open.tmp"
+        with open(tmp_filename, "wb") as outfile:
+            pickle.dump(
+                {
+                    "num_frames": num_frames,
+                    "open_from": open_from,
+                    "pixel_lists": open_pixel_lists,
+                },
+                outfile,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.rename(tmp_filename, filename + ".open")
+        new_file = not os.path.exists(filename)
+        with open(filename, "ab") as outfile:
+            if new_file:
+                pickle.dump(
+                    {
+                        "key": self.key,
+                        "first_frame": self.first_frame,
+                        "num_panels": self.num_panels,
+                    },
+                    outfile,
+                    protocol=pickle.HIGHEST_PROTOCOL,
+                )
+            pickle.dump(record, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+        self._apply(record)
+        self.open_from = open_from
+        self.open_pixel_lists = open_pixel_lists
+
+
+class IncrementalSpotFinder(object):
+    """
+    A class to do spot finding incrementally on a growing imageset.
+    """
+
+    def __init__(
+        self, spot_finder, state_filename, state_key="", resolution_analysis=False
+    ):
+        """
+        Initialise the class
+
+        :param spot_finder: The configured SpotFinder instance
+        :param state_filename: The file in which to keep the state
+        :param state_key: A string identifying the threshold parameters
+        :param resolution_analysis: Do resolution analysis in per-image stats
+        """
+        self.spot_finder = spot_finder
+        self.state_filename = state_filename
+        self.state_key = state_key
+        self.resolution_analysis = resolution_analysis
+        self.stats = None
+
+    @staticmethod
+    def from_parameters(params, experiments, state_filename, state_key=""):
+        """
+        Construct the incremental spot finder from the input parameters
+
+        :param params: The dials.find_spots parameters
+        :param experiments: The experiments to process
+        :param state_filename: The file in which to keep the state
+        :param state_key: A string identifying the threshold parameters
+        :return: The incremental spot finder
+        """
+        from dials.algorithms.spot_finding.factory import SpotFinderFactory
+        from libtbx import Auto
+
+        if params.spotfinder.filter.min_spot_size is Auto:
+            detector = experiments[0].imageset.get_detector()
+            if detector[0].get_type() == "SENSOR_PAD":
+                # smaller default value for pixel array detectors
+                params.spotfinder.filter.min_spot_size = 3
+            else:
+                params.spotfinder.filter.min_spot_size = 6
+            logger.info(
+                "Setting spotfinder.filter.min_spot_size=%i"
+                % (params.spotfinder.filter.min_spot_size)
+            )
+        spot_finder = SpotFinderFactory.from_parameters(
+            experiments=experiments, params=params
+        )
+        return IncrementalSpotFinder(spot_finder, state_filename, state_key)
+
+    def __call__(self, experiments):
+        """
+        Do the spot finding on the newly arrived images.
+
+        :param experiments: The experiments to process
+        :return: The observed spots on all the images
+        """
+        from dials.array_family import flex
+        from dxtbx.imageset import ImageSweep
+
+        if len(experiments) != 1:
+            raise Sorry("Incremental spot finding requires a single imageset")
+        imageset = experiments[0].imageset
+        if not isinstance(imageset, ImageSweep):
+            raise Sorry("Incremental spot finding requires an image sweep")
+        if self.spot_finder.scan_range and self.spot_finder.scan_range[0] is not None:
+            raise Sorry("Incremental spot finding does not support scan_range")
+        if self.spot_finder.write_hot_mask:
+            logger.info("Hot pixel mask is not written in incremental mode")
+
+        # Load or create the state
+        state = self._load_state(imageset)
+        num_old = state.num_frames()
+        if num_old > len(imageset):
+            raise Sorry(
+                "The imageset has %d images but %d have already been processed"
+                % (len(imageset), num_old)
+            )
+        if num_old == len(imageset) and not state.open_pixel_lists:
+            logger.info("No new images to process")
+            self._combine_stats(state)
+            return state.reflections
+
+        # Extract the strong pixels from only the new images
+        logger.info(
+            "Processing images %d to %d (%d images already processed)"
+            % (
+                state.first_frame + num_old + 1,
+                state.first_frame + len(imageset),
+                num_old,
+            )
+        )
+        pixel_lists = state.open_pixel_lists + self._extract_pixels(
+            imageset, range(num_old, len(imageset))
+        )
+
+        # Label the pixels of the open spots with those of the new images and
+        # create the reflections
+        reflections, open_from, open_pixel_lists = self._label_pixels(
+            imageset, state, pixel_lists
+        )
+        reflections["id"] = flex.int(reflections.nrows(), 0)
+        reflections.set_flags(
+            flex.size_t_range(len(reflections)), reflections.flags.strong
+        )
+        reflections.is_overloaded(experiments)
+
+        # The spots which end before the last image are complete
+        end = state.first_frame + len(imageset)
+        closed = reflections["bbox"].parts()[5] < end
+        logger.info(
+            "Labelled %d images: %d spots completed, %d still open"
+            % (len(pixel_lists), closed.count(True), closed.count(False))
+        )
+        all_reflections = flex.reflection_table()
+        if state.reflections is not None:
+            all_reflections.extend(state.reflections)
+        all_reflections.extend(reflections)
+
+        # The spots of the images before the open spots are unchanged, so only
+        # recompute the stats from there
+        stats_from = state.open_from
+        stats = self._compute_stats(imageset, all_reflections, state, stats_from)
+
+        # Save the state for next time
+        state.update(
+            self.state_filename,
+            len(imageset),
+            reflections.select(closed),
+            stats_from,
+            stats,
+            open_from,
+            open_pixel_lists,
+        )
+        self._combine_stats(state)
+        return all_reflections
+
+    def _load_state(self, imageset):
+        """
+        Load the state or create a new one if it does not exist
+        """
+        first_frame = imageset.get_array_range()[0]
+        num_panels = len(imageset.get_detector())
+        if not os.path.exists(self.state_filename):
+            logger.info("Creating new spot finding state %s" % self.state_filename)
+            return IncrementalSpotFinderState(self.state_key, first_frame, num_panels)
+        state = IncrementalSpotFinderState.from_file(self.state_filename)
+        if state.key != self.state_key:
+            raise Sorry(
+                "Spot finding parameters differ from those in %s" % self.state_filename
+            )
+        if state.first_frame != first_frame or state.num_panels != num_panels:
+            raise Sorry(
+                "The imageset does not match the one in %s" % self.state_filename
+            )
+        logger.info("Loaded spot finding state from %s" % self.state_filename)
+        return state
+
+    def _extract_pixels(self, imageset, indices):
+        """
+        Extract the strong pixels from the given images
+
+        :return: The list of per-panel pixel lists for each image
+        """
+        from dials.algorithms.spot_finding.finder import (
+            ExtractPixelsFromImage,
+            ExtractSpotsParallelTask,
+        )
+        from dials.util.mp import batch_multi_node_parallel_map
+
+        indices = list(indices)
+        if not indices:
+            return []
+
+        # The input mask
+        mask = self.spot_finder.mask_generator.generate(imageset)
+        if self.spot_finder.mask is not None:
+            mask = tuple(m1 & m2 for m1, m2 in zip(mask, self.spot_finder.mask))
+
+        # The extract pixels function
+        function = ExtractPixelsFromImage(
+            imageset=imageset,
+            threshold_function=self.spot_finder.threshold_function,
+            mask=mask,
+            max_strong_pixel_fraction=self.spot_finder.max_strong_pixel_fraction,
+            compute_mean_background=self.spot_finder.compute_mean_background,
+            region_of_interest=self.spot_finder.region_of_interest,
+        )
+
+        first = imageset.get_array_range()[0]
+        pixel_lists = {}
+        mp_nproc = min(self.spot_finder.mp_nproc, len(indices))
+        if mp_nproc > 1 and os.name != "nt":
+
+            def process_output(result):
+                for message in result[1]:
+                    logger.log(message.levelno, message.msg)
+                frame = result[0].pixel_list[0].frame()
+                pixel_lists[frame - first] = result[0].pixel_list
+                result[0].pixel_list = None
+
+            batch_multi_node_parallel_map(
+                func=ExtractSpotsParallelTask(function),
+                iterable=indices,
+                nproc=mp_nproc,
+                njobs=1,
+                cluster_method=None,
+                chunksize=1,
+                callback=process_output,
+            )
+        else:
+            for index in indices:
+                pixel_lists[index] = function(index).pixel_list
+        return [pixel_lists[index] for index in indices]
+
+    def _label_pixels(self, imageset, state, pixel_lists):
+        """
+        Do the connected component labelling over the pixel lists of the open
+        spots and of the new images
+
+        :param pixel_lists: The per-panel pixel lists of each image from the
+                            first image of the open spots
+        :return: The reflection table, the first image of the spots open on
+                 the last image and the per-panel pixel lists of those spots on
+                 each image from there
+        """
+        import numpy as np
+        from dials.algorithms.spot_finding.finder import PixelListToReflectionTable
+        from dials.array_family import flex
+        from dials.model.data import PixelList, PixelListLabeller
+
+        num_frames = len(imageset)
+        first = state.first_frame + num_frames - len(pixel_lists)
+        last = state.first_frame + num_frames - 1
+
+        pixel_labeller = [PixelListLabeller() for p in range(state.num_panels)]
+        for pixel_list in pixel_lists:
+            assert len(pixel_labeller) == len(pixel_list), "Inconsistent size"
+            for plabeller, plist in zip(pixel_labeller, pixel_list):
+                plabeller.add(plist)
+
+        # Keep the pixels of the spots which touch the last image
+        open_pixels = []
+        open_from = num_frames
+        for plabeller, plist in zip(pixel_labeller, pixel_lists[0]):
+            height, width = plist.size()
+            z, y, x = plabeller.coords().as_int().as_numpy_array().reshape(-1, 3).T
+            labels = plabeller.labels_3d().as_numpy_array()
+            sel = np.isin(labels, labels[z == last])
+            z = z[sel]
+            index = y[sel] * width + x[sel]
+            values = plabeller.values().as_numpy_array()[sel]
+            if len(z):
+                open_from = min(open_from, int(z.min()) - state.first_frame)
+            open_pixels.append((z, index, values, (height, width)))
+        open_pixel_lists = []
+        for frame in range(state.first_frame + open_from, last + 1):
+            frame_lists = []
+            for z, index, values, size in open_pixels:
+                i0, i1 = np.searchsorted(z, [frame, frame + 1])
+                frame_lists.append(
+                    PixelList(
+                        frame,
+                        size,
+                        flex.double(values[i0:i1]),
+                        flex.size_t(index[i0:i1].astype(np.uint64)),
+                    )
+                )
+            open_pixel_lists.append(frame_lists)
+
+        converter = PixelListToReflectionTable(
+            self.spot_finder.min_spot_size,
+            self.spot_finder.max_spot_size,
+            self.spot_finder.filter_spots,
+            False,
+        )
+        offset = first - state.first_frame
+        reflections, _ = converter(imageset[offset:num_frames], pixel_labeller)
+        return reflections, open_from, open_pixel_lists
+
+    def _compute_stats(self, imageset, reflections, state, stats_from):
+        """
+        Compute the per-image statistics from the given image
+
+        :return: The list of per-image statistics
+        """
+        from dials.algorithms.spot_finding import per_image_analysis
+        from dials.array_family import flex
+
+        stats = []
+        image_number = flex.floor(reflections["xyzobs.px.value"].parts()[2])
+        for i in range(stats_from, len(imageset)):
+            stats.append(
+                per_image_analysis.stats_single_image(
+                    imageset[i : i + 1],
+                    reflections.select(image_number == i + state.first_frame),
+                    i=i + state.first_frame,
+                    resolution_analysis=self.resolution_analysis,
+                )
+            )
+        logger.info(
+            "Computed per-image statistics for %d images" % (len(imageset) - stats_from)
+        )
+        return stats
+
+    def _combine_stats(self, state):
+        """
+        Combine the per-image statistics in the same form as
+        per_image_analysis.stats_imageset
+        """
+        from libtbx import group_args
+
+        names = [
+            "n_spots_total",
+            "n_spots_no_ice",
+            "n_spots_4A",
+            "total_intensity",
+            "estimated_d_min",
+            "d_min_distl_method_1",
+            "noisiness_method_1",
+            "d_min_distl_method_2",
+            "noisiness_method_2",
+        ]
+        self.stats = group_args(
+            **{name: [getattr(s, name) for s in state.stats] for name in names}
+        )
@@ -1,6 +1,10 @@
 from __future__ import absolute_import, division, print_function
 
 import math
+import multiprocessing
+import os
+
+import numpy as np
 from libtbx import group_args
 from cctbx import sgtbx, uctbx
 from dials.array_family import flex
@@ -134,24 +138,24 @@ def wilson_outliers(reflections, ice_sel=None, p_cutoff=1e-2):
     # http://scripts.iucr.org/cgi-bin/paper?ba0032
     if ice_sel is None:
         ice_sel = flex.bool(len(reflections), False)
+    return _wilson_outliers(reflections["intensity.sum.value"], ice_sel, p_cutoff)
 
-    E_cutoff = math.sqrt(-math.log(p_cutoff))
-    intensities = reflections["intensity.sum.value"]
-
-    Sigma_n = flex.mean(intensities.select(~ice_sel))
-    normalised_amplitudes = flex.sqrt(intensities) / math.sqrt(Sigma_n)
 
-    outliers = normalised_amplitudes >= E_cutoff
-
-    if outliers.count(True):
-        # iterative outlier rejection
+def _wilson_outliers(intensities, ice_sel, p_cutoff=1e-2):
+    # iterative outlier rejection, rejecting the outliers among the inliers of
+    # the previous iteration until there are none
+    E_cutoff = math.sqrt(-math.log(p_cutoff))
+    amplitudes = flex.sqrt(intensities)
+
+    outliers = flex.bool(len(intensities), False)
+    inliers = ~outliers
+    while True:
+        Sigma_n = flex.mean(intensities.select(inliers & ~ice_sel))
+        rejected = inliers & (amplitudes / math.sqrt(Sigma_n) >= E_cutoff)
+        if not rejected.count(True):
+            return outliers
+        outliers = outliers | rejected
         inliers = ~outliers
-        outliers.set_selected(
-            inliers,
-            wilson_outliers(reflections.select(inliers), ice_sel.select(inliers)),
-        )
-
-    return outliers
 
 
 def estimate_resolution_limit(reflections, imageset, ice_sel=None, plot_filename=None):
@@ -162,7 +166,8 @@ def estimate_resolution_limit(reflections, imageset, ice_sel=None, plot_filename
     d_star_sq = flex.pow2(reflections["rlp"].norms())
     d_spacings = uctbx.d_star_sq_as_d(d_star_sq)
 
-    intensities = reflections["intensity.sum.value"]
+    all_intensities = reflections["intensity.sum.value"]
+    intensities = all_intensities
     variances = reflections["intensity.sum.variance"]
 
     sel = variances > 0
@@ -207,8 +212,8 @@ def estimate_resolution_limit(reflections, imageset, ice_sel=None, plot_filename
             # else:
             # continue
 
-        outliers = wilson_outliers(
-            reflections.select(sel_all), ice_sel=ice_sel.select(sel_all)
+        outliers = _wilson_outliers(
+            all_intensities.select(sel_all), ice_sel.select(sel_all)
         )
         # print "rejecting %d wilson outliers" %outliers.count(True)
         outliers_all.set_selected(sel_all, outliers)
@@ -377,11 +382,9 @@ def estimate_resolution_limit_distl_method1(reflections, imageset, plot_filename
 
     order = flex.sort_permutation(d_spacings, reverse=True)
 
-    ds3_subset = flex.double()
-    d_subset = flex.double()
-    for i in range(len(reflections) // step):
-        ds3_subset.append(d_star_cubed[order[i * step]])
-        d_subset.append(d_spacings[order[i * step]])
+    order = order.select(flex.size_t_range(0, len(reflections) // step * step, step))
+    ds3_subset = d_star_cubed.select(order)
+    d_subset = d_spacings.select(order)
 
     x = flex.double(range(len(ds3_subset)))
 
@@ -400,39 +403,26 @@ def estimate_resolution_limit_distl_method1(reflections, imageset, plot_filename
 
     from scitbx import matrix
 
-    x1 = matrix.col((0, ds3_subset[0]))
-    x2 = matrix.col((p_m, ds3_subset[p_m]))
-
-    gaps = flex.double([0])
-    v = matrix.col(((x2[1] - x1[1]), -(x2[0] - x1[0]))).normalize()
+    # the distances of the points P1 to Pm-1 from the line through P0 and Pm
+    ds3 = ds3_subset.as_numpy_array()
+    v = matrix.col(((ds3[p_m] - ds3[0]), -(p_m - 0))).normalize()
+    i = np.arange(1, p_m)
+    gaps = np.concatenate(([0], np.abs(v[0] * -i + v[1] * (ds3[0] - ds3[i]))))
 
-    for i in range(1, p_m):
-        x0 = matrix.col((i, ds3_subset[i]))
-        r = x1 - x0
-        g = abs(v.dot(r))
-        gaps.append(g)
-
-    mv = flex.mean_and_variance(gaps)
+    mv = flex.mean_and_variance(flex.double(gaps))
     s = mv.unweighted_sample_standard_deviation()
 
     # (iii)
 
-    p_k = flex.max_index(gaps)
+    p_k = int(np.argmax(gaps))
     g_k = gaps[p_k]
-    p_g = p_k
-    for i in range(p_k + 1, len(gaps)):
-        g_i = gaps[i]
-        if g_i > (g_k - 0.5 * s):
-            p_g = i
+    (p_g,) = np.nonzero(gaps[p_k + 1 :] > (g_k - 0.5 * s))
+    p_g = p_k + 1 + p_g[-1] if len(p_g) else p_k
 
-    d_g = d_subset[p_g]
+    d_g = d_subset[int(p_g)]
 
-    noisiness = 0
     n = len(ds3_subset)
-    for i in range(n - 1):
-        for j in range(i + 1, n - 1):
-            if slopes[i] >= slopes[j]:
-                noisiness += 1
+    noisiness = _count_ordered_pairs(slopes.as_numpy_array(), np.greater_equal)
     noisiness /= (n - 1) * (n - 2) / 2
 
     if plot_filename is not None:
@@ -471,13 +461,12 @@ def estimate_resolution_limit_distl_method2(reflections, imageset, plot_filename
 
     binner = binner_d_star_cubed(d_spacings)
 
-    bin_counts = flex.size_t()
-
-    for i_slot, slot in enumerate(binner.bins):
-        sel_all = (d_spacings < slot.d_max) & (d_spacings >= slot.d_min)
-        sel = sel_all
-
-        bin_counts.append(sel.count(True))
+    # the numbers of spots with d_min <= d < d_max in each bin
+    d_sorted = np.sort(d_spacings.as_numpy_array())
+    n_below = np.searchsorted(
+        d_sorted, [(slot.d_max, slot.d_min) for slot in binner.bins]
+    )
+    bin_counts = flex.size_t(n_below[:, 0] - n_below[:, 1])
 
     # print list(bin_counts)
     t0 = (bin_counts[0] + bin_counts[1]) / 2
@@ -491,12 +480,8 @@ def estimate_resolution_limit_distl_method2(reflections, imageset, plot_filename
             break
 
     d_min = binner.bins[i].d_min
-    noisiness = 0
     m = len(bin_counts)
-    for i in range(m):
-        for j in range(i + 1, m):
-            if bin_counts[i] <= bin_counts[j]:
-                noisiness += 1
+    noisiness = _count_ordered_pairs(n_below[:, 0] - n_below[:, 1], np.less_equal)
     noisiness /= 0.5 * m * (m - 1)
 
     if plot_filename is not None:
@@ -518,28 +503,26 @@ def estimate_resolution_limit_distl_method2(reflections, imageset, plot_filename
     return d_min, noisiness
 
 
-def points_below_line(d_star_sq, log_i_over_sigi, m, c):
+def _count_ordered_pairs(values, compare):
+    """The number of pairs i < j of the values for which
+    compare(values[i], values[j]) is true"""
+    i, j = np.triu_indices(len(values), 1)
+    return int(np.count_nonzero(compare(values[i], values[j])))
 
-    from scitbx import matrix
-
-    p1 = matrix.col((0, c))
-    p2 = matrix.col((1, m * 1 + c))
 
-    def side(p1, p2, p):
-        diff = p2 - p1
-        perp = matrix.col((-diff[1], diff[0]))
-        # print p, p1, p2, perp
-        d = (p - p1).dot(perp)
-        # print d
-        return math.copysign(1, d)
+def points_below_line(d_star_sq, log_i_over_sigi, m, c):
 
-    inside = flex.bool(len(d_star_sq), False)
-    for i, (x, y) in enumerate(zip(d_star_sq, log_i_over_sigi)):
-        p = matrix.col((x, y))
-        if side(p1, p2, p) < 0:
-            inside[i] = True
+    # the sign of the dot product of each point, relative to p1 = (0, c), with
+    # the perpendicular (-(p2 - p1)[1], 1) to the line through p1 and
+    # p2 = (1, m + c)
+    n = min(len(d_star_sq), len(log_i_over_sigi))
+    x = d_star_sq[:n].as_numpy_array()
+    y = log_i_over_sigi[:n].as_numpy_array()
+    d = x * -((m + c) - c) + (y - c)
 
-    return inside
+    inside = np.zeros(len(d_star_sq), dtype=bool)
+    inside[:n] = np.signbit(d)
+    return flex.bool(inside)
 
 
 def points_inside_envelope(
@@ -676,6 +659,27 @@ def stats_single_image(
     ice_rings_width=0.004,
 ):
     reflections = map_to_reciprocal_space(reflections, imageset)
+    return _stats_single_image(
+        imageset,
+        reflections,
+        i=i,
+        resolution_analysis=resolution_analysis,
+        plot=plot,
+        filter_ice=filter_ice,
+        ice_rings_width=ice_rings_width,
+    )
+
+
+def _stats_single_image(
+    imageset,
+    reflections,
+    i=None,
+    resolution_analysis=True,
+    plot=False,
+    filter_ice=True,
+    ice_rings_width=0.004,
+):
+    # The statistics for reflections already mapped to reciprocal space
     if plot and i is not None:
         filename = "i_over_sigi_vs_resolution_%d.png" % (i + 1)
         hist_filename = "spot_count_vs_resolution_%d.png" % (i + 1)
@@ -742,16 +746,54 @@ def stats_single_image(
     )
 
 
-def stats_imageset(imageset, reflections, resolution_analysis=True, plot=False):
-    n_spots_total = []
-    n_spots_no_ice = []
-    n_spots_4A = []
-    total_intensity = []
-    estimated_d_min = []
-    d_min_distl_method_1 = []
-    d_min_distl_method_2 = []
-    noisiness_method_1 = []
-    noisiness_method_2 = []
+# State inherited by the forked worker processes
+_worker_state = {}
+
+# The statistics of each image, in the order of the columns of the table
+_stats_names = (
+    "n_spots_total",
+    "n_spots_no_ice",
+    "n_spots_4A",
+    "total_intensity",
+    "estimated_d_min",
+    "d_min_distl_method_1",
+    "noisiness_method_1",
+    "d_min_distl_method_2",
+    "noisiness_method_2",
+)
+
+
+def _stats_images(images):
+    """The statistics of a range of the images of _worker_state["imageset"]"""
+    imageset = _worker_state["imageset"]
+    reflections = _worker_state["reflections"]
+    offsets = _worker_state["offsets"]
+    start = _worker_state["start"]
+    mapped = _worker_state["mapped"]
+    kwargs = _worker_state["kwargs"]
+    result = []
+    for i in range(*images):
+        refl = reflections[int(offsets[i]) : int(offsets[i + 1])]
+        if mapped:
+            stats = _stats_single_image(imageset, refl, i=i + start, **kwargs)
+        else:
+            stats = stats_single_image(imageset[i : i + 1], refl, i=i + start, **kwargs)
+        result.append(tuple(getattr(stats, name) for name in _stats_names))
+    return result
+
+
+def stats_imageset(
+    imageset, reflections, resolution_analysis=True, plot=False, nproc=1
+):
+    """
+    The statistics of each image of an imageset.
+
+    The reflections are grouped by image with one sort. For a sweep they are
+    mapped to reciprocal space together, and the images are analysed in nproc
+    worker processes, forked with the reflections.
+
+    """
+    from dxtbx.imageset import ImageSweep
 
     image_number = reflections["xyzobs.px.value"].parts()[2]
     image_number = flex.floor(image_number)
@@ -760,34 +802,48 @@ def stats_imageset(imageset, reflections, resolution_analysis=True, plot=False):
         start, end = imageset.get_array_range()
     except AttributeError:
         start = 0
-    for i in range(len(imageset)):
-        stats = stats_single_image(
-            imageset[i : i + 1],
-            reflections.select(image_number == i + start),
-            i=i + start,
-            resolution_analysis=resolution_analysis,
-            plot=plot,
-        )
-        n_spots_total.append(stats.n_spots_total)
-        n_spots_no_ice.append(stats.n_spots_no_ice)
-        n_spots_4A.append(stats.n_spots_4A)
-        total_intensity.append(stats.total_intensity)
-        estimated_d_min.append(stats.estimated_d_min)
-        d_min_distl_method_1.append(stats.d_min_distl_method_1)
-        noisiness_method_1.append(stats.noisiness_method_1)
-        d_min_distl_method_2.append(stats.d_min_distl_method_2)
-        noisiness_method_2.append(stats.noisiness_method_2)
 
+    # sort the reflections by image, with the offsets of the reflections of
+    # each image, ignoring those outside the images of the imageset
+    perm = flex.sort_permutation(image_number, stable=True)
+    reflections = reflections.select(perm)
+    offsets = np.searchsorted(
+        image_number.select(perm).as_numpy_array(),
+        np.arange(start, start + len(imageset) + 1),
+    )
+
+    mapped = isinstance(imageset, ImageSweep)
+    if mapped:
+        reflections = map_to_reciprocal_space(reflections, imageset)
+
+    _worker_state.update(
+        imageset=imageset,
+        reflections=reflections,
+        offsets=offsets,
+        start=start,
+        mapped=mapped,
+        kwargs=dict(resolution_analysis=resolution_analysis, plot=plot),
+    )
+    try:
+        # plots are written serially, and fork is required to share the state
+        if nproc > 1 and len(imageset) > 1 and not plot and hasattr(os, "fork"):
+            n_chunks = min(len(imageset), 4 * nproc)
+            bounds = np.linspace(0, len(imageset), n_chunks + 1).astype(int)
+            pool = multiprocessing.Pool(processes=nproc)
+            try:
+                chunks = pool.map(_stats_images, list(zip(bounds[:-1], bounds[1:])))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            chunks = [_stats_images((0, len(imageset)))]
+    finally:
+        _worker_state.clear()
+
+    rows = [row for chunk in chunks for row in chunk]
+    columns = list(zip(*rows)) if rows else [()] * len(_stats_names)
     return group_args(
-        n_spots_total=n_spots_total,
-        n_spots_no_ice=n_spots_no_ice,
-        n_spots_4A=n_spots_4A,
-        total_intensity=total_intensity,
-        estimated_d_min=estimated_d_min,
-        d_min_distl_method_1=d_min_distl_method_1,
-        noisiness_method_1=noisiness_method_1,
-        d_min_distl_method_2=d_min_distl_method_2,
-        noisiness_method_2=noisiness_method_2,
+        **{name: list(column) for name, column in zip(_stats_names, columns)}
     )
 
 
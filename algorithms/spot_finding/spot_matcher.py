@@ -11,148 +11,154 @@
 from __future__ import absolute_import, division, print_function
 
 
-class SpotMatcher(object):
-    """Match the observed with predicted spots."""
+import logging
+from multiprocessing.pool import ThreadPool
 
-    def __init__(self, max_separation=2):
-        """
-        Setup the algorithm
+logger = logging.getLogger(__name__)
 
-        :param max_separation: Max pixel dist between predicted and observed spot
-
-        """
-        # Set the algorithm parameters
-        self._max_separation = max_separation
 
-    def __call__(self, observed, predicted):
-        """i
-        Match the observed reflections with the predicted.
+class SpotIndex(object):
+    """
+    A spatial index of predicted spot positions.
 
-        :param observed: The list of observed reflections.
-        :param predicted: The list of predicted reflections.
+    An octree is built for each panel when the index is created. The index can
+    then be queried many times with different sets of observed positions. The
+    search releases the GIL, so the panels are queried in parallel threads.
 
-        :returns: The list of matched reflections
+    """
 
+    def __init__(self, panel, xyz, max_bucket_size=10):
         """
-        from dials.array_family import flex
+        Build the index.
 
-        # Find the nearest neighbours and distances
-        # Command.start('Finding nearest neighbours')
-        nn, dist = self._find_nearest_neighbours(observed, predicted)
-        # Command.end('Found nearest neighbours')
+        :param panel: The panel number of each spot
+        :param xyz: The pixel coordinates of each spot
+        :param max_bucket_size: The maximum number of spots in a tree node
 
-        # Filter the matches by distance
-        # Command.start('Filtering matches by distance')
-        index = self._filter_by_distance(nn, dist)
-        # Command.end('Filtered {0} matches by distance'.format(len(index)))
+        """
+        from dials.algorithms.spatial_indexing import make_spatial_index
+
+        assert len(panel) == len(xyz)
+        self._size = len(xyz)
+        self._panels = {}
+        if len(panel) == 0:
+            return
+        for p in sorted(set(panel)):
+            indices = (panel == p).iselection()
+            tree = make_spatial_index(xyz.select(indices), max_bucket_size)
+            self._panels[p] = (tree, indices)
+
+    def __len__(self):
+        """ The number of spots in the index """
+        return self._size
+
+    def query(self, panel, xyz, max_separation, nproc=None):
+        """
+        Find the nearest spot in the index to each position within a maximum
+        separation. Each spot in the index is matched to at most one position,
+        the closest; ties are resolved in favour of the lowest position index.
 
-        # Filter out duplicates to just leave the closest pairs
-        # Command.start('Removing duplicate matches')
-        len_index = len(index)
-        index = self._filter_duplicates(index, nn, dist)
-        len_diff = len_index - len(index)
-        # Command.end('Removed {0} duplicate match(es)'.format(len_diff))
+        :param panel: The panel number of each position
+        :param xyz: The pixel coordinates of each position
+        :param max_separation: The maximum distance between matched spots
+        :param nproc: The number of threads (default one per panel)
 
-        # Copy all of the reflection data for the matched reflections
-        return flex.size_t(index), flex.size_t([nn[i] for i in index])
+        :returns: (position indices, spot indices, distances) sorted by position
 
-    def _find_nearest_neighbours(self, observed, predicted):
         """
-        Find the nearest predicted spot to the observed spot.
+        from dials.array_family import flex
 
-        :param observed: The observed reflections
-        :param predicted: The predicted reflections
+        assert len(panel) == len(xyz)
 
-        :returns: (nearest neighbours, distance)
+        def query_panel(p):
+            tree, spots = self._panels[p]
+            indices = (panel == p).iselection()
+            i, nn, dist = tree.query_nearest(xyz.select(indices), max_separation)
+            return indices.select(i), spots.select(nn), dist
 
-        """
-        from scitbx.array_family import flex
-
-        # Get the predicted coordinates
-        predicted_panel = predicted["panel"]
-        predicted_xyz = predicted["xyzcal.px"]
-        observed_panel = observed["panel"]
-        observed_xyz = observed["xyzobs.px.value"]
-
-        # Get the number of panels
-        max_panel1 = flex.max(predicted_panel)
-        max_panel2 = flex.max(observed_panel)
-        max_panel = max([max_panel1, max_panel2])
-
-        nn_all = flex.size_t()
-        dd_all = flex.double()
-        for panel in range(max_panel + 1):
-            pind = predicted_panel == panel
-            oind = observed_panel == panel
-            pxyz = predicted_xyz.select(pind)
-            oxyz = observed_xyz.select(oind)
+        panels = sorted(set(panel).intersection(self._panels)) if len(panel) else []
+        if len(panels) > 1 and nproc != 1:
+            pool = ThreadPool(processes=nproc or len(panels))
             try:
-                nn, d = self._find_nearest_neighbours_single(oxyz, pxyz)
-                indices = flex.size_t(range(len(pind))).select(pind)
-                indices = indices.select(flex.size_t(list(nn)))
-                nn_all.extend(indices)
-                dd_all.extend(d)
-            except Exception:
-                warn("Unable to match spots on panel %d" % panel)
-        return nn_all, dd_all
-
-    def _find_nearest_neighbours_single(self, oxyz, pxyz):
-        """
-        Find the nearest predicted spot to the observed spot.
+                results = pool.map(query_panel, panels)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [query_panel(p) for p in panels]
+
+        index = flex.size_t()
+        nearest = flex.size_t()
+        distance = flex.double()
+        for i, nn, dist in results:
+            index.extend(i)
+            nearest.extend(nn)
+            distance.extend(dist)
+
+        # Remove duplicates in bulk: order the matches by distance then by spot
+        # (both sorts are stable) and keep the first match of each spot
+        perm = flex.sort_permutation(distance, stable=True)
+        perm = perm.select(flex.sort_permutation(nearest.select(perm), stable=True))
+        sorted_nearest = nearest.select(perm)
+        keep = flex.bool(len(perm), True)
+        if len(perm) > 1:
+            keep.set_selected(
+                flex.size_t_range(1, len(perm)),
+                sorted_nearest[1:] != sorted_nearest[:-1],
+            )
+        perm = perm.select(keep)
+        perm = perm.select(flex.sort_permutation(index.select(perm)))
+        return index.select(perm), nearest.select(perm), distance.select(perm)
 
-        :param observed: The observed reflections
-        :param predicted: The predicted reflections
 
-        :returns: (nearest neighbours, distance)
+class SpotMatcher(object):
+    """Match the observed with predicted spots."""
 
+    def __init__(self, max_separation=2, nproc=None):
         """
-        from annlib_ext import AnnAdaptor
-        from scitbx.array_family import flex
-
-        # Create the KD Tree
-        ann = AnnAdaptor(pxyz.as_double().as_1d(), 3)
+        Setup the algorithm
 
-        # Query to find all the nearest neighbours
-        ann.query(oxyz.as_double().as_1d())
+        :param max_separation: Max pixel dist between predicted and observed spot
+        :param nproc: The number of threads to query the panels with
 
-        # Return the nearest neighbours and distances
-        return ann.nn, flex.sqrt(ann.distances)
+        """
+        # Set the algorithm parameters
+        self._max_separation = max_separation
+        self._nproc = nproc
 
-    def _filter_by_distance(self, nn, dist):
+    def __call__(self, observed, predicted):
         """
-        Filter the matches by distance.
+        Match the observed reflections with the predicted.
 
-        :param nn: The nearest neighbour list
-        :param dist: The distances
+        :param observed: The list of observed reflections.
+        :param predicted: The list of predicted reflections.
 
-        :returns: A reduced list of nearest neighbours
+        :returns: The list of matched reflections
 
         """
-        from scitbx.array_family import flex
+        index = SpotIndex(predicted["panel"], predicted["xyzcal.px"])
+        return self.match_with_index(observed, index)
 
-        index = range(len(nn))
-        return flex.int([i for i in index if dist[i] <= self._max_separation])
-
-    def _filter_duplicates(self, index, nn, dist):
+    def match_with_index(self, observed, index):
         """
-        Filter the matches to remove duplicates
+        Match the observed reflections with a prebuilt index of predictions.
 
-        :param index: The indices of valid spots
-        :param nn: The nearest neighbour indices
-        :param dist: The distances
+        :param observed: The list of observed reflections.
+        :param index: The SpotIndex of predicted reflections
 
-        :returns: A reduced list of nearest neighbours
+        :returns: The indices of the matched observed and predicted reflections
 
         """
-        seen = {}
-        for i in index:
-            p = nn[i]
-            if p in seen:
-                j = seen[p]
-                if dist[i] < dist[j]:
-                    seen[p] = i
-            else:
-                seen[p] = i
-
-        index = list(seen.values())
-        return index
+        oind, pind, dist = index.query(
+            observed["panel"],
+            observed["xyzobs.px.value"],
+            self._max_separation,
+            nproc=self._nproc,
+        )
+        logger.debug(
+            "Matched %d of %d observed spots with %d predictions",
+            len(oind),
+            len(observed),
+            len(index),
+        )
+        return oind, pind
@@ -0,0 +1,419 @@
+#
+# stream_processor.py
+#
+#  Copyright (C) 2019 Diamond Light Source
+#
+#  This code is distributed under the BSD license, a copy of which is
+#  included in the root directory of this package.
+
+"""
+Spot finding and per-image analysis on frames received from a zmq stream.
+
+The frames are never written to disk. The image frames are fanned out to a
+pool of worker processes, in which each frame is wrapped without copying,
+thresholded, labelled and analysed in memory. The per-frame results are sent
+back to the main process which publishes them, together with throughput and
+latency metrics, for live feedback at the beamline.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class FrameProcessor(object):
+    """
+    A class to find spots and compute statistics on a single in-memory frame.
+    """
+
+    def __init__(
+        self,
+        imageset,
+        threshold_function,
+        mask=None,
+        region_of_interest=None,
+        max_strong_pixel_fraction=0.1,
+        min_spot_size=1,
+        max_spot_size=20,
+        filter_spots=None,
+        resolution_analysis=True,
+    ):
+        """
+        Initialise the processor
+
+        :param imageset: An imageset providing the experimental models
+        :param threshold_function: The function to threshold with
+        :param mask: The static image mask
+        :param region_of_interest: A region of interest to process
+        :param max_strong_pixel_fraction: The maximum fraction of pixels allowed
+        :param min_spot_size: The minimum spot size
+        :param max_spot_size: The maximum spot size
+        :param filter_spots: The spot filter
+        :param resolution_analysis: Estimate the resolution of each frame
+        """
+        from dials.algorithms.spot_finding.finder import ExtractPixelsFromImage
+        from dials.algorithms.spot_finding.finder import PixelListToReflectionTable
+
+        self.imageset = imageset
+        self.resolution_analysis = resolution_analysis
+        self.extract_pixels = ExtractPixelsFromImage(
+            imageset=imageset,
+            threshold_function=threshold_function,
+            mask=mask,
+            region_of_interest=region_of_interest,
+            max_strong_pixel_fraction=max_strong_pixel_fraction,
+            compute_mean_background=False,
+        )
+        self.to_reflection_table = PixelListToReflectionTable(
+            min_spot_size, max_spot_size, filter_spots, False
+        )
+
+    @staticmethod
+    def from_parameters(params, imageset):
+        """
+        Construct the frame processor from the dials.find_spots parameters
+
+        :param params: The spot finding parameters
+        :param imageset: An imageset providing the experimental models
+        :return: The frame processor
+        """
+        from dials.algorithms.spot_finding.factory import SpotFinderFactory
+        from dials.util.masking import MaskGenerator
+        from dxtbx.model.experiment_list import ExperimentListFactory
+        from libtbx import Auto
+
+        if params.spotfinder.filter.min_spot_size is Auto:
+            if imageset.get_detector()[0].get_type() == "SENSOR_PAD":
+                # smaller default value for pixel array detectors
+                params.spotfinder.filter.min_spot_size = 3
+            else:
+                params.spotfinder.filter.min_spot_size = 6
+        experiments = ExperimentListFactory.from_imageset_and_crystal(imageset, None)
+        threshold_function = SpotFinderFactory.configure_threshold(params, experiments)
+        filter_spots = SpotFinderFactory.configure_filter(params)
+
+        # The static mask from the detector models and user parameters
+        mask = MaskGenerator(params.spotfinder.filter).generate(imageset)
+        lookup_mask = SpotFinderFactory.load_image(params.spotfinder.lookup.mask)
+        if lookup_mask is not None:
+            mask = tuple(m1 & m2 for m1, m2 in zip(mask, lookup_mask))
+
+        return FrameProcessor(
+            imageset,
+            threshold_function,
+            mask=mask,
+            region_of_interest=params.spotfinder.region_of_interest,
+            max_strong_pixel_fraction=params.spotfinder.filter.max_strong_pixel_fraction,
+            min_spot_size=params.spotfinder.filter.min_spot_size,
+            max_spot_size=params.spotfinder.filter.max_spot_size,
+            filter_spots=filter_spots,
+        )
+
+    def __call__(self, frame, image):
+        """
+        Process a single frame
+
+        :param frame: The frame number
+        :param image: The tuple of per-panel flex.double image data
+        :return: A dictionary of per-frame results
+        """
+        from dials.algorithms.spot_finding import per_image_analysis
+        from dials.array_family import flex
+        from dials.model.data import PixelListLabeller
+
+        # Pixels outside the trusted range are masked
+        mask = []
+        for im, panel in zip(image, self.imageset.get_detector()):
+            low, high = panel.get_trusted_range()
+            mask.append((im > low) & (im < high))
+
+        # Extract the strong pixels and label the spots
+        result = self.extract_pixels.extract(frame, image, tuple(mask))
+        pixel_labeller = [PixelListLabeller() for p in result.pixel_list]
+        for plabeller, plist in zip(pixel_labeller, result.pixel_list):
+            plabeller.add(plist)
+        reflections, _ = self.to_reflection_table(self.imageset, pixel_labeller)
+        reflections["id"] = flex.int(len(reflections), 0)
+
+        # Compute the per-image statistics
+        stats = per_image_analysis.stats_single_image(
+            self.imageset,
+            reflections,
+            i=frame,
+            resolution_analysis=self.resolution_analysis,
+        )
+        return {
+            "frame": frame,
+            "n_spots_total": stats.n_spots_total,
+            "n_spots_no_ice": stats.n_spots_no_ice,
+            "n_spots_4A": stats.n_spots_4A,
+            "total_intensity": stats.total_intensity,
+            "estimated_d_min": stats.estimated_d_min,
+            "d_min_distl_method_1": stats.d_min_distl_method_1,
+            "noisiness_method_1": stats.noisiness_method_1,
+            "d_min_distl_method_2": stats.d_min_distl_method_2,
+            "noisiness_method_2": stats.noisiness_method_2,
+        }
+
+
+def _worker(processor, header, distribute_url, collect_url):
+    """
+    Receive image frames from the distributor and process them until an empty
+    message is received.
+
+    :param processor: The frame processor
+    :param header: The decoded stream header
+    :param distribute_url: The url from which the image frames are received
+    :param collect_url: The url to send the results to
+    """
+    import zmq
+    from dials.util.stream import Decoder
+
+    context = zmq.Context()
+    receiver = context.socket(zmq.PULL)
+    receiver.connect(distribute_url)
+    sender = context.socket(zmq.PUSH)
+    sender.connect(collect_url)
+
+    decoder = Decoder(None, None)
+    decoder.header = header
+    while True:
+        frames = receiver.recv_multipart(copy=False)
+        if len(frames) == 1:
+            break
+        received = time.time()
+        image = decoder.decode(frames)
+        try:
+            result = processor(image.count, (image.as_flex(),))
+        except Exception as e:
+            result = {"frame": image.count, "error": str(e)}
+        result["processing_time"] = time.time() - received
+        sender.send_json(result)
+    receiver.close(linger=0)
+    sender.close()
+    context.term()
+
+
+class StreamSpotFinder(object):
+    """
+    A class to run the frame processing over a pool of worker processes and to
+    collect and publish the results.
+
+    The main process receives the frames from the stream without copying and
+    forwards the image frames, again without copying, to the workers. The
+    header is decoded in the main process and given to each worker as it is
+    started, so that the frame processor can be created from it.
+    """
+
+    def __init__(
+        self,
+        processor_factory,
+        nproc=1,
+        output_url=None,
+        distribute_url=None,
+        collect_url=None,
+        timeout=10,
+    ):
+        """
+        Initialise the spot finder
+
+        :param processor_factory: A function creating a processor from a header
+        :param nproc: The number of worker processes
+        :param output_url: The url on which to publish the per-frame results
+        :param distribute_url: The url used to send the frames to the workers,
+                               by default an ipc socket in a temporary
+                               directory for this run
+        :param collect_url: The url used to collect results from the workers,
+                            by default an ipc socket in a temporary directory
+                            for this run
+        :param timeout: Seconds to wait for outstanding frames after the end
+        """
+        self.processor_factory = processor_factory
+        self.nproc = nproc
+        self.output_url = output_url
+        self.distribute_url = distribute_url
+        self.collect_url = collect_url
+        self.timeout = timeout
+        self.results = []
+        self.metrics = {}
+
+    def run(self, stream):
+        """
+        Process the stream until the end of the series
+
+        :param stream: The ZMQStream to receive frames from
+        :return: The list of per-frame results ordered by frame
+        """
+        import zmq
+        from dials.util.stream import Decoder
+
+        # Sockets private to this run, so concurrent runs do not collide
+        socket_directory = None
+        distribute_url = self.distribute_url
+        collect_url = self.collect_url
+        if distribute_url is None or collect_url is None:
+            socket_directory = tempfile.mkdtemp(prefix="dials-stream-")
+            if distribute_url is None:
+                distribute_url = "ipc://" + os.path.join(socket_directory, "distribute")
+            if collect_url is None:
+                collect_url = "ipc://" + os.path.join(socket_directory, "collect")
+
+        context = zmq.Context()
+        distributor = context.socket(zmq.PUSH)
+        distributor.bind(distribute_url)
+        collector = context.socket(zmq.PULL)
+        collector.bind(collect_url)
+        publisher = None
+        if self.output_url is not None:
+            publisher = context.socket(zmq.PUB)
+            publisher.bind(self.output_url)
+        poller = zmq.Poller()
+        poller.register(stream.receiver, zmq.POLLIN)
+        poller.register(collector, zmq.POLLIN)
+
+        decoder = Decoder(None, None)
+        workers = []
+        received = {}
+        self.results = []
+        latency = []
+        start_time = None
+        end_time = None
+        end_of_series = False
+        try:
+            while not end_of_series or len(self.results) < len(received):
+                wait = self.timeout * 1000 if end_of_series else None
+                sockets = dict(poller.poll(wait))
+                if not sockets:
+                    logger.warning(
+                        "Timed out waiting for %d outstanding frames"
+                        % (len(received) - len(self.results))
+                    )
+                    break
+
+                # Forward the image frames to the workers
+                if stream.receiver in sockets:
+                    frames = stream.receive()
+                    obj = decoder.decode(frames)
+                    if obj.is_header():
+                        # A new header replaces the workers for the last one
+                        self._stop_workers(distributor, workers)
+                        workers = self._start_workers(obj, distribute_url, collect_url)
+                    elif obj.is_image():
+                        if not workers:
+                            raise RuntimeError("Received image before header")
+                        received[obj.count] = time.time()
+                        if start_time is None:
+                            start_time = received[obj.count]
+                        distributor.send_multipart(frames, copy=False)
+                    elif obj.is_endofseries():
+                        end_of_series = True
+                        poller.unregister(stream.receiver)
+
+                # Collect and publish the results
+                if collector in sockets:
+                    result = collector.recv_json()
+                    end_time = time.time()
+                    latency.append(end_time - received[result["frame"]])
+                    result["latency"] = latency[-1]
+                    self.results.append(result)
+                    if publisher is not None:
+                        publisher.send_json(result)
+                    logger.info(
+                        "Frame %d: %s spots (latency %.3f s)"
+                        % (result["frame"], result.get("n_spots_total"), latency[-1])
+                    )
+        finally:
+            self._stop_workers(distributor, workers)
+            for socket in (distributor, collector, publisher):
+                if socket is not None:
+                    socket.close(linger=0)
+            context.term()
+            if socket_directory is not None:
+                shutil.rmtree(socket_directory, ignore_errors=True)
+
+        # Compute the metrics
+        self.metrics = {"num_frames": len(self.results)}
+        if self.results:
+            elapsed = max(end_time - start_time, 1e-9)
+            self.metrics["elapsed_time"] = elapsed
+            self.metrics["frames_per_second"] = len(self.results) / elapsed
+            self.metrics["mean_latency"] = sum(latency) / len(latency)
+            self.metrics["max_latency"] = max(latency)
+            self.metrics["mean_processing_time"] = sum(
+                r["processing_time"] for r in self.results
+            ) / len(self.results)
+            logger.info(
+                "Processed %d frames at %.1f frames/s, mean latency %.3f s"
+                % (
+                    len(self.results),
+                    self.metrics["frames_per_second"],
+                    self.metrics["mean_latency"],
+                )
+            )
+        return sorted(self.results, key=lambda r: r["frame"])
+
+    def _start_workers(self, header, distribute_url, collect_url):
+        """
+        Create the frame processor and start the workers
+
+        :param header: The decoded stream header
+        :param distribute_url: The url the frames are sent to the workers on
+        :param collect_url: The url the workers send the results to
+        :return: The list of worker processes
+        """
+        processor = self.processor_factory(header)
+        workers = [
+            multiprocessing.Process(
+                target=_worker, args=(processor, header, distribute_url, collect_url)
+            )
+            for i in range(self.nproc)
+        ]
+        for worker in workers:
+            worker.start()
+        logger.info("Started %d stream processing workers" % len(workers))
+        return workers
+
+    def _stop_workers(self, distributor, workers):
+        """
+        Stop the workers once they have processed the frames already sent.
+
+        An empty message stops a worker after the frames sent to it before.
+        Messages are sent round-robin to the workers already connected, so a
+        worker which is slow to connect would miss its message while another
+        receives two. The messages are therefore sent again until every worker
+        has stopped, and any worker still running after the timeout is
+        terminated.
+
+        :param distributor: The socket the frames are sent to the workers on
+        :param workers: The list of worker processes
+        """
+        import zmq
+
+        deadline = time.time() + self.timeout
+        while True:
+            running = [worker for worker in workers if worker.is_alive()]
+            if not running:
+                break
+            if time.time() > deadline:
+                for worker in running:
+                    logger.warning(
+                        "Terminating stream processing worker %d" % worker.pid
+                    )
+                    worker.terminate()
+                break
+            for worker in running:
+                try:
+                    distributor.send(b"", zmq.NOBLOCK)
+                except zmq.Again:
+                    pass
+            running[0].join(0.1)
+        for worker in workers:
+            worker.join()
+        del workers[:]
@@ -60,6 +60,107 @@ def maha_dist_sq(cols, center, cov):
     return d2
 
 
+def _group_sums(a, ngroups):
+    """Sum each of ngroups consecutive, equal-sized groups of elements of a"""
+
+    size = len(a) // ngroups
+    a = a.deep_copy()
+    a.reshape(flex.grid(ngroups, size))
+    return a.matrix_multiply(flex.double(size, 1.0))
+
+
+def _expand(values, size):
+    """Repeat each element of values size times"""
+
+    return values.matrix_outer_product(flex.double(size, 1.0)).as_1d()
+
+
+def _tile(values, ntimes):
+    """Repeat the whole of values ntimes"""
+
+    return flex.double(ntimes, 1.0).matrix_outer_product(values).as_1d()
+
+
+def batch_means_and_covariance(subsets, ntrials):
+    """Calculate the means and covariance matrices of ntrials subsets of
+    observations at once. The subsets are given as a list of vectors, one per
+    variable, each being the concatenation of ntrials equal-sized subsets. The
+    means are returned as a list of vectors of length ntrials, one per variable,
+    and the covariance matrices as a dictionary of vectors of length ntrials,
+    keyed by (i, j) for the upper triangle i <= j"""
+
+    size = len(subsets[0]) // ntrials
+    centers = [_group_sums(col, ntrials) / size for col in subsets]
+    centred = [col - _expand(c, size) for col, c in zip(subsets, centers)]
+    covs = {}
+    for i in range(len(subsets)):
+        for j in range(i, len(subsets)):
+            covs[i, j] = _group_sums(centred[i] * centred[j], ntrials) / (size - 1)
+    return centers, covs
+
+
+def batch_cholesky(covs, p):
+    """Cholesky decomposition of a batch of covariance matrices, as returned by
+    batch_means_and_covariance. Return the determinants and the lower triangular
+    factors as a dictionary keyed by (i, j) for i >= j. Matrices that are not
+    positive definite are given a determinant of zero"""
+
+    det = flex.double(len(covs[0, 0]), 1.0)
+    L = {}
+    for j in range(p):
+        d = covs[j, j].deep_copy()
+        for k in range(j):
+            d -= L[j, k] * L[j, k]
+        singular = d <= 0.0
+        det *= d
+        det.set_selected(singular, 0.0)
+        d.set_selected(singular, 1.0)
+        L[j, j] = flex.sqrt(d)
+        for i in range(j + 1, p):
+            s = covs[j, i].deep_copy()
+            for k in range(j):
+                s -= L[i, k] * L[j, k]
+            L[i, j] = s / L[j, j]
+    return det, L
+
+
+def batch_maha_dist_sq(tiled, centers, L):
+    """Calculate squared Mahalanobis distances of all observations for a batch of
+    trials. tiled contains the vectors of observations repeated once for each
+    trial, centers and L are the means and Cholesky factors of the covariance
+    matrices for each trial"""
+
+    n = len(tiled[0]) // len(centers[0])
+    d2 = flex.double(len(tiled[0]), 0.0)
+    y = []
+    for i, col in enumerate(tiled):
+        r = col - _expand(centers[i], n)
+        for k in range(i):
+            r -= _expand(L[i, k], n) * y[k]
+        y.append(r / _expand(L[i, i], n))
+        d2 += y[i] * y[i]
+    return d2
+
+
+def batch_concentration_step(h, tiled, centers, L):
+    """Practical application of Theorem 1 of R&vD for a batch of trials. Return
+    the h observations closest to each trial's center, concatenated over trials"""
+
+    ntrials = len(centers[0])
+    n = len(tiled[0]) // ntrials
+    d2s = batch_maha_dist_sq(tiled, centers, L)
+
+    # sort by distance, then stably by trial, to order each trial's observations
+    perm = flex.sort_permutation(d2s, stable=True)
+    trial = _expand(flex.double(range(ntrials)), n)
+    perm = perm.select(flex.sort_permutation(trial.select(perm), stable=True))
+
+    keep = flex.size_t()
+    for i in range(ntrials):
+        keep.extend(perm[i * n : i * n + h])
+    return [col.select(keep) for col in tiled]
+
+
 def mcd_finite_sample(p, n, alpha):
     """Finite sample correction factor for the MCD estimate. Described in
     Pison et al. Metrika (2002). doi.org/10.1007/s001840200191. Implementation
@@ -310,47 +411,118 @@ def concentration_step(h, data, T, S):
         H1 = [col.select(p)[0:h] for col in data]
         return H1
 
-    def small_dataset_estimate(self):
-        """When a dataset is small, perform the initial trials directly on the
-        whole dataset"""
+    def _batch(self, trials):
+        """Convert a list of (det, T, S) trials to batch form"""
 
-        trials = []
-        for i in xrange(self._n_trials):
+        det = flex.double([t[0] for t in trials])
+        centers = [flex.double([t[1][i] for t in trials]) for i in range(self._p)]
+        covs = {}
+        for i in range(self._p):
+            for j in range(i, self._p):
+                covs[i, j] = flex.double([t[2][i, j] for t in trials])
+        return det, centers, covs
 
-            H1 = self.form_initial_subset(h=self._h, data=self._data)
-            T1, S1 = self.means_and_covariance(H1)
-            detS1 = S1.matrix_determinant_via_lu()
+    def _unbatch(self, det, centers, covs):
+        """Convert batch form trials to a list of (det, T, S) trials"""
 
-            # perform concentration steps
-            detScurr, Tcurr, Scurr = detS1, T1, S1
-            for j in xrange(self._k1):  # take maximum of k1 steps
+        trials = []
+        for k in range(len(det)):
+            T = flex.double([c[k] for c in centers])
+            S = flex.double(flex.grid(self._p, self._p))
+            for (i, j), cov_ij in covs.items():
+                S[i, j] = cov_ij[k]
+            S.matrix_copy_upper_to_lower_triangle_in_place()
+            trials.append((det[k], T, S))
+        return trials
+
+    def initial_trials(self, h, data, n_trials):
+        """Form n_trials initial subsets by method 2 of subsection 3.1 of R&vD and
+        take k1 concentration steps from each. The trials are processed together,
+        with the covariance and Mahalanobis distance calculations vectorised over
+        all trials. Return a list of (det, T, S) for each trial"""
 
-                Hnew = self.concentration_step(self._h, self._data, Tcurr, Scurr)
-                Tnew, Snew = self.means_and_covariance(Hnew)
-                detSnew = Snew.matrix_determinant_via_lu()
+        n = len(data[0])
+        rows = flex.size_t()
+        for i in range(n_trials):
+            rows.extend(flex.random_selection(n, self._p + 1))
+        T0, S0 = batch_means_and_covariance([c.select(rows) for c in data], n_trials)
+        det0, L0 = batch_cholesky(S0, self._p)
+
+        tiled = [_tile(col, n_trials) for col in data]
+        H1 = batch_concentration_step(h, tiled, T0, L0)
+        T1, S1 = batch_means_and_covariance(H1, n_trials)
+
+        # A random p+1 subset occasionally has a singular covariance matrix. For
+        # these trials the subset is enlarged until it is not, one at a time.
+        singular = (det0 <= 0.0).iselection()
+        for k in singular:
+            T, S = self.means_and_covariance(self.form_initial_subset(h, data))
+            for i in range(self._p):
+                T1[i][k] = T[i]
+                for j in range(i, self._p):
+                    S1[i, j][k] = S[i, j]
+        det1, L1 = batch_cholesky(S1, self._p)
+
+        # perform concentration steps
+        detScurr, Tcurr, Scurr, Lcurr = det1, T1, S1, L1
+        for j in range(self._k1):
+            Hnew = batch_concentration_step(h, tiled, Tcurr, Lcurr)
+            Tnew, Snew = batch_means_and_covariance(Hnew, n_trials)
+            detSnew, Lnew = batch_cholesky(Snew, self._p)
+
+            # detS3 < detS2 < detS1 by Theorem 1. In practice (rounding errors?)
+            # this is not always the case here. Ensure that detScurr is no smaller than
+            # one billionth the value of detSnew less than detSnew
+            assert (detScurr > (detSnew - detSnew / 1.0e9)).all_eq(True)
+            detScurr, Tcurr, Scurr, Lcurr = detSnew, Tnew, Snew, Lnew
+
+        return self._unbatch(detScurr, Tcurr, Scurr)
+
+    def concentrate_trials(self, h, data, trials, n_steps, converge=True):
+        """Take up to n_steps concentration steps from each (det, T, S) trial
+        using the observations in data, processing all trials together. If
+        converge is True, each trial stops when its determinant no longer
+        changes. Return the list of updated (det, T, S) trials"""
+
+        det, centers, covs = self._batch(trials)
+        _, L = batch_cholesky(covs, self._p)
+        active = flex.bool(len(trials), True)
+        for j in range(n_steps):
+            isel = active.iselection()
+            if len(isel) == 0:
+                break
+            tiled = [_tile(col, len(isel)) for col in data]
+            Hnew = batch_concentration_step(
+                h,
+                tiled,
+                [c.select(isel) for c in centers],
+                dict((k, v.select(isel)) for k, v in L.items()),
+            )
+            Tnew, Snew = batch_means_and_covariance(Hnew, len(isel))
+            detNew, Lnew = batch_cholesky(Snew, self._p)
+            if converge:
+                active.set_selected(isel.select(detNew == det.select(isel)), False)
+            det.set_selected(isel, detNew)
+            for i in range(self._p):
+                centers[i].set_selected(isel, Tnew[i])
+            for k in covs:
+                covs[k].set_selected(isel, Snew[k])
+            for k in L:
+                L[k].set_selected(isel, Lnew[k])
+
+        return self._unbatch(det, centers, covs)
 
-                # detS3 < detS2 < detS1 by Theorem 1. In practice (rounding errors?)
-                # this is not always the case here. Ensure that detScurr is no smaller than
-                # one billionth the value of detSnew less than detSnew
-                assert detScurr > (detSnew - detSnew / 1.0e9)
-                detScurr, Tcurr, Scurr = detSnew, Tnew, Snew
+    def small_dataset_estimate(self):
+        """When a dataset is small, perform the initial trials directly on the
+        whole dataset"""
 
-            trials.append((detSnew, Tnew, Snew))
+        trials = self.initial_trials(self._h, self._data, self._n_trials)
 
-        # choose 10 trials with the lowest detS3
+        # choose 10 trials with the lowest detS3 and take maximum of k3 steps
         trials.sort(key=lambda x: x[0])
-        best_trials = []
-        for i in xrange(10):
-            detCurr, Tcurr, Scurr = trials[i]
-            for j in xrange(self._k3):  # take maximum of k3 steps
-                Hnew = self.concentration_step(self._h, self._data, Tcurr, Scurr)
-                Tnew, Snew = self.means_and_covariance(Hnew)
-                detNew = Snew.matrix_determinant_via_lu()
-                if detNew == detCurr:
-                    # print "trial {0}; iteration {1}; convergence".format(i,j)
-                    break
-                detCurr, Tcurr, Scurr = detNew, Tnew, Snew
-            best_trials.append((detNew, Tnew, Snew))
+        best_trials = self.concentrate_trials(
+            self._h, self._data, trials[0:10], self._k3
+        )
 
         # Find the minimum covariance determinant from that set of 10
         best_trials.sort(key=lambda x: x[0])
@@ -381,48 +553,18 @@ def large_dataset_estimate(self):
         for group in groups:
 
             h_sub = int(len(group[0]) * h_frac)
-            gp_trials = []
-            for i in xrange(n_trials):
-
-                H1 = self.form_initial_subset(h=h_sub, data=group)
-                T1, S1 = self.means_and_covariance(H1)
-                detS1 = S1.matrix_determinant_via_lu()
-
-                # perform concentration steps
-                detScurr, Tcurr, Scurr = detS1, T1, S1
-                for j in xrange(self._k1):  # take k1 steps
-
-                    Hnew = self.concentration_step(h_sub, group, Tcurr, Scurr)
-                    Tnew, Snew = self.means_and_covariance(Hnew)
-                    detSnew = Snew.matrix_determinant_via_lu()
-
-                    # detS3 < detS2 < detS1 by Theorem 1. In practice (rounding errors?)
-                    # this is not always the case here. Ensure that detScurr is no smaller than
-                    # one billionth the value of detSnew less than detSnew
-                    assert detScurr > (detSnew - detSnew / 1.0e9)
-                    detScurr, Tcurr, Scurr = detSnew, Tnew, Snew
-
-                gp_trials.append((detSnew, Tnew, Snew))
+            gp_trials = self.initial_trials(h_sub, group, n_trials)
 
             # choose 10 trials with the lowest determinant and put in the outer list
             gp_trials.sort(key=lambda x: x[0])
             trials.extend(gp_trials[0:10])
 
         # now have 10 best trials from each group. Work with the merged (==sampled)
-        # set
-        mrgd_trials = []
+        # set, taking k2 steps
         h_mrgd = int(sample_size * h_frac)
-        for trial in trials:
-
-            detScurr, Tcurr, Scurr = trial
-            for j in xrange(self._k2):  # take k2 steps
-
-                Hnew = self.concentration_step(h_mrgd, sampled, Tcurr, Scurr)
-                Tnew, Snew = self.means_and_covariance(Hnew)
-                detSnew = Snew.matrix_determinant_via_lu()
-                detScurr, Tcurr, Scurr = detSnew, Tnew, Snew
-
-            mrgd_trials.append((detSnew, Tnew, Snew))
+        mrgd_trials = self.concentrate_trials(
+            h_mrgd, sampled, trials, self._k2, converge=False
+        )
 
         # sort trials by the lowest detS3 and work with the whole dataset now
         mrgd_trials.sort(key=lambda x: x[0])
@@ -455,22 +597,10 @@ def large_dataset_estimate(self):
         # choose number of trials to look at based on number of obs (ugly)
         n_reps = 1 if self._n > 5000 else 10
 
-        best_trials = []
-        for i in xrange(n_reps):
-            detCurr, Tcurr, Scurr = mrgd_trials[i]
-            for j in xrange(k4):  # take maximum of k4 steps
-                Hnew = self.concentration_step(self._h, self._data, Tcurr, Scurr)
-                Tnew, Snew = self.means_and_covariance(Hnew)
-                detNew = Snew.matrix_determinant_via_lu()
-                if detNew == detCurr:
-                    # print "trial {0}; iteration {1}; convergence".format(i,j)
-                    break
-                detCurr, Tcurr, Scurr = detNew, Tnew, Snew
-            # print "determinant", detNew
-            # print "location:", list(Tnew)
-            # print "covariance:"
-            # print Snew.as_scitbx_matrix()
-            best_trials.append((detNew, Tnew, Snew))
+        # take maximum of k4 steps
+        best_trials = self.concentrate_trials(
+            self._h, self._data, mrgd_trials[0:n_reps], k4
+        )
 
         # Find the minimum covariance determinant from that set of 10
         best_trials.sort(key=lambda x: x[0])
@@ -939,6 +939,30 @@ def compute_mask(self, experiments, image_volume=None, overlaps=None):
                     self["fraction"] = flex.double(len(self))
                 self["fraction"].set_selected(indices, result)
 
+    def split_views_by_experiment_id(self):
+        """
+        Split the table into views of the reflections of each experiment, with
+        one sort of the id column. Unlike split_by_experiment_id no rows are
+        copied until a view is written to, and reflections with an id of -1 are
+        ignored.
+
+        :return: An ordered dictionary of the views, by id
+
+        """
+        import numpy as np
+
+        assert "id" in self
+        ids = self["id"].as_numpy_array()
+        order = np.argsort(ids, kind="mergesort")
+        unique_ids, offsets = np.unique(ids[order], return_index=True)
+        offsets = np.append(offsets, len(ids))
+        views = collections.OrderedDict()
+        for i, id_ in enumerate(unique_ids):
+            if id_ >= 0:
+                indices = flex.size_t(order[offsets[i] : offsets[i + 1]])
+                views[int(id_)] = reflection_table_view(self, indices, int(id_))
+        return views
+
     def iterate_experiments_and_indices(self, experiments):
         """
         A helper function to interate through experiments and indices of reflections
@@ -1000,32 +1024,27 @@ def compute_fitted_intensity(self, fitter):
         success = fitter.fit(self)
         self.set_flags(~success, self.flags.failed_during_profile_fitting)
 
-    def compute_corrections(self, experiments):
+    def compute_corrections(self, experiments, nthreads=1):
         """
         Helper function to correct the intensity.
 
         :param experiments: The list of experiments
+        :param nthreads: The number of threads to use
         :return: The LP correction for each reflection
 
         """
-        from dials.algorithms.integration import Corrections, CorrectionsMulti
+        from dials.algorithms.integration.reflection_geometry import (
+            compute_reflection_geometry,
+        )
 
-        compute = CorrectionsMulti()
-        for experiment in experiments:
-            if experiment.goniometer is not None:
-                compute.append(
-                    Corrections(
-                        experiment.beam, experiment.goniometer, experiment.detector
-                    )
-                )
-            else:
-                compute.append(Corrections(experiment.beam, experiment.detector))
-        lp = compute.lp(self["id"], self["s1"])
-        self["lp"] = lp
-        if experiment.detector[0].get_mu() > 0:
-            qe = compute.qe(self["id"], self["s1"], self["panel"])
-            self["qe"] = qe
-        return lp
+        qe = all(experiment.detector[0].get_mu() > 0 for experiment in experiments)
+        result = compute_reflection_geometry(
+            self, experiments, lp=True, qe=qe, nthreads=nthreads
+        )
+        self["lp"] = result.lp
+        if qe:
+            self["qe"] = result.qe
+        return result.lp
 
     def integrate(self, experiments, profile_model, reference_selector=None):
         """
@@ -1307,28 +1326,11 @@ def select_on_experiment_identifiers(self, list_of_identifiers):
         and return a reflection table with properly configured experiment_identifiers
         map.
         """
-        # First get the reverse of the map i.e. ids for a given exp_identifier
-        id_values = []
-        for exp_id in list_of_identifiers:
-            for k in self.experiment_identifiers().keys():
-                if self.experiment_identifiers()[k] == exp_id:
-                    id_values.append(k)
-                    break
-        if len(id_values) != len(list_of_identifiers):
-            raise KeyError(
-                """Not all requested identifiers
-found in the table's map, has the experiment_identifiers() map been created?
-Requested %s:
-Found %s"""
-                % (list_of_identifiers, id_values)
-            )
-        # Build up a selection and use this
-        sel = flex.bool(self.size(), False)
-        for id_val, exp_id in zip(id_values, list_of_identifiers):
-            id_sel = self["id"] == id_val
-            sel.set_selected(id_sel, True)
-        self = self.select(sel)
+        id_values = self._ids_of_experiment_identifiers(list_of_identifiers)
+        # Select the rows of all the ids at once
+        self = self.select(self._rows_with_ids(id_values))
         # Remove entries from the experiment_identifiers map
+        id_values = set(id_values)
         for k in self.experiment_identifiers().keys():
             if k not in id_values:
                 del self.experiment_identifiers()[k]
@@ -1339,14 +1341,28 @@ def remove_on_experiment_identifiers(self, list_of_identifiers):
         Remove datasets from the table, given a list of experiment
         identifiers (strings).
         """
-        # First get the reverse of the map i.e. ids for a given exp_identifier
         assert "id" in self
-        id_values = []
-        for exp_id in list_of_identifiers:
-            for k in self.experiment_identifiers().keys():
-                if self.experiment_identifiers()[k] == exp_id:
-                    id_values.append(k)
-                    break
+        id_values = self._ids_of_experiment_identifiers(list_of_identifiers)
+        # Now delete the rows of all the ids at once, also removing the entries
+        # from the map
+        self.del_selected(self._rows_with_ids(id_values))
+        for id_val in id_values:
+            del self.experiment_identifiers()[id_val]
+        return self
+
+    def _ids_of_experiment_identifiers(self, list_of_identifiers):
+        """
+        The ids for a list of experiment identifiers, from the reverse of the
+        experiment_identifiers map.
+        """
+        reverse_map = {}
+        for k, v in self.experiment_identifiers():
+            reverse_map.setdefault(v, k)
+        id_values = [
+            reverse_map[exp_id]
+            for exp_id in list_of_identifiers
+            if exp_id in reverse_map
+        ]
         if len(id_values) != len(list_of_identifiers):
             raise KeyError(
                 """Not all requested identifiers
@@ -1355,12 +1371,15 @@ def remove_on_experiment_identifiers(self, list_of_identifiers):
 Found %s"""
                 % (list_of_identifiers, id_values)
             )
-        # Now delete the selections, also removing the entry from the map
-        for id_val in id_values:
-            sel = self["id"] == id_val
-            self.del_selected(sel)
-            del self.experiment_identifiers()[id_val]
-        return self
+        return id_values
+
+    def _rows_with_ids(self, id_values):
+        """
+        The selection of the rows with any of the ids.
+        """
+        import numpy as np
+
+        return flex.bool(np.isin(self["id"].as_numpy_array(), list(id_values)))
 
     def clean_experiment_identifiers_map(self):
         """
@@ -1379,15 +1398,26 @@ def reset_ids(self):
         Reset the 'id' column such that the experiment identifiers are
         numbered 0 .. n-1.
         """
+        import numpy as np
+
         reverse_map = collections.OrderedDict(
             (v, k) for k, v in self.experiment_identifiers()
         )
-        orig_id = self["id"].deep_copy()
         for k in self.experiment_identifiers().keys():
             del self.experiment_identifiers()[k]
+        if not reverse_map:
+            return
+
+        # Look up the new id of every row at once, from the sorted old ids
+        old_ids = np.array(list(reverse_map.values()))
+        order = np.argsort(old_ids, kind="mergesort")
+        orig_id = self["id"].as_numpy_array()
+        pos = np.minimum(np.searchsorted(old_ids[order], orig_id), len(order) - 1)
+        (rows,) = np.nonzero(old_ids[order][pos] == orig_id)
+        self["id"].set_selected(
+            flex.size_t(rows), flex.int(order[pos[rows]].astype(np.int32))
+        )
         for i_exp, exp_id in enumerate(reverse_map.keys()):
-            sel_exp = orig_id == reverse_map[exp_id]
-            self["id"].set_selected(sel_exp, i_exp)
             self.experiment_identifiers()[i_exp] = exp_id
 
     def centroid_px_to_mm(self, detector, scan=None):
@@ -1480,6 +1510,141 @@ def map_centroids_to_reciprocal_space(
     pass
 
 
+class reflection_table_view(object):
+    """
+    A view of the reflections of one experiment in a reflection table, given by
+    their indices in the table.
+
+    Columns are selected from the table as they are first read, and the view
+    keeps the selected columns, so a column read from the view may be modified
+    in place. The reflections are copied into a table of their own, with only
+    the experiment identifier of their id and the columns already read, when
+    the view is first written to or anything but a column is needed from the
+    table, and the view then uses the copy.
+
+    The view holds the indices of the reflections in the table, so the table
+    must not be reordered or resized (e.g. with del_selected or extend) until
+    the view has been copied. A change of size is detected when the view next
+    reads from the table.
+
+    """
+
+    flags = reflection_table.flags
+
+    def __init__(self, parent, indices, experiment_id):
+        """
+        Initialise the view
+
+        :param parent: The reflection table
+        :param indices: The indices of the reflections in the table
+        :param experiment_id: The id of the reflections
+
+        """
+        self._parent = parent
+        self._parent_size = len(parent)
+        self._indices = indices
+        self._experiment_id = experiment_id
+        self._columns = {}
+        self._table = None
+
+    def _check_parent(self):
+        assert (
+            len(self._parent) == self._parent_size
+        ), "The reflection table has changed size since the view was made"
+
+    @property
+    def experiment_id(self):
+        return self._experiment_id
+
+    @property
+    def indices(self):
+        """The indices of the reflections in the table the view was made from"""
+        return self._indices
+
+    def identifier(self):
+        """The experiment identifier of the reflections, or None if not set"""
+        if self._table is not None:
+            identifiers = self._table.experiment_identifiers()
+        else:
+            identifiers = self._parent.experiment_identifiers()
+        if self._experiment_id in identifiers.keys():
+            return identifiers[self._experiment_id]
+        return None
+
+    def table(self):
+        """
+        The reflections as a reflection table, copying them from the table the
+        view was made from the first time this is called.
+        """
+        if self._table is None:
+            self._check_parent()
+            table = self._parent.select(self._indices)
+            for k in table.experiment_identifiers().keys():
+                if k != self._experiment_id:
+                    del table.experiment_identifiers()[k]
+            for key, column in self._columns.items():
+                table[key] = column
+            self._table = table
+            self._parent = None
+            self._columns = None
+        return self._table
+
+    def size(self):
+        if self._table is not None:
+            return self._table.size()
+        return len(self._indices)
+
+    def __len__(self):
+        return self.size()
+
+    def keys(self):
+        if self._table is not None:
+            return self._table.keys()
+        return self._parent.keys()
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def __getitem__(self, key):
+        if self._table is not None:
+            return self._table[key]
+        if key not in self._columns:
+            self._check_parent()
+            self._columns[key] = self._parent[key].select(self._indices)
+        return self._columns[key]
+
+    def __setitem__(self, key, value):
+        self.table()[key] = value
+
+    def __delitem__(self, key):
+        del self.table()[key]
+
+    def get_flags(self, value, all=True):
+        """Get the flags of the reflections, reading only the flags column"""
+        flags = reflection_table()
+        flags["flags"] = self["flags"]
+        return flags.get_flags(value, all=all)
+
+    def select(self, selection):
+        """
+        Select reflections from the view, copying only the selected reflections
+        into a new reflection table.
+        """
+        if self._table is not None or self._columns:
+            return self.table().select(selection)
+        if isinstance(selection, flex.bool):
+            selection = selection.iselection()
+        return reflection_table_view(
+            self._parent, self._indices.select(selection), self._experiment_id
+        ).table()
+
+    def __getattr__(self, name):
+        # Anything else is done with the reflections copied into a table
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.table(), name)
+
+
 class reflection_table_selector(object):
     """
     A class to select columns from reflection table.
@@ -0,0 +1,167 @@
+from __future__ import absolute_import, division, print_function
+
+import logging
+import os
+import shutil
+import tempfile
+
+import iotbx.phil
+from dials.util import Sorry
+
+logger = logging.getLogger("dials.command_line.benchmark")
+
+help_message = """
+
+Benchmark the processing pipeline on deterministic synthetic datasets.
+
+For each size of dataset a rotation sweep is simulated and processed with
+dials.import, dials.find_spots, dials.index (with each of the fft1d, fft3d and
+real_space_grid_search methods), dials.refine (static and scan varying),
+dials.integrate (with the 3d and 3d_threaded integrators), dials.scale,
+dials.cosym and dials.export, recording the wall clock time, the CPU time and
+the peak memory of each stage. The results are written as JSON, and may be
+compared with the results of an earlier benchmark, e.g. of another commit, to
+find performance regressions.
+
+Examples::
+
+  dials.benchmark
+
+  dials.benchmark size=small+medium nproc=4 output.json=benchmark.json
+
+  dials.benchmark stages=integrate.3d,scale compare=reference.json
+
+"""
+
+phil_scope = iotbx.phil.parse(
+    """
+size = *small medium large
+  .type = choice(multi=True)
+  .help = "The sizes of the simulated datasets to benchmark"
+stages = None
+  .type = strings
+  .help = "The stages to benchmark, with the stages they depend on, or all"
+          "stages if None: import, find_spots, index.fft1d, index.fft3d,"
+          "index.real_space_grid_search, refine.static, refine.scan_varying,"
+          "integrate.3d, integrate.3d_threaded, scale, cosym, export"
+nproc = 1
+  .type = int(value_min=1)
+  .help = "The number of processes for the stages which use them"
+repeats = 1
+  .type = int(value_min=1)
+  .help = "The number of times to run each stage, recording the least time"
+seed = 0
+  .type = int(value_min=0)
+  .help = "The seed of the random numbers of the simulation"
+directory = None
+  .type = path
+  .help = "The working directory, in which the simulated images are kept to"
+          "be reused. If None a temporary directory is used and removed."
+compare = None
+  .type = path
+  .help = "The JSON results of an earlier benchmark to compare with"
+tolerance {
+  time = 0.1
+    .type = float(value_min=0)
+    .help = "The fractional increase in time tolerated"
+  min_time = 1.0
+    .type = float(value_min=0)
+    .help = "The increase in time tolerated, in seconds"
+  memory = 0.1
+    .type = float(value_min=0)
+    .help = "The fractional increase in peak memory tolerated"
+}
+output {
+  json = benchmark.json
+    .type = path
+  log = dials.benchmark.log
+    .type = path
+  debug_log = dials.benchmark.debug.log
+    .type = path
+}
+"""
+)
+
+
+def run(args):
+    from dials.util import log
+    from dials.util import benchmark
+    from dials.util.options import OptionParser
+    from dials.util.version import dials_version
+    import libtbx.load_env
+
+    usage = "%s [options]" % libtbx.env.dispatcher_name
+
+    parser = OptionParser(usage=usage, phil=phil_scope, epilog=help_message)
+    params, options = parser.parse_args(args=args, show_diff_phil=False)
+
+    log.config(info=params.output.log, debug=params.output.debug_log)
+    logger.info(dials_version())
+
+    diff_phil = parser.diff_phil.as_str()
+    if diff_phil != "":
+        logger.info("The following parameters have been modified:\n")
+        logger.info(diff_phil)
+
+    if params.stages is not None:
+        names = [stage.name for stage in benchmark.STAGES]
+        for name in params.stages:
+            if name not in names:
+                raise Sorry("Unknown stage %s" % name)
+
+    reference = None
+    if params.compare is not None:
+        reference = benchmark.from_json(params.compare)
+
+    directory = params.directory
+    if directory is None:
+        directory = tempfile.mkdtemp(prefix="dials_benchmark_")
+    try:
+        results = benchmark.run_benchmark(
+            params.size,
+            os.path.abspath(directory),
+            stages=params.stages,
+            nproc=params.nproc,
+            repeats=params.repeats,
+            seed=params.seed,
+        )
+    finally:
+        if params.directory is None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    logger.info("Saving the results to %s", params.output.json)
+    benchmark.as_json(results, params.output.json)
+
+    if reference is not None:
+        regressions = benchmark.compare(
+            reference,
+            results,
+            time_tolerance=params.tolerance.time,
+            memory_tolerance=params.tolerance.memory,
+            min_time=params.tolerance.min_time,
+        )
+        for r in regressions:
+            logger.info(
+                "Regression in %s for the %s dataset: %s %s -> %s",
+                r.stage,
+                r.size,
+                r.quantity,
+                r.reference,
+                r.value,
+            )
+        if regressions:
+            raise Sorry(
+                "%d performance regressions relative to %s"
+                % (len(regressions), params.compare)
+            )
+        logger.info("No performance regressions relative to %s", params.compare)
+
+
+if __name__ == "__main__":
+    import sys
+    from dials.util import halraiser
+
+    try:
+        run(sys.argv[1:])
+    except Exception as e:
+        halraiser(e)
@@ -5,6 +5,7 @@
 
 import iotbx.phil
 from cctbx import sgtbx
+from dials.util import Sorry
 
 help_message = """
 """
@@ -14,6 +15,20 @@
 threshold = 5000
   .type = float(value_min=0)
   .help = 'Threshold value for the clustering'
+nproc = 1
+  .type = int(value_min=1)
+  .help = "The number of processes to calculate the distances between the"
+          "unit cells with"
+approximate = False
+  .type = bool
+  .help = "Skip the distances between pairs of unit cells whose Niggli cell"
+          "edges put them further apart than the threshold. The clusters are"
+          "unchanged, but the dendrogram is approximate."
+storage = *condensed sparse
+  .type = choice
+  .help = "Calculate the full condensed matrix of the distances between the"
+          "unit cells, or only a spanning tree of the unit cells, in memory"
+          "proportional to the number of unit cells."
 plot {
   show = False
     .type = bool
@@ -84,10 +99,10 @@ def do_cluster_analysis(crystal_symmetries, params):
     except ImportError:
         raise Sorry("cluster_unit_cell requires xfel module but is not available")
 
-    from xfel.clustering.cluster import Cluster
     from xfel.clustering.cluster_groups import unit_cell_info
+    from dials.algorithms.clustering.unit_cell import UnitCellCluster
 
-    ucs = Cluster.from_crystal_symmetries(crystal_symmetries)
+    ucs = UnitCellCluster.from_crystal_symmetries(crystal_symmetries)
 
     if params.plot.show or params.plot.name is not None:
         if not params.plot.show:
@@ -99,13 +114,16 @@ def do_cluster_analysis(crystal_symmetries, params):
 
         plt.figure("Andrews-Bernstein distance dendogram", figsize=(12, 8))
         ax = plt.gca()
-        clusters, cluster_axes = ucs.ab_cluster(
+        clusters, dendrogram, cluster_axes = ucs.ab_cluster(
             params.threshold,
             log=params.plot.log,
             ax=ax,
             write_file_lists=False,
             # schnell=_args.schnell,
             doplot=True,
+            nproc=params.nproc,
+            approximate=params.approximate,
+            storage=params.storage,
         )
         print(unit_cell_info(clusters))
         plt.tight_layout()
@@ -115,12 +133,15 @@ def do_cluster_analysis(crystal_symmetries, params):
             plt.show()
 
     else:
-        clusters, cluster_axes = ucs.ab_cluster(
+        clusters, dendrogram, cluster_axes = ucs.ab_cluster(
             params.threshold,
             log=params.plot.log,
             write_file_lists=False,
             # schnell=_args.schnell,
             doplot=False,
+            nproc=params.nproc,
+            approximate=params.approximate,
+            storage=params.storage,
         )
         print(unit_cell_info(clusters))
 
@@ -1,6 +1,7 @@
 #!/usr/bin/env dials.python
 from __future__ import absolute_import, division, print_function
 
+import itertools
 import os
 
 from libtbx.phil import parse
@@ -31,8 +32,7 @@
 """
 
 # The phil scope
-phil_scope = parse(
-    """
+phil_str = """
 
   reference_from_experiment{
     beam = None
@@ -159,11 +159,31 @@
       .help = "If not None, throw out any experiment with fewer than this"
               "many reflections"
 
+    streaming = False
+      .type = bool
+      .expert_level = 2
+      .help = "Read the input reflection files one at a time as they are"
+              "combined, instead of all at once before combining. With"
+              "max_batch_size, each batch is saved as soon as it is complete,"
+              "so only one input file and one batch are held in memory."
+              "Not compatible with n_subset or clustering."
+
     include scope dials.algorithms.integration.stills_significance_filter.phil_scope
   }
-""",
-    process_includes=True,
-)
+"""
+
+phil_scope = parse(phil_str, process_includes=True)
+
+# For reading the experiments given on the command line, leaving the
+# reflection files to be read as they are combined
+input_phil_str = """
+  input {
+    reflections = None
+      .type = path
+      .multiple = True
+      .help = "The reflection table file path"
+  }
+"""
 
 
 def find_experiment_in(experiment, all_experiments):
@@ -335,6 +355,74 @@ def __init__(
             plt.show()
 
 
+class BatchWriter(object):
+    """
+    Save combined experiments and reflections as they are added, in batches
+    of experiments, so that only one batch is held in memory at a time.
+    """
+
+    def __init__(self, save, exp_name, refl_name, batch_sizes=None):
+        """
+        :param save: Called as save(experiments, reflections, exp_name,
+                     refl_name) to save a batch
+        :param exp_name: The filename for the experiments
+        :param refl_name: The filename for the reflections
+        :param batch_sizes: An iterable of the number of experiments in each
+                            batch, or None to save all the experiments to
+                            exp_name and refl_name on close
+        """
+        self._save = save
+        self._exp_name = exp_name
+        self._refl_name = refl_name
+        self._batch_sizes = None if batch_sizes is None else iter(batch_sizes)
+        self._batch = 0
+        self._experiments = None
+        self._reflections = None
+        self._size = None
+
+    def _start_batch(self):
+        from dials.array_family import flex
+        from dxtbx.model.experiment_list import ExperimentList
+
+        self._experiments = ExperimentList()
+        self._reflections = flex.reflection_table()
+        if self._batch_sizes is not None:
+            self._size = next(size for size in self._batch_sizes if size > 0)
+
+    def add(self, experiment, reflections):
+        """Add an experiment and its reflections, whose ids are reset to the
+        index of the experiment in the batch"""
+        from dials.array_family import flex
+
+        if self._experiments is None:
+            self._start_batch()
+        reflections["id"] = flex.int(len(reflections), len(self._experiments))
+        self._experiments.append(experiment)
+        self._reflections.extend(reflections)
+        if len(self._experiments) == self._size:
+            self._save_batch()
+
+    def _save_batch(self):
+        if self._batch_sizes is None:
+            exp_name, refl_name = self._exp_name, self._refl_name
+        else:
+            exp_name = os.path.splitext(self._exp_name)[0] + "_%03d.json" % self._batch
+            refl_name = (
+                os.path.splitext(self._refl_name)[0] + "_%03d.pickle" % self._batch
+            )
+        self._save(self._experiments, self._reflections, exp_name, refl_name)
+        self._batch += 1
+        self._experiments = None
+        self._reflections = None
+
+    def close(self):
+        """Save the last batch, or all the experiments if not in batches"""
+        if self._experiments is None and self._batch_sizes is None:
+            self._start_batch()
+        if self._experiments is not None:
+            self._save_batch()
+
+
 class Script(object):
     def __init__(self):
         """Initialise the script."""
@@ -358,31 +446,82 @@ def __init__(self):
             epilog=help_message,
         )
 
+        # The parser used by run, which does not read the reflection files
+        self.input_parser = OptionParser(
+            usage=usage,
+            phil=parse(phil_str + input_phil_str, process_includes=True),
+            read_experiments=True,
+            check_format=False,
+            epilog=help_message,
+        )
+
     def run(self):
         """Execute the script."""
-        params, options = self.parser.parse_args(show_diff_phil=True)
-        self.run_with_preparsed(params, options)
+        from dials.util.phil import ReflectionTableConverters
+
+        params, options, args = self.input_parser.parse_args(
+            show_diff_phil=True, return_unhandled=True
+        )
 
-    def run_with_preparsed(self, params, options):
-        """Run combine_experiments, but allow passing in of parameters"""
+        # The remaining arguments are reflection files
+        unhandled = [arg for arg in args if not os.path.isfile(arg)]
+        if unhandled:
+            raise Sorry(
+                self.input_parser._warn_about_unhandled_args(
+                    unhandled, verbosity=options.verbose
+                )
+            )
+        reflection_filenames = list(params.input.reflections) + args
+
+        if not params.output.streaming:
+            converter = ReflectionTableConverters()
+            params.input.reflections = []
+            for filename in reflection_filenames:
+                try:
+                    params.input.reflections.append(converter.from_string(filename))
+                except Exception as e:
+                    raise Sorry(
+                        "Unable to read reflections from %s:\n  %s" % (filename, e)
+                    )
+            reflection_filenames = None
+        self.run_with_preparsed(params, options, reflection_filenames)
+
+    def run_with_preparsed(self, params, options, reflection_filenames=None):
+        """Run combine_experiments, but allow passing in of parameters
+
+        If reflection_filenames is given, the reflection files are read one at a
+        time as they are combined, instead of taken from params.input.reflections
+        """
         from dials.util.options import flatten_experiments
 
+        if reflection_filenames is None:
+            n_reflections = len(params.input.reflections)
+        else:
+            n_reflections = len(reflection_filenames)
+
         # Try to load the models and data
         if len(params.input.experiments) == 0:
             print("No Experiments found in the input")
             self.parser.print_help()
             return
-        if len(params.input.reflections) == 0:
+        if n_reflections == 0:
             print("No reflection data found in the input")
             self.parser.print_help()
             return
         try:
-            assert len(params.input.reflections) == len(params.input.experiments)
+            assert n_reflections == len(params.input.experiments)
         except AssertionError:
             raise Sorry(
                 "The number of input reflections files does not match the "
                 "number of input experiments"
             )
+        if params.output.streaming and (
+            params.output.n_subset is not None or params.clustering.use
+        ):
+            raise Sorry(
+                "output.streaming is not compatible with output.n_subset or "
+                "clustering.use"
+            )
 
         flat_exps = flatten_experiments(params.input.experiments)
 
@@ -486,13 +625,36 @@ def average_detectors(target, panelgroups, depth):
 
         experiments = ExperimentList()
 
+        if params.output.streaming:
+            # save the combined data as they are added
+            if params.output.max_batch_size is None:
+                batch_sizes = None
+            elif params.output.min_reflections_per_experiment is None:
+                batch_sizes = self._batch_sizes(
+                    len(flat_exps), params.output.max_batch_size
+                )
+            else:
+                # the number of experiments is not known in advance
+                batch_sizes = itertools.repeat(params.output.max_batch_size)
+            writer = BatchWriter(
+                self._save_output,
+                params.output.experiments_filename,
+                params.output.reflections_filename,
+                batch_sizes,
+            )
+
+        def read_input():
+            for i, exp_wrapper in enumerate(params.input.experiments):
+                if reflection_filenames is None:
+                    yield params.input.reflections[i].data, exp_wrapper.data
+                else:
+                    yield flex.reflection_table.from_file(
+                        reflection_filenames[i]
+                    ), exp_wrapper.data
+
         # loop through the input, building up the global lists
         nrefs_per_exp = []
-        for ref_wrapper, exp_wrapper in zip(
-            params.input.reflections, params.input.experiments
-        ):
-            refs = ref_wrapper.data
-            exps = exp_wrapper.data
+        for refs, exps in read_input():
             for i, exp in enumerate(exps):
                 sel = refs["id"] == i
                 sub_ref = refs.select(sel)
@@ -508,9 +670,12 @@ def average_detectors(target, panelgroups, depth):
                 sub_ref["id"] = flex.int(len(sub_ref), global_id)
                 if params.output.delete_shoeboxes and "shoebox" in sub_ref:
                     del sub_ref["shoebox"]
-                reflections.extend(sub_ref)
                 try:
-                    experiments.append(combine(exp))
+                    if params.output.streaming:
+                        writer.add(combine(exp), sub_ref)
+                    else:
+                        reflections.extend(sub_ref)
+                        experiments.append(combine(exp))
                 except ComparisonError as e:
                     # When we failed tolerance checks, give a useful error message
                     (path, index) = find_experiment_in(exp, params.input.experiments)
@@ -523,6 +688,9 @@ def average_detectors(target, panelgroups, depth):
 
                 global_id += 1
 
+            # release this input before reading the next
+            del refs, exps
+
         if (
             params.output.min_reflections_per_experiment is not None
             and skipped_expts > 0
@@ -541,6 +709,10 @@ def average_detectors(target, panelgroups, depth):
         st = simple_table(rows, header)
         print(st.format())
 
+        if params.output.streaming:
+            writer.close()
+            return
+
         # save a random subset if requested
         if (
             params.output.n_subset is not None
@@ -715,6 +887,19 @@ def combine_in_clusters(
                 )
         return
 
+    @staticmethod
+    def _batch_sizes(n_experiments, max_batch_size):
+        """The sizes of the batches that n experiments are saved in, as split by
+        save_in_batches"""
+        from dxtbx.command_line.image_average import splitit
+
+        return [
+            len(indices)
+            for indices in splitit(
+                range(n_experiments), (n_experiments // max_batch_size) + 1
+            )
+        ]
+
     def _save_output(self, experiments, reflections, exp_name, refl_name):
         # save output
         from dxtbx.model.experiment_list import ExperimentListDumper
@@ -1,8 +1,12 @@
 from __future__ import absolute_import, division, print_function
 
+import functools
+
 import iotbx.phil
 from dials.util.options import OptionParser, flatten_experiments
 from dials.util import Sorry
+from dials.util import frame_cache
+from dials.util.image_iterator import iterate_imageset
 from scitbx.array_family import flex
 
 help_message = """
@@ -28,6 +32,9 @@
     .type = int
     .help = "For multi-file images (NeXus for example), report a gain for each"
             "image, up to max_images, and then report an average gain"
+  nproc = 1
+    .type = int(value_min=1)
+    .help = "The number of processes used to analyse the images"
   output {
     gain_map = None
       .type = str
@@ -38,74 +45,89 @@
 )
 
 
-def estimate_gain(imageset, kernel_size=(10, 10), output_gain_map=None, max_images=1):
-    detector = imageset.get_detector()
+def _read_image_and_mask(imageset, index):
+    return frame_cache.get_raw_data(imageset, index), imageset.get_mask(index)
 
-    from dials.algorithms.image.threshold import DispersionThresholdDebug
 
-    gains = flex.double()
+def _dispersion_quartiles(index, data, kernel_size=(10, 10)):
+    """Return the quartiles of the index of dispersion of the pixels of an
+    image, and the median of the inliers as the estimated gain, or None if
+    the gain could not be estimated"""
 
-    for image_no in xrange(len(imageset)):
-        raw_data = imageset.get_raw_data(image_no)
-
-        gain_value = 1
-        gain_map = [
-            flex.double(raw_data[i].accessor(), gain_value)
-            for i in range(len(detector))
-        ]
-
-        mask = imageset.get_mask(image_no)
-
-        min_local = 0
-
-        # dummy values, shouldn't affect results
-        nsigma_b = 6
-        nsigma_s = 3
-        global_threshold = 0
-
-        kabsch_debug_list = []
-        for i_panel in range(len(detector)):
-            kabsch_debug_list.append(
-                DispersionThresholdDebug(
-                    raw_data[i_panel].as_double(),
-                    mask[i_panel],
-                    gain_map[i_panel],
-                    kernel_size,
-                    nsigma_b,
-                    nsigma_s,
-                    global_threshold,
-                    min_local,
-                )
+    from dials.algorithms.image.threshold import DispersionThresholdDebug
+    from libtbx.math_utils import nearest_integer as nint
+
+    raw_data, mask = data
+
+    gain_value = 1
+    gain_map = [
+        flex.double(raw_data[i].accessor(), gain_value) for i in range(len(raw_data))
+    ]
+
+    min_local = 0
+
+    # dummy values, shouldn't affect results
+    nsigma_b = 6
+    nsigma_s = 3
+    global_threshold = 0
+
+    kabsch_debug_list = []
+    for i_panel in range(len(raw_data)):
+        kabsch_debug_list.append(
+            DispersionThresholdDebug(
+                raw_data[i_panel].as_double(),
+                mask[i_panel],
+                gain_map[i_panel],
+                kernel_size,
+                nsigma_b,
+                nsigma_s,
+                global_threshold,
+                min_local,
             )
+        )
+
+    dispersion = flex.double()
+    for kabsch in kabsch_debug_list:
+        dispersion.extend(kabsch.index_of_dispersion().as_1d())
+
+    sorted_dispersion = flex.sorted(dispersion)
+
+    q1 = sorted_dispersion[nint(len(sorted_dispersion) / 4)]
+    q2 = sorted_dispersion[nint(len(sorted_dispersion) / 2)]
+    q3 = sorted_dispersion[nint(len(sorted_dispersion) * 3 / 4)]
+    iqr = q3 - q1
+    if iqr == 0.0:
+        return q1, q2, q3, None
 
-        dispersion = flex.double()
-        for kabsch in kabsch_debug_list:
-            dispersion.extend(kabsch.index_of_dispersion().as_1d())
+    inlier_sel = (sorted_dispersion > (q1 - 1.5 * iqr)) & (
+        sorted_dispersion < (q3 + 1.5 * iqr)
+    )
+    sorted_dispersion = sorted_dispersion.select(inlier_sel)
+    gain = sorted_dispersion[nint(len(sorted_dispersion) / 2)]
+    return q1, q2, q3, gain
 
-        sorted_dispersion = flex.sorted(dispersion)
-        from libtbx.math_utils import nearest_integer as nint
 
-        q1 = sorted_dispersion[nint(len(sorted_dispersion) / 4)]
-        q2 = sorted_dispersion[nint(len(sorted_dispersion) / 2)]
-        q3 = sorted_dispersion[nint(len(sorted_dispersion) * 3 / 4)]
-        iqr = q3 - q1
+def estimate_gain(
+    imageset, kernel_size=(10, 10), output_gain_map=None, max_images=1, nproc=1
+):
+    gains = flex.double()
 
+    # read the images ahead and compute the dispersion in worker processes
+    for image_no, (q1, q2, q3, gain) in iterate_imageset(
+        imageset,
+        functools.partial(_dispersion_quartiles, kernel_size=kernel_size),
+        indices=range(min(len(imageset), max(max_images, 1))),
+        read=_read_image_and_mask,
+        nproc=nproc,
+    ):
         print("q1, q2, q3: %.2f, %.2f, %.2f" % (q1, q2, q3))
-        if iqr == 0.0:
+        if gain is None:
             raise Sorry("Unable to robustly estimate the variation of pixel values.")
-
-        inlier_sel = (sorted_dispersion > (q1 - 1.5 * iqr)) & (
-            sorted_dispersion < (q3 + 1.5 * iqr)
-        )
-        sorted_dispersion = sorted_dispersion.select(inlier_sel)
-        gain = sorted_dispersion[nint(len(sorted_dispersion) / 2)]
         print("Estimated gain: %.2f" % gain)
         gains.append(gain)
 
         if image_no == 0:
             gain0 = gain
-        if image_no + 1 >= max_images:
-            break
 
     if len(gains) > 1:
         stats = flex.mean_and_variance(gains)
@@ -115,8 +137,7 @@ def estimate_gain(imageset, kernel_size=(10, 10), output_gain_map=None, max_imag
         )
 
     if output_gain_map:
-        if len(gains) > 1:
-            raw_data = imageset.get_raw_data(0)
+        raw_data = imageset.get_raw_data(0)
         # write the gain map
         import six.moves.cPickle as pickle
 
@@ -124,18 +145,6 @@ def estimate_gain(imageset, kernel_size=(10, 10), output_gain_map=None, max_imag
         with open(output_gain_map, "wb") as fh:
             pickle.dump(gain_map, fh, protocol=pickle.HIGHEST_PROTOCOL)
 
-    if 0:
-        sel = flex.random_selection(
-            population_size=len(sorted_dispersion), sample_size=10000
-        )
-        sorted_dispersion = sorted_dispersion.select(sel)
-
-        from matplotlib import pyplot
-
-        pyplot.scatter(range(len(sorted_dispersion)), sorted_dispersion)
-        pyplot.ylim(0, 10)
-        pyplot.show()
-
     return gain0
 
 
@@ -178,7 +187,11 @@ def run(args):
     assert len(imagesets) == 1
     imageset = imagesets[0]
     estimate_gain(
-        imageset, params.kernel_size, params.output.gain_map, params.max_images
+        imageset,
+        params.kernel_size,
+        params.output.gain_map,
+        params.max_images,
+        nproc=params.nproc,
     )
 
     return
@@ -135,6 +135,15 @@
     crystal_name = XTAL
       .type = str
       .help = "The name of the crystal, for the mtz file metadata"
+
+    streaming = False
+      .type = bool
+      .help = "Filter and convert the reflections one experiment at a time,
+        keeping only the compact output columns for each experiment. This
+        reduces the peak memory needed to export large multi-sweep datasets,
+        with the same output as the default. Note that every experiment must
+        have reflections remaining after filtering."
+      .expert_level = 2
   }
 
   sadabs {
@@ -8,6 +8,8 @@
 from dials.util.options import OptionParser
 import libtbx.load_env
 from dials.util import Sorry
+from dials.util import frame_cache
+from dials.util.image_iterator import iterate_imageset
 
 help_message = """
 
@@ -83,6 +85,10 @@
     .type = int(value_min=1, value_max=95)
     .help = "The image quality, on a scale from 1 (worst) to 95 (best)"
 }
+nproc = 1
+  .type = int(value_min=1)
+  .help = "The number of processes used to render the images. The images are"
+          "read ahead in separate threads."
 
 """,
     process_includes=True,
@@ -117,13 +123,6 @@ def run(args):
 
 
 def imageset_as_bitmaps(imageset, params):
-    from rstbx.slip_viewer.tile_generation import (
-        _get_flex_image,
-        _get_flex_image_multipanel,
-    )
-
-    brightness = params.brightness / 100
-    vendortype = "made up"
     # check that binning is a power of 2
     binning = params.binning
     if not (binning > 0 and ((binning & (binning - 1)) == 0)):
@@ -155,21 +154,43 @@ def imageset_as_bitmaps(imageset, params):
     ]
     if params.output_file and len(image_range) != 1:
         sys.exit("output_file can only be specified if a single image is exported")
-    for i_image in image_range:
-        image = imageset.get_raw_data(i_image - start)
 
-        trange = [p.get_trusted_range() for p in detector]
-        mask = imageset.get_mask(i_image - start)
-        if mask is None:
-            mask = [p.get_trusted_range_mask(im) for im, p in zip(image, detector)]
+    # read the images ahead in threads and render them in worker processes
+    render = _BitmapRenderer(
+        params, detector, imageset.get_beam(), saturation, output_dir, start
+    )
+    for i, path in iterate_imageset(
+        imageset,
+        render,
+        indices=[i_image - start for i_image in image_range],
+        read=_read_image_and_mask,
+        nproc=params.nproc,
+    ):
+        print("Exporting %s" % path)
+        output_files.append(path)
+
+    return output_files
+
+
+def _read_image_and_mask(imageset, index):
+    return frame_cache.get_raw_data(imageset, index), imageset.get_mask(index)
 
-        if params.show_mask:
-            for rd, m in zip(image, mask):
-                rd.set_selected(~m, -2)
 
-        image = image_filter(
-            image,
-            mask,
+class _BitmapRenderer(object):
+    """Filter, render and write a single image as a bitmap. This holds only
+    simple values and models, so can be sent to worker processes."""
+
+    def __init__(self, params, detector, beam, saturation, output_dir, start):
+        self.detector = detector
+        self.beam = beam
+        self.saturation = saturation
+        self.output_dir = output_dir
+        self.start = start
+        self.brightness = params.brightness / 100
+        self.binning = params.binning
+        self.colour_scheme = params.colour_scheme
+        self.show_mask = params.show_mask
+        self.filter_kwargs = dict(
             display=params.display,
             gain_value=params.gain,
             nsigma_b=params.nsigma_b,
@@ -178,31 +199,55 @@ def imageset_as_bitmaps(imageset, params):
             min_local=params.min_local,
             kernel_size=params.kernel_size,
         )
+        self.output_file = params.output_file
+        self.prefix = params.prefix
+        self.padding = params.padding
+        self.format = params.format
+        self.compress_level = params.png.compress_level
+        self.quality = params.jpeg.quality
+
+    def __call__(self, index, data):
+        from rstbx.slip_viewer.tile_generation import (
+            _get_flex_image,
+            _get_flex_image_multipanel,
+        )
 
-        show_untrusted = params.show_mask
+        detector = self.detector
+        i_image = index + self.start
+        image, mask = data
+        if mask is None:
+            mask = [p.get_trusted_range_mask(im) for im, p in zip(image, detector)]
+
+        if self.show_mask:
+            for rd, m in zip(image, mask):
+                rd.set_selected(~m, -2)
+
+        image = image_filter(image, mask, **self.filter_kwargs)
+
+        show_untrusted = self.show_mask
         if len(detector) > 1:
             # FIXME This doesn't work properly, as flex_image.size2() is incorrect
             # also binning doesn't work
             flex_image = _get_flex_image_multipanel(
-                brightness=brightness,
+                brightness=self.brightness,
                 panels=detector,
                 raw_data=image,
-                binning=binning,
-                beam=imageset.get_beam(),
+                binning=self.binning,
+                beam=self.beam,
                 show_untrusted=show_untrusted,
             )
         else:
             flex_image = _get_flex_image(
-                brightness=brightness,
+                brightness=self.brightness,
                 data=image[0],
-                binning=binning,
-                saturation=saturation,
-                vendortype=vendortype,
+                binning=self.binning,
+                saturation=self.saturation,
+                vendortype="made up",
                 show_untrusted=show_untrusted,
             )
 
         flex_image.setWindow(0, 0, 1)
-        flex_image.adjust(color_scheme=colour_schemes.get(params.colour_scheme))
+        flex_image.adjust(color_scheme=colour_schemes.get(self.colour_scheme))
 
         # now export as a bitmap
         flex_image.prep_string()
@@ -223,27 +268,24 @@ def imageset_as_bitmaps(imageset, params):
                 (flex_image.ex_size2(), flex_image.ex_size1()),
                 flex_image.export_string,
             )
-        if params.output_file:
-            path = os.path.join(output_dir, params.output_file)
+        if self.output_file:
+            path = os.path.join(self.output_dir, self.output_file)
         else:
             path = os.path.join(
-                output_dir,
+                self.output_dir,
                 "{p.prefix}{image:0{p.padding}}.{p.format}".format(
-                    p=params, image=i_image
+                    p=self, image=i_image
                 ),
             )
 
-        print("Exporting %s" % path)
-        output_files.append(path)
         with open(path, "wb") as tmp_stream:
             pil_img.save(
                 tmp_stream,
-                format=params.format,
-                compress_level=params.png.compress_level,
-                quality=params.jpeg.quality,
+                format=self.format,
+                compress_level=self.compress_level,
+                quality=self.quality,
             )
-
-    return output_files
+        return path
 
 
 def image_filter(
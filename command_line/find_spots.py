@@ -14,6 +14,7 @@
 from __future__ import absolute_import, division, print_function
 
 import logging
+import os
 
 logger = logging.getLogger("dials.command_line.find_spots")
 
@@ -78,6 +79,18 @@
     .type = bool
     .help = "Whether or not to print a table of per-image statistics."
 
+  incremental {
+    state = None
+      .type = path
+      .help = "Do spot finding incrementally on an imageset that grows between"
+              "invocations, for example during live data collection. The spots"
+              "completed and per-image statistics of the images already"
+              "processed are appended to this file, and the strong pixels of"
+              "the spots still open on the last image are kept next to it, so"
+              "that only newly arrived images are read and thresholded on each"
+              "invocation."
+  }
+
   verbosity = 1
     .type = int(value_min=0)
     .help = "The verbosity level"
@@ -89,6 +102,34 @@
 )
 
 
+def incremental_state_key(params):
+    """
+    A string identifying the parameters which affect the strong pixels found
+    on each image, for incremental spot finding: all the spotfinder
+    parameters other than those of the multiprocessing and the pixel cache,
+    with the contents of the mask file.
+
+    """
+    import hashlib
+
+    working_phil = phil_scope.format(python_object=params)
+    lines = []
+    for definition in working_phil.all_definitions():
+        if not definition.path.startswith("spotfinder.") or definition.path.startswith(
+            ("spotfinder.mp.", "spotfinder.cache.")
+        ):
+            continue
+        lines.append(
+            "%s = %s"
+            % (definition.path, " ".join(w.value for w in definition.object.words))
+        )
+    mask = params.spotfinder.lookup.mask
+    if isinstance(mask, str) and os.path.isfile(mask):
+        with open(mask, "rb") as infile:
+            lines.append("mask = %s" % hashlib.sha1(infile.read()).hexdigest())
+    return "\n".join(lines)
+
+
 class Script(object):
     """A class for running the script."""
 
@@ -149,7 +190,20 @@ def run(self, args=None):
             return
 
         # Loop through all the imagesets and find the strong spots
-        reflections = flex.reflection_table.from_observations(experiments, params)
+        incremental_stats = None
+        if params.incremental.state is not None:
+            from dials.algorithms.spot_finding.incremental import IncrementalSpotFinder
+
+            find_spots = IncrementalSpotFinder.from_parameters(
+                params,
+                experiments,
+                params.incremental.state,
+                incremental_state_key(params),
+            )
+            reflections = find_spots(experiments)
+            incremental_stats = find_spots.stats
+        else:
+            reflections = flex.reflection_table.from_observations(experiments, params)
 
         # Add n_signal column - before deleting shoeboxes
         from dials.algorithms.shoebox import MaskCode
@@ -196,11 +250,15 @@ def run(self, args=None):
             for i, experiment in enumerate(experiments):
                 print("Number of centroids per image for imageset %i:" % i, file=s)
                 imageset = experiment.imageset
-                stats = per_image_analysis.stats_imageset(
-                    imageset,
-                    reflections.select(reflections["id"] == i),
-                    resolution_analysis=False,
-                )
+                if incremental_stats is not None:
+                    stats = incremental_stats
+                else:
+                    stats = per_image_analysis.stats_imageset(
+                        imageset,
+                        reflections.select(reflections["id"] == i),
+                        resolution_analysis=False,
+                        nproc=params.spotfinder.mp.nproc,
+                    )
                 per_image_analysis.print_table(stats, out=s)
             logger.info(s.getvalue())
 
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+#
+# find_spots_stream.py
+#
+#  Copyright (C) 2019 Diamond Light Source
+#
+#  This code is distributed under the BSD license, a copy of which is
+#  included in the root directory of this package.
+from __future__ import absolute_import, division, print_function
+
+import json
+import logging
+
+from dials.util import Sorry
+
+logger = logging.getLogger("dials.command_line.find_spots_stream")
+
+help_message = """
+
+This program does spot finding and per-image analysis on images received from
+an EIGER zmq stream. The images are processed in memory by a pool of worker
+processes without being written to disk, and the per-frame results are
+published as JSON on an output zmq socket as they become available. At the end
+of the series the results and the throughput and latency metrics are written
+to file.
+
+Examples::
+
+  dials.find_spots_stream input.host=eiger-dcu nproc=8
+
+  dials.find_spots_stream input.host=eiger-dcu output.port=9998
+
+"""
+
+# Create the phil parameters
+from libtbx.phil import parse
+
+phil_scope = parse(
+    """
+
+  output {
+
+    port = None
+      .type = int
+      .help = "The port on which to publish the per-frame results"
+
+    results = 'stream_spots.json'
+      .type = str
+      .help = "The file to write the per-frame results and metrics to"
+
+    log = 'dials.find_spots_stream.log'
+      .type = str
+      .help = "The log filename"
+
+    debug_log = 'dials.find_spots_stream.debug.log'
+      .type = str
+      .help = "The debug log filename"
+
+    directory = auto
+      .type = str
+      .help = "The directory in which the stream header is written"
+
+  }
+
+  verbosity = 1
+    .type = int(value_min=0)
+    .help = "The verbosity level"
+
+  input {
+
+    host = localhost
+      .type = str
+      .help = "The input host"
+
+    port = 9999
+      .type = int
+      .help = "The input port"
+
+  }
+
+  nproc = 1
+    .type = int(value_min=1)
+    .help = "The number of worker processes"
+
+  timeout = 10
+    .type = float(value_min=0)
+    .help = "The time to wait for outstanding frames after the end of series"
+
+  include scope dials.algorithms.spot_finding.factory.phil_scope
+
+""",
+    process_includes=True,
+)
+
+
+class Script(object):
+    """ Class to parse the command line options. """
+
+    def __init__(self):
+        """ Set the expected options. """
+        from dials.util.options import OptionParser
+        import libtbx.load_env
+
+        # Create the option parser
+        usage = "usage: %s [options]" % libtbx.env.dispatcher_name
+        self.parser = OptionParser(
+            usage=usage, sort_options=True, phil=phil_scope, epilog=help_message
+        )
+
+    def run(self):
+        """ Parse the options. """
+        from dials.util import log
+        from dials.util.stream import ZMQStream
+        from dials.algorithms.spot_finding.stream_processor import StreamSpotFinder
+        import libtbx
+        from uuid import uuid4
+        import os
+
+        # Parse the command line arguments in two passes to set up logging early
+        params, options = self.parser.parse_args(show_diff_phil=False, quick_parse=True)
+
+        # Configure logging
+        log.config(
+            params.verbosity, info=params.output.log, debug=params.output.debug_log
+        )
+        from dials.util.version import dials_version
+
+        logger.info(dials_version())
+
+        # Parse the command line arguments completely
+        params, options = self.parser.parse_args(show_diff_phil=False)
+
+        # Log the diff phil
+        diff_phil = self.parser.diff_phil.as_str()
+        if diff_phil != "":
+            logger.info("The following parameters have been modified:\n")
+            logger.info(diff_phil)
+
+        # Check a stream is given
+        if params.input.host is None:
+            raise Sorry("An input host needs to be given")
+
+        # The directory for the stream header
+        if params.output.directory is None:
+            raise Sorry("An output directory needs to be given")
+        elif params.output.directory is libtbx.Auto:
+            params.output.directory = "/dev/shm/dials-%s" % uuid4()
+        if not os.path.exists(params.output.directory):
+            os.mkdir(params.output.directory)
+
+        # Process the stream
+        output_url = None
+        if params.output.port is not None:
+            output_url = "tcp://*:%d" % params.output.port
+        spot_finder = StreamSpotFinder(
+            ProcessorFactory(params, params.output.directory),
+            nproc=params.nproc,
+            output_url=output_url,
+            timeout=params.timeout,
+        )
+        stream = ZMQStream(params.input.host, params.input.port)
+        try:
+            results = spot_finder.run(stream)
+        finally:
+            stream.close()
+
+        # Write the results
+        if params.output.results:
+            logger.info("Writing results to %s" % params.output.results)
+            with open(params.output.results, "w") as outfile:
+                json.dump(
+                    {"results": results, "metrics": spot_finder.metrics},
+                    outfile,
+                    indent=2,
+                )
+
+
+class ProcessorFactory(object):
+    """
+    Create the frame processor from the stream header
+    """
+
+    def __init__(self, params, directory):
+        self.params = params
+        self.directory = directory
+
+    def __call__(self, header):
+        from dials.algorithms.spot_finding.stream_processor import FrameProcessor
+        from os.path import join
+
+        filename = join(self.directory, "metadata.json")
+        with open(filename, "w") as outfile:
+            json.dump(header.header, outfile)
+        imageset = header.as_imageset(filename)
+        return FrameProcessor.from_parameters(self.params, imageset)
+
+
+if __name__ == "__main__":
+    from dials.util import halraiser
+
+    try:
+        script = Script()
+        script.run()
+    except Exception as e:
+        halraiser(e)
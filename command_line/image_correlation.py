@@ -4,6 +4,7 @@
 
 import iotbx.phil
 from dials.array_family import flex
+from dials.util.image_iterator import iterate_imageset
 
 help_message = """
 
@@ -18,6 +19,9 @@
   image=None
     .type = ints
     .help = "image numbers to analyse"
+  nproc = 1
+    .type = int(value_min=1)
+    .help = "The number of processes used to find the signal in the images"
 """,
     process_includes=True,
 )
@@ -45,13 +49,22 @@ def extract_signal_mask(data):
     return signal
 
 
+def _image_and_signal_mask(index, data):
+    image = data[0]
+    return image.as_1d().as_double(), extract_signal_mask(image).as_1d()
+
+
 def image_correlation(a, b):
 
     sig_a = extract_signal_mask(a)
     sig_b = extract_signal_mask(b)
 
-    a = a.as_1d().as_double()
-    b = b.as_1d().as_double()
+    return _correlation(
+        a.as_1d().as_double(), sig_a.as_1d(), b.as_1d().as_double(), sig_b.as_1d()
+    )
+
+
+def _correlation(a, sig_a, b, sig_b):
     sel = (a > 0) & (b > 0) & sig_a & sig_b
     _a = a.select(sel)
     _b = b.select(sel)
@@ -92,11 +105,15 @@ def run(args):
 
     images = params.image
 
+    # stream the images after each image, finding the signal pixels in worker
+    # processes, so that only a few images are held in memory at once
     for j, img_a in enumerate(images[:-1]):
-        for img_b in images[j + 1 :]:
-            a = imageset.get_raw_data(img_a)[0]
-            b = imageset.get_raw_data(img_b)[0]
-            n, cc = image_correlation(a, b)
+        signal = iterate_imageset(
+            imageset, _image_and_signal_mask, indices=images[j:], nproc=params.nproc
+        )
+        _, signal_a = next(signal)
+        for img_b, signal_b in signal:
+            n, cc = _correlation(*(signal_a + signal_b))
             print("%5d %5d %7d %.4f" % (img_a, img_b, n, cc))
 
 
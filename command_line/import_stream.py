@@ -164,7 +164,7 @@ def run(self):
                     params.output.directory, params.output.image_template % obj.count
                 )
                 with open(filename, "wb") as outfile:
-                    outfile.write(obj.data)
+                    outfile.write(obj.buffer)
                 filename = join(
                     params.output.directory,
                     "%s.info" % (params.output.image_template % obj.count),
@@ -393,6 +393,18 @@ def run(self):
 
             pickle.dump(static_model, outfile, protocol=pickle.HIGHEST_PROTOCOL)
 
+        # Save a copy which integration processes can memory map
+        from dials.algorithms.background.gmodel.algorithm import (
+            content_hash,
+            write_mapped_model,
+        )
+
+        write_mapped_model(
+            static_model,
+            params.output.model + ".mapped",
+            content_hash(params.output.model),
+        )
+
         # Output some diagnostic images
         image_generator = ImageGenerator(model)
         image_generator.save_mean(params.output.mean_image_prefix)
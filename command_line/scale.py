@@ -48,7 +48,6 @@
 from libtbx import phil
 from dials.util import Sorry
 from cctbx import crystal
-import iotbx.merging_statistics
 from dials.util import log, show_mail_on_error
 from dials.array_family import flex
 from dials.util.options import OptionParser, flatten_reflections, flatten_experiments
@@ -78,6 +77,7 @@
     scaling_algorithm,
 )
 from dials.util.observer import Subject
+from dials.report import merging_statistics
 from dials.algorithms.scaling.observers import (
     register_default_scaling_observers,
     register_merging_stats_observers,
@@ -381,11 +381,10 @@ def merging_stats_from_scaled_array(scaled_miller_array, params):
                 "Dataset contains no equivalent reflections, merging statistics cannot be calculated."
             )
         try:
-            result = iotbx.merging_statistics.dataset_statistics(
+            result = merging_statistics.dataset_statistics(
                 i_obs=scaled_miller_array,
                 n_bins=params.output.merging.nbins,
                 anomalous=False,
-                sigma_filtering=None,
                 eliminate_sys_absent=False,
                 use_internal_variance=params.output.use_internal_variance,
                 cc_one_half_significance_level=0.01,
@@ -395,11 +394,10 @@ def merging_stats_from_scaled_array(scaled_miller_array, params):
             intensities_anom = intensities_anom.map_to_asu().customized_copy(
                 info=scaled_miller_array.info()
             )
-            anom_result = iotbx.merging_statistics.dataset_statistics(
+            anom_result = merging_statistics.dataset_statistics(
                 i_obs=intensities_anom,
                 n_bins=params.output.merging.nbins,
                 anomalous=True,
-                sigma_filtering=None,
                 cc_one_half_significance_level=0.01,
                 eliminate_sys_absent=False,
                 use_internal_variance=params.output.use_internal_variance,
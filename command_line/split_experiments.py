@@ -2,6 +2,7 @@
 from __future__ import absolute_import, division, print_function
 
 from libtbx.phil import parse
+from dials.array_family import flex
 from dials.util import Sorry
 
 help_message = """
@@ -17,6 +18,17 @@
 """
 
 
+def _reflections_with_id(reflections, views, id_):
+    """
+    Copy the reflections with an id into a table of their own, from the views
+    of the reflections of each experiment, which are each used once.
+    """
+    view = views.pop(id_, None)
+    if view is None:
+        return reflections.select(flex.size_t())
+    return view.table()
+
+
 class Script(object):
     def __init__(self):
         """Initialise the script."""
@@ -105,6 +117,12 @@ def run(self):
         experiments = flatten_experiments(params.input.experiments)
         if params.input.reflections:
             reflections = flatten_reflections(params.input.reflections)[0]
+            # Split the reflections by experiment with one sort, rather than
+            # selecting from all of them for each experiment
+            views = reflections.split_views_by_experiment_id()
+            ids_by_identifier = {}
+            for k, v in reflections.experiment_identifiers():
+                ids_by_identifier.setdefault(v, k)
         else:
             reflections = None
 
@@ -161,16 +179,12 @@ def run(self):
                     if reflections.experiment_identifiers().keys():
                         # first find which id value corresponds to experiment in question
                         identifier = experiment.identifier
-                        id_ = None
-                        for k in reflections.experiment_identifiers().keys():
-                            if reflections.experiment_identifiers()[k] == identifier:
-                                id_ = k
-                                break
+                        id_ = ids_by_identifier.get(identifier)
                         if id_ is None:
                             raise Sorry(
                                 "Unable to find id matching experiment identifier in reflection table."
                             )
-                        ref_sel = reflections.select(reflections["id"] == id_)
+                        ref_sel = _reflections_with_id(reflections, views, id_)
                         # now reset ids and reset/update identifiers map
                         for k in ref_sel.experiment_identifiers().keys():
                             del ref_sel.experiment_identifiers()[k]
@@ -178,7 +192,7 @@ def run(self):
                         ref_sel["id"] = flex.int(len(ref_sel), new_id)
                         ref_sel.experiment_identifiers()[new_id] = identifier
                     else:
-                        ref_sel = reflections.select(reflections["id"] == i)
+                        ref_sel = _reflections_with_id(reflections, views, i)
                         ref_sel["id"] = flex.int(
                             len(ref_sel),
                             len(split_data[experiment.detector]["experiments"]) - 1,
@@ -227,16 +241,12 @@ def save_chunk(chunk_id, expts, refls):
                     if reflections.experiment_identifiers().keys():
                         # first find which id value corresponds to experiment in question
                         identifier = experiment.identifier
-                        id_ = None
-                        for k in reflections.experiment_identifiers().keys():
-                            if reflections.experiment_identifiers()[k] == identifier:
-                                id_ = k
-                                break
+                        id_ = ids_by_identifier.get(identifier)
                         if id_ is None:
                             raise Sorry(
                                 "Unable to find id matching experiment identifier in reflection table."
                             )
-                        ref_sel = reflections.select(reflections["id"] == id_)
+                        ref_sel = _reflections_with_id(reflections, views, id_)
                         # now reset ids and reset/update identifiers map
                         for k in ref_sel.experiment_identifiers().keys():
                             del ref_sel.experiment_identifiers()[k]
@@ -244,7 +254,7 @@ def save_chunk(chunk_id, expts, refls):
                         ref_sel["id"] = flex.int(len(ref_sel), new_id)
                         ref_sel.experiment_identifiers()[new_id] = identifier
                     else:
-                        ref_sel = reflections.select(reflections["id"] == i)
+                        ref_sel = _reflections_with_id(reflections, views, i)
                         ref_sel["id"] = flex.int(len(ref_sel), len(chunk_expts) - 1)
                     chunk_refls.extend(ref_sel)
                 if params.output.chunk_sizes:
@@ -276,7 +286,7 @@ def save_chunk(chunk_id, expts, refls):
                         "Saving reflections for experiment %d to %s"
                         % (i, reflections_filename)
                     )
-                    ref_sel = reflections.select(reflections["id"] == i)
+                    ref_sel = _reflections_with_id(reflections, views, i)
                     if ref_sel.experiment_identifiers().keys():
                         identifier = ref_sel.experiment_identifiers()[i]
                         for k in ref_sel.experiment_identifiers().keys():
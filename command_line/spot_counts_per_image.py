@@ -44,6 +44,9 @@
   .type = bool
 id = None
   .type = int(value_min=0)
+nproc = 1
+  .type = int(value_min=1)
+  .help = "The number of processes to analyse the images with"
 """
 )
 
@@ -90,6 +93,7 @@ def run(args):
             refl,
             resolution_analysis=params.resolution_analysis,
             plot=params.individual_plots,
+            nproc=params.nproc,
         )
         all_stats.append(stats)
 
@@ -0,0 +1,668 @@
+"""
+Merging statistics in resolution bins, calculated in a single pass.
+
+The statistics reported by iotbx.merging_statistics.dataset_statistics are
+calculated here with vectorised array operations: the observations are sorted
+once, by resolution bin, asymmetric unit index, Friedel mate and a random key,
+after which every quantity is a sum over runs of equal keys, and every
+resolution bin is a sum over the runs it contains. The results are held in
+objects with the attributes of the iotbx merging_stats and dataset_statistics
+objects, so they may be used by anything that reads those.
+
+Results are cached, keyed on the content of the intensity array and the
+options used, so the statistics of the same data are calculated only once by
+dials.scale, dials.report and the resolutionizer.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import collections
+import hashlib
+import math
+import sys
+import threading
+
+import numpy as np
+
+from cctbx import miller
+from libtbx.str_utils import format_value
+
+from dials.util import Sorry
+
+# Observations with a sigma smaller than this fraction of the largest sigma of
+# their symmetry equivalents are not used for the merged intensity, as in
+# cctbx merge_equivalents_obs
+SIGMA_DYNAMIC_RANGE = 1e-6
+
+# The relative tolerance of d_min for the complete set, as in cctbx: the
+# complete set is generated to a tolerance of D_MIN_TOLERANCE, then cut at the
+# d_min of the data to within the machine precision
+D_MIN_TOLERANCE = 1e-6
+D_MIN_EPS = sys.float_info.epsilon
+
+# The number of sets of merging statistics to keep in the cache
+CACHE_SIZE = 8
+
+_cache = collections.OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class StatisticsError(RuntimeError):
+    """Raised if merging statistics cannot be calculated for the data."""
+
+    pass
+
+
+def _hkl_as_numpy(indices):
+    return (
+        indices.as_vec3_double().as_double().as_numpy_array().reshape(-1, 3)
+    ).astype(np.int64)
+
+
+class _Runs(object):
+    """The runs of equal keys in sorted arrays."""
+
+    def __init__(self, *keys):
+        n = len(keys[0])
+        new = np.zeros(n, dtype=bool)
+        new[:1] = True
+        for key in keys:
+            new[1:] |= key[1:] != key[:-1]
+        self.starts = np.flatnonzero(new)
+        self.sizes = np.diff(np.append(self.starts, n))
+        # the run of each element, and the position of each element in its run
+        self.index = np.cumsum(new) - 1
+        self.rank = np.arange(n) - self.starts[self.index]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def sum(self, values):
+        return np.add.reduceat(values, self.starts)
+
+    def first(self, values):
+        return values[self.starts]
+
+    def half_dataset_means(self, data, weights, random_state):
+        """The mean of each run split at random into two halves, as in cctbx
+        split_unmerged. Runs with one element have undefined means."""
+        # the elements are in random order within each run, as the random key
+        # is the last sort key, so the first half of each run is a random half
+        odd = (self.sizes % 2 == 1) & (random_state.random_sample(len(self)) < 0.5)
+        first = self.rank < (self.sizes // 2 + odd)[self.index]
+        wd = weights * data
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean_1 = self.sum(np.where(first, wd, 0)) / self.sum(
+                np.where(first, weights, 0)
+            )
+            mean_2 = self.sum(np.where(first, 0, wd)) / self.sum(
+                np.where(first, 0, weights)
+            )
+        return mean_1, mean_2
+
+
+class _Binned(object):
+    """Sums over labelled elements, for a number of labels."""
+
+    def __init__(self, labels, n_labels):
+        self.labels = labels
+        self.n_labels = n_labels
+
+    def count(self, selection=None):
+        labels = self.labels if selection is None else self.labels[selection]
+        return np.bincount(labels, minlength=self.n_labels)
+
+    def sum(self, values, selection=None):
+        labels = self.labels
+        if selection is not None:
+            labels, values = labels[selection], values[selection]
+        # an empty selection would otherwise give integer sums
+        return np.bincount(labels, weights=values, minlength=self.n_labels).astype(
+            np.float64
+        )
+
+    def correlation(self, x, y, selection):
+        """The correlation coefficient of the selected x and y in each bin,
+        which is 0 where it is undefined, and the number of pairs."""
+        labels, x, y = self.labels[selection], x[selection], y[selection]
+        n = np.bincount(labels, minlength=self.n_labels)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            dx = x - (np.bincount(labels, x, self.n_labels) / n)[labels]
+            dy = y - (np.bincount(labels, y, self.n_labels) / n)[labels]
+            sxy = np.bincount(labels, dx * dy, self.n_labels)
+            den = np.sqrt(
+                np.bincount(labels, dx * dx, self.n_labels)
+                * np.bincount(labels, dy * dy, self.n_labels)
+            )
+            return np.where(den > 0, sxy / den, 0), n
+
+
+def _cc_significance(r, n, p):
+    if r == -1 or n <= 2:
+        return False, 0
+    from scitbx.math import distributions
+
+    t = distributions.students_t_distribution(n - 2).quantile(1 - p)
+    critical_value = t / math.sqrt(n - 2 + t ** 2)
+    return r > critical_value, critical_value
+
+
+class BinStatistics(object):
+    """
+    Merging statistics for a resolution range, with the attributes of an
+    iotbx.merging_statistics.merging_stats object.
+    """
+
+    def __init__(self, d_max, d_min, cc_one_half_method="half_dataset"):
+        self.d_max = d_max
+        self.d_min = d_min
+        self.cc_one_half_method = cc_one_half_method
+        self.n_obs = 0
+        self.n_uniq = 0
+        self.n_neg_sigmas = 0
+        self.n_zero_sigmas = 0
+        self.n_rejected_before_merge = 0
+        self.n_rejected_after_merge = 0
+        self.observed_criterion_sigma_I = None
+        self.completeness = 0
+        self.anom_completeness = None
+        self.mean_redundancy = 0
+        self.i_mean = 0
+        self.sigi_mean = 0
+        self.i_over_sigma_mean = 0
+        self.i_mean_over_sigi_mean = 0
+        self.unmerged_i_over_sigma_mean = 0
+        self.r_merge = self.r_meas = self.r_pim = None
+        self.r_anom = None
+        self.cc_one_half = 0
+        self.cc_one_half_n_refl = 0
+        self.cc_one_half_significance = None
+        self.cc_one_half_critical_value = None
+        self.cc_one_half_sigma_tau = 0
+        self.cc_one_half_sigma_tau_n_refl = 0
+        self.cc_one_half_sigma_tau_significance = None
+        self.cc_one_half_sigma_tau_critical_value = None
+        self.cc_anom = 0
+        self.cc_anom_n_pairs = 0
+        self.cc_anom_significance = None
+        self.cc_anom_critical_value = None
+        self.cc_star = 0
+
+    @property
+    def anom_half_corr(self):
+        return self.cc_anom
+
+    def _set_cc_star(self):
+        if self.cc_one_half == 0:
+            self.cc_star = 0
+        elif self.cc_one_half < -0.999:
+            self.cc_star = float("-inf")
+        else:
+            mult = -1.0 if self.cc_one_half < 0 else 1.0
+            self.cc_star = mult * math.sqrt(
+                (2 * abs(self.cc_one_half)) / (1 + self.cc_one_half)
+            )
+
+    def _set_significance(self, level):
+        significance, critical_value = _cc_significance(
+            self.cc_one_half, self.cc_one_half_n_refl, level
+        )
+        self.cc_one_half_significance = significance
+        self.cc_one_half_critical_value = critical_value
+        significance, critical_value = _cc_significance(
+            self.cc_anom, self.cc_anom_n_pairs, level
+        )
+        self.cc_anom_significance = significance
+        self.cc_anom_critical_value = critical_value
+        significance, critical_value = _cc_significance(
+            self.cc_one_half_sigma_tau, self.n_uniq, level
+        )
+        self.cc_one_half_sigma_tau_significance = significance
+        self.cc_one_half_sigma_tau_critical_value = critical_value
+
+    def format(self):
+        """Format the statistics as a row of a table."""
+        if self.cc_one_half_method == "sigma_tau":
+            cc_one_half = self.cc_one_half_sigma_tau
+            cc_one_half_significance = self.cc_one_half_sigma_tau_significance
+        else:
+            cc_one_half = self.cc_one_half
+            cc_one_half_significance = self.cc_one_half_significance
+        return (
+            "%6.2f %6.2f %6d %6d   %5.2f %6.2f  %8.1f  %6.1f  %s  %s  %s  % 5.3f%s  % 5.3f%s"
+            % (
+                self.d_max,
+                self.d_min,
+                self.n_obs,
+                self.n_uniq,
+                self.mean_redundancy,
+                self.completeness * 100,
+                self.i_mean,
+                self.i_over_sigma_mean,
+                format_value("% 7.3f", self.r_merge),
+                format_value("% 7.3f", self.r_meas),
+                format_value("% 7.3f", self.r_pim),
+                cc_one_half,
+                "*" if cc_one_half_significance else "",
+                self.cc_anom,
+                "*" if self.cc_anom_significance else "",
+            )
+        )
+
+
+class MergingStatistics(object):
+    """
+    Overall and binned merging statistics for an unmerged intensity array,
+    with the attributes of an iotbx.merging_statistics.dataset_statistics
+    object.
+
+    The statistics are those of iotbx, with the same binning and without
+    sigma filtering (the "scala" convention), except that the observations
+    are split into half datasets for CC1/2 and CC(anom) with a random number
+    generator of their own, so these differ from iotbx by the random error of
+    the split.
+    """
+
+    def __init__(
+        self,
+        i_obs,
+        n_bins=20,
+        anomalous=False,
+        use_internal_variance=True,
+        cc_one_half_significance_level=None,
+        cc_one_half_method="half_dataset",
+        binning_method="volume",
+        eliminate_sys_absent=False,
+        assert_is_not_unique_set_under_symmetry=True,
+        seed=0,
+    ):
+        """
+        Args:
+            i_obs (miller array): the unmerged intensities, with sigmas.
+            n_bins (int): the number of resolution bins.
+            anomalous (bool): keep I(+) and I(-) separate.
+            use_internal_variance (bool): use the larger of the internal and
+                external variances for the merged sigmas.
+            cc_one_half_significance_level (float, optional): if given, test
+                the significance of the correlation coefficients at this
+                level.
+            cc_one_half_method (str): 'half_dataset' or 'sigma_tau', the
+                method of CC1/2 used in formatting and resolution estimates.
+            binning_method (str): 'volume' or 'counting_sorted'.
+            eliminate_sys_absent (bool): remove systematic absences first.
+            assert_is_not_unique_set_under_symmetry (bool): raise a Sorry if
+                the data are already merged.
+            seed (int): the seed for the random split into half datasets.
+
+        Raises:
+            Sorry: if there are no data, or if the data are merged and
+                assert_is_not_unique_set_under_symmetry is True.
+            StatisticsError: if no observations have a positive sigma.
+
+        """
+        assert i_obs.sigmas() is not None
+        assert cc_one_half_method in ("half_dataset", "sigma_tau")
+        assert binning_method in ("volume", "counting_sorted")
+        self.cc_one_half_method = cc_one_half_method
+        self.crystal_symmetry = i_obs.crystal_symmetry()
+        info = i_obs.info()
+        if assert_is_not_unique_set_under_symmetry and (
+            (anomalous and i_obs.as_anomalous_array().is_unique_set_under_symmetry())
+            or i_obs.as_non_anomalous_array().is_unique_set_under_symmetry()
+        ):
+            raise Sorry(
+                "The data in %s are already merged.  Only unmerged (but scaled) "
+                "data may be used in this program."
+                % (info.label_string() if info is not None else "the array")
+            )
+        if i_obs.size() == 0:
+            raise Sorry("No reflections left after applying resolution cutoffs.")
+        if not anomalous:
+            i_obs = i_obs.customized_copy(anomalous_flag=False).set_info(info)
+        if eliminate_sys_absent:
+            i_obs = i_obs.eliminate_sys_absent()
+        if binning_method == "volume":
+            i_obs.setup_binner(n_bins=n_bins)
+        else:
+            i_obs.setup_binner_counting_sorted(n_bins=n_bins, reflections_per_bin=None)
+        binner = i_obs.binner()
+        n_labels = binner.n_bins_all()
+
+        sigmas = i_obs.sigmas().as_numpy_array()
+        bin_indices = binner.bin_indices().as_numpy_array().astype(np.int64)
+        positive = sigmas > 0
+        n_neg_sigmas = np.bincount(bin_indices[sigmas < 0], minlength=n_labels)
+        n_zero_sigmas = np.bincount(bin_indices[sigmas == 0], minlength=n_labels)
+        if not positive.any():
+            raise StatisticsError("No observations with a positive sigma")
+        sel = i_obs.sigmas() > 0
+        i_obs = i_obs.select(sel)
+        # d of the asu indices, as the complete set is (the d of symmetry
+        # equivalents may differ by rounding)
+        asu = i_obs.customized_copy(anomalous_flag=False).map_to_asu()
+        d_max, d_min = asu.d_max_min()
+
+        # Sort once, by bin, asu index, Friedel mate and a random key, so that
+        # the observations of each unique reflection are contiguous and in
+        # random order
+        hkl = _hkl_as_numpy(asu.indices())
+        hkl_anom = _hkl_as_numpy(
+            i_obs.customized_copy(anomalous_flag=True).map_to_asu().indices()
+        )
+        minus = np.any(hkl != hkl_anom, axis=1)
+        hkl -= hkl.min(axis=0)
+        span = hkl.max(axis=0) + 1
+        packed = (hkl[:, 0] * span[1] + hkl[:, 1]) * span[2] + hkl[:, 2]
+        random_state = np.random.RandomState(seed)
+        bin_indices = bin_indices[positive]
+        order = np.lexsort(
+            (random_state.random_sample(len(packed)), minus, packed, bin_indices)
+        )
+        packed, minus, bin_indices = packed[order], minus[order], bin_indices[order]
+        data = i_obs.data().as_numpy_array()[order]
+        d_star_sq = asu.d_star_sq().data().as_numpy_array()[order]
+        sigmas = sigmas[positive][order]
+
+        # The merged intensities of the unique reflections
+        groups = _Runs(packed, minus) if anomalous else _Runs(packed)
+        max_sigma = np.maximum.reduceat(sigmas, groups.starts)
+        used = sigmas > (max_sigma * SIGMA_DYNAMIC_RANGE)[groups.index]
+        weights = np.where(used, 1 / sigmas ** 2, 0)
+        sum_w = groups.sum(weights)
+        merged = groups.sum(weights * data) / sum_w
+        variance = 1 / sum_w
+        deviations = data - merged[groups.index]
+        if use_internal_variance:
+            n_used = groups.sum(used.astype(np.int64))
+            multiple = n_used > 1
+            with np.errstate(invalid="ignore", divide="ignore"):
+                internal = (
+                    sum_w
+                    / (sum_w ** 2 - groups.sum(weights ** 2))
+                    * groups.sum(weights * deviations ** 2)
+                    / n_used
+                )
+            variance[multiple] = np.maximum(internal[multiple], variance[multiple])
+        merged_sigmas = np.sqrt(variance)
+        n = groups.sizes
+        multiple = n > 1
+        sum_data = groups.sum(data)
+        abs_deviations = groups.sum(np.abs(deviations))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            r_meas_terms = np.sqrt(n / (n - 1.0)) * abs_deviations
+            r_pim_terms = np.sqrt(1 / (n - 1.0)) * abs_deviations
+
+        # CC1/2 from half datasets, and by the sigma-tau method, from the means
+        # and variances of unit weighted observations
+        half_1, half_2 = groups.half_dataset_means(data, 1 / sigmas ** 2, random_state)
+        unit_mean = sum_data / n
+        with np.errstate(invalid="ignore", divide="ignore"):
+            unit_variance = np.maximum(
+                groups.sum((data - unit_mean[groups.index]) ** 2) / (n - 1.0) / n,
+                1.0 / n,
+            )
+
+        # CC(anom) from the anomalous differences of unweighted half datasets
+        mates = _Runs(packed, minus)
+        anom_1, anom_2 = mates.half_dataset_means(
+            data, np.ones(len(data)), random_state
+        )
+        mates_packed, mates_minus = mates.first(packed), mates.first(minus)
+        both = (mates_packed[:-1] == mates_packed[1:]) & mates_minus[1:]
+        pairs = np.flatnonzero(both & (mates.sizes[:-1] > 1) & (mates.sizes[1:] > 1))
+        dano_1 = anom_1[pairs] - anom_1[pairs + 1]
+        dano_2 = anom_2[pairs] - anom_2[pairs + 1]
+
+        # Pairs of merged I(+) and I(-), for the anomalous completeness
+        groups_packed, groups_minus = groups.first(packed), groups.first(minus)
+        anomalous_pairs = np.flatnonzero(
+            (groups_packed[:-1] == groups_packed[1:]) & groups_minus[1:]
+        )
+
+        # The complete set, for the completeness, as the sorted d* of all the
+        # reflections and of the acentric reflections
+        complete_set = miller.build_set(
+            crystal_symmetry=i_obs.crystal_symmetry(),
+            anomalous_flag=False,
+            d_min=d_min * (1 - D_MIN_TOLERANCE),
+        )
+        complete_d_star = np.sqrt(complete_set.d_star_sq().data().as_numpy_array())
+        acentric = ~complete_set.centric_flags().data().as_numpy_array()
+        acentric_d_star = np.sort(complete_d_star[acentric])
+        complete_d_star.sort()
+
+        def n_complete(d_star, d_max, d_min):
+            """The number of reflections with d_max >= d >= d_min"""
+            return np.searchsorted(d_star, 1 / d_min, side="right") - np.searchsorted(
+                d_star, 1 / d_max, side="left"
+            )
+
+        # The highest resolution of the data in each bin
+        bins = _Runs(bin_indices)
+        bins_d_min = dict(
+            zip(
+                bins.first(bin_indices),
+                1 / np.sqrt(np.maximum.reduceat(d_star_sq, bins.starts)),
+            )
+        )
+
+        def statistics(obs_labels, n_labels):
+            # the labels of the unique reflections, Friedel mates and pairs
+            group_labels = groups.first(obs_labels)
+            obs = _Binned(obs_labels, n_labels)
+            uniq = _Binned(group_labels, n_labels)
+            pair_labels = mates.first(obs_labels)[pairs]
+            cc_half, cc_half_n = uniq.correlation(half_1, half_2, multiple)
+            mean_y = uniq.sum(unit_mean, multiple)
+            n_y = uniq.count(multiple)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                mean_y /= n_y
+                var_y = uniq.sum((unit_mean - mean_y[group_labels]) ** 2, multiple) / (
+                    n_y - 1
+                )
+                var_e = 2 * uniq.sum(unit_variance, multiple) / n_y
+                cc_sigma_tau = (var_y - 0.5 * var_e) / (var_y + 0.5 * var_e)
+            cc_sigma_tau[n_y <= 1] = 0
+            cc_anom, cc_anom_n = _Binned(pair_labels, n_labels).correlation(
+                dano_1, dano_2, np.ones(len(pairs), dtype=bool)
+            )
+            return dict(
+                n_obs=obs.count(),
+                n_uniq=uniq.count(),
+                n_pairs=_Binned(group_labels[anomalous_pairs], n_labels).count(),
+                sum_redundancy=uniq.sum(n.astype(np.float64)),
+                sum_i=uniq.sum(merged),
+                sum_sigi=uniq.sum(merged_sigmas),
+                sum_i_over_sigma=uniq.sum(merged / merged_sigmas),
+                sum_unmerged_i_over_sigma=obs.sum(data / sigmas),
+                r_num=uniq.sum(abs_deviations, multiple),
+                r_den=uniq.sum(sum_data, multiple),
+                r_meas_num=uniq.sum(r_meas_terms, multiple),
+                r_pim_num=uniq.sum(r_pim_terms, multiple),
+                cc_one_half=cc_half,
+                cc_one_half_n_refl=cc_half_n,
+                cc_one_half_sigma_tau=cc_sigma_tau,
+                cc_one_half_sigma_tau_n_refl=n_y,
+                cc_anom=cc_anom,
+                cc_anom_n_pairs=cc_anom_n,
+            )
+
+        def make_stats(d_range, data_d_min, sums, i, n_neg, n_zero):
+            d_max, d_min = d_range
+            stats = BinStatistics(d_max, d_min, cc_one_half_method=cc_one_half_method)
+            stats.n_neg_sigmas = int(n_neg)
+            stats.n_zero_sigmas = int(n_zero)
+            stats.n_obs = int(sums["n_obs"][i])
+            stats.n_uniq = int(sums["n_uniq"][i])
+            # as in iotbx, relative to the complete set to the d_min of the data
+            n_expected = n_complete(
+                complete_d_star, d_max, max(d_min, data_d_min * (1 - D_MIN_EPS))
+            )
+            if anomalous:
+                n_acentric = n_complete(
+                    acentric_d_star, d_max, d_min * (1 - D_MIN_TOLERANCE)
+                )
+                n_expected += n_complete(
+                    acentric_d_star, d_max, max(d_min, data_d_min * (1 - D_MIN_EPS)),
+                )
+                stats.anom_completeness = (
+                    min(sums["n_pairs"][i] / n_acentric, 1.0) if n_acentric else 0
+                )
+            if n_expected:
+                stats.completeness = min(stats.n_uniq / n_expected, 1.0)
+            stats.cc_anom = float(sums["cc_anom"][i])
+            stats.cc_anom_n_pairs = int(sums["cc_anom_n_pairs"][i])
+            if stats.n_uniq == 0:
+                return stats
+            stats.mean_redundancy = sums["sum_redundancy"][i] / stats.n_uniq
+            stats.i_mean = sums["sum_i"][i] / stats.n_uniq
+            stats.sigi_mean = sums["sum_sigi"][i] / stats.n_uniq
+            stats.i_over_sigma_mean = sums["sum_i_over_sigma"][i] / stats.n_uniq
+            stats.i_mean_over_sigi_mean = stats.i_mean / stats.sigi_mean
+            stats.unmerged_i_over_sigma_mean = (
+                sums["sum_unmerged_i_over_sigma"][i] / stats.n_obs
+            )
+            r_den = sums["r_den"][i]
+            stats.r_merge = sums["r_num"][i] / r_den if r_den else 0
+            stats.r_meas = sums["r_meas_num"][i] / r_den if r_den else 0
+            stats.r_pim = sums["r_pim_num"][i] / r_den if r_den else 0
+            stats.cc_one_half = float(sums["cc_one_half"][i])
+            stats.cc_one_half_n_refl = int(sums["cc_one_half_n_refl"][i])
+            stats.cc_one_half_sigma_tau = float(sums["cc_one_half_sigma_tau"][i])
+            stats.cc_one_half_sigma_tau_n_refl = int(
+                sums["cc_one_half_sigma_tau_n_refl"][i]
+            )
+            if cc_one_half_significance_level is not None:
+                stats._set_significance(cc_one_half_significance_level)
+            stats._set_cc_star()
+            return stats
+
+        overall = statistics(np.zeros(len(data), np.int64), 1)
+        self.overall = make_stats(
+            (d_max, d_min), d_min, overall, 0, n_neg_sigmas.sum(), n_zero_sigmas.sum()
+        )
+        binned = statistics(bin_indices, n_labels)
+        self.bins = [
+            make_stats(
+                binner.bin_d_range(i_bin),
+                bins_d_min.get(i_bin, binner.bin_d_range(i_bin)[1]),
+                binned,
+                i_bin,
+                n_neg_sigmas[i_bin],
+                n_zero_sigmas[i_bin],
+            )
+            for i_bin in binner.range_used()
+        ]
+
+        n_refl = np.array([b.cc_one_half_n_refl for b in self.bins], np.float64)
+        cc = np.array([b.cc_one_half for b in self.bins])
+        self.cc_one_half_overall = (
+            float((cc * n_refl).sum() / n_refl.sum()) if n_refl.sum() else 0
+        )
+        n_refl = np.array(
+            [b.cc_one_half_sigma_tau_n_refl for b in self.bins], np.float64
+        )
+        cc = np.array([b.cc_one_half_sigma_tau for b in self.bins])
+        self.cc_one_half_sigma_tau_overall = (
+            float((cc * n_refl).sum() / n_refl.sum()) if n_refl.sum() else 0
+        )
+
+    def estimate_d_min(
+        self,
+        min_i_over_sigma=0,
+        min_cc_one_half=0,
+        max_r_merge=sys.maxsize,
+        max_r_meas=sys.maxsize,
+        min_cc_anom=-1,
+        min_completeness=0,
+    ):
+        """
+        Determine the d_min of the outermost bin for which all the bins up to
+        and including it meet the criteria, as in iotbx dataset_statistics.
+
+        Returns:
+            float: the d_min, or None if no bins meet the criteria.
+
+        """
+        if min_completeness is not None and min_completeness > 1:
+            min_completeness /= 100.0
+        last_bin = None
+        for b in self.bins:
+            if (
+                (
+                    min_i_over_sigma is not None
+                    and b.i_over_sigma_mean < min_i_over_sigma
+                )
+                or (min_cc_one_half is not None and b.cc_one_half < min_cc_one_half)
+                or (
+                    max_r_merge is not None
+                    and b.r_merge is not None
+                    and b.r_merge > max_r_merge
+                )
+                or (
+                    max_r_meas is not None
+                    and b.r_meas is not None
+                    and b.r_meas > max_r_meas
+                )
+                or (min_cc_anom is not None and b.cc_anom < min_cc_anom)
+                or (min_completeness is not None and b.completeness < min_completeness)
+            ):
+                break
+            last_bin = b
+        return last_bin.d_min if last_bin is not None else None
+
+
+def data_version(i_obs):
+    """A digest of the content of an intensity array, which changes whenever
+    the indices, data, sigmas or symmetry change."""
+    digest = hashlib.sha1()
+    for values in (
+        i_obs.indices().as_vec3_double().as_double(),
+        i_obs.data(),
+        i_obs.sigmas(),
+    ):
+        digest.update(values.as_numpy_array().tobytes())
+    digest.update(
+        repr(
+            (
+                i_obs.unit_cell().parameters(),
+                i_obs.space_group().type().hall_symbol(),
+                i_obs.anomalous_flag(),
+            )
+        ).encode("utf-8")
+    )
+    return digest.hexdigest()
+
+
+def dataset_statistics(i_obs, **kwargs):
+    """
+    Return the MergingStatistics of an intensity array, from the cache if the
+    same statistics have been calculated for the same data.
+
+    Args:
+        i_obs (miller array): the unmerged intensities, with sigmas.
+        **kwargs: the options of MergingStatistics.
+
+    Returns:
+        MergingStatistics: the merging statistics, which must not be modified
+            as they are shared.
+
+    """
+    key = (data_version(i_obs), tuple(sorted(kwargs.items())))
+    with _cache_lock:
+        if key in _cache:
+            result = _cache.pop(key)
+            _cache[key] = result
+            return result
+    result = MergingStatistics(i_obs, **kwargs)
+    with _cache_lock:
+        _cache[key] = result
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
+
+
+def clear_cache():
+    """Remove all the cached merging statistics."""
+    with _cache_lock:
+        _cache.clear()
@@ -0,0 +1,199 @@
+"""
+Tests for the dials.report.merging_statistics module.
+"""
+from __future__ import absolute_import, division, print_function
+
+import time
+
+import numpy as np
+import pytest
+
+from cctbx import crystal, miller, sgtbx
+from cctbx.array_family import flex
+import iotbx.merging_statistics
+from dials.util import Sorry
+from dials.report import merging_statistics
+from dials.report.merging_statistics import MergingStatistics
+from dials.report.plots import ResolutionPlotsAndStats
+
+
+def generate_intensities(
+    n_obs, space_group="P 21 21 21", d_min=1.5, anomalous_signal=0.1, seed=0
+):
+    """Generate unmerged intensities, with each observation of a random
+    reflection at a random symmetry equivalent or its Friedel mate."""
+    rs = np.random.RandomState(seed)
+    sgi = sgtbx.space_group_info(space_group)
+    symmetry = crystal.symmetry(
+        unit_cell=sgi.any_compatible_unit_cell(volume=2.1e5), space_group_info=sgi
+    )
+    unique = miller.build_set(symmetry, anomalous_flag=False, d_min=d_min)
+    true = rs.exponential(1000, unique.size()) * np.exp(
+        -5 * unique.d_star_sq().data().as_numpy_array()
+    )
+    delta = rs.normal(scale=anomalous_signal, size=unique.size())
+    choice = rs.randint(unique.size(), size=n_obs)
+    hkl = unique.indices().as_vec3_double().as_double().as_numpy_array()
+    hkl = hkl.reshape(-1, 3)[choice]
+    ops = [
+        np.array(op.r().num()).reshape(3, 3) for op in symmetry.space_group().all_ops()
+    ]
+    op = rs.randint(len(ops), size=n_obs)
+    for i, r in enumerate(ops):
+        hkl[op == i] = hkl[op == i].dot(r)
+    friedel = np.where(rs.random_sample(n_obs) < 0.5, 1, -1)
+    sigmas = 10 + rs.random_sample(n_obs) * 20
+    data = true[choice] * (1 + friedel * delta[choice]) + rs.normal(size=n_obs) * sigmas
+    indices = flex.miller_index(
+        [tuple(int(x) for x in h) for h in (hkl * friedel[:, None])]
+    )
+    i_obs = miller.array(
+        miller.set(symmetry, indices, anomalous_flag=False),
+        data=flex.double(data),
+        sigmas=flex.double(sigmas),
+    )
+    i_obs.set_observation_type_xray_intensity()
+    i_obs.set_info(miller.array_info(source="DIALS", source_type="reflection_tables"))
+    return i_obs
+
+
+# The attributes which do not depend on the random split into half datasets
+deterministic = [
+    "d_max",
+    "d_min",
+    "n_obs",
+    "n_uniq",
+    "mean_redundancy",
+    "completeness",
+    "anom_completeness",
+    "i_mean",
+    "sigi_mean",
+    "i_over_sigma_mean",
+    "i_mean_over_sigi_mean",
+    "unmerged_i_over_sigma_mean",
+    "r_merge",
+    "r_meas",
+    "r_pim",
+    "cc_one_half_n_refl",
+    "cc_one_half_sigma_tau",
+    "cc_one_half_sigma_tau_n_refl",
+    "cc_one_half_sigma_tau_significance",
+]
+
+
+@pytest.mark.parametrize("space_group", ["P 21 21 21", "P 41 21 2", "P 1"])
+@pytest.mark.parametrize("anomalous", [False, True])
+@pytest.mark.parametrize("use_internal_variance", [False, True])
+@pytest.mark.parametrize("binning_method", ["volume", "counting_sorted"])
+def test_merging_statistics_against_iotbx(
+    space_group, anomalous, use_internal_variance, binning_method
+):
+    i_obs = generate_intensities(20000, space_group=space_group)
+    kwargs = dict(
+        n_bins=10,
+        anomalous=anomalous,
+        use_internal_variance=use_internal_variance,
+        binning_method=binning_method,
+        eliminate_sys_absent=False,
+        cc_one_half_significance_level=0.01,
+    )
+    expected = iotbx.merging_statistics.dataset_statistics(
+        i_obs=i_obs, sigma_filtering=None, **kwargs
+    )
+    result = MergingStatistics(i_obs, **kwargs)
+
+    assert len(result.bins) == len(expected.bins)
+    for stats, expected_stats in zip(
+        [result.overall] + result.bins, [expected.overall] + expected.bins
+    ):
+        for name in deterministic:
+            assert getattr(stats, name) == pytest.approx(
+                getattr(expected_stats, name)
+            ), name
+        assert stats.cc_one_half == pytest.approx(expected_stats.cc_one_half, abs=0.1)
+        assert stats.format()[:64] == expected_stats.format()[:64]
+    assert result.estimate_d_min(min_i_over_sigma=30) == pytest.approx(
+        expected.estimate_d_min(min_i_over_sigma=30)
+    )
+    assert result.estimate_d_min(max_r_merge=0.2) == pytest.approx(
+        expected.estimate_d_min(max_r_merge=0.2)
+    )
+
+
+def test_merging_statistics_negative_sigmas():
+    i_obs = generate_intensities(2000)
+    sigmas = i_obs.sigmas()
+    sigmas.set_selected(flex.size_t(range(0, 100)), -1.0)
+    sigmas.set_selected(flex.size_t(range(100, 110)), 0.0)
+    result = MergingStatistics(i_obs, n_bins=5)
+    assert result.overall.n_neg_sigmas == 100
+    assert result.overall.n_zero_sigmas == 10
+    assert result.overall.n_obs == 1890
+    assert sum(b.n_neg_sigmas for b in result.bins) == 100
+
+
+def test_merging_statistics_merged_data():
+    i_obs = generate_intensities(2000).merge_equivalents().array()
+    with pytest.raises(Sorry):
+        MergingStatistics(i_obs)
+    result = MergingStatistics(i_obs, assert_is_not_unique_set_under_symmetry=False)
+    assert result.overall.mean_redundancy == 1
+    assert result.overall.r_merge == 0
+
+
+def test_dataset_statistics_cache():
+    merging_statistics.clear_cache()
+    i_obs = generate_intensities(2000)
+    result = merging_statistics.dataset_statistics(i_obs, n_bins=5)
+    assert merging_statistics.dataset_statistics(i_obs.deep_copy(), n_bins=5) is result
+    assert merging_statistics.dataset_statistics(i_obs, n_bins=6) is not result
+
+    # Changing the data changes the data version
+    version = merging_statistics.data_version(i_obs)
+    i_obs.data()[0] += 1
+    assert merging_statistics.data_version(i_obs) != version
+    assert merging_statistics.dataset_statistics(i_obs, n_bins=5) is not result
+
+    merging_statistics.clear_cache()
+    assert merging_statistics.dataset_statistics(i_obs, n_bins=5) is not result
+
+
+def test_resolution_plots_and_stats():
+    """The statistics may be used in place of the iotbx statistics."""
+    i_obs = generate_intensities(5000)
+    result = MergingStatistics(i_obs, n_bins=5, cc_one_half_significance_level=0.01)
+    anom_result = MergingStatistics(
+        i_obs.as_anomalous_array(),
+        n_bins=5,
+        anomalous=True,
+        cc_one_half_significance_level=0.01,
+    )
+    plotter = ResolutionPlotsAndStats(result, anom_result)
+    plots = plotter.make_all_plots()
+    assert len(plots["cc_one_half"]["data"][0]["y"]) == 5
+    summary, table = plotter.statistics_tables()
+    assert len(table) == 6
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("n_obs", [100000, 1000000])
+@pytest.mark.parametrize("n_bins", [20, 100])
+def test_merging_statistics_benchmark(n_obs, n_bins):
+    """Compare the time to calculate the merging statistics with iotbx and
+    with the single pass implementation, and to fetch them from the cache"""
+    i_obs = generate_intensities(n_obs, d_min=1.0)
+    merging_statistics.clear_cache()
+
+    t0 = time.time()
+    iotbx.merging_statistics.dataset_statistics(
+        i_obs=i_obs, n_bins=n_bins, sigma_filtering=None, eliminate_sys_absent=False
+    )
+    t1 = time.time()
+    merging_statistics.dataset_statistics(i_obs, n_bins=n_bins)
+    t2 = time.time()
+    merging_statistics.dataset_statistics(i_obs, n_bins=n_bins)
+    t3 = time.time()
+    print(
+        "%d observations, %d bins: %.3fs iotbx, %.3fs single pass, %.3fs cached"
+        % (n_obs, n_bins, t1 - t0, t2 - t1, t3 - t2)
+    )
@@ -137,3 +137,57 @@ def test_robust(dials_data, model, tmpdir):
     scale4 = integrated4["background.scale"]
     diff2 = flex.abs(mean_bg2 - mean_bg4)
     assert (scale4 > 0).count(False) == 0
+
+
+def test_mapped_model_cache(tmpdir, monkeypatch):
+    from dials.array_family import flex
+    from dials.algorithms.background.gmodel import (
+        MappedBackgroundModel,
+        StaticBackgroundModel,
+    )
+    from dials.algorithms.background.gmodel import algorithm
+    from dials.algorithms.background.gmodel.algorithm import ModelCache
+    import six.moves.cPickle as pickle
+
+    def write_model(filename, scale):
+        model = StaticBackgroundModel()
+        for ysize, xsize in ((30, 40), (25, 35)):
+            data = flex.double(range(ysize * xsize)) * scale
+            data.reshape(flex.grid(ysize, xsize))
+            model.add(data)
+        with filename.open("wb") as fh:
+            pickle.dump(model, fh, pickle.HIGHEST_PROTOCOL)
+        return model
+
+    model_file = tmpdir.join("model.pickle")
+    model = write_model(model_file, 1.0)
+
+    # The pickle is converted to a mapped model on first use
+    mapped = ModelCache().get(model_file.strpath)
+    assert isinstance(mapped, MappedBackgroundModel)
+    assert tmpdir.join("model.pickle.mapped").check()
+    assert len(mapped) == 2
+    for i in range(2):
+        assert list(mapped.data(i)) == list(model.data(i))
+        assert mapped.data(i).all() == model.data(i).all()
+    bbox = (5, 15, 2, 12, 0, 3)
+    assert list(mapped.extract(1, bbox)) == list(model.extract(1, bbox))
+
+    # The mapped model can be used directly, without hashing the pickle, as
+    # by the workers given the name of the mapped model by the parent
+    mapped_name = algorithm.mapped_model_filename(model_file.strpath)
+    assert mapped_name == tmpdir.join("model.pickle.mapped").strpath
+
+    def content_hash(filename):
+        raise AssertionError("The model is hashed")
+
+    monkeypatch.setattr(algorithm, "content_hash", content_hash)
+    mapped = ModelCache().get(mapped_name)
+    monkeypatch.undo()
+    assert list(mapped.data(0)) == list(model.data(0))
+
+    # A changed pickle does not match the hash of the mapped model, which is
+    # recreated
+    model = write_model(model_file, 2.0)
+    mapped = ModelCache().get(model_file.strpath)
+    assert list(mapped.data(1)) == list(model.data(1))
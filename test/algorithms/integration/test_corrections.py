@@ -1,5 +1,9 @@
 from __future__ import absolute_import, division, print_function
 
+import time
+
+import pytest
+
 
 def test_run(dials_data):
     filename = dials_data("centroid_test_data").join("experiments.json").strpath
@@ -57,3 +61,149 @@ def LP_calculations(experiment, s1):
     )
 
     return L_f / P_f
+
+
+def _predictions(dials_data, ncopies=1):
+    from dxtbx.model.experiment_list import ExperimentListFactory
+    from dials.array_family import flex
+
+    filename = dials_data("centroid_test_data").join("experiments.json").strpath
+    exlist = ExperimentListFactory.from_json_file(filename)
+    rlist = flex.reflection_table.from_predictions_multi(exlist)
+    predictions = flex.reflection_table()
+    for i in range(ncopies):
+        predictions.extend(rlist)
+    return exlist, predictions
+
+
+def _psi_and_direction_cosines_reference(experiment, miller_index, phi):
+    """The psi angles and direction cosines of each reflection for a scan static
+    crystal model, calculated one reflection at a time with scitbx.matrix, as
+    previously done in the XDS_ASCII and SADABS exporters"""
+    from scitbx import matrix
+
+    F = matrix.sqr(experiment.goniometer.get_fixed_rotation())
+    S = matrix.sqr(experiment.goniometer.get_setting_rotation())
+    axis = matrix.col(experiment.goniometer.get_rotation_axis_datum())
+    s0 = matrix.col(experiment.beam.get_s0())
+    beam = matrix.col(experiment.beam.get_direction())
+    UB = matrix.sqr(experiment.crystal.get_A())
+
+    psi = []
+    cosines = []
+    for hkl, angle in zip(miller_index, phi):
+        RUB = S * axis.axis_and_angle_as_r3_rotation_matrix(angle) * F * UB
+        s = s0 + RUB * hkl
+        g = s.cross(s0).normalize()
+        e = -(s + s0).normalize()
+        h, k, l = hkl
+        if h == k and k == l:
+            u = matrix.col((h, -h, 0))
+        else:
+            u = matrix.col((k - l, l - h, h - k))
+        q = (u.transpose() * RUB.inverse()).normalize().transpose()
+        p = q.angle(g, deg=True)
+        if q.dot(e) < 0:
+            p *= -1
+        psi.append(p)
+
+        row = []
+        for v in ((1, 0, 0), (0, 1, 0), (0, 0, 1)):
+            astar = (RUB * v).normalize()
+            row.extend([beam.dot(astar), s.normalize().dot(astar)])
+        cosines.append(row)
+    return psi, cosines
+
+
+@pytest.mark.parametrize("nthreads", [1, 4])
+def test_reflection_geometry(dials_data, nthreads):
+    from dials.algorithms.integration import CorrectionsMulti, Corrections
+    from dials.algorithms.integration.reflection_geometry import (
+        compute_reflection_geometry,
+    )
+    from dials.array_family import flex
+
+    exlist, rlist = _predictions(dials_data)
+    experiment = exlist[0]
+    corrector = CorrectionsMulti()
+    corrector.append(
+        Corrections(experiment.beam, experiment.goniometer, experiment.detector)
+    )
+
+    result = compute_reflection_geometry(
+        rlist, exlist, psi=True, direction_cosines=True, nthreads=nthreads
+    )
+    assert list(result.lp) == pytest.approx(
+        list(corrector.lp(rlist["id"], rlist["s1"])), abs=1e-12
+    )
+    assert list(result.qe) == pytest.approx(
+        list(corrector.qe(rlist["id"], rlist["s1"], rlist["panel"])), abs=1e-12
+    )
+
+    # the psi angles and direction cosines agree with a calculation for each
+    # reflection in turn
+    phi = rlist["xyzcal.mm"].parts()[2]
+    psi, cosines = _psi_and_direction_cosines_reference(
+        experiment, rlist["miller_index"], phi
+    )
+    result = compute_reflection_geometry(
+        rlist,
+        exlist,
+        lp=False,
+        qe=False,
+        psi=True,
+        direction_cosines=True,
+        UB=flex.mat3_double(1, experiment.crystal.get_A()),
+        phi=phi,
+        nthreads=nthreads,
+    )
+    assert len(result.lp) == len(result.qe) == 0
+    assert list(result.psi) == pytest.approx(psi, abs=1e-9)
+    for j, expected in enumerate(zip(*cosines)):
+        assert list(result.direction_cosines[j]) == pytest.approx(expected, abs=1e-12)
+
+
+def test_compute_corrections(dials_data):
+    from dials.algorithms.integration import CorrectionsMulti, Corrections
+
+    exlist, rlist = _predictions(dials_data)
+    experiment = exlist[0]
+    corrector = CorrectionsMulti()
+    corrector.append(
+        Corrections(experiment.beam, experiment.goniometer, experiment.detector)
+    )
+    lp = rlist.compute_corrections(exlist, nthreads=2)
+    assert list(rlist["lp"]) == list(lp)
+    assert list(lp) == pytest.approx(
+        list(corrector.lp(rlist["id"], rlist["s1"])), abs=1e-12
+    )
+
+
+@pytest.mark.slow
+def test_reflection_geometry_benchmark(dials_data):
+    from dials.algorithms.integration import CorrectionsMulti, Corrections
+    from dials.algorithms.integration.reflection_geometry import (
+        compute_reflection_geometry,
+    )
+
+    exlist, rlist = _predictions(dials_data, ncopies=100)
+    experiment = exlist[0]
+
+    t0 = time.time()
+    corrector = CorrectionsMulti()
+    corrector.append(
+        Corrections(experiment.beam, experiment.goniometer, experiment.detector)
+    )
+    corrector.lp(rlist["id"], rlist["s1"])
+    corrector.qe(rlist["id"], rlist["s1"], rlist["panel"])
+    t_separate = time.time() - t0
+
+    for nthreads in (1, 4):
+        t0 = time.time()
+        compute_reflection_geometry(
+            rlist, exlist, psi=True, direction_cosines=True, nthreads=nthreads
+        )
+        print(
+            "%d reflections: lp and qe %.3fs; lp, qe, psi and cosines with %d "
+            "threads %.3fs" % (len(rlist), t_separate, nthreads, time.time() - t0)
+        )
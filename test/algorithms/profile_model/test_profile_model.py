@@ -1,5 +1,7 @@
 from __future__ import absolute_import, division, print_function
 
+import pytest
+
 
 def test_load_and_dump():
     from dials.algorithms.profile_model.gaussian_rs import Model
@@ -14,3 +16,65 @@ def test_load_and_dump():
     assert model2.n_sigma() == 2
     assert model2.sigma_b() == 4
     assert model2.sigma_m() == 5
+
+
+def test_beam_divergence_variance_matches_python_implementation():
+    import random
+    from dxtbx.model import DetectorFactory
+    from dials.array_family import flex
+    from dials.model.data import Shoebox
+    from dials.algorithms.profile_model.gaussian_rs.calculator import (
+        ComputeEsdBeamDivergence,
+    )
+
+    random.seed(0)
+    detector = DetectorFactory.simple(
+        "PAD", 100, (50, 50), "+x", "-y", (0.172, 0.172), (100, 100)
+    )
+
+    n = 50
+    reflections = flex.reflection_table()
+    shoebox = flex.shoebox(n)
+    xyz = flex.vec3_double(n)
+    s1 = flex.vec3_double(n)
+    for i in range(n):
+        x0 = random.randint(0, 90)
+        y0 = random.randint(0, 90)
+        z0 = random.randint(0, 5)
+        shoebox[i] = Shoebox(0, (x0, x0 + 5, y0, y0 + 5, z0, z0 + 3))
+        shoebox[i].allocate()
+        data = shoebox[i].data
+        mask = shoebox[i].mask
+        for j in range(len(data)):
+            data[j] = random.uniform(0, 10)
+            mask[j] = random.choice([0, 5])
+        shoebox[i].data = data
+        shoebox[i].mask = mask
+        xyz[i] = (x0 + 2.5, y0 + 2.5, z0 + 1.5)
+        s1[i] = detector[0].get_pixel_lab_coord(xyz[i][0:2])
+    reflections["shoebox"] = shoebox
+    reflections["xyzobs.px.value"] = xyz
+    reflections["s1"] = s1
+
+    calculator = ComputeEsdBeamDivergence.__new__(ComputeEsdBeamDivergence)
+    for centroid_definition in ("s1", "com"):
+        expected = calculator._beam_direction_variance_list_py(
+            detector, reflections, centroid_definition
+        )
+        for nthreads in (1, 4):
+            result = calculator._beam_direction_variance_list(
+                detector, reflections, centroid_definition, nthreads
+            )
+            assert len(result) == len(expected)
+            for a, b in zip(result, expected):
+                assert a == pytest.approx(b)
+
+    # An error in a thread is raised rather than terminating the process
+    shoebox[n - 1] = Shoebox(1, (0, 5, 0, 5, 0, 3))
+    shoebox[n - 1].allocate()
+    reflections["shoebox"] = shoebox
+    for nthreads in (1, 4):
+        with pytest.raises(RuntimeError):
+            calculator._beam_direction_variance_list(
+                detector, reflections, "s1", nthreads
+            )
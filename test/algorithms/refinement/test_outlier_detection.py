@@ -0,0 +1,100 @@
+from __future__ import absolute_import, division, print_function
+
+import math
+import time
+
+import pytest
+
+from dials.algorithms.refinement.outlier_detection import CentroidOutlierFactory
+from dials.algorithms.refinement.outlier_detection import phil_scope
+from dials.array_family import flex
+
+
+def _residuals_table(npanels, nblocks, nref_per_job, seed=0):
+    """Random centroid residuals for reflections spread over panels and phi
+    blocks, with two gross outliers planted in each job"""
+
+    flex.set_random_seed(seed)
+    nref = npanels * nblocks * nref_per_job
+    rt = flex.reflection_table()
+    rt["id"] = flex.int(nref, 0)
+    panel = flex.size_t()
+    phi = flex.double()
+    block_width = 2 * math.pi / nblocks
+    for ipanel in range(npanels):
+        for iblock in range(nblocks):
+            panel.extend(flex.size_t(nref_per_job, ipanel))
+            phi.extend((iblock + flex.random_double(nref_per_job)) * block_width)
+    rt["panel"] = panel
+    rt["xyzobs.mm.value"] = flex.vec3_double(
+        flex.double(nref, 0), flex.double(nref, 0), phi
+    )
+    for col in ("x_resid", "y_resid", "phi_resid"):
+        rt[col] = flex.normal_random_double(nref) * 0.01
+    planted = flex.size_t()
+    for i in range(0, nref, nref_per_job):
+        planted.extend(flex.size_t([i, i + 1]))
+    rt["x_resid"].set_selected(planted, 1.0)
+    rt["phi_resid"].set_selected(planted, -1.0)
+    rt.set_flags(flex.bool(nref, True), rt.flags.predicted)
+    return rt, planted
+
+
+def _outlier_detector(algorithm, nproc, block_width):
+    params = phil_scope.extract()
+    params.outlier.algorithm = algorithm
+    params.outlier.separate_panels = True
+    params.outlier.block_width = block_width
+    params.outlier.nproc = nproc
+    return CentroidOutlierFactory.from_parameters_and_colnames(
+        params, ["x_resid", "y_resid", "phi_resid"]
+    )
+
+
+@pytest.mark.parametrize("algorithm", ["tukey", "mcd"])
+def test_outlier_detection_jobs_in_parallel(algorithm):
+    rt, planted = _residuals_table(npanels=4, nblocks=3, nref_per_job=60)
+
+    flex.set_random_seed(42)
+    expected = flex.random_double()
+
+    flagged = []
+    for nproc in (1, 2, 3):
+        flex.set_random_seed(42)
+        reflections = rt.copy()
+        od = _outlier_detector(algorithm, nproc, block_width=120)
+        assert od(reflections)
+        sel = reflections.get_flags(reflections.flags.centroid_outlier)
+        assert sel.select(planted).all_eq(True)
+        flagged.append(sel)
+
+        # Only the randomised MCD algorithm in this process draws random numbers
+        if algorithm == "tukey" or nproc > 1:
+            assert flex.random_double() == expected
+
+    # The jobs run in worker processes are seeded from their index, so even the
+    # randomised MCD algorithm gives the same results with any nproc > 1
+    if algorithm == "tukey":
+        assert flagged[0].all_eq(flagged[1])
+    assert flagged[1].all_eq(flagged[2])
+
+
+@pytest.mark.slow
+def test_outlier_detection_benchmark():
+    """Time MCD outlier rejection on 64 panels by 36 blocks of phi"""
+
+    rt, planted = _residuals_table(npanels=64, nblocks=36, nref_per_job=100)
+    timings = {}
+    for nproc in (1, 4):
+        reflections = rt.copy()
+        od = _outlier_detector("mcd", nproc, block_width=10)
+        t0 = time.time()
+        assert od(reflections)
+        timings[nproc] = time.time() - t0
+        sel = reflections.get_flags(reflections.flags.centroid_outlier)
+        assert sel.select(planted).all_eq(True)
+
+    print(
+        "%d reflections in %d jobs: nproc=1 %.2fs, nproc=4 %.2fs"
+        % (len(rt), 64 * 36, timings[1], timings[4])
+    )
@@ -1,6 +1,8 @@
 from __future__ import absolute_import, division, print_function
 
 import sys
+import time
+
 import pytest
 
 from math import pi
@@ -12,6 +14,7 @@
 )
 from dials.algorithms.refinement.parameterisation.scan_varying_prediction_parameters import (
     ScanVaryingPredictionParameterisation,
+    ScanVaryingPredictionParameterisationSparse,
 )
 from dials.algorithms.refinement.parameterisation.scan_varying_crystal_parameters import (
     ScanVaryingCrystalOrientationParameterisation,
@@ -219,6 +222,127 @@ def test(cmdline_overrides=[]):
     pred_param.compose(reflections)
 
 
+def test_sparse_gradients_match_dense_gradients():
+    tc = _Test()
+    tc.create_models()
+    reflections = tc.generate_reflections()
+
+    from dials.algorithms.refinement.reflection_manager import ReflectionManager
+
+    refman = ReflectionManager(reflections, tc.experiments, outlier_detector=None)
+    refman.finalise()
+    reflections = refman.get_matches()
+
+    args = (
+        tc.experiments,
+        [tc.det_param],
+        [tc.s0_param],
+        [tc.xlo_param],
+        [tc.xluc_param],
+        [tc.gon_param],
+    )
+    dense = ScanVaryingPredictionParameterisation(*args)
+    sparse = ScanVaryingPredictionParameterisationSparse(*args)
+
+    # the whole table, then a block of it as set up by split_matches_into_blocks
+    block = reflections.select(flex.size_t(range(1, len(reflections), 2)))
+    block["imatch"] = flex.size_t(range(1, len(reflections), 2))
+    for refs in (reflections, block):
+        dense.compose(reflections)
+        dense_grads = dense.get_gradients(refs)
+        sparse.compose(reflections)
+        sparse_grads = sparse.get_gradients(refs)
+        assert len(dense_grads) == len(sparse_grads) == len(dense)
+
+        for d, s in zip(dense_grads, sparse_grads):
+            for key in ("dX_dp", "dY_dp", "dphi_dp"):
+                assert list(s[key].as_dense_vector()) == pytest.approx(
+                    list(d[key]), abs=1e-12
+                )
+
+
+@pytest.mark.slow
+def test_sparse_gradients_benchmark():
+    """Compare the time and storage for gradients and the Jacobian of the dense
+    and sparse paths for a long sweep with many scan-varying parameters"""
+
+    from cctbx.sgtbx import space_group, space_group_symbols
+    from dxtbx.model import ScanFactory
+    from dials.algorithms.refinement.reflection_manager import (
+        BlockCalculator,
+        ReflectionManager,
+    )
+    from dials.algorithms.refinement.target import (
+        LeastSquaresPositionalResidualWithRmsdCutoff,
+        LeastSquaresPositionalResidualWithRmsdCutoffSparse,
+    )
+    from dials.algorithms.spot_prediction import IndexGenerator, ray_intersection
+
+    tc = _Test()
+    tc.create_models()
+
+    # a 180 degree sweep of 0.1 degree images
+    tc.scan = ScanFactory().make_scan((1, 1800), 0.1, (0, 0.1), range(1800), deg=True)
+    tc.experiments[0].scan = tc.scan
+    predictor = ScansExperimentsPredictor(tc.experiments)
+    indices = IndexGenerator(
+        tc.crystal.get_unit_cell(),
+        space_group(space_group_symbols(1).hall()).type(),
+        2.0,
+    ).to_array()
+    obs_refs = ScansRayPredictor(
+        tc.experiments, tc.scan.get_oscillation_range(deg=False)
+    )(indices)
+    obs_refs = obs_refs.select(ray_intersection(tc.detector, obs_refs))
+    obs_refs["id"] = flex.int(len(obs_refs), 0)
+    obs_refs = predictor(obs_refs)
+    obs_refs["xyzobs.mm.value"] = obs_refs["xyzcal.mm"]
+    obs_refs["xyzobs.mm.variance"] = flex.vec3_double(len(obs_refs), (1e-4,) * 3)
+    obs_refs = BlockCalculator(tc.experiments, obs_refs).per_image()
+
+    # one crystal orientation and unit cell smoother point per degree
+    array_range = tc.scan.get_array_range()
+    xlo_param = ScanVaryingCrystalOrientationParameterisation(
+        tc.crystal, array_range, 180
+    )
+    xluc_param = ScanVaryingCrystalUnitCellParameterisation(
+        tc.crystal, array_range, 180
+    )
+
+    for name, pred_param_type, target_type in (
+        (
+            "dense",
+            ScanVaryingPredictionParameterisation,
+            LeastSquaresPositionalResidualWithRmsdCutoff,
+        ),
+        (
+            "sparse",
+            ScanVaryingPredictionParameterisationSparse,
+            LeastSquaresPositionalResidualWithRmsdCutoffSparse,
+        ),
+    ):
+        pred_param = pred_param_type(
+            tc.experiments, [], [], [xlo_param], [xluc_param], []
+        )
+        refman = ReflectionManager(
+            obs_refs.deep_copy(), tc.experiments, outlier_detector=None
+        )
+        target = target_type(tc.experiments, predictor, refman, pred_param)
+        target.predict()
+
+        t0 = time.time()
+        residuals, jacobian, weights = target.compute_residuals_and_gradients()
+        elapsed = time.time() - t0
+        try:
+            stored = jacobian.non_zeroes
+        except AttributeError:
+            stored = jacobian.size()
+        print(
+            "%s: %d reflections, %d parameters, %.2fs, %d stored Jacobian elements"
+            % (name, target.get_num_matches(), len(pred_param), elapsed, stored)
+        )
+
+
 if __name__ == "__main__":
     cmdline_overrides = sys.argv[1:]
     test(cmdline_overrides)
@@ -0,0 +1,208 @@
+"""
+Test that refinement with a persistent pool of worker processes gives the same
+results as refinement in a single process, using generated reflection positions
+from ideal geometry.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import time
+from math import pi
+
+import pytest
+
+from dials.algorithms.refinement.engine import (
+    GaussNewtonIterations,
+    LevenbergMarquardtIterations,
+    SimpleLBFGS,
+)
+
+engines = {
+    "SimpleLBFGS": SimpleLBFGS,
+    "GaussNewton": GaussNewtonIterations,
+    "LevMar": LevenbergMarquardtIterations,
+}
+
+
+def _refinement_problem(resolution=2.0, ncopies=1):
+    """Generate observations with known parameter shifts applied to the models,
+    then undo the shifts. Return the target, the prediction parameterisation
+    and the starting parameter values"""
+
+    from libtbx.phil import parse
+    from scitbx.array_family import flex
+    from dxtbx.model import ScanFactory
+    from dxtbx.model.experiment_list import ExperimentList, Experiment
+    from cctbx.sgtbx import space_group, space_group_symbols
+    import dials.test.algorithms.refinement.setup_geometry as setup_geometry
+    from dials.algorithms.refinement.parameterisation.detector_parameters import (
+        DetectorParameterisationSinglePanel,
+    )
+    from dials.algorithms.refinement.parameterisation.beam_parameters import (
+        BeamParameterisation,
+    )
+    from dials.algorithms.refinement.parameterisation.crystal_parameters import (
+        CrystalOrientationParameterisation,
+        CrystalUnitCellParameterisation,
+    )
+    from dials.algorithms.refinement.parameterisation.prediction_parameters import (
+        XYPhiPredictionParameterisation,
+    )
+    from dials.algorithms.refinement.prediction.managed_predictors import (
+        ScansRayPredictor,
+        ScansExperimentsPredictor,
+    )
+    from dials.algorithms.refinement.reflection_manager import ReflectionManager
+    from dials.algorithms.refinement.target import (
+        LeastSquaresPositionalResidualWithRmsdCutoff,
+    )
+    from dials.algorithms.spot_prediction import IndexGenerator, ray_intersection
+
+    master_phil = parse(
+        """
+      include scope dials.test.algorithms.refinement.geometry_phil
+      """,
+        process_includes=True,
+    )
+    models = setup_geometry.Extract(master_phil)
+    scan = ScanFactory().make_scan(
+        image_range=(1, 1800),
+        exposure_times=0.1,
+        oscillation=(0, 0.1),
+        epochs=range(1800),
+        deg=True,
+    )
+    experiments = ExperimentList()
+    experiments.append(
+        Experiment(
+            beam=models.beam,
+            detector=models.detector,
+            goniometer=models.goniometer,
+            scan=scan,
+            crystal=models.crystal,
+            imageset=None,
+        )
+    )
+
+    det_param = DetectorParameterisationSinglePanel(models.detector)
+    s0_param = BeamParameterisation(models.beam, models.goniometer)
+    xlo_param = CrystalOrientationParameterisation(models.crystal)
+    xluc_param = CrystalUnitCellParameterisation(models.crystal)
+    s0_param.set_fixed([True, False, True])
+    pred_param = XYPhiPredictionParameterisation(
+        experiments, [det_param], [s0_param], [xlo_param], [xluc_param]
+    )
+
+    # shift the detector and crystal orientation to generate observations
+    start = pred_param.get_param_vals()
+    det_param.set_param_vals(
+        [a + b for a, b in zip(det_param.get_param_vals(), [0.5] * 3 + [1.0] * 3)]
+    )
+    xlo_param.set_param_vals([a + 1.0 for a in xlo_param.get_param_vals()])
+
+    indices = IndexGenerator(
+        models.crystal.get_unit_cell(),
+        space_group(space_group_symbols(1).hall()).type(),
+        resolution,
+    ).to_array()
+    obs_refs = ScansRayPredictor(experiments, scan.get_oscillation_range(deg=False))(
+        indices
+    )
+    obs_refs = obs_refs.select(ray_intersection(models.detector, obs_refs))
+    obs_refs["id"] = flex.int(len(obs_refs), 0)
+    ref_predictor = ScansExperimentsPredictor(experiments)
+    obs_refs = ref_predictor(obs_refs)
+    obs_refs["xyzobs.mm.value"] = obs_refs["xyzcal.mm"]
+    im_width = 0.1 * pi / 180.0
+    px_size = models.detector[0].get_pixel_size()
+    obs_refs["xyzobs.mm.variance"] = flex.vec3_double(
+        flex.double(len(obs_refs), (px_size[0] / 2.0) ** 2),
+        flex.double(len(obs_refs), (px_size[1] / 2.0) ** 2),
+        flex.double(len(obs_refs), (im_width / 2.0) ** 2),
+    )
+
+    # repeat the observations to reach larger problem sizes
+    all_refs = obs_refs.copy()
+    for i in range(ncopies - 1):
+        all_refs.extend(obs_refs)
+
+    pred_param.set_param_vals(start)
+    refman = ReflectionManager(all_refs, experiments)
+    target = LeastSquaresPositionalResidualWithRmsdCutoff(
+        experiments, ref_predictor, refman, pred_param, restraints_parameterisation=None
+    )
+    return target, pred_param, start
+
+
+def _refine(engine, target, pred_param, start, nproc, persistent_workers):
+    pred_param.set_param_vals(start)
+    refinery = engines[engine](
+        target=target, prediction_parameterisation=pred_param, max_iterations=5
+    )
+    refinery.set_nproc(nproc)
+    refinery.set_persistent_workers(persistent_workers)
+    try:
+        refinery.run()
+    finally:
+        refinery.close_worker_pool()
+    return refinery
+
+
+@pytest.mark.parametrize("engine", ["SimpleLBFGS", "GaussNewton", "LevMar"])
+def test_persistent_workers_give_same_results_as_single_process(engine, monkeypatch):
+    target, pred_param, start = _refinement_problem(resolution=2.0)
+
+    serial = _refine(engine, target, pred_param, start, 1, False)
+    expected = pred_param.get_param_vals()
+
+    # with persistent workers the parent predicts when constructing the
+    # refinery, and otherwise only for the trial objective of Levenberg-Marquardt
+    # or to set the parameters back a step in Gauss-Newton
+    predict = target.predict
+    calls = []
+
+    def counted_predict():
+        calls.append(None)
+        predict()
+
+    monkeypatch.setattr(target, "predict", counted_predict)
+    parallel = _refine(engine, target, pred_param, start, 2, True)
+    monkeypatch.undo()
+    assert parallel._worker_pool is None
+    if engine == "SimpleLBFGS":
+        assert len(calls) == 1
+    assert pred_param.get_param_vals() == pytest.approx(expected, abs=1e-6)
+    assert parallel.history["num_reflections"] == serial.history["num_reflections"]
+    assert parallel.history["objective"] == pytest.approx(
+        serial.history["objective"], rel=1e-6
+    )
+
+    # the rmsds are calculated from the predictions gathered from the workers
+    for rmsds, expected_rmsds in zip(parallel.history["rmsd"], serial.history["rmsd"]):
+        assert rmsds == pytest.approx(expected_rmsds, abs=1e-8)
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("engine", ["SimpleLBFGS", "GaussNewton", "LevMar"])
+def test_persistent_workers_benchmark(engine):
+    """Time refinement steps with fresh processes for each step and with a
+    persistent worker pool, for increasing numbers of reflections"""
+
+    nproc = 4
+    for ncopies in (1, 10, 100):
+        target, pred_param, start = _refinement_problem(resolution=1.5, ncopies=ncopies)
+        nref = len(target.get_obs())
+        timings = {}
+        for persistent_workers in (False, True):
+            t0 = time.time()
+            refinery = _refine(
+                engine, target, pred_param, start, nproc, persistent_workers
+            )
+            timings[persistent_workers] = (time.time() - t0) / (
+                refinery.get_num_steps() + 1
+            )
+        print(
+            "%s, %d reflections, nproc=%d: %.2fs per step (new processes), "
+            "%.2fs per step (persistent workers)"
+            % (engine, nref, nproc, timings[False], timings[True])
+        )
@@ -0,0 +1,77 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import random
+from glob import glob
+
+import pytest
+
+from cctbx import sgtbx, uctbx
+from libtbx import easy_run
+from dials.algorithms.integration.filtering import PowderRingFilter
+from dials.algorithms.spot_finding import per_image_analysis
+from dials.array_family import flex
+
+
+def test_points_below_line():
+    random.seed(0)
+    x = flex.double([random.uniform(0, 0.5) for i in range(1000)])
+    y = flex.double([random.uniform(-2, 5) for i in range(1000)])
+    inside = per_image_analysis.points_below_line(x, y, -4, 3)
+    assert list(inside) == [yi < -4 * xi + 3 for xi, yi in zip(x, y)]
+
+
+def test_powder_ring_filter():
+    random.seed(0)
+    unit_cell = uctbx.unit_cell((4.498, 4.498, 7.338, 90, 90, 120))
+    space_group = sgtbx.space_group_info(number=194).group()
+    ice_filter = PowderRingFilter(unit_cell, space_group, 1.5, 0.004)
+    d = flex.double([random.uniform(1.5, 10) for i in range(1000)])
+    d_star_sq = uctbx.d_as_d_star_sq(d)
+    expected = [
+        any(abs(ds2 - ring) < 0.002 for ring in ice_filter.d_star_sq)
+        for ds2 in d_star_sq
+    ]
+    assert list(ice_filter(d)) == expected
+    assert 0 < expected.count(True) < 1000
+
+
+def test_stats_imageset(dials_data, run_in_tmpdir):
+    from dxtbx.model.experiment_list import ExperimentListFactory
+
+    path = dials_data("centroid_test_data").strpath
+    cmd = "dials.import %s output.experiments=experiments.json" % " ".join(
+        glob(os.path.join(path, "*.cbf"))
+    )
+    easy_run.fully_buffered(cmd).raise_if_errors()
+    easy_run.fully_buffered(
+        "dials.find_spots experiments.json min_spot_size=3"
+    ).raise_if_errors()
+    imageset = ExperimentListFactory.from_json_file("experiments.json")[0].imageset
+    reflections = flex.reflection_table.from_pickle("strong.pickle")
+
+    # The statistics of each image, analysed separately
+    image_number = flex.floor(reflections["xyzobs.px.value"].parts()[2])
+    start = imageset.get_array_range()[0]
+    expected = [
+        per_image_analysis.stats_single_image(
+            imageset[i : i + 1], reflections.select(image_number == i + start)
+        )
+        for i in range(len(imageset))
+    ]
+
+    for nproc in (1, 2):
+        stats = per_image_analysis.stats_imageset(imageset, reflections, nproc=nproc)
+        for name in ("n_spots_total", "n_spots_no_ice", "n_spots_4A"):
+            assert getattr(stats, name) == [getattr(e, name) for e in expected]
+        for name in (
+            "total_intensity",
+            "estimated_d_min",
+            "d_min_distl_method_1",
+            "noisiness_method_1",
+            "d_min_distl_method_2",
+            "noisiness_method_2",
+        ):
+            assert getattr(stats, name) == pytest.approx(
+                [getattr(e, name) for e in expected]
+            )
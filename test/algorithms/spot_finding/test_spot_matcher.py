@@ -0,0 +1,134 @@
+from __future__ import absolute_import, division, print_function
+
+import random
+import time
+
+import pytest
+
+from dials.algorithms.spot_finding.spot_matcher import SpotIndex, SpotMatcher
+from dials.array_family import flex
+
+
+def _random_spots(n, npanels=4, nframes=10, seed=0):
+    random.seed(seed)
+    table = flex.reflection_table()
+    table["panel"] = flex.size_t([random.randrange(npanels) for i in range(n)])
+    table["xyzcal.px"] = flex.vec3_double(
+        [
+            (
+                random.uniform(0, 500),
+                random.uniform(0, 500),
+                random.uniform(0, nframes),
+            )
+            for i in range(n)
+        ]
+    )
+    return table
+
+
+def _observe(predicted, n, seed=1):
+    # Observations near a random subset of the predictions, plus some noise
+    random.seed(seed)
+    observed = flex.reflection_table()
+    panel = flex.size_t()
+    xyz = flex.vec3_double()
+    for i in range(n):
+        j = random.randrange(len(predicted))
+        x, y, z = predicted["xyzcal.px"][j]
+        panel.append(predicted["panel"][j])
+        xyz.append(
+            (
+                x + random.uniform(-3, 3),
+                y + random.uniform(-3, 3),
+                z + random.uniform(-1, 1),
+            )
+        )
+    observed["panel"] = panel
+    observed["xyzobs.px.value"] = xyz
+    return observed
+
+
+def _brute_force_match(observed, predicted, max_separation):
+    # For each observed spot find the nearest prediction on the same panel, then
+    # keep only the closest observation of each prediction
+    best = {}
+    for i, (p, xyz) in enumerate(zip(observed["panel"], observed["xyzobs.px.value"])):
+        nearest = None
+        for j, (q, pxyz) in enumerate(zip(predicted["panel"], predicted["xyzcal.px"])):
+            if p != q:
+                continue
+            d = sum((a - b) ** 2 for a, b in zip(xyz, pxyz)) ** 0.5
+            if d <= max_separation and (nearest is None or d < nearest[1]):
+                nearest = (j, d)
+        if nearest is not None:
+            j, d = nearest
+            if j not in best or d < best[j][1]:
+                best[j] = (i, d)
+    matches = sorted((i, j) for j, (i, d) in best.items())
+    return [m[0] for m in matches], [m[1] for m in matches]
+
+
+@pytest.mark.parametrize("nproc", [1, 4])
+def test_spot_matcher(nproc):
+    predicted = _random_spots(1000)
+    observed = _observe(predicted, 500)
+    oind, pind = SpotMatcher(max_separation=2, nproc=nproc)(observed, predicted)
+    expected_oind, expected_pind = _brute_force_match(observed, predicted, 2)
+    assert list(oind) == expected_oind
+    assert list(pind) == expected_pind
+
+
+def test_spot_index_reuse():
+    predicted = _random_spots(1000)
+    index = SpotIndex(predicted["panel"], predicted["xyzcal.px"])
+    assert len(index) == 1000
+    matcher = SpotMatcher(max_separation=1)
+    for seed in range(3):
+        observed = _observe(predicted, 200, seed=seed)
+        oind, pind = matcher.match_with_index(observed, index)
+        expected_oind, expected_pind = _brute_force_match(observed, predicted, 1)
+        assert list(oind) == expected_oind
+        assert list(pind) == expected_pind
+
+    # An empty set of observations or predictions gives no matches
+    oind, pind = matcher.match_with_index(observed.select(flex.size_t()), index)
+    assert len(oind) == len(pind) == 0
+    empty = SpotIndex(flex.size_t(), flex.vec3_double())
+    oind, pind = matcher.match_with_index(observed, empty)
+    assert len(oind) == len(pind) == 0
+
+
+def test_spot_index_duplicates():
+    # Several observations near one prediction: only the closest is kept
+    predicted = flex.reflection_table()
+    predicted["panel"] = flex.size_t([0, 0])
+    predicted["xyzcal.px"] = flex.vec3_double([(10, 10, 1), (20, 20, 1)])
+    index = SpotIndex(predicted["panel"], predicted["xyzcal.px"])
+    oind, pind, dist = index.query(
+        flex.size_t([0, 0, 0]),
+        flex.vec3_double([(11, 10, 1), (9, 10, 1), (10, 10.5, 1)]),
+        2,
+    )
+    assert list(oind) == [2]
+    assert list(pind) == [0]
+    assert list(dist) == pytest.approx([0.5])
+
+
+@pytest.mark.slow
+def test_spot_matcher_benchmark():
+    predicted = _random_spots(200000, npanels=24, nframes=100)
+    observed = _observe(predicted, 100000)
+
+    t0 = time.time()
+    index = SpotIndex(predicted["panel"], predicted["xyzcal.px"])
+    t_build = time.time() - t0
+    matcher = SpotMatcher(max_separation=2)
+    t0 = time.time()
+    for i in range(5):
+        oind, pind = matcher.match_with_index(observed, index)
+    t_query = (time.time() - t0) / 5
+    print(
+        "%d predictions, %d observations: build %.3fs, query %.3fs, %d matches"
+        % (len(predicted), len(observed), t_build, t_query, len(oind))
+    )
+    assert len(oind) > 0
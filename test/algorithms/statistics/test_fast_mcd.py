@@ -43,7 +43,6 @@ def test_maha():
     cols = [x1, x2, x3]
     center = [flex.mean(e) for e in cols]
     covmat = cov(x1, x2, x3)
-    n = len(cols[0])
 
     maha = maha_dist_sq(cols, center, covmat)
 
@@ -259,3 +258,50 @@ def test_fast_mcd_large(dials_regression):
     # Correction factors
     assert approx_equal(fast_mcd._consistency_fac, 2.45659976388)
     assert approx_equal(fast_mcd._finite_samp_fac, 1.00193273884)
+
+
+def test_batch_calculations():
+    from scitbx.array_family import flex
+    from libtbx.test_utils import approx_equal
+    from dials.algorithms.statistics.fast_mcd import (
+        FastMCD,
+        batch_cholesky,
+        batch_concentration_step,
+        batch_means_and_covariance,
+        cov,
+    )
+
+    flex.set_random_seed(0)
+    n, h, ntrials = 200, 120, 7
+    data = [flex.random_double(n), flex.random_double(n), flex.random_double(n)]
+    data[1] += data[0]
+    data[2] += data[1]
+
+    # the batched calculations must match the calculations for each trial in turn
+    subsets = [flex.random_selection(n, 20) for i in range(ntrials)]
+    rows = flex.size_t()
+    for sel in subsets:
+        rows.extend(sel)
+    centers, covs = batch_means_and_covariance([c.select(rows) for c in data], ntrials)
+    det, L = batch_cholesky(covs, 3)
+    tiled = [flex.double() for c in data]
+    for i in range(ntrials):
+        for t, c in zip(tiled, data):
+            t.extend(c)
+    H = batch_concentration_step(h, tiled, centers, L)
+    for i, sel in enumerate(subsets):
+        T, S = FastMCD.means_and_covariance([c.select(sel) for c in data])
+        assert approx_equal([c[i] for c in centers], T)
+        for j in range(3):
+            for k in range(j, 3):
+                assert approx_equal(covs[j, k][i], S[j, k])
+        assert approx_equal(det[i], S.matrix_determinant_via_lu())
+        H1 = FastMCD.concentration_step(h, data, T, S)
+        assert approx_equal(cov(*H1), cov(*[c[i * h : (i + 1) * h] for c in H]))
+
+    # a singular covariance matrix has zero determinant
+    centers, covs = batch_means_and_covariance(
+        [flex.double(range(4)), flex.double(range(4))], 1
+    )
+    det, L = batch_cholesky(covs, 2)
+    assert approx_equal(det[0], 0.0)
@@ -876,6 +876,77 @@ def test_split_by_experiment_id():
         assert list(res.experiment_identifiers().values()) == [str(exp)]
 
 
+def test_split_views_by_experiment_id():
+    r = flex.reflection_table()
+    r["id"] = flex.int([5, 0, -1, 1, 0, 5, 1, -1, 0])
+    r["intensity"] = flex.double(range(9))
+    r.set_flags(flex.size_t([1, 5]), r.flags.bad_for_scaling)
+    r.experiment_identifiers()[0] = "0"
+    r.experiment_identifiers()[1] = "1"
+    r.experiment_identifiers()[5] = "5"
+
+    views = r.split_views_by_experiment_id()
+    assert list(views.keys()) == [0, 1, 5]
+    expected = {0: [1, 4, 8], 1: [3, 6], 5: [0, 5]}
+    for id_, view in views.items():
+        assert view.experiment_id == id_
+        assert view.identifier() == str(id_)
+        assert list(view.indices) == expected[id_]
+        assert len(view) == len(expected[id_])
+        assert "intensity" in view
+        assert list(view["intensity"]) == [float(i) for i in expected[id_]]
+        assert list(view.get_flags(view.flags.bad_for_scaling)) == [
+            i in (1, 5) for i in expected[id_]
+        ]
+        selected = view.select(view["intensity"] > 1)
+        assert list(selected["intensity"]) == [float(i) for i in expected[id_] if i > 1]
+        assert list(selected.experiment_identifiers().keys()) == [id_]
+
+    # Writing to a view copies its reflections, leaving the table unchanged
+    view = views[0]
+    view["intensity"] = flex.double(3, 10)
+    assert list(view["intensity"]) == [10, 10, 10]
+    assert list(r["intensity"]) == [float(i) for i in range(9)]
+    table = view.table()
+    assert isinstance(table, flex.reflection_table)
+    assert list(table["id"]) == [0, 0, 0]
+    assert list(table.experiment_identifiers().keys()) == [0]
+
+    # Anything else is done with the copied reflections
+    assert list(views[1].experiment_identifiers().values()) == ["1"]
+    assert views[1].size() == 2
+
+
+def test_reflection_table_view_columns():
+    r = flex.reflection_table()
+    r["id"] = flex.int([0, 1, 0, 1])
+    r["intensity"] = flex.double(range(4))
+    views = r.split_views_by_experiment_id()
+
+    # A column read from a view may be modified in place, leaving the table
+    # unchanged, and the changes are kept when the view is copied
+    view = views[0]
+    view["intensity"].set_selected(flex.size_t([0]), 10)
+    view["intensity"][1] = 20
+    assert list(view["intensity"]) == [10, 20]
+    view["variance"] = flex.double(2, 1)
+    assert list(view["intensity"]) == [10, 20]
+    assert list(view.table()["intensity"]) == [10, 20]
+    assert list(r["intensity"]) == [0, 1, 2, 3]
+
+    view = views[1]
+    view["intensity"] *= 2
+    assert list(view.select(flex.size_t([1]))["intensity"]) == [6]
+
+    # A view may not be read once the table has changed size
+    views = r.split_views_by_experiment_id()
+    r.del_selected(flex.size_t([0]))
+    with pytest.raises(AssertionError):
+        views[0]["intensity"]
+    with pytest.raises(AssertionError):
+        views[1].table()
+
+
 def test_split_indices_by_experiment_id():
     from dials.array_family import flex
 
@@ -260,3 +260,56 @@ def test_failed_tolerance_error(dials_regression, monkeypatch):
         script.run_with_preparsed(params, options)
     assert "Beam" in exc.value.message
     print("Got error message:", exc.value.message)
+
+
+@pytest.mark.parametrize("max_batch_size", [None, 5])
+def test_streaming(dials_regression, run_in_tmpdir, max_batch_size):
+    """Streaming gives the same output as combining all of the input at once"""
+    data_dir = os.path.join(
+        dials_regression, "refinement_test_data", "multi_narrow_wedges", "data"
+    )
+    files = []
+    for i in range(2, 8):
+        files.append(os.path.join(data_dir, "sweep_%03d" % i, "experiments.json"))
+        files.append(os.path.join(data_dir, "sweep_%03d" % i, "reflections.pickle"))
+    if max_batch_size is not None:
+        files.append("output.max_batch_size=%d" % max_batch_size)
+
+    for streaming in (False, True):
+        result = procrunner.run(
+            ["dials.combine_experiments"]
+            + files
+            + [
+                "reference_from_experiment.beam=0",
+                "output.streaming=%s" % streaming,
+                "output.experiments_filename=%s.json" % streaming,
+                "output.reflections_filename=%s.pickle" % streaming,
+            ]
+        )
+        assert result["exitcode"] == 0
+        assert result["stderr"] == ""
+
+    # The same files are written, with the same content
+    expected_files = sorted(f for f in os.listdir(".") if f.startswith("False"))
+    streamed_files = sorted(f for f in os.listdir(".") if f.startswith("True"))
+    assert [f.replace("True", "False") for f in streamed_files] == expected_files
+    if max_batch_size is not None:
+        assert len(expected_files) > 2
+    for exp_name in (f for f in expected_files if f.endswith(".json")):
+        expected, streamed = (
+            ExperimentListFactory.from_json_file(
+                exp_name.replace("False", s), check_format=False
+            )
+            for s in ("False", "True")
+        )
+        assert len(streamed) == len(expected)
+        assert len(streamed.beams()) == 1
+        for e1, e2 in zip(expected, streamed):
+            assert e1.crystal == e2.crystal
+    for refl_name in (f for f in expected_files if f.endswith(".pickle")):
+        expected, streamed = (
+            flex.reflection_table.from_pickle(refl_name.replace("False", s))
+            for s in ("False", "True")
+        )
+        assert list(streamed["id"]) == list(expected["id"])
+        assert list(streamed["miller_index"]) == list(expected["miller_index"])
@@ -100,6 +100,57 @@ def test_mtz_multi_wavelength(dials_data, run_in_tmpdir):
     assert wavelengths == [0, 0.5, 1.0]  # base, dataset1, dataset2
 
 
+@pytest.mark.parametrize("without_profiles", [False, True])
+def test_mtz_streaming(dials_data, run_in_tmpdir, without_profiles):
+    """Test that streaming mtz export gives the same output as the default,
+    also when only one experiment has no profile fitted reflections"""
+    mcp = dials_data("multi_crystal_proteinase_k")
+    exps = load.experiment_list(
+        mcp.join("experiments_1.json").strpath, check_format=False
+    )
+    exps.extend(
+        load.experiment_list(mcp.join("experiments_2.json").strpath, check_format=False)
+    )
+    refls = [
+        flex.reflection_table.from_pickle(mcp.join("reflections_1.pickle").strpath),
+        flex.reflection_table.from_pickle(mcp.join("reflections_2.pickle").strpath),
+    ]
+    if without_profiles:
+        refls[1].unset_flags(
+            flex.bool(len(refls[1]), True), refls[1].flags.integrated_prf
+        )
+    exps, refls = assign_unique_identifiers(exps, refls)
+    joint_refl = flex.reflection_table()
+    for r in refls:
+        joint_refl.extend(r)
+    dump.experiment_list(exps, "tmp_exp.json")
+    joint_refl.as_pickle("tmp_refl.pickle")
+
+    for streaming in (False, True):
+        result = procrunner.run(
+            [
+                "dials.export",
+                "experiments=tmp_exp.json",
+                "reflections=tmp_refl.pickle",
+                "format=mtz",
+                "mtz.streaming=%s" % streaming,
+                "mtz.hklout=streaming_%s.mtz" % streaming,
+            ],
+            environment_override={"DIALS_EXPORT_DO_NOT_CHECK_FORMAT": "True"},
+            working_directory=run_in_tmpdir.strpath,
+        )
+        assert result["exitcode"] == 0
+        assert result["stderr"] == ""
+
+    m1 = mtz.object("streaming_False.mtz")
+    m2 = mtz.object("streaming_True.mtz")
+    assert m1.n_reflections() == m2.n_reflections()
+    assert m1.column_labels() == m2.column_labels()
+    assert [b.num() for b in m1.batches()] == [b.num() for b in m2.batches()]
+    for c1, c2 in zip(m1.columns(), m2.columns()):
+        assert list(c1.extract_values()) == list(c2.extract_values())
+
+
 def test_mmcif(dials_data, tmpdir):
     # Call dials.export after integration
     result = procrunner.run(
@@ -139,3 +139,27 @@ def test_export_restricted_multiimage(dials_data, tmpdir):
     assert [f.basename for f in tmpdir.listdir("*.png")] == [
         "image0002.png"
     ], "Only one image expected"
+
+
+def test_export_multiple_bitmaps_in_parallel(dials_data, tmpdir):
+    for nproc in (1, 3):
+        result = procrunner.run(
+            [
+                "dials.export_bitmaps",
+                dials_data("centroid_test_data").join("experiments.json").strpath,
+                "prefix=nproc%d_" % nproc,
+                "display=threshold",
+                "nproc=%d" % nproc,
+            ],
+            working_directory=tmpdir.strpath,
+        )
+        assert not result["exitcode"] and not result["stderr"]
+
+    for i in range(1, 10):
+        serial = tmpdir.join("nproc1_%04i.png" % i)
+        parallel = tmpdir.join("nproc3_%04i.png" % i)
+        assert serial.check(file=1)
+        assert parallel.read_binary() == serial.read_binary()
+    assert result["stdout"].index(b"nproc3_0001.png") < result["stdout"].index(
+        b"nproc3_0009.png"
+    )
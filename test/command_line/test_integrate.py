@@ -136,6 +136,38 @@ def test_integration_with_sample_size(dials_data, tmpdir):
     assert len(table) == 500
 
 
+def test_threaded_integration_with_concurrent_tasks(dials_data, tmpdir):
+    tables = []
+    for ntasks in (1, 3):
+        output = "integrated_%d.pickle" % ntasks
+        result = procrunner.run(
+            [
+                "dials.integrate",
+                dials_data("centroid_test_data").join("experiments.json"),
+                "profile.fitting=False",
+                "integration.integrator=3d_threaded",
+                "integration.block.size=3",
+                "integration.block.units=frames",
+                "integration.mp.njobs=3",
+                "integration.mp.ntasks=%d" % ntasks,
+                "prediction.padding=0",
+                "output.reflections=%s" % output,
+            ],
+            working_directory=tmpdir,
+        )
+        assert result["exitcode"] == 0
+        assert result["stderr"] == ""
+        with tmpdir.join(output).open("rb") as fh:
+            tables.append(pickle.load(fh))
+
+    # the tasks are independent so the results must be the same
+    assert len(tables[0]) == len(tables[1])
+    assert list(tables[0]["miller_index"]) == list(tables[1]["miller_index"])
+    assert list(tables[0]["intensity.sum.value"]) == list(
+        tables[1]["intensity.sum.value"]
+    )
+
+
 def test_multi_sweep(dials_regression, run_in_tmpdir):
     result = procrunner.run(
         [
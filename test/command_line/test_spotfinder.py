@@ -227,3 +227,157 @@ def test_find_spots_with_xfel_stills(dials_regression, tmpdir):
     with tmpdir.join("spotfinder.pickle").open("rb") as f:
         reflections = pickle.load(f)
     assert len(reflections) == 2643
+
+
+def test_find_spots_incremental(dials_data, tmpdir):
+    images = sorted(
+        f.strpath for f in dials_data("centroid_test_data").listdir("centroid*.cbf")
+    )
+
+    # Find spots on all the images in one go
+    result = procrunner.run(
+        ["dials.find_spots", "output.reflections=all.pickle"] + images,
+        working_directory=tmpdir.strpath,
+    )
+    assert result["exitcode"] == 0
+    assert result["stderr"] == ""
+
+    # Find spots as the images "arrive", a few at a time. The state file is
+    # only appended to.
+    state = b""
+    for n in (3, 4, 9):
+        result = procrunner.run(
+            [
+                "dials.find_spots",
+                "incremental.state=state.pickle",
+                "per_image_statistics=True",
+                "output.reflections=incremental.pickle",
+            ]
+            + images[:n],
+            working_directory=tmpdir.strpath,
+        )
+        assert result["exitcode"] == 0
+        assert result["stderr"] == ""
+        assert tmpdir.join("state.pickle").check(file=1)
+        assert tmpdir.join("state.pickle.open").check(file=1)
+        previous, state = state, tmpdir.join("state.pickle").read_binary()
+        assert len(state) > len(previous)
+        assert state.startswith(previous)
+
+    with tmpdir.join("all.pickle").open("rb") as f:
+        expected = pickle.load(f)
+    with tmpdir.join("incremental.pickle").open("rb") as f:
+        reflections = pickle.load(f)
+    assert len(reflections) == len(expected)
+    expected.sort("xyzobs.px.value")
+    reflections.sort("xyzobs.px.value")
+    for a, b in zip(reflections["xyzobs.px.value"], expected["xyzobs.px.value"]):
+        assert a == pytest.approx(b)
+
+    # Changing the threshold parameters is an error
+    result = procrunner.run(
+        [
+            "dials.find_spots",
+            "incremental.state=state.pickle",
+            "output.reflections=incremental.pickle",
+            "threshold.dispersion.gain=2",
+        ]
+        + images,
+        working_directory=tmpdir.strpath,
+    )
+    assert result["exitcode"] != 0
+
+
+def test_find_spots_with_pixel_cache(dials_data, tmpdir):
+    images = sorted(
+        f.strpath for f in dials_data("centroid_test_data").listdir("centroid*.cbf")
+    )
+
+    def find_spots(output, *args):
+        result = procrunner.run(
+            [
+                "dials.find_spots",
+                "cache.directory=cache",
+                "output.reflections=%s" % output,
+            ]
+            + list(args)
+            + images,
+            working_directory=tmpdir.strpath,
+        )
+        assert result["exitcode"] == 0
+        assert result["stderr"] == ""
+        with tmpdir.join(output).open("rb") as f:
+            return pickle.load(f), result["stdout"]
+
+    # The first run populates the cache
+    first, _ = find_spots("first.pickle", "min_spot_size=3")
+    assert len(tmpdir.join("cache").listdir("*.pickle")) == len(images)
+
+    # Changing only the spot size filter reuses the cached pixels
+    cached, stdout = find_spots("cached.pickle", "min_spot_size=6")
+    assert b"(cached)" in stdout
+    assert len(tmpdir.join("cache").listdir("*.pickle")) == len(images)
+    result = procrunner.run(
+        ["dials.find_spots", "min_spot_size=6", "output.reflections=direct.pickle"]
+        + images,
+        working_directory=tmpdir.strpath,
+    )
+    assert result["exitcode"] == 0
+    with tmpdir.join("direct.pickle").open("rb") as f:
+        direct = pickle.load(f)
+    assert len(cached) == len(direct) < len(first)
+    assert list(cached["bbox"]) == list(direct["bbox"])
+
+    # Changing the threshold parameters gives new cache entries
+    find_spots("gain.pickle", "threshold.dispersion.gain=2")
+    assert len(tmpdir.join("cache").listdir("*.pickle")) == 2 * len(images)
+
+    # As does changing the region of interest, giving the spots found without
+    # the cache
+    roi, stdout = find_spots("roi.pickle", "region_of_interest=0,1000,0,1000")
+    assert b"(cached)" not in stdout
+    assert len(tmpdir.join("cache").listdir("*.pickle")) == 3 * len(images)
+    result = procrunner.run(
+        ["dials.find_spots", "region_of_interest=0,1000,0,1000"]
+        + ["output.reflections=direct_roi.pickle"]
+        + images,
+        working_directory=tmpdir.strpath,
+    )
+    assert result["exitcode"] == 0
+    with tmpdir.join("direct_roi.pickle").open("rb") as f:
+        direct = pickle.load(f)
+    assert len(roi) == len(direct) < len(first)
+    assert list(roi["bbox"]) == list(direct["bbox"])
+
+
+def test_incremental_state_key(tmpdir):
+    from dials.command_line.find_spots import incremental_state_key, phil_scope
+
+    params = phil_scope.extract()
+    key = incremental_state_key(params)
+    params.spotfinder.mp.nproc = 4
+    assert incremental_state_key(params) == key
+
+    # The parameters which affect the strong pixels change the key
+    for name, value in (
+        ("threshold.dispersion.gain", 2.0),
+        ("filter.min_spot_size", 3),
+        ("filter.max_strong_pixel_fraction", 0.5),
+        ("filter.ice_rings.filter", True),
+        ("region_of_interest", [0, 100, 0, 100]),
+    ):
+        params = phil_scope.extract()
+        scope = params.spotfinder
+        for attr in name.split(".")[:-1]:
+            scope = getattr(scope, attr)
+        setattr(scope, name.split(".")[-1], value)
+        assert incremental_state_key(params) != key, name
+
+    # As do the contents of the mask
+    mask = tmpdir.join("mask.pickle")
+    mask.write("a")
+    params = phil_scope.extract()
+    params.spotfinder.lookup.mask = mask.strpath
+    key = incremental_state_key(params)
+    mask.write("b")
+    assert incremental_state_key(params) != key
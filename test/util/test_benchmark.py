@@ -0,0 +1,123 @@
+from __future__ import absolute_import, division, print_function
+
+import copy
+import sys
+
+import numpy as np
+import pytest
+
+from dials.util import benchmark
+
+
+def test_stages_to_run():
+    assert [s.name for s in benchmark.stages_to_run()] == [
+        s.name for s in benchmark.STAGES
+    ]
+    assert [s.name for s in benchmark.stages_to_run(["export", "index.fft1d"])] == [
+        "import",
+        "find_spots",
+        "index.fft1d",
+        "index.fft3d",
+        "refine.static",
+        "refine.scan_varying",
+        "integrate.3d",
+        "scale",
+        "export",
+    ]
+
+
+def test_pixel_fractions():
+    centre = np.array([10.3, 20.5])
+    first = np.array([7, 17])
+    fractions = benchmark._pixel_fractions(centre, 1.0, first, 7)
+    assert fractions.shape == (2, 7)
+    assert fractions.sum(axis=1) == pytest.approx([1, 1], abs=1e-3)
+    # the fractions are symmetric about a centre in the middle of a pixel
+    assert fractions[1] == pytest.approx(fractions[1][::-1])
+    assert np.argmax(fractions[0]) == 3
+
+
+def test_run_stage(tmpdir):
+    # allocate and touch 100 MB
+    command = [sys.executable, "-c", "x = bytearray(10 ** 8); print('done')"]
+    result = benchmark.run_stage(
+        command, tmpdir.strpath, tmpdir.join("allocate.log").strpath
+    )
+    assert result["status"] == "ok"
+    assert result["peak_memory"] > 10 ** 8
+    assert result["wall_time"] >= result["cpu_time"] * 0.5
+    assert tmpdir.join("allocate.log").read().strip() == "done"
+
+    command = [sys.executable, "-c", "import sys; sys.exit(1)"]
+    result = benchmark.run_stage(
+        command, tmpdir.strpath, tmpdir.join("fail.log").strpath
+    )
+    assert result["status"] == "failed"
+
+
+def test_compare():
+    def stage(wall_time, peak_memory, status="ok"):
+        return {
+            "status": status,
+            "wall_time": wall_time,
+            "cpu_time": wall_time,
+            "peak_memory": peak_memory,
+        }
+
+    reference = {
+        "sizes": {
+            "small": {
+                "dataset": benchmark.dataset_parameters("small"),
+                "stages": {
+                    "find_spots": stage(10.0, 1e9),
+                    "index.fft3d": stage(0.5, 1e9),
+                    "refine.static": stage(20.0, 1e9),
+                    "scale": stage(20.0, 1e9, status="failed"),
+                },
+            }
+        }
+    }
+    results = copy.deepcopy(reference)
+    assert benchmark.compare(reference, results) == []
+
+    stages = results["sizes"]["small"]["stages"]
+    # slower, but by less than the tolerance
+    stages["find_spots"] = stage(10.5, 1.05e9)
+    # twice as slow, but by less than min_time
+    stages["index.fft3d"] = stage(1.0, 1e9)
+    # previously failed
+    stages["scale"] = stage(100.0, 1e10)
+    assert benchmark.compare(reference, results) == []
+
+    stages["find_spots"] = stage(12.0, 1.2e9)
+    stages["refine.static"] = stage(20.0, 1e9, status="skipped")
+    regressions = benchmark.compare(reference, results)
+    assert sorted(regressions) == [
+        ("small", "find_spots", "cpu_time", 10.0, 12.0),
+        ("small", "find_spots", "peak_memory", 1e9, 1.2e9),
+        ("small", "find_spots", "wall_time", 10.0, 12.0),
+        ("small", "refine.static", "status", "ok", "skipped"),
+    ]
+    assert len(benchmark.compare(reference, results, memory_tolerance=0.5)) == 3
+
+    # datasets simulated differently are not compared
+    results["sizes"]["small"]["dataset"] = benchmark.dataset_parameters("small", seed=1)
+    assert benchmark.compare(reference, results) == []
+
+
+@pytest.mark.slow
+def test_benchmark_small(tmpdir):
+    results = benchmark.run_benchmark(["small"], tmpdir.strpath)
+    benchmark.as_json(results, tmpdir.join("benchmark.json").strpath)
+    loaded = benchmark.from_json(tmpdir.join("benchmark.json").strpath)
+    stages = loaded["sizes"]["small"]["stages"]
+    assert list(stages) == [s.name for s in benchmark.STAGES]
+    for name, result in stages.items():
+        assert result["status"] == "ok", name
+        assert result["peak_memory"] > 0
+    assert loaded["sizes"]["small"]["dataset"]["n_reflections"] > 0
+    assert benchmark.compare(loaded, loaded) == []
+
+    # The simulated images are reused
+    dataset = benchmark.simulate_dataset(tmpdir.join("small").strpath, "small")
+    assert dataset == loaded["sizes"]["small"]["dataset"]
@@ -0,0 +1,171 @@
+from __future__ import absolute_import, division, print_function
+
+import random
+import time
+
+import pytest
+from six.moves import cStringIO as StringIO
+
+from dials.array_family import flex
+from dials.util.chunked_writer import (
+    cif_loop_from_columns,
+    miller_index_sort_permutation,
+    write_formatted_rows,
+)
+from scitbx import matrix
+
+
+def _random_miller_indices(n, seed=0):
+    random.seed(seed)
+    indices = [tuple(random.randint(-30, 30) for i in range(3)) for j in range(n)]
+    return flex.miller_index([hkl for hkl in indices if hkl != (0, 0, 0)])
+
+
+def _random_ub():
+    U = matrix.col((1, 2, 3)).normalize().axis_and_angle_as_r3_rotation_matrix(0.3)
+    B = matrix.sqr((0.02, 0.001, 0.002, 0, 0.018, 0.003, 0, 0, 0.012))
+    return U * B
+
+
+def test_write_formatted_rows():
+    fmt = "%4d%8.2f %s\n"
+    a = flex.int(range(1234))
+    b = flex.double(range(1234)) / 7
+    c = ["x%d" % i for i in range(1234)]
+    out = StringIO()
+    assert write_formatted_rows(out, fmt, [a, b, c], chunk_size=100) == 1234
+    assert out.getvalue() == "".join(fmt % row for row in zip(a, b, c))
+
+    out = StringIO()
+    assert write_formatted_rows(out, fmt, []) == 0
+    assert out.getvalue() == ""
+
+
+def test_miller_index_sort_permutation():
+    miller_index = _random_miller_indices(5000)
+    perm = miller_index_sort_permutation(miller_index)
+    expected = sorted(range(len(miller_index)), key=lambda i: miller_index[i])
+    assert list(perm) == expected
+
+
+def test_cif_loop_from_columns():
+    iotbx_cif_model = pytest.importorskip("iotbx.cif.model")
+    header = ("_a.id", "_a.index_h", "_a.value")
+    ids = flex.size_t_range(1, 101)
+    h = flex.int(range(-50, 50))
+    value = flex.double(range(100)) / 3
+    loop = iotbx_cif_model.loop(header=header)
+    for row in zip(ids, h, value):
+        loop.add_row(row)
+    expected = StringIO()
+    loop.show(out=expected)
+    out = StringIO()
+    cif_loop_from_columns(header, [ids, h, value]).show(out=out)
+    assert out.getvalue() == expected.getvalue()
+
+
+def _psi_reference(miller_index, z, UB, axis, s0, phi_start, phi_range):
+    # The per-reflection calculation previously done in export_xds_ascii
+    result = []
+    for j in range(len(miller_index)):
+        phi = phi_start + z[j] * phi_range
+        h, k, l = miller_index[j]
+        X = (UB * (h, k, l)).rotate(axis, phi, deg=True)
+        s = s0 + X
+        g = s.cross(s0).normalize()
+        e = -(s + s0).normalize()
+        if h == k and k == l:
+            u = (h, -h, 0)
+        else:
+            u = (k - l, l - h, h - k)
+        q = (
+            (matrix.col(u).transpose() * UB.inverse())
+            .normalize()
+            .transpose()
+            .rotate(axis, phi, deg=True)
+        )
+        psi = q.angle(g, deg=True)
+        if q.dot(e) < 0:
+            psi *= -1
+        result.append(psi)
+    return result
+
+
+def _experiment(UB, axis, s0, phi_start, phi_range):
+    from dxtbx.model import (
+        Beam,
+        Crystal,
+        DetectorFactory,
+        Goniometer,
+        ScanFactory,
+    )
+    from dxtbx.model.experiment_list import Experiment
+
+    real_space = UB.inverse().elems
+    return Experiment(
+        beam=Beam((-s0.normalize()).elems, 1 / s0.length()),
+        detector=DetectorFactory.simple(
+            "PAD", 100, (50, 50), "+x", "-y", (0.172, 0.172), (487, 619)
+        ),
+        goniometer=Goniometer(axis.elems),
+        scan=ScanFactory.make_scan(
+            image_range=(1, 450),
+            exposure_times=0.1,
+            oscillation=(phi_start, phi_range),
+            epochs=list(range(450)),
+            deg=True,
+        ),
+        crystal=Crystal(
+            real_space[0:3], real_space[3:6], real_space[6:9], space_group_symbol="P 1"
+        ),
+    )
+
+
+def test_calculate_psi():
+    from dials.util.export_xds_ascii import calculate_psi
+
+    miller_index = _random_miller_indices(2000)
+    miller_index.append((3, 3, 3))
+    z = flex.random_double(len(miller_index)) * 90
+    UB = _random_ub()
+    axis = matrix.col((1, 0, 0))
+    s0 = matrix.col((0, 0, -1 / 0.9795))
+    experiment = _experiment(UB, axis, s0, 0.0, 0.2)
+    psi = calculate_psi(experiment, miller_index, z)
+    expected = _psi_reference(miller_index, z, UB, axis, s0, 0.0, 0.2)
+    assert ["%f" % p for p in psi] == ["%f" % p for p in expected]
+
+
+@pytest.mark.slow
+def test_xds_ascii_writer_benchmark():
+    from dials.util.export_xds_ascii import calculate_psi
+
+    n = 200000
+    miller_index = _random_miller_indices(n)
+    n = len(miller_index)
+    z = flex.random_double(n) * 90
+    UB = _random_ub()
+    axis = matrix.col((1, 0, 0))
+    s0 = matrix.col((0, 0, -1 / 0.9795))
+    fmt = "%d %d %d %f\n"
+
+    t0 = time.time()
+    psi = _psi_reference(miller_index, z, UB, axis, s0, 0.0, 0.2)
+    out = StringIO()
+    for (h, k, l), p in zip(miller_index, psi):
+        out.write(fmt % (h, k, l, p))
+    t_reference = time.time() - t0
+
+    t0 = time.time()
+    psi = calculate_psi(_experiment(UB, axis, s0, 0.0, 0.2), miller_index, z)
+    h, k, l = [c.iround() for c in miller_index.as_vec3_double().parts()]
+    out2 = StringIO()
+    write_formatted_rows(out2, fmt, [h, k, l, psi])
+    t_vectorised = time.time() - t0
+
+    print(
+        "%d reflections: per-row %.2fs, vectorised %.2fs (%.1fx)"
+        % (n, t_reference, t_vectorised, t_reference / t_vectorised)
+    )
+    assert out2.getvalue() == out.getvalue()
+    assert t_vectorised < t_reference
@@ -0,0 +1,89 @@
+from __future__ import absolute_import, division, print_function
+
+import json
+import os
+
+import pytest
+from six.moves import cPickle as pickle
+
+from dials.util.file_reading import (
+    ExperimentListCache,
+    has_extension,
+    is_json_file,
+    read_experiment_list_dicts,
+)
+
+
+def test_has_extension():
+    assert has_extension("indexed.expt", (".expt",))
+    assert has_extension("/data/INDEXED.EXPT", (".expt",))
+    assert not has_extension("indexed.refl", (".expt",))
+    assert not has_extension("expt", (".expt",))
+
+
+def test_is_json_file(tmpdir):
+    experiments = tmpdir.join("experiments.json")
+    experiments.write('\n  {"__id__": "ExperimentList"}')
+    assert is_json_file(experiments.strpath)
+    reflections = tmpdir.join("reflections.pickle")
+    reflections.write_binary(pickle.dumps({"miller_index": []}, 2))
+    assert not is_json_file(reflections.strpath)
+    assert not is_json_file(tmpdir.join("empty").ensure().strpath)
+
+
+def test_experiment_list_cache(tmpdir):
+    filename = tmpdir.join("models.expt")
+    filename.write("{}")
+    cache = ExperimentListCache(tmpdir.join("cache").strpath)
+    assert filename.strpath not in cache
+    assert cache.get(filename.strpath) is None
+
+    cache.put(filename.strpath, {"experiment": [1, 2, 3]})
+    assert filename.strpath in cache
+    assert cache.get(filename.strpath) == {"experiment": [1, 2, 3]}
+
+    # Changing the file invalidates the entry
+    filename.write("{ }")
+    assert filename.strpath not in cache
+    assert cache.get(filename.strpath) is None
+
+
+@pytest.mark.parametrize("nproc", [1, 3])
+def test_read_experiment_list_dicts(tmpdir, nproc):
+    from dxtbx.model.experiment_list import InvalidExperimentListError
+
+    filenames = []
+    for i in range(12):
+        filename = tmpdir.join("%d.expt" % i)
+        filename.write(json.dumps({"__id__": "ExperimentList", "index": i}))
+        filenames.append(filename.strpath)
+    bad = tmpdir.join("bad.expt")
+    bad.write("{")
+    filenames.insert(5, bad.strpath)
+    not_json = tmpdir.join("reflections.pickle")
+    not_json.write_binary(pickle.dumps(list(range(10)), 2))
+    filenames.insert(8, not_json.strpath)
+    filenames.append(tmpdir.join("missing.expt").strpath)
+    cache_dir = tmpdir.join("cache").strpath
+
+    def read():
+        return list(
+            read_experiment_list_dicts(filenames, nproc=nproc, cache_dir=cache_dir)
+        )
+
+    results = read()
+    assert [result[0] for result in results] == filenames
+    assert [result[1]["index"] for result in results if result[1]] == list(range(12))
+    assert isinstance(results[5][2][0], ValueError)
+    assert isinstance(results[8][2][0], InvalidExperimentListError)
+    assert isinstance(results[-1][2][0], (IOError, OSError))
+
+    # All but the invalid files are now cached, and read from the cache
+    assert len(os.listdir(cache_dir)) == 12
+    assert [result[1] for result in read()] == [result[1] for result in results]
+
+    # Until the file is changed
+    st = os.stat(filenames[0])
+    os.utime(filenames[0], (st.st_atime, st.st_mtime + 10))
+    assert read()[0][1] == results[0][1]
+    assert len(os.listdir(cache_dir)) == 13
@@ -0,0 +1,141 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+
+from scitbx.array_family import flex
+from dials.util import frame_cache
+from dials.util.frame_cache import FrameCache
+
+
+class _Panel(object):
+    def get_gain(self):
+        return 1.0
+
+
+class _Lookup(object):
+    class gain(object):
+        filename = None
+
+    class pedestal(object):
+        filename = None
+
+
+class _ImageSet(object):
+    """An imageset of two panel images in files, counting the images read"""
+
+    def __init__(self, directory, n_images=4):
+        self.paths = []
+        for i in range(n_images):
+            path = os.path.join(directory, "image_%03d.cbf" % (i + 1))
+            with open(path, "w") as fh:
+                fh.write("image %d" % i)
+            self.paths.append(path)
+        self.external_lookup = _Lookup()
+        self.reads = 0
+
+    def __len__(self):
+        return len(self.paths)
+
+    def get_path(self, index):
+        return self.paths[index]
+
+    def get_format_class(self):
+        return _ImageSet
+
+    def get_detector(self):
+        return [_Panel(), _Panel()]
+
+    def indices(self):
+        return list(range(len(self)))
+
+    def get_raw_data(self, index):
+        self.reads += 1
+        data = flex.int(flex.grid(20, 30), index)
+        return data, data + 1
+
+    def get_corrected_data(self, index):
+        self.reads += 1
+        data = flex.double(flex.grid(20, 30), index + 0.5)
+        return data, data * 2
+
+
+def test_memory_cache(tmpdir):
+    imageset = _ImageSet(tmpdir.strpath)
+    # Room for three frames of raw data
+    cache = FrameCache(memory_bytes=3 * 2 * 20 * 30 * 4)
+    for index in (0, 1, 2, 0, 3, 0, 1):
+        data = cache.get_raw_data(imageset, index)
+        assert len(data) == 2
+        assert list(data[1]) == [index + 1] * 600
+    # Frame 1 is evicted by frame 3
+    assert imageset.reads == 5
+    assert cache.stats() == {"memory_hits": 2, "store_hits": 0, "misses": 5}
+
+    # The data returned may be modified
+    data = cache.get_raw_data(imageset, 0)
+    data[0][0] = 100
+    assert cache.get_raw_data(imageset, 0)[0][0] == 0
+
+    # The raw and corrected data are different frames
+    assert cache.get_corrected_data(imageset, 0)[1][0] == 1.0
+    assert imageset.reads == 6
+
+    # A frame is read again when the file changes
+    with open(imageset.get_path(0), "a") as fh:
+        fh.write(" changed")
+    cache.get_raw_data(imageset, 0)
+    assert imageset.reads == 7
+
+
+def test_mapped_frame_store(tmpdir):
+    imageset = _ImageSet(tmpdir.mkdir("images").strpath)
+    directory = tmpdir.join("scratch").strpath
+    cache = FrameCache(directory=directory)
+    for index in range(4):
+        cache.get_corrected_data(imageset, index)
+    assert imageset.reads == 4
+    assert len(os.listdir(directory)) == 4
+
+    # Another cache, as in another process, reads the frames from the store
+    other = FrameCache(memory_bytes=10 ** 6, directory=directory)
+    for index in (3, 2, 3):
+        data = other.get_corrected_data(imageset, index)
+        assert isinstance(data[0], flex.double)
+        assert data[0].all() == (20, 30)
+        assert list(data[1]) == [2 * index + 1.0] * 600
+    assert imageset.reads == 4
+    assert other.stats() == {"memory_hits": 1, "store_hits": 2, "misses": 0}
+    before = other.stats()
+    other.get_corrected_data(imageset, 0)
+    other.get_corrected_data(imageset, 0)
+    assert other.stats(since=before) == {
+        "memory_hits": 1,
+        "store_hits": 1,
+        "misses": 0,
+    }
+
+    # The store is limited in size, removing the least recently read frames
+    small = FrameCache(directory=directory, directory_bytes=3 * 14000)
+    small.get_raw_data(imageset, 0)
+    assert len(os.listdir(directory)) == 3
+    assert small.get_corrected_data(imageset, 3) is not None
+    assert small.stats()["store_hits"] == 1
+
+
+def test_disabled(tmpdir, monkeypatch):
+    imageset = _ImageSet(tmpdir.strpath)
+    monkeypatch.setattr(frame_cache, "_frame_cache", None)
+    monkeypatch.delenv("DIALS_FRAME_CACHE_MB", raising=False)
+    monkeypatch.delenv("DIALS_FRAME_CACHE_DIR", raising=False)
+    assert not frame_cache.frame_cache().enabled
+    frame_cache.get_raw_data(imageset, 0)
+    frame_cache.get_raw_data(imageset, 0)
+    assert imageset.reads == 2
+    assert frame_cache.frame_cache().stats()["misses"] == 0
+
+    monkeypatch.setattr(frame_cache, "_frame_cache", None)
+    monkeypatch.setenv("DIALS_FRAME_CACHE_MB", "1")
+    assert frame_cache.frame_cache().memory.max_bytes == 10 ** 6
+    frame_cache.get_raw_data(imageset, 0)
+    frame_cache.get_raw_data(imageset, 0)
+    assert imageset.reads == 3
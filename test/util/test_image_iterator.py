@@ -0,0 +1,88 @@
+from __future__ import absolute_import, division, print_function
+
+import threading
+import time
+
+import pytest
+
+from dials.util.image_iterator import imap_ordered, iterate_imageset
+
+
+def _square(item, data):
+    return data * data
+
+
+class _Reader(object):
+    """Read items slowly, in a random order, counting how many are read ahead"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.read = 0
+        self.consumed = 0
+        self.max_ahead = 0
+
+    def __call__(self, item):
+        time.sleep(0.001 * ((item * 7) % 5))
+        with self.lock:
+            self.read += 1
+            self.max_ahead = max(self.max_ahead, self.read - self.consumed)
+        return item + 1
+
+
+@pytest.mark.parametrize("nproc", [1, 3])
+def test_imap_ordered(nproc):
+    reader = _Reader()
+    results = []
+    for item, result in imap_ordered(
+        reader, _square, range(50), nthreads=4, nproc=nproc, max_queued=6
+    ):
+        with reader.lock:
+            reader.consumed += 1
+        results.append((item, result))
+    assert results == [(i, (i + 1) ** 2) for i in range(50)]
+    assert reader.max_ahead <= 6
+
+
+def test_imap_ordered_without_func():
+    results = list(imap_ordered(lambda item: -item, None, range(10), nthreads=3))
+    assert results == [(i, -i) for i in range(10)]
+    assert list(imap_ordered(lambda item: item, None, [])) == []
+
+
+def _fail(item, data):
+    if item == 3:
+        raise ValueError("bad item")
+    return data
+
+
+@pytest.mark.parametrize("nproc", [1, 2])
+def test_imap_ordered_raises(nproc):
+    results = []
+    with pytest.raises(ValueError):
+        for item, result in imap_ordered(
+            lambda item: item, _fail, range(10), nproc=nproc
+        ):
+            results.append(item)
+    assert results == [0, 1, 2]
+
+
+def test_imap_ordered_stops_early():
+    reader = _Reader()
+    for item, result in imap_ordered(reader, None, range(1000), max_queued=4):
+        if item == 5:
+            break
+    assert reader.read < 20
+
+
+def test_iterate_imageset_reads_in_one_thread():
+    threads = set()
+
+    def read(imageset, index):
+        threads.add(threading.current_thread().ident)
+        time.sleep(0.001)
+        return imageset[index]
+
+    imageset = list(range(20))
+    results = list(iterate_imageset(imageset, _square, read=read, nproc=2))
+    assert results == [(i, i * i) for i in range(20)]
+    assert len(threads) == 1
@@ -85,3 +85,47 @@ def test_flatten_experiments_updating_id_values():
     assert list(rs[1]["id"]) == [-1, 1, 1, 2, 2]
     assert list(rs[1].experiment_identifiers().keys()) == [1, 2]
     assert list(rs[1].experiment_identifiers().values()) == ["1", "2"]
+
+
+@pytest.mark.parametrize("processes", [1, 3])
+def test_read_many_files_in_order(tmpdir, processes):
+    """Read interleaved experiment list and reflection files in parallel, then
+    again with the decoded experiment lists from the cache."""
+    from dxtbx.model import Beam
+    from dxtbx.model.experiment_list import (
+        Experiment,
+        ExperimentList,
+        ExperimentListDumper,
+    )
+    from dials.util.phil import ExperimentListConverters, ReflectionTableConverters
+
+    args = []
+    for i in range(12):
+        experiments = ExperimentList(
+            [Experiment(beam=Beam((0, 0, 1), 1.0 + i), identifier=str(i))]
+        )
+        expt = tmpdir.join("%d_%d.expt" % (processes, i)).strpath
+        ExperimentListDumper(experiments).as_file(expt)
+        table = flex.reflection_table()
+        table["id"] = flex.int(i + 1, 0)
+        refl = tmpdir.join("%d_%d.refl" % (processes, i)).strpath
+        table.as_pickle(refl)
+        args.extend([expt, refl])
+    cache = tmpdir.join("cache").strpath
+    args.append("input.file_reading.processes=%d" % processes)
+    args.append("input.file_reading.experiment_cache=%s" % cache)
+
+    parser = OptionParser(read_experiments=True, read_reflections=True)
+    for attempt in range(2):
+        for filename in args[:-2]:
+            ExperimentListConverters.cache.pop(filename, None)
+            ReflectionTableConverters.cache.pop(filename, None)
+        params, options = parser.parse_args(args)
+        experiments = flatten_experiments(params.input.experiments)
+        reflections = flatten_reflections(params.input.reflections)
+        assert list(experiments.identifiers()) == [str(i) for i in range(12)]
+        assert [b.get_wavelength() for b in experiments.beams()] == [
+            1.0 + i for i in range(12)
+        ]
+        assert [r.size() for r in reflections] == list(range(1, 13))
+        assert len(tmpdir.join("cache").listdir()) == 12
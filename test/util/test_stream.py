@@ -0,0 +1,180 @@
+from __future__ import absolute_import, division, print_function
+
+import json
+import multiprocessing
+import socket
+import threading
+import time
+
+import pytest
+
+zmq = pytest.importorskip("zmq")
+
+
+def _header_frames(nx, ny):
+    head = {"htype": "dheader-1.0", "header_detail": "basic", "series": 1}
+    conf = {"x_pixels_in_detector": nx, "y_pixels_in_detector": ny}
+    return [json.dumps(head).encode(), json.dumps(conf).encode()]
+
+
+def _image_frames(count, data, nx, ny, encoding="<"):
+    head = {"htype": "dimage-1.0", "series": 1, "frame": count, "hash": ""}
+    info = {
+        "htype": "dimage_d-1.0",
+        "shape": [ny, nx],
+        "type": "int32",
+        "encoding": encoding,
+        "size": len(data),
+    }
+    time = {"htype": "dconfig-1.0", "start_time": 0, "stop_time": 0, "real_time": 0}
+    return [
+        json.dumps(head).encode(),
+        json.dumps(info).encode(),
+        data,
+        json.dumps(time).encode(),
+    ]
+
+
+def _end_frames():
+    return [json.dumps({"htype": "dseries_end-1.0", "series": 1}).encode()]
+
+
+def _waiting_worker(url, delay):
+    """A stand-in worker which connects after a delay and waits to be stopped"""
+    time.sleep(delay)
+    context = zmq.Context()
+    receiver = context.socket(zmq.PULL)
+    receiver.connect(url)
+    receiver.recv()
+    receiver.close(linger=0)
+    context.term()
+
+
+def test_image_decoding_is_zero_copy():
+    numpy = pytest.importorskip("numpy")
+    from dials.util.stream import Decoder
+
+    nx, ny = 5, 3
+    array = numpy.arange(nx * ny, dtype="<i4").reshape(ny, nx)
+    frames = [zmq.Frame(f) for f in _header_frames(nx, ny)]
+    decoder = Decoder(None, None)
+    assert decoder.decode(frames).is_header()
+
+    frames = [zmq.Frame(f) for f in _image_frames(7, array.tobytes(), nx, ny)]
+    image = decoder.decode(frames)
+    assert image.is_image()
+    assert image.count == 7
+    assert image.data == array.tobytes()
+
+    # The array is a view of the zmq message memory
+    view = image.as_numpy_array()
+    assert not view.flags.writeable
+    assert (view == array).all()
+
+    data = image.as_flex()
+    assert data.all() == (ny, nx)
+    assert list(data) == list(array.ravel())
+
+    # Big endian data are swapped before conversion
+    big_endian = array.astype(">i4").tobytes()
+    frames = [zmq.Frame(f) for f in _image_frames(8, big_endian, nx, ny, ">")]
+    data = decoder.decode(frames).as_flex()
+    assert data.all() == (ny, nx)
+    assert list(data) == list(array.ravel())
+
+
+def test_stream_spot_finder(dials_data, tmpdir):
+    pytest.importorskip("numpy")
+    from dials.algorithms.spot_finding.factory import phil_scope
+    from dials.algorithms.spot_finding.stream_processor import (
+        FrameProcessor,
+        StreamSpotFinder,
+    )
+    from dials.util.stream import ZMQStream
+    from dxtbx.model.experiment_list import ExperimentListFactory
+
+    experiments = ExperimentListFactory.from_json_file(
+        dials_data("centroid_test_data").join("experiments.json").strpath
+    )
+    imageset = experiments[0].imageset
+    nx, ny = imageset.get_detector()[0].get_image_size()
+    params = phil_scope.extract()
+
+    # Get a free port for the stand-in detector stream
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+
+    def publish(context):
+        sender = context.socket(zmq.PUSH)
+        sender.bind("tcp://127.0.0.1:%d" % port)
+        sender.send_multipart(_header_frames(nx, ny))
+        for i in range(len(imageset)):
+            if i == len(imageset) // 2:
+                # a repeated header restarts the workers
+                sender.send_multipart(_header_frames(nx, ny))
+            data = imageset.get_raw_data(i)[0].as_numpy_array().astype("<i4")
+            sender.send_multipart(_image_frames(i, data.tobytes(), nx, ny))
+        sender.send_multipart(_end_frames())
+        sender.close(linger=-1)
+
+    context = zmq.Context()
+    publisher = threading.Thread(target=publish, args=(context,))
+    publisher.start()
+
+    headers = []
+
+    def processor_factory(header):
+        headers.append(header)
+        return FrameProcessor.from_parameters(params, imageset)
+
+    spot_finder = StreamSpotFinder(processor_factory, nproc=2)
+    stream = ZMQStream("127.0.0.1", port)
+    try:
+        results = spot_finder.run(stream)
+    finally:
+        stream.close()
+        publisher.join()
+        context.term()
+
+    # The workers for the first header were stopped
+    assert len(headers) == 2
+    assert multiprocessing.active_children() == []
+
+    # One result per frame, in order
+    assert [r["frame"] for r in results] == list(range(len(imageset)))
+    assert all("error" not in r for r in results)
+    assert all(r["n_spots_total"] > 0 for r in results)
+    assert spot_finder.metrics["num_frames"] == len(imageset)
+    assert spot_finder.metrics["frames_per_second"] > 0
+    assert spot_finder.metrics["max_latency"] >= spot_finder.metrics["mean_latency"]
+
+
+def test_stop_workers(tmpdir):
+    from dials.algorithms.spot_finding.stream_processor import StreamSpotFinder
+
+    url = "ipc://" + tmpdir.join("distribute").strpath
+    context = zmq.Context()
+    distributor = context.socket(zmq.PUSH)
+    distributor.bind(url)
+
+    # A worker which connects late is still stopped, and one which never
+    # connects is terminated after the timeout
+    spot_finder = StreamSpotFinder(None, timeout=3)
+    for delays in ((0, 0, 1), (0, 100)):
+        workers = [
+            multiprocessing.Process(target=_waiting_worker, args=(url, delay))
+            for delay in delays
+        ]
+        for worker in workers:
+            worker.start()
+        time.sleep(0.5)
+        t0 = time.time()
+        spot_finder._stop_workers(distributor, workers)
+        assert time.time() - t0 < 10
+        assert workers == []
+        assert multiprocessing.active_children() == []
+
+    distributor.close(linger=0)
+    context.term()
@@ -0,0 +1,148 @@
+from __future__ import absolute_import, division, print_function
+
+import time
+
+import pytest
+
+from dials.util.image_viewer.slip_viewer.tile_cache import (
+    TILE_SIZE,
+    LRUCache,
+    PrefetchQueue,
+    TilePyramid,
+)
+
+
+def test_lru_cache():
+    cache = LRUCache(3)
+    for i in range(3):
+        cache.put(i, str(i))
+    assert cache.get(0) == "0"
+    cache.put(3, "3")
+    # 1 was the least recently used
+    assert 1 not in cache
+    assert cache.keys() == [2, 0, 3]
+    assert cache.get(1) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.discard(lambda key: key > 2)
+    assert cache.keys() == [2, 0]
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_prefetch_queue():
+    queue = PrefetchQueue()
+    done = []
+    queue.add("a", lambda: done.append("a"))
+    queue.add("b", lambda: queue.add("c", lambda: done.append("c")))
+    queue.add("a", lambda: done.append("duplicate"))
+    assert len(queue) == 2
+    assert not queue.run(max_time=10)
+    assert done == ["a", "c"]
+
+    for i in range(10):
+        queue.add(i, lambda: time.sleep(0.01))
+    assert queue.run(max_time=0.005)
+    assert len(queue) == 9
+    queue.cancel()
+    assert not queue.run()
+
+
+class _FakeFlexImage(object):
+    """Record how tiles are rendered from an image of size x size pixels"""
+
+    supports_rotated_tiles_antialiasing_recommended = False
+
+    def __init__(self, size, binning=1):
+        self.size = size
+        self.binning = binning
+        self.rendered = []
+
+    def size1(self):
+        return self.size
+
+    def setZoom(self, zoom):
+        self.zoom = zoom
+
+    def setWindowCart(self, x, y, fraction):
+        self.window = (x, y, fraction)
+
+    def prep_string(self):
+        self.rendered.append((self.zoom,) + self.window)
+        self.export_string = b"\0" * (3 * TILE_SIZE * TILE_SIZE)
+
+    def ex_size1(self):
+        return TILE_SIZE
+
+    def ex_size2(self):
+        return TILE_SIZE
+
+
+def test_tile_pyramid():
+    full = _FakeFlexImage(4096)
+    binned = {}
+
+    def make_binned(binning):
+        binned[binning] = _FakeFlexImage(4096, binning)
+        return binned[binning]
+
+    pyramid = TilePyramid(full, make_binned=make_binned)
+    pyramid.render(1, 3, 2)
+    pyramid.render(-2, 1, 0)
+    pyramid.render(-2, 0, 0)
+    assert full.rendered == [(1, 2, 3, TILE_SIZE / 4096 / 2)]
+    # Zoomed out tiles are rendered from a binned image at zoom level 0,
+    # covering the same fraction of the picture
+    assert list(binned) == [4]
+    assert binned[4].rendered == [(0, 0, 1, TILE_SIZE * 4 / 4096), (0, 0, 0, 0.25)]
+
+    # Without binning all levels use the full image
+    full = _FakeFlexImage(4096)
+    TilePyramid(full).render(-1, 0, 0)
+    assert full.rendered == [(-1, 0, 0, TILE_SIZE * 2 / 4096)]
+
+
+@pytest.mark.slow
+def test_tile_rendering_benchmark():
+    """Compare the rate of rendering tiles at each zoom level from the full
+    resolution image, from the binned images, and from the cache"""
+    detectors = pytest.importorskip("iotbx.detectors")
+    from scitbx.array_family import flex
+
+    size = 4096
+    data = flex.random_double(size * size) * 100
+    data.reshape(flex.grid(size, size))
+    data = data.iround()
+
+    def flex_image(binning=1):
+        image = detectors.FlexImage(
+            binning=binning,
+            brightness=1.0,
+            rawdata=data,
+            saturation=65535,
+            vendortype="Pilatus",
+            show_untrusted=False,
+            color_scheme=0,
+        )
+        image.adjust(color_scheme=0)
+        return image
+
+    def tiles(level):
+        n = max(1, int(size * 2 ** level) // TILE_SIZE)
+        return [(x, y) for x in range(min(n, 4)) for y in range(min(n, 4))]
+
+    cache = LRUCache(512)
+    full = TilePyramid(flex_image())
+    binned = TilePyramid(flex_image(), make_binned=flex_image)
+    for level in (-3, -2, -1, 0, 1):
+        rates = []
+        for pyramid in (full, binned, binned):
+            t0 = time.time()
+            for x, y in tiles(level):
+                key = (id(pyramid), level, x, y)
+                if cache.get(key) is None:
+                    cache.put(key, pyramid.render(level, x, y))
+            rates.append(len(tiles(level)) / max(time.time() - t0, 1e-6))
+        print(
+            "Level %2d: %8.1f tiles/s full resolution, %8.1f tiles/s binned, "
+            "%8.1f tiles/s cached" % ((level,) + tuple(rates))
+        )
@@ -330,9 +330,9 @@ def __init__(self, i_obs, params, batches=None, reference=None):
 
         self._intensities = i_obs
 
-        import iotbx.merging_statistics
+        from dials.report.merging_statistics import dataset_statistics
 
-        self._merging_statistics = iotbx.merging_statistics.dataset_statistics(
+        self._merging_statistics = dataset_statistics(
             i_obs=i_obs,
             n_bins=self._params.nbins,
             cc_one_half_significance_level=self._params.cc_half_significance_level,
@@ -0,0 +1,531 @@
+"""
+A benchmark of the processing pipeline on deterministic synthetic data.
+
+A rotation sweep of images is simulated for each size of dataset: the
+reflections predicted for a crystal in a random (but seeded) orientation are
+drawn as Gaussian spots, with intensities from the symmetry test data of
+dials.algorithms.symmetry.cosym._generate_test_data, on a Poisson background.
+The sweep is then processed with the dials commands, each stage in its own
+process, recording the wall clock time, the CPU time and the peak resident
+memory of each stage. The results are a dictionary which may be saved as JSON
+and compared with the results of an earlier run, e.g. of another commit, to
+find performance regressions.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import collections
+import json
+import logging
+import math
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# The sizes of the simulated datasets
+SIZES = collections.OrderedDict(
+    [
+        ("small", {"image_size": 512, "n_images": 30, "distance": 120.0}),
+        ("medium", {"image_size": 1024, "n_images": 180, "distance": 200.0}),
+        ("large", {"image_size": 2048, "n_images": 360, "distance": 300.0}),
+    ]
+)
+
+# The parameters of the simulation shared by all sizes of dataset
+SIMULATION = {
+    "unit_cell": [57.8, 57.8, 150.0, 90.0, 90.0, 90.0],
+    "space_group": "P422",
+    "wavelength": 0.9795,
+    "pixel_size": 0.172,
+    "oscillation": 0.5,
+    "background": 5.0,
+    "spot_counts": 1000.0,
+    "sigma_xy": 1.0,
+    "sigma_z": 0.6,
+}
+
+TEMPLATE = "image_#####.cbf"
+
+Stage = collections.namedtuple("Stage", ["name", "command", "requires"])
+
+# The stages of processing, in order, with the stages which produce their
+# input. The commands are formatted with the template, nproc and the unit cell
+# and space group of the simulation.
+STAGES = (
+    Stage("import", ("dials.import", "template=%(template)s"), ()),
+    Stage(
+        "find_spots",
+        (
+            "dials.find_spots",
+            "imported_experiments.json",
+            "spotfinder.mp.nproc=%(nproc)d",
+        ),
+        ("import",),
+    ),
+    Stage(
+        "index.fft1d",
+        (
+            "dials.index",
+            "imported_experiments.json",
+            "strong.pickle",
+            "indexing.method=fft1d",
+            "output.experiments=indexed_fft1d_experiments.json",
+            "output.reflections=indexed_fft1d.pickle",
+        ),
+        ("find_spots",),
+    ),
+    Stage(
+        "index.fft3d",
+        (
+            "dials.index",
+            "imported_experiments.json",
+            "strong.pickle",
+            "indexing.method=fft3d",
+            "output.experiments=indexed_fft3d_experiments.json",
+            "output.reflections=indexed_fft3d.pickle",
+        ),
+        ("find_spots",),
+    ),
+    Stage(
+        "index.real_space_grid_search",
+        (
+            "dials.index",
+            "imported_experiments.json",
+            "strong.pickle",
+            "indexing.method=real_space_grid_search",
+            "unit_cell=%(unit_cell)s",
+            "space_group=%(space_group)s",
+            "output.experiments=indexed_rsgs_experiments.json",
+            "output.reflections=indexed_rsgs.pickle",
+        ),
+        ("find_spots",),
+    ),
+    Stage(
+        "refine.static",
+        (
+            "dials.refine",
+            "indexed_fft3d_experiments.json",
+            "indexed_fft3d.pickle",
+            "scan_varying=False",
+            "output.experiments=refined_static_experiments.json",
+            "output.reflections=refined_static.pickle",
+        ),
+        ("index.fft3d",),
+    ),
+    Stage(
+        "refine.scan_varying",
+        (
+            "dials.refine",
+            "refined_static_experiments.json",
+            "refined_static.pickle",
+            "scan_varying=True",
+            "output.experiments=refined_experiments.json",
+            "output.reflections=refined.pickle",
+        ),
+        ("refine.static",),
+    ),
+    Stage(
+        "integrate.3d",
+        (
+            "dials.integrate",
+            "refined_experiments.json",
+            "refined.pickle",
+            "integration.integrator=3d",
+            "integration.mp.nproc=%(nproc)d",
+            "output.experiments=integrated_experiments.json",
+            "output.reflections=integrated.pickle",
+        ),
+        ("refine.scan_varying",),
+    ),
+    Stage(
+        "integrate.3d_threaded",
+        (
+            "dials.integrate",
+            "refined_experiments.json",
+            "refined.pickle",
+            "integration.integrator=3d_threaded",
+            "integration.mp.nproc=%(nproc)d",
+            "output.experiments=integrated_threaded_experiments.json",
+            "output.reflections=integrated_threaded.pickle",
+        ),
+        ("refine.scan_varying",),
+    ),
+    Stage(
+        "scale",
+        ("dials.scale", "integrated_experiments.json", "integrated.pickle"),
+        ("integrate.3d",),
+    ),
+    Stage(
+        "cosym",
+        ("dials.cosym", "integrated_experiments.json", "integrated.pickle"),
+        ("integrate.3d",),
+    ),
+    Stage(
+        "export",
+        (
+            "dials.export",
+            "scaled_experiments.json",
+            "scaled.pickle",
+            "intensity=scale",
+            "mtz.hklout=scaled.mtz",
+        ),
+        ("scale",),
+    ),
+)
+
+Regression = collections.namedtuple(
+    "Regression", ["size", "stage", "quantity", "reference", "value"]
+)
+
+
+def stages_to_run(names=None):
+    """
+    The stages to run for the named stages, with the stages they depend on,
+    in the order of processing.
+
+    :param names: The names of the stages, or None for all stages
+    :return: The list of stages
+
+    """
+    if names is None:
+        return list(STAGES)
+    by_name = {stage.name: stage for stage in STAGES}
+    for name in names:
+        assert name in by_name, "Unknown stage %s" % name
+    required = set()
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name not in required:
+            required.add(name)
+            pending.extend(by_name[name].requires)
+    return [stage for stage in STAGES if stage.name in required]
+
+
+def dataset_parameters(size, seed=0):
+    """The parameters of the simulated dataset of a size"""
+    parameters = dict(SIMULATION)
+    parameters.update(SIZES[size])
+    parameters["seed"] = seed
+    return parameters
+
+
+def _erf(x):
+    return np.vectorize(math.erf, otypes=[np.float64])(x)
+
+
+def _pixel_fractions(centre, sigma, first, n):
+    """The fractions of Gaussian profiles falling in n consecutive pixels,
+    starting from the pixels first"""
+    edges = first[:, np.newaxis] + np.arange(n + 1) - centre[:, np.newaxis]
+    cdf = 0.5 * _erf(edges / (math.sqrt(2) * sigma))
+    return np.diff(cdf, axis=1)
+
+
+def simulate_dataset(directory, size, seed=0):
+    """
+    Write the images of a simulated rotation sweep.
+
+    The images are only written if the directory does not already hold the
+    images of a dataset simulated with the same parameters.
+
+    :param directory: The directory to write the images to
+    :param size: The size of the dataset, one of SIZES
+    :param seed: The seed of the random numbers
+    :return: The parameters of the dataset, with the number of reflections
+
+    """
+    from cctbx import crystal, miller, sgtbx, uctbx
+    from dxtbx.format.FormatCBFMini import FormatCBFMini
+    from dxtbx.model import BeamFactory, Crystal, DetectorFactory
+    from dxtbx.model import GoniometerFactory, ScanFactory
+    from dxtbx.model.experiment_list import Experiment
+    from scitbx import matrix
+    from dials.algorithms.symmetry.cosym._generate_test_data import generate_intensities
+    from dials.array_family import flex
+
+    parameters = dataset_parameters(size, seed)
+    description = os.path.join(directory, "dataset.json")
+    if os.path.isfile(description):
+        with open(description) as fh:
+            existing = json.load(fh)
+        n_reflections = existing.pop("n_reflections", None)
+        if n_reflections is not None and existing == parameters:
+            logger.info("Using the %s dataset in %s", size, directory)
+            return dict(parameters, n_reflections=n_reflections)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    logger.info("Simulating the %s dataset in %s", size, directory)
+    random_state = np.random.RandomState(seed)
+    image_size = parameters["image_size"]
+    n_images = parameters["n_images"]
+    pixel_size = parameters["pixel_size"]
+
+    beam = BeamFactory.simple(parameters["wavelength"])
+    detector = DetectorFactory.simple(
+        "PAD",
+        parameters["distance"],
+        (image_size * pixel_size / 2, image_size * pixel_size / 2),
+        "+x",
+        "-y",
+        (pixel_size, pixel_size),
+        (image_size, image_size),
+        (-1, 1e6),
+    )
+    goniometer = GoniometerFactory.known_axis((1, 0, 0))
+    scan = ScanFactory.make_scan(
+        image_range=(1, n_images),
+        exposure_times=0.1,
+        oscillation=(0, parameters["oscillation"]),
+        epochs=list(range(n_images)),
+        deg=True,
+    )
+
+    # A crystal in a random orientation
+    unit_cell = uctbx.unit_cell(parameters["unit_cell"])
+    space_group = sgtbx.space_group_info(parameters["space_group"]).group()
+    axis = matrix.col(random_state.normal(size=3)).normalize()
+    rotation = axis.axis_and_angle_as_r3_rotation_matrix(
+        random_state.uniform(0, 360), deg=True
+    )
+    # The columns of the orthogonalization matrix are the real space vectors
+    orthogonalization = unit_cell.orthogonalization_matrix()
+    real_space = [rotation * matrix.col(orthogonalization[i::3]) for i in range(3)]
+    crystal_model = Crystal(*real_space, space_group=space_group)
+
+    experiment = Experiment(
+        beam=beam,
+        detector=detector,
+        goniometer=goniometer,
+        scan=scan,
+        crystal=crystal_model,
+    )
+    d_min = detector.get_max_resolution(beam.get_s0())
+    reflections = flex.reflection_table.from_predictions(experiment, dmin=d_min)
+
+    # The intensities of the symmetry equivalent reflections are the same
+    flex.set_random_seed(seed)
+    symmetry = crystal.symmetry(unit_cell=unit_cell, space_group=space_group)
+    intensities = generate_intensities(symmetry, d_min=0.99 * d_min)
+    lookup = dict(zip(intensities.indices(), intensities.data()))
+    asu = (
+        miller.set(symmetry, reflections["miller_index"], anomalous_flag=False)
+        .map_to_asu()
+        .indices()
+    )
+    counts = parameters["spot_counts"] * (
+        0.1 + np.array([lookup.get(h, 0.5) for h in asu])
+    )
+
+    x, y, z = [c.as_numpy_array() for c in reflections["xyzcal.px"].parts()]
+    order = np.argsort(z, kind="mergesort")
+    x, y, z, counts = x[order], y[order], z[order], counts[order]
+
+    sigma_xy = parameters["sigma_xy"]
+    sigma_z = parameters["sigma_z"]
+    half_width = int(math.ceil(3 * sigma_xy))
+    half_depth = int(math.ceil(3 * sigma_z))
+    n = 2 * half_width + 1
+    offsets = np.arange(n)
+    for i in range(n_images):
+        lo, hi = np.searchsorted(z, (i - half_depth, i + 1 + half_depth))
+        first_x = np.floor(x[lo:hi]).astype(np.int64) - half_width
+        first_y = np.floor(y[lo:hi]).astype(np.int64) - half_width
+        fz = _pixel_fractions(z[lo:hi], sigma_z, np.full(hi - lo, i), 1)[:, 0]
+        fx = _pixel_fractions(x[lo:hi], sigma_xy, first_x, n)
+        fy = _pixel_fractions(y[lo:hi], sigma_xy, first_y, n)
+        signal = (counts[lo:hi] * fz)[:, np.newaxis, np.newaxis] * (
+            fy[:, :, np.newaxis] * fx[:, np.newaxis, :]
+        )
+        xs = np.broadcast_to(
+            (first_x[:, np.newaxis] + offsets)[:, np.newaxis, :], signal.shape
+        )
+        ys = np.broadcast_to(
+            (first_y[:, np.newaxis] + offsets)[:, :, np.newaxis], signal.shape
+        )
+        inside = (xs >= 0) & (xs < image_size) & (ys >= 0) & (ys < image_size)
+        image = np.full((image_size, image_size), parameters["background"])
+        np.add.at(image, (ys[inside], xs[inside]), signal[inside])
+        image = random_state.poisson(image).astype(np.int32)
+        FormatCBFMini.as_file(
+            detector,
+            beam,
+            goniometer,
+            scan[i],
+            flex.int(image),
+            os.path.join(directory, TEMPLATE.replace("#####", "%05d") % (i + 1)),
+        )
+
+    parameters["n_reflections"] = len(reflections)
+    with open(description, "w") as fh:
+        json.dump(parameters, fh, indent=2)
+    return parameters
+
+
+def run_stage(command, directory, log_filename):
+    """
+    Run a command, recording the time taken and the peak memory used.
+
+    :param command: The command and its arguments
+    :param directory: The directory to run the command in
+    :param log_filename: The file to write the output of the command to
+    :return: A dictionary of the status ("ok" or "failed"), the wall clock time
+             and the CPU time in seconds, and the peak resident memory in bytes
+
+    """
+    with open(log_filename, "w") as log:
+        start = time.time()
+        process = subprocess.Popen(
+            command, cwd=directory, stdout=log, stderr=subprocess.STDOUT
+        )
+        _, status, usage = os.wait4(process.pid, 0)
+        wall_time = time.time() - start
+    if os.WIFEXITED(status):
+        process.returncode = os.WEXITSTATUS(status)
+    else:
+        process.returncode = -os.WTERMSIG(status)
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    peak_memory = usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    return {
+        "status": "ok" if process.returncode == 0 else "failed",
+        "wall_time": wall_time,
+        "cpu_time": usage.ru_utime + usage.ru_stime,
+        "peak_memory": peak_memory,
+    }
+
+
+def run_benchmark(sizes, directory, stages=None, nproc=1, repeats=1, seed=0):
+    """
+    Simulate and process the datasets of the given sizes.
+
+    Each stage is run the given number of times, recording the least wall
+    clock and CPU time and the greatest peak memory. A stage is skipped if a
+    stage it depends on failed.
+
+    :param sizes: The sizes of the datasets, from SIZES
+    :param directory: The working directory, with a directory for each size
+    :param stages: The names of the stages to run, or None for all stages
+    :param nproc: The number of processes for the stages which use them
+    :param repeats: The number of times to run each stage
+    :param seed: The seed of the random numbers of the simulation
+    :return: The dictionary of results
+
+    """
+    from dials.util.version import dials_version
+
+    results = collections.OrderedDict(
+        [
+            ("version", dials_version()),
+            ("platform", platform.platform()),
+            ("python", platform.python_version()),
+            ("cpu_count", multiprocessing.cpu_count()),
+            ("nproc", nproc),
+            ("repeats", repeats),
+            ("sizes", collections.OrderedDict()),
+        ]
+    )
+    arguments = {
+        "template": TEMPLATE,
+        "nproc": nproc,
+        "unit_cell": ",".join("%g" % p for p in SIMULATION["unit_cell"]),
+        "space_group": SIMULATION["space_group"],
+    }
+    for size in sizes:
+        size_directory = os.path.join(directory, size)
+        dataset = simulate_dataset(size_directory, size, seed=seed)
+        stage_results = collections.OrderedDict()
+        for stage in stages_to_run(stages):
+            if any(stage_results[r]["status"] != "ok" for r in stage.requires):
+                logger.info("Skipping %s for the %s dataset", stage.name, size)
+                stage_results[stage.name] = {"status": "skipped"}
+                continue
+            command = [argument % arguments for argument in stage.command]
+            log_filename = os.path.join(size_directory, "benchmark.%s.log" % stage.name)
+            runs = [
+                run_stage(command, size_directory, log_filename) for _ in range(repeats)
+            ]
+            result = {
+                "status": "ok" if all(r["status"] == "ok" for r in runs) else "failed",
+                "wall_time": min(r["wall_time"] for r in runs),
+                "cpu_time": min(r["cpu_time"] for r in runs),
+                "peak_memory": max(r["peak_memory"] for r in runs),
+            }
+            stage_results[stage.name] = result
+            logger.info(
+                "%s %s: %s, %.2f s, %.2f s CPU, %.1f MB",
+                size,
+                stage.name,
+                result["status"],
+                result["wall_time"],
+                result["cpu_time"],
+                result["peak_memory"] / 1e6,
+            )
+        results["sizes"][size] = collections.OrderedDict(
+            [("dataset", dataset), ("stages", stage_results)]
+        )
+    return results
+
+
+def compare(reference, results, time_tolerance=0.1, memory_tolerance=0.1, min_time=1.0):
+    """
+    Find the performance regressions of a benchmark relative to another.
+
+    Only the stages run successfully for the same dataset in both are
+    compared. A stage has regressed if it failed or was skipped, if its wall
+    clock or CPU time increased by more than the fraction time_tolerance and
+    by more than min_time seconds, or if its peak memory increased by more
+    than the fraction memory_tolerance.
+
+    :param reference: The results of the reference benchmark
+    :param results: The results of the benchmark to compare
+    :param time_tolerance: The fractional increase in time tolerated
+    :param memory_tolerance: The fractional increase in peak memory tolerated
+    :param min_time: The increase in time tolerated, in seconds
+    :return: A list of the regressions
+
+    """
+    regressions = []
+    for size, result in results["sizes"].items():
+        reference_result = reference["sizes"].get(size)
+        if reference_result is None:
+            continue
+        if reference_result["dataset"] != result["dataset"]:
+            logger.warning("The %s datasets differ, so they are not compared", size)
+            continue
+        for name, stage in result["stages"].items():
+            reference_stage = reference_result["stages"].get(name)
+            if reference_stage is None or reference_stage["status"] != "ok":
+                continue
+            if stage["status"] != "ok":
+                regressions.append(
+                    Regression(size, name, "status", "ok", stage["status"])
+                )
+                continue
+            for quantity in ("wall_time", "cpu_time"):
+                before, after = reference_stage[quantity], stage[quantity]
+                if after > before * (1 + time_tolerance) and after - before > min_time:
+                    regressions.append(Regression(size, name, quantity, before, after))
+            before, after = reference_stage["peak_memory"], stage["peak_memory"]
+            if after > before * (1 + memory_tolerance):
+                regressions.append(Regression(size, name, "peak_memory", before, after))
+    return regressions
+
+
+def as_json(results, filename):
+    """Save the results of a benchmark as JSON"""
+    with open(filename, "w") as fh:
+        json.dump(results, fh, indent=2)
+
+
+def from_json(filename):
+    """Load the results of a benchmark from JSON"""
+    with open(filename) as fh:
+        return json.load(fh, object_pairs_hook=collections.OrderedDict)
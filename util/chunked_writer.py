@@ -0,0 +1,72 @@
+"""
+Helpers for writing large reflection tables as text.
+
+Formatting and writing a file one row at a time from Python is slow for tables
+of millions of reflections. Here the rows are formatted from whole columns in
+chunks and each chunk is written with a single call. The output is identical to
+formatting each row with the same format string.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+from collections import OrderedDict
+
+from dials.array_family import flex
+
+
+def write_formatted_rows(fh, fmt, columns, chunk_size=100000):
+    """
+    Write the rows of a set of columns to file.
+
+    :param fh: The file object to write to
+    :param fmt: The format string for a row, including any newline
+    :param columns: The list of columns (flex arrays or lists) in row order
+    :param chunk_size: The number of rows to format before writing
+    :return: The number of rows written
+    """
+    nrows = len(columns[0]) if columns else 0
+    assert all(len(c) == nrows for c in columns), "Inconsistent column sizes"
+    for i0 in range(0, nrows, chunk_size):
+        i1 = min(i0 + chunk_size, nrows)
+        fh.write("".join(fmt % row for row in zip(*[c[i0:i1] for c in columns])))
+    return nrows
+
+
+def miller_index_sort_permutation(miller_index):
+    """
+    Get the permutation which sorts the miller indices by h, then k, then l.
+
+    The permutation is the same as that given by sorting the indices with
+    sorted(), which is stable, but done with successive stable sorts of the
+    components.
+
+    :param miller_index: The flex.miller_index array
+    :return: The flex.size_t permutation
+    """
+    h, k, l = [c.iround() for c in miller_index.as_vec3_double().parts()]
+    perm = flex.sort_permutation(l, stable=True)
+    for c in (k, h):
+        perm = perm.select(flex.sort_permutation(c.select(perm), stable=True))
+    return perm
+
+
+def cif_loop_from_columns(header, columns):
+    """
+    Create a cif loop from whole columns.
+
+    Each value is converted with str(), as done when adding rows one at a time
+    with iotbx.cif.model.loop.add_row, so the text of the loop is the same.
+
+    :param header: The list of loop item names
+    :param columns: The list of columns (flex arrays or lists)
+    :return: The iotbx.cif.model.loop
+    """
+    import iotbx.cif.model
+
+    assert len(header) == len(columns), "Inconsistent number of columns"
+    return iotbx.cif.model.loop(
+        data=OrderedDict(
+            (name, flex.std_string(list(map(str, column))))
+            for name, column in zip(header, columns)
+        )
+    )
@@ -6,6 +6,7 @@
 
 import dials.util.version
 from dials.array_family import flex
+from dials.util.chunked_writer import cif_loop_from_columns
 from dials.util.filter_reflections import filter_reflection_table
 import iotbx.cif.model
 from cctbx.sgtbx import bravais_types
@@ -274,16 +275,21 @@ def write(self, experiments, reflections):
 
             cif_block.update(result.as_cif_block())
 
-        cif_loop = iotbx.cif.model.loop(header=header)
-
-        for i, r in enumerate(reflections):
-            refl_id = i + 1
-            scan_id = r["id"] + 1
-            _, _, _, _, z0, z1 = r["bbox"]
-            h, k, l = r["miller_index"]
-            variable_values = tuple((r[name]) for name in variables_present)
-            cif_loop.add_row((refl_id, scan_id, z0, z1, h, k, l) + variable_values)
-        cif_block.add_loop(cif_loop)
+        # Build the loop from whole columns rather than row by row
+        _, _, _, _, z0, z1 = reflections["bbox"].parts()
+        h, k, l = [
+            hkl.iround() for hkl in reflections["miller_index"].as_vec3_double().parts()
+        ]
+        columns = [
+            flex.size_t_range(1, len(reflections) + 1),
+            reflections["id"] + 1,
+            z0,
+            z1,
+            h,
+            k,
+            l,
+        ] + [reflections[name] for name in variables_present]
+        cif_block.add_loop(cif_loop_from_columns(header, columns))
 
         # Add the block
         self._cif["dials"] = cif_block
@@ -2,6 +2,7 @@
 
 from __future__ import absolute_import, division, print_function
 
+import bisect
 import logging
 import time
 from collections import OrderedDict, Counter
@@ -31,6 +32,32 @@ def isclose(a, b, rel_tol=1e-09, abs_tol=0.0):
 logger = logging.getLogger(__name__)
 
 
+# MTZ column types for the exported columns
+_type_table = {
+    "H": "H",
+    "K": "H",
+    "L": "H",
+    "I": "J",
+    "SIGI": "Q",
+    "IPR": "J",
+    "SIGIPR": "Q",
+    "BG": "R",
+    "SIGBG": "R",
+    "XDET": "R",
+    "YDET": "R",
+    "BATCH": "B",
+    "BGPKRATIOS": "R",
+    "WIDTH": "R",
+    "MPART": "I",
+    "M_ISYM": "Y",
+    "FLAG": "I",
+    "LP": "R",
+    "FRACTIONCALC": "R",
+    "ROT": "R",
+    "QE": "R",
+}
+
+
 def _add_batch(
     mtz,
     experiment,
@@ -165,11 +192,6 @@ def _add_batch(
 def _write_columns(mtz_file, dataset, integrated_data):
     """Write the column definitions AND data for a single dataset."""
 
-    # now create the actual data structures - first keep a track of the columns
-
-    # H K L M/ISYM BATCH I SIGI IPR SIGIPR FRACTIONCALC XDET YDET ROT WIDTH
-    # LP MPART FLAG BGPKRATIOS
-
     # gather the required information for the reflection file
 
     nref = len(integrated_data["miller_index"])
@@ -177,37 +199,22 @@ def _write_columns(mtz_file, dataset, integrated_data):
     # check reflections remain
     if nref == 0:
         raise Sorry("no reflections for export")
-    xdet, ydet, zdet = [
-        flex.double(x) for x in integrated_data["xyzobs.px.value"].parts()
-    ]
 
-    # now add column information...
+    _add_columns(
+        mtz_file,
+        dataset,
+        integrated_data["miller_index_rebase"],
+        _column_data(integrated_data),
+    )
 
-    # FIXME add DIALS_FLAG which can include e.g. was partial etc.
 
-    type_table = {
-        "H": "H",
-        "K": "H",
-        "L": "H",
-        "I": "J",
-        "SIGI": "Q",
-        "IPR": "J",
-        "SIGIPR": "Q",
-        "BG": "R",
-        "SIGBG": "R",
-        "XDET": "R",
-        "YDET": "R",
-        "BATCH": "B",
-        "BGPKRATIOS": "R",
-        "WIDTH": "R",
-        "MPART": "I",
-        "M_ISYM": "Y",
-        "FLAG": "I",
-        "LP": "R",
-        "FRACTIONCALC": "R",
-        "ROT": "R",
-        "QE": "R",
-    }
+def _add_columns(mtz_file, dataset, miller_indices, columns):
+    """Add the columns to the dataset and set their values.
+
+    The columns are given as a list of (label, type, values) tuples, as
+    returned by _column_data."""
+
+    nref = len(miller_indices)
 
     # derive index columns from original indices with
     #
@@ -221,16 +228,40 @@ def _write_columns(mtz_file, dataset, integrated_data):
 
     # assign H, K, L, M_ISYM space
     for column in "H", "K", "L", "M_ISYM":
-        dataset.add_column(column, type_table[column]).set_values(
+        dataset.add_column(column, _type_table[column]).set_values(
             flex.double(nref, 0.0).as_float()
         )
 
-    mtz_file.replace_original_index_miller_indices(
-        integrated_data["miller_index_rebase"]
-    )
+    mtz_file.replace_original_index_miller_indices(miller_indices)
+
+    for label, column_type, values in columns:
+        dataset.add_column(label, column_type).set_values(values)
+
+
+def _column_data(integrated_data):
+    """Calculate the data for the non-index columns of a set of reflections.
+
+    Returns a list of (label, type, values) tuples, with the values as
+    flex.float arrays in the order in which the columns are written."""
+
+    # now create the actual data structures - first keep a track of the columns
+
+    # H K L M/ISYM BATCH I SIGI IPR SIGIPR FRACTIONCALC XDET YDET ROT WIDTH
+    # LP MPART FLAG BGPKRATIOS
+
+    nref = len(integrated_data["miller_index"])
+    xdet, ydet, _ = [flex.double(x) for x in integrated_data["xyzobs.px.value"].parts()]
+
+    # FIXME add DIALS_FLAG which can include e.g. was partial etc.
 
-    dataset.add_column("BATCH", type_table["BATCH"]).set_values(
-        integrated_data["batch"].as_double().as_float()
+    type_table = _type_table
+    columns = []
+
+    def add_column(label, column_type, values):
+        columns.append((label, column_type, values))
+
+    add_column(
+        "BATCH", type_table["BATCH"], integrated_data["batch"].as_double().as_float()
     )
 
     # if intensity values used in scaling exist, then just export these as I, SIGI
@@ -239,15 +270,13 @@ def _write_columns(mtz_file, dataset, integrated_data):
         V_scaling = integrated_data["intensity.scale.variance"]
         # Trap negative variances
         assert V_scaling.all_gt(0)
-        dataset.add_column("I", type_table["I"]).set_values(I_scaling.as_float())
-        dataset.add_column("SIGI", type_table["SIGI"]).set_values(
-            flex.sqrt(V_scaling).as_float()
-        )
-        dataset.add_column("SCALEUSED", "R").set_values(
-            integrated_data["inverse_scale_factor"].as_float()
-        )
-        dataset.add_column("SIGSCALEUSED", "R").set_values(
-            flex.sqrt(integrated_data["inverse_scale_factor_variance"]).as_float()
+        add_column("I", type_table["I"], I_scaling.as_float())
+        add_column("SIGI", type_table["SIGI"], flex.sqrt(V_scaling).as_float())
+        add_column("SCALEUSED", "R", integrated_data["inverse_scale_factor"].as_float())
+        add_column(
+            "SIGSCALEUSED",
+            "R",
+            flex.sqrt(integrated_data["inverse_scale_factor_variance"]).as_float(),
         )
     else:
         if "intensity.prf.value" in integrated_data:
@@ -259,21 +288,17 @@ def _write_columns(mtz_file, dataset, integrated_data):
             V_profile = integrated_data["intensity.prf.variance"]
             # Trap negative variances
             assert V_profile.all_gt(0)
-            dataset.add_column(col_names[0], type_table["I"]).set_values(
-                I_profile.as_float()
-            )
-            dataset.add_column(col_names[1], type_table["SIGI"]).set_values(
-                flex.sqrt(V_profile).as_float()
+            add_column(col_names[0], type_table["I"], I_profile.as_float())
+            add_column(
+                col_names[1], type_table["SIGI"], flex.sqrt(V_profile).as_float()
             )
         if "intensity.sum.value" in integrated_data:
             I_sum = integrated_data["intensity.sum.value"]
             V_sum = integrated_data["intensity.sum.variance"]
             # Trap negative variances
             assert V_sum.all_gt(0)
-            dataset.add_column("I", type_table["I"]).set_values(I_sum.as_float())
-            dataset.add_column("SIGI", type_table["SIGI"]).set_values(
-                flex.sqrt(V_sum).as_float()
-            )
+            add_column("I", type_table["I"], I_sum.as_float())
+            add_column("SIGI", type_table["SIGI"], flex.sqrt(V_sum).as_float())
     if (
         "background.sum.value" in integrated_data
         and "background.sum.variance" in integrated_data
@@ -282,34 +307,65 @@ def _write_columns(mtz_file, dataset, integrated_data):
         varbg = integrated_data["background.sum.variance"]
         assert (varbg >= 0).count(False) == 0
         sigbg = flex.sqrt(varbg)
-        dataset.add_column("BG", type_table["BG"]).set_values(bg.as_float())
-        dataset.add_column("SIGBG", type_table["SIGBG"]).set_values(sigbg.as_float())
+        add_column("BG", type_table["BG"], bg.as_float())
+        add_column("SIGBG", type_table["SIGBG"], sigbg.as_float())
 
-    dataset.add_column("FRACTIONCALC", type_table["FRACTIONCALC"]).set_values(
-        integrated_data["fractioncalc"].as_float()
+    add_column(
+        "FRACTIONCALC",
+        type_table["FRACTIONCALC"],
+        integrated_data["fractioncalc"].as_float(),
     )
 
-    dataset.add_column("XDET", type_table["XDET"]).set_values(xdet.as_float())
-    dataset.add_column("YDET", type_table["YDET"]).set_values(ydet.as_float())
-    dataset.add_column("ROT", type_table["ROT"]).set_values(
-        integrated_data["ROT"].as_float()
-    )
+    add_column("XDET", type_table["XDET"], xdet.as_float())
+    add_column("YDET", type_table["YDET"], ydet.as_float())
+    add_column("ROT", type_table["ROT"], integrated_data["ROT"].as_float())
     if "lp" in integrated_data:
-        dataset.add_column("LP", type_table["LP"]).set_values(
-            integrated_data["lp"].as_float()
-        )
+        add_column("LP", type_table["LP"], integrated_data["lp"].as_float())
     if "qe" in integrated_data:
-        dataset.add_column("QE", type_table["QE"]).set_values(
-            integrated_data["qe"].as_float()
-        )
+        add_column("QE", type_table["QE"], integrated_data["qe"].as_float())
     elif "dqe" in integrated_data:
-        dataset.add_column("QE", type_table["QE"]).set_values(
-            integrated_data["dqe"].as_float()
-        )
+        add_column("QE", type_table["QE"], integrated_data["dqe"].as_float())
     else:
-        dataset.add_column("QE", type_table["QE"]).set_values(
-            flex.double(nref, 1.0).as_float()
-        )
+        add_column("QE", type_table["QE"], flex.double(nref, 1.0).as_float())
+
+    return columns
+
+
+def _indices_by_id(reflections, ids_to_find):
+    """Get the row indices of the reflections for each experiment id.
+
+    The indices for each id are in the order of the rows in the table, so that
+    selecting them gives the same order as selecting with a boolean mask."""
+    ids = reflections["id"]
+    perm = flex.sort_permutation(ids, stable=True)
+    sorted_ids = ids.select(perm)
+    result = {}
+    for id_ in ids_to_find:
+        start = bisect.bisect_left(sorted_ids, id_)
+        end = bisect.bisect_right(sorted_ids, id_)
+        result[id_] = perm[start:end]
+    return result
+
+
+def _combine_column_data(chunks):
+    """Join the (miller_indices, columns) data computed for each experiment.
+
+    The chunks are consumed one at a time so that the data for an experiment
+    can be released as soon as it has been appended."""
+    miller_indices = flex.miller_index()
+    columns = None
+    for chunk_indices, chunk_columns in chunks:
+        if columns is None:
+            columns = [(label, t, flex.float()) for label, t, _ in chunk_columns]
+        if [c[:2] for c in columns] != [c[:2] for c in chunk_columns]:
+            raise Sorry(
+                "Inconsistent columns between experiments, unable to export "
+                "with mtz.streaming=True"
+            )
+        miller_indices.extend(chunk_indices)
+        for (_, _, values), (_, _, chunk_values) in zip(columns, chunk_columns):
+            values.extend(chunk_values)
+    return miller_indices, columns or []
 
 
 def export_mtz(integrated_data, experiment_list, params):
@@ -364,16 +420,41 @@ def export_mtz(integrated_data, experiment_list, params):
     if any(len(experiment.detector) != 1 for experiment in experiment_list):
         logger.warning("Warning: Ignoring multiple panels in output MTZ")
 
-    # Clean up the data with the passed in options
-    integrated_data = filter_reflection_table(
-        integrated_data,
-        intensity_choice=params.intensity,
-        partiality_threshold=params.mtz.partiality_threshold,
-        combine_partials=params.mtz.combine_partials,
-        min_isigi=params.mtz.min_isigi,
-        filter_ice_rings=params.mtz.filter_ice_rings,
-        d_min=params.mtz.d_min,
-    )
+    # Choose the intensities once for the whole table, as filtering without
+    # profile fitted intensities falls back to the other intensities
+    intensity_choice = list(params.intensity)
+    if (
+        params.mtz.streaming
+        and "profile" in intensity_choice
+        and integrated_data.get_flags(integrated_data.flags.integrated_prf).count(True)
+        == 0
+    ):
+        logger.warning("No profile-integrated reflections found")
+        intensity_choice.remove("profile")
+        if not intensity_choice:
+            raise Sorry(
+                "Unable to process data due to absence of profile fitted reflections"
+            )
+
+    # Clean up the data with the passed in options. Filtering may change the
+    # intensity choice it is given, so it is given a copy.
+    def filter_for_export(reflections):
+        return filter_reflection_table(
+            reflections,
+            intensity_choice=list(intensity_choice),
+            partiality_threshold=params.mtz.partiality_threshold,
+            combine_partials=params.mtz.combine_partials,
+            min_isigi=params.mtz.min_isigi,
+            filter_ice_rings=params.mtz.filter_ice_rings,
+            d_min=params.mtz.d_min,
+        )
+
+    if params.mtz.streaming:
+        # Filter each experiment separately in the loop below, so that only a
+        # single experiment's worth of filtered data exists at any time
+        indices_by_id = _indices_by_id(integrated_data, expids_in_table.keys())
+    else:
+        integrated_data = filter_for_export(integrated_data)
 
     # get batch offsets and image ranges - even for scanless experiments
     batch_offsets = [
@@ -417,6 +498,7 @@ def export_mtz(integrated_data, experiment_list, params):
     #   integrated at the same time
     # ✓ decide a sensible BATCH increment to apply to the BATCH value between
     #   experiments and add this
+    chunks = {}
     for id_ in expids_in_table.keys():
         # Grab our subset of the data
         loc = expids_in_list.index(
@@ -432,7 +514,20 @@ def export_mtz(integrated_data, experiment_list, params):
         else:
             wavelength = wavelengths.keys()[0]
             dataset_id = 1
-        reflections = integrated_data.select(integrated_data["id"] == id_)
+        if params.mtz.streaming:
+            reflections = integrated_data.select(indices_by_id[id_])
+            if (
+                "profile" in intensity_choice
+                and reflections.get_flags(reflections.flags.integrated_prf).count(True)
+                == 0
+            ):
+                # Filtering the whole table keeps only the profile fitted
+                # reflections, so none of this experiment's reflections
+                reflections = reflections.select(flex.size_t())
+            else:
+                reflections = filter_for_export(reflections)
+        else:
+            reflections = integrated_data.select(integrated_data["id"] == id_)
         batch_offset = batch_offsets[loc]
         image_range = image_ranges[loc]
         reflections = assign_batches_to_reflections([reflections], [batch_offset])[0]
@@ -477,6 +572,17 @@ def export_mtz(integrated_data, experiment_list, params):
         else:
             experiment.data["ROT"] = z
 
+        if params.mtz.streaming:
+            # Convert to the compact output columns and release this experiment's
+            # reflections before moving on to the next one
+            if len(reflections):
+                chunks[loc] = (
+                    experiment.data["miller_index_rebase"],
+                    _column_data(experiment.data),
+                )
+            del experiment.data
+            del reflections
+
     # Update the mtz general information now we've processed the experiments
     mtz_file.set_space_group_info(experiment_list[0].crystal.get_space_group().info())
     unit_cell = experiment_list[0].crystal.get_unit_cell()
@@ -486,26 +592,34 @@ def export_mtz(integrated_data, experiment_list, params):
     for wavelength in wavelengths.iterkeys():
         mtz_dataset = mtz_crystal.add_dataset("FROMDIALS", wavelength)
 
-    # Combine all of the experiment data columns before writing
-    combined_data = {k: v.deep_copy() for k, v in experiment_list[0].data.items()}
-    for experiment in experiment_list[1:]:
-        for k, v in experiment.data.items():
-            combined_data[k].extend(v)
-    # ALL columns must be the same length
-    assert (
-        len(set(len(v) for v in combined_data.values())) == 1
-    ), "Column length mismatch"
-    assert len(combined_data["id"]) == len(
-        integrated_data["id"]
-    ), "Lost rows in split/combine"
-
-    # Write all the data and columns to the mtz file
-    _write_columns(mtz_file, mtz_dataset, combined_data)
+    if params.mtz.streaming:
+        miller_indices, columns = _combine_column_data(
+            chunks.pop(loc) for loc in sorted(chunks)
+        )
+        if not len(miller_indices):
+            raise Sorry("no reflections for export")
+        _add_columns(mtz_file, mtz_dataset, miller_indices, columns)
+        nref = len(miller_indices)
+    else:
+        # Combine all of the experiment data columns before writing
+        combined_data = {k: v.deep_copy() for k, v in experiment_list[0].data.items()}
+        for experiment in experiment_list[1:]:
+            for k, v in experiment.data.items():
+                combined_data[k].extend(v)
+        # ALL columns must be the same length
+        assert (
+            len(set(len(v) for v in combined_data.values())) == 1
+        ), "Column length mismatch"
+        assert len(combined_data["id"]) == len(
+            integrated_data["id"]
+        ), "Lost rows in split/combine"
+
+        # Write all the data and columns to the mtz file
+        _write_columns(mtz_file, mtz_dataset, combined_data)
+        nref = len(combined_data["id"])
 
     logger.info(
-        "Saving {} integrated reflections to {}".format(
-            len(combined_data["id"]), params.mtz.hklout
-        )
+        "Saving {} integrated reflections to {}".format(nref, params.mtz.hklout)
     )
     mtz_file.write(params.mtz.hklout)
 
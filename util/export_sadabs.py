@@ -1,7 +1,11 @@
 from __future__ import absolute_import, division, print_function
 
 import logging
+import math
+
 from dials.util import Sorry
+from dials.util.chunked_writer import miller_index_sort_permutation
+from dials.util.chunked_writer import write_formatted_rows
 from dials.util.filter_reflections import filter_reflection_table
 
 logger = logging.getLogger(__name__)
@@ -12,9 +16,12 @@ def export_sadabs(integrated_data, experiment_list, params):
     file for input to SADABS. FIXME probably need to make a .p4p file as
     well..."""
 
+    from dials.algorithms.integration.reflection_geometry import (
+        compute_reflection_geometry,
+    )
     from dials.array_family import flex
+    from libtbx.introspection import number_of_processors
     from scitbx import matrix
-    import math
 
     # for the moment assume (and assert) that we will convert data from exactly
     # one lattice...
@@ -39,16 +46,13 @@ def export_sadabs(integrated_data, experiment_list, params):
     assert not experiment.scan is None
 
     # sort data before output
-    nref = len(integrated_data["miller_index"])
-    indices = flex.size_t_range(nref)
-    perm = sorted(indices, key=lambda k: integrated_data["miller_index"][k])
-    integrated_data = integrated_data.select(flex.size_t(perm))
+    perm = miller_index_sort_permutation(integrated_data["miller_index"])
+    integrated_data = integrated_data.select(perm)
 
     assert not experiment.goniometer is None
 
     axis = matrix.col(experiment.goniometer.get_rotation_axis_datum())
 
-    beam = matrix.col(experiment.beam.get_direction())
     s0 = matrix.col(experiment.beam.get_s0())
 
     F = matrix.sqr(experiment.goniometer.get_fixed_rotation())
@@ -144,61 +148,64 @@ def export_sadabs(integrated_data, experiment_list, params):
     else:
         static = False
 
+    # compute the geometry for all reflections at once: for each reflection
+    # RUB = S * R(phi) * F * UB, with UB either scan static or taken from the
+    # scan point nearest the calculated z position
+    if params.sadabs.predict:
+        x_mm, y_mm, z_rad = integrated_data["xyzcal.mm"].parts()
+    else:
+        x_mm, y_mm, z_rad = integrated_data["xyzobs.mm.value"].parts()
+    z0 = integrated_data["xyzcal.px"].parts()[2]
+    istol = flex.int([int(round(v)) for v in 10000 * unit_cell.stol(miller_index)])
+
+    if params.sadabs.predict or static:
+        # work from a scan static model & assume perfect goniometer
+        # FIXME maybe should work back in the option to predict spot positions
+        UB = flex.mat3_double(1, experiment.crystal.get_A())
+    else:
+        # properly compute RUB for every reflection
+        UB = None
+    geometry = compute_reflection_geometry(
+        integrated_data,
+        experiment_list,
+        lp=False,
+        qe=False,
+        direction_cosines=True,
+        UB=UB,
+        phi=(phi_start + z0 * phi_range) * (math.pi / 180),
+        nthreads=number_of_processors(return_value_if_unknown=1),
+    )
+    ix, dx, iy, dy, iz, dz = geometry.direction_cosines
+
+    x = x_mm * scl_x
+    y = y_mm * scl_y
+    z = (z_rad * 180 / math.pi - phi_start) / phi_range
+
+    h, k, l = [c.iround() for c in miller_index.as_vec3_double().parts()]
     with open(params.sadabs.hklout, "w") as fout:
+        write_formatted_rows(
+            fout,
+            "%4d%4d%4d%8.2f%8.2f%4d%8.5f%8.5f%8.5f%8.5f%8.5f%8.5f"
+            "%7.2f%7.2f%8.2f%7.2f%5d\n",
+            [
+                h,
+                k,
+                l,
+                I,
+                sigI,
+                flex.int(nref, params.sadabs.run),
+                ix,
+                dx,
+                iy,
+                dy,
+                iz,
+                dz,
+                x,
+                y,
+                z,
+                flex.double(nref, detector2t),
+                istol,
+            ],
+        )
 
-        for j in range(nref):
-
-            h, k, l = miller_index[j]
-
-            if params.sadabs.predict:
-                x_mm, y_mm, z_rad = integrated_data["xyzcal.mm"][j]
-            else:
-                x_mm, y_mm, z_rad = integrated_data["xyzobs.mm.value"][j]
-
-            z0 = integrated_data["xyzcal.px"][j][2]
-            istol = int(round(10000 * unit_cell.stol((h, k, l))))
-
-            if params.sadabs.predict or static:
-                # work from a scan static model & assume perfect goniometer
-                # FIXME maybe should work back in the option to predict spot positions
-                UB = matrix.sqr(experiment.crystal.get_A())
-                phi = phi_start + z0 * phi_range
-                R = axis.axis_and_angle_as_r3_rotation_matrix(phi, deg=True)
-                RUB = S * R * F * UB
-            else:
-                # properly compute RUB for every reflection
-                UB = matrix.sqr(experiment.crystal.get_A_at_scan_point(int(round(z0))))
-                phi = phi_start + z0 * phi_range
-                R = axis.axis_and_angle_as_r3_rotation_matrix(phi, deg=True)
-                RUB = S * R * F * UB
-
-            x = RUB * (h, k, l)
-            s = (s0 + x).normalize()
-
-            # can also compute s based on centre of mass of spot
-            # s = (origin + x_mm * fast_axis + y_mm * slow_axis).normalize()
-
-            astar = (RUB * (1, 0, 0)).normalize()
-            bstar = (RUB * (0, 1, 0)).normalize()
-            cstar = (RUB * (0, 0, 1)).normalize()
-
-            ix = beam.dot(astar)
-            iy = beam.dot(bstar)
-            iz = beam.dot(cstar)
-
-            dx = s.dot(astar)
-            dy = s.dot(bstar)
-            dz = s.dot(cstar)
-
-            x = x_mm * scl_x
-            y = y_mm * scl_y
-            z = (z_rad * 180 / math.pi - phi_start) / phi_range
-
-            fout.write(
-                "%4d%4d%4d%8.2f%8.2f%4d%8.5f%8.5f%8.5f%8.5f%8.5f%8.5f"
-                % (h, k, l, I[j], sigI[j], params.sadabs.run, ix, dx, iy, dy, iz, dz)
-            )
-            fout.write("%7.2f%7.2f%8.2f%7.2f%5d\n" % (x, y, z, detector2t, istol))
-
-    fout.close()
     logger.info("Output %d reflections to %s" % (nref, params.sadabs.hklout))
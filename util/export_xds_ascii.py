@@ -1,7 +1,11 @@
 from __future__ import absolute_import, division, print_function
 
 import logging
+import math
+
 from dials.util import Sorry
+from dials.util.chunked_writer import miller_index_sort_permutation
+from dials.util.chunked_writer import write_formatted_rows
 from dials.util.filter_reflections import (
     filter_reflection_table,
     FilteringReductionMethods,
@@ -44,9 +48,6 @@ def export_xds_ascii(integrated_data, experiment_list, params, var_model=(1, 0))
     experiment = experiment_list[0]
 
     # sort data before output
-    nref = len(integrated_data["miller_index"])
-    indices = flex.size_t_range(nref)
-
     import copy
 
     unique = copy.deepcopy(integrated_data["miller_index"])
@@ -54,9 +55,10 @@ def export_xds_ascii(integrated_data, experiment_list, params, var_model=(1, 0))
 
     map_to_asu(experiment.crystal.get_space_group().type(), False, unique)
 
-    perm = sorted(indices, key=lambda k: unique[k])
-    integrated_data = integrated_data.select(flex.size_t(perm))
+    perm = miller_index_sort_permutation(unique)
+    integrated_data = integrated_data.select(perm)
 
+    from libtbx.introspection import number_of_processors
     from scitbx import matrix
     from rstbx.cftbx.coordinate_frame_helpers import align_reference_frame
 
@@ -64,9 +66,6 @@ def export_xds_ascii(integrated_data, experiment_list, params, var_model=(1, 0))
 
     unit_cell = experiment.crystal.get_unit_cell()
 
-    from scitbx.array_family import flex
-    from math import sqrt
-
     assert not experiment.scan is None
     image_range = experiment.scan.get_image_range()
     phi_start, phi_range = experiment.scan.get_image_oscillation(image_range[0])
@@ -88,7 +87,7 @@ def export_xds_ascii(integrated_data, experiment_list, params, var_model=(1, 0))
     if "partiality" in integrated_data:
         partiality = 100 * integrated_data["partiality"]
     else:
-        prof_corr = flex.double(nref, 100.0)
+        partiality = flex.double(nref, 100.0)
 
     if "intensity.sum.value" in integrated_data:
         I = integrated_data["intensity.sum.value"]
@@ -181,54 +180,67 @@ def export_xds_ascii(integrated_data, experiment_list, params, var_model=(1, 0))
         )
     )
 
-    # then write the data records
-
-    s0 = Rd * matrix.col(experiment.beam.get_s0())
-
-    for j in range(nref):
-        x, y, z = integrated_data["xyzcal.px"][j]
-        phi = phi_start + z * phi_range
-        h, k, l = miller_index[j]
-        X = (UB * (h, k, l)).rotate(axis, phi, deg=True)
-        s = s0 + X
-        g = s.cross(s0).normalize()
-        f = (s - s0).normalize()
-
-        # find component of beam perpendicular to f, e
-        e = -(s + s0).normalize()
-        if h == k and k == l:
-            u = (h, -h, 0)
-        else:
-            u = (k - l, l - h, h - k)
-        q = (
-            (matrix.col(u).transpose() * UB.inverse())
-            .normalize()
-            .transpose()
-            .rotate(axis, phi, deg=True)
-        )
+    # then compute psi for all the reflections
+    x, y, z = integrated_data["xyzcal.px"].parts()
+    psi = calculate_psi(
+        experiment,
+        miller_index,
+        z,
+        nthreads=number_of_processors(return_value_if_unknown=1),
+    )
 
-        psi = q.angle(g, deg=True)
-        if q.dot(e) < 0:
-            psi *= -1
-
-        fout.write(
-            "%d %d %d %f %f %f %f %f %f %.1f %.1f %f\n"
-            % (
-                h,
-                k,
-                l,
-                I[j],
-                sigI[j],
-                x,
-                y,
-                z,
-                scl[j],
-                partiality[j],
-                prof_corr[j],
-                psi,
-            )
-        )
+    # then write the data records
+    h, k, l = [c.iround() for c in miller_index.as_vec3_double().parts()]
+    write_formatted_rows(
+        fout,
+        "%d %d %d %f %f %f %f %f %f %.1f %.1f %f\n",
+        [h, k, l, I, sigI, x, y, z, scl, partiality, prof_corr, psi],
+    )
 
     fout.write("!END_OF_DATA\n")
     fout.close()
     logger.info("Output %d reflections to %s" % (nref, params.xds_ascii.hklout))
+
+
+def calculate_psi(experiment, miller_index, z, nthreads=1):
+    """Calculate the azimuthal angle psi (in degrees) for each reflection.
+
+    The reciprocal lattice vector of each reflection is the scan static UB * hkl
+    rotated about the goniometer rotation axis by the angle of its z position
+    (in images) in the scan. Psi does not depend on the coordinate frame, so it
+    is computed in the laboratory frame by the ReflectionGeometry kernel.
+    """
+    from dials.array_family import flex
+    from dials.algorithms.integration import ReflectionGeometry
+    from dials.algorithms.integration.reflection_geometry import (
+        reflection_geometry_model,
+    )
+    from scitbx import matrix
+
+    image_range = experiment.scan.get_image_range()
+    phi_start, phi_range = experiment.scan.get_image_oscillation(image_range[0])
+
+    # the fixed and setting rotations are not applied to UB, as the rotation
+    # axis is taken with the setting rotation applied
+    identity = matrix.identity(3).elems
+    compute = ReflectionGeometry()
+    compute.append(
+        reflection_geometry_model(
+            experiment,
+            fixed_rotation=identity,
+            setting_rotation=identity,
+            rotation_axis=experiment.goniometer.get_rotation_axis(),
+        )
+    )
+    result = compute.compute(
+        id=flex.int(),
+        s1=flex.vec3_double(),
+        panel=flex.size_t(),
+        miller_index=miller_index,
+        UB=flex.mat3_double(1, experiment.crystal.get_A()),
+        phi=(phi_start + z * phi_range) * (math.pi / 180),
+        psi=True,
+        direction_cosines=False,
+        nthreads=nthreads,
+    )
+    return result.psi
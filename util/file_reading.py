@@ -0,0 +1,229 @@
+"""
+Read many experiment list and reflection files, in parallel and in order.
+
+Experiment list files are read in threads and their JSON is decoded in worker
+processes. The decoded JSON can be cached on disk, keyed on the path,
+modification time and size of each file, so that reading the same files again
+only needs the cached objects to be unpickled. Reflection files are read in
+threads. The first bytes of each file are checked before it is read, so that
+JSON files are only read as experiment lists, and other files (e.g. pickled or
+msgpack reflection tables) only as reflection tables. In each case the results
+are returned in the order of the files, so the order of the input is
+independent of the number of processes.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import errno
+import functools
+import hashlib
+import json
+import os
+import tempfile
+import traceback
+
+from six.moves import cPickle as pickle
+
+from dials.util.image_iterator import imap_ordered
+
+# Files are only read in parallel if there are at least this many per process
+MIN_FILES_PER_PROCESS = 4
+
+# File extensions that identify the type of a file, so that reading it as
+# another type need not be tried
+EXPERIMENT_LIST_EXTENSIONS = (".expt",)
+REFLECTION_TABLE_EXTENSIONS = (".refl",)
+
+
+def has_extension(filename, extensions):
+    """Return True if the filename ends with one of the extensions"""
+    return os.path.splitext(filename)[1].lower() in extensions
+
+
+def is_json_file(filename):
+    """Return True if the first character of a file, after any whitespace,
+    opens a JSON object or array, without reading the rest of the file"""
+    with open(filename, "rb") as fh:
+        start = fh.read(4096).lstrip()
+    return start[:1] in (b"{", b"[")
+
+
+def default_nproc(n_files):
+    """The number of processes to read a number of files with, using the
+    available cores if there are enough files to make it worthwhile"""
+    from libtbx.introspection import number_of_processors
+
+    nproc = number_of_processors(return_value_if_unknown=1)
+    return max(1, min(nproc, n_files // MIN_FILES_PER_PROCESS))
+
+
+class ExperimentListCache(object):
+    """
+    An on-disk cache of decoded experiment list files.
+
+    Each entry is the pickled, decoded JSON of a file, stored under a hash of
+    the absolute path, modification time and size of the file, so an entry is
+    no longer found once the file is changed. Entries are written atomically,
+    so the cache may be shared by concurrent jobs, and are never removed; the
+    directory may be deleted at any time.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _entry(self, filename):
+        st = os.stat(filename)
+        key = "%s\n%r\n%d" % (os.path.abspath(filename), st.st_mtime, st.st_size)
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest + ".pickle")
+
+    def __contains__(self, filename):
+        try:
+            return os.path.isfile(self._entry(filename))
+        except OSError:
+            return False
+
+    def get(self, filename):
+        """Return the decoded experiment list file, or None if not cached"""
+        try:
+            with open(self._entry(filename), "rb") as fh:
+                return pickle.load(fh)
+        except Exception:
+            # a missing or unreadable entry is a cache miss
+            return None
+
+    def put(self, filename, obj):
+        """Add a decoded experiment list file to the cache"""
+        entry = self._entry(filename)
+        try:
+            os.makedirs(self.directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                pickle.dump(obj, fh, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, entry)
+        except Exception:
+            os.remove(tmp)
+            raise
+
+
+def _error_info(exception):
+    return exception, traceback.format_exc()
+
+
+def _read_text(filename):
+    try:
+        with open(filename, "r") as fh:
+            return fh.read(), None
+    except Exception as e:
+        return None, _error_info(e)
+
+
+def _decode_experiment_list(filename, data, cache_dir=None):
+    from dxtbx.serialize.load import _decode_dict
+
+    text, error = data
+    if error is not None:
+        return data
+    try:
+        obj = json.loads(text, object_hook=_decode_dict)
+    except Exception as e:
+        return None, _error_info(e)
+    if cache_dir is not None:
+        try:
+            ExperimentListCache(cache_dir).put(filename, obj)
+        except Exception:
+            pass
+    return obj, None
+
+
+def _not_json_error(filename):
+    from dxtbx.model.experiment_list import InvalidExperimentListError
+
+    try:
+        if is_json_file(filename):
+            return None
+        raise InvalidExperimentListError("%s is not a JSON file" % filename)
+    except Exception as e:
+        return _error_info(e)
+
+
+def read_experiment_list_dicts(filenames, nproc=1, cache_dir=None):
+    """
+    Read and decode the JSON of experiment list files, which may be converted
+    to experiment lists with ExperimentListFactory.from_dict. Files that are not
+    JSON are not read, and an InvalidExperimentListError is returned for them.
+
+    :param filenames: The experiment list files
+    :param nproc: The number of processes decoding files
+    :param cache_dir: A directory to cache the decoded files in, or None
+    :return: A generator of (filename, decoded JSON, error) in the order of
+             the files, where error is None or a tuple of the exception raised
+             and its formatted traceback
+
+    """
+    filenames = list(filenames)
+    cache = ExperimentListCache(cache_dir) if cache_dir is not None else None
+    cached = [cache is not None and filename in cache for filename in filenames]
+    errors = [None if hit else _not_json_error(f) for f, hit in zip(filenames, cached)]
+    decoded = imap_ordered(
+        _read_text,
+        functools.partial(_decode_experiment_list, cache_dir=cache_dir),
+        [
+            filename
+            for filename, hit, error in zip(filenames, cached, errors)
+            if not hit and error is None
+        ],
+        nthreads=min(nproc, 4),
+        nproc=nproc,
+    )
+    try:
+        for filename, hit, error in zip(filenames, cached, errors):
+            obj = cache.get(filename) if hit else None
+            if error is not None:
+                yield filename, None, error
+            elif obj is not None:
+                yield filename, obj, None
+            elif hit:
+                # the entry has been removed or spoilt since it was found
+                obj, error = _decode_experiment_list(
+                    filename, _read_text(filename), cache_dir
+                )
+                yield filename, obj, error
+            else:
+                _, (obj, error) = next(decoded)
+                yield filename, obj, error
+    finally:
+        decoded.close()
+
+
+def _read_reflection_table(filename):
+    from dials.array_family import flex
+
+    try:
+        if is_json_file(filename):
+            raise pickle.UnpicklingError("%s is a JSON file" % filename)
+        return flex.reflection_table.from_file(filename), None
+    except Exception as e:
+        return None, _error_info(e)
+
+
+def read_reflection_tables(filenames, nproc=1):
+    """
+    Read reflection files in threads. JSON files are not read, and an
+    UnpicklingError is returned for them.
+
+    :param filenames: The reflection files
+    :param nproc: The number of threads reading files
+    :return: A generator of (filename, reflection table, error) in the order of
+             the files, where error is None or a tuple of the exception raised
+             and its formatted traceback
+
+    """
+    for filename, (table, error) in imap_ordered(
+        _read_reflection_table, None, filenames, nthreads=nproc
+    ):
+        yield filename, table, error
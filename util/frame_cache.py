@@ -0,0 +1,414 @@
+"""
+A cache of decoded frames, shared by everything that reads the images of an
+imageset in a process, and optionally by processes on the same machine.
+
+Reading an image decompresses it, and reading the corrected data also applies
+the gain and pedestal, each time it is read. Frames are identified by the
+format class, path, modification time and size of the image file and the
+index of the image in the file, with the gain and pedestal for the corrected
+data, so a frame is not found once the file has changed. There are two
+levels:
+
+- a least recently used cache of the panel arrays in memory, bounded in bytes;
+- optionally a store of the panel arrays in files in a local scratch
+  directory, which are read through memory maps, bounded in bytes by removing
+  the least recently read frames. The store may be shared by concurrent
+  processes and by commands run one after another.
+
+The cache is disabled unless configured, either with configure() or with the
+environment variables DIALS_FRAME_CACHE_MB (the size of the memory cache),
+DIALS_FRAME_CACHE_DIR (the scratch directory) and DIALS_FRAME_CACHE_DIR_MB
+(the size limit of the scratch directory). The data returned is a copy, which
+the caller may modify.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import collections
+import errno
+import hashlib
+import json
+import logging
+import mmap
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+from scitbx.array_family import flex
+
+logger = logging.getLogger(__name__)
+
+# The default size limit of the scratch directory, in MB
+DEFAULT_DIRECTORY_MB = 10000
+
+# The numpy types of the flex arrays which may be stored in the scratch
+# directory
+_NUMPY_TYPES = {
+    "int": np.int32,
+    "float": np.float32,
+    "double": np.float64,
+    "bool": np.bool_,
+}
+
+# The size of the header of a frame file, holding the panel types and sizes
+_HEADER_SIZE = 4096
+
+
+def _as_tuple(data):
+    if isinstance(data, tuple):
+        return data
+    return (data,)
+
+
+def _nbytes(data):
+    return sum(
+        a.size() * np.dtype(_NUMPY_TYPES.get(_type(a), np.float64)).itemsize
+        for a in data
+    )
+
+
+def _type(array):
+    return type(array).__name__
+
+
+def _copy(data):
+    return tuple(a.deep_copy() for a in data)
+
+
+def frame_key(imageset, index, corrected):
+    """
+    The key identifying a frame of an imageset, or None if the frame is not
+    read from a file.
+
+    :param imageset: The imageset
+    :param index: The index of the image in the imageset
+    :param corrected: True for the corrected data, False for the raw data
+    :return: The hex digest
+
+    """
+    try:
+        path = imageset.get_path(index)
+        st = os.stat(path)
+    except Exception:
+        return None
+    parts = [
+        imageset.get_format_class().__name__,
+        os.path.abspath(path),
+        repr(st.st_mtime),
+        str(st.st_size),
+        str(imageset.indices()[index]),
+    ]
+    if corrected:
+        lookup = imageset.external_lookup
+        parts.append("corrected")
+        parts.append(str(lookup.gain.filename))
+        parts.append(str(lookup.pedestal.filename))
+        parts.extend(repr(panel.get_gain()) for panel in imageset.get_detector())
+    return hashlib.sha1("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+class MemoryFrameCache(object):
+    """A least recently used cache of frames, bounded in bytes"""
+
+    def __init__(self, max_bytes):
+        assert max_bytes > 0
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the frame for a key, or None, marking it as recently used"""
+        with self._lock:
+            try:
+                data, nbytes = self._data.pop(key)
+            except KeyError:
+                return None
+            self._data[key] = data, nbytes
+            return data
+
+    def put(self, key, data):
+        """Add a frame, evicting the least recently used frames if full"""
+        nbytes = _nbytes(data)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            self._data[key] = data, nbytes
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted) = self._data.popitem(last=False)
+                self.nbytes -= evicted
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+
+def _read_frame(buf):
+    """Copy the panel arrays of a frame out of the buffer of a frame file"""
+    header = json.loads(buf[:_HEADER_SIZE].rstrip(b"\0").decode("utf-8"))
+    data = []
+    offset = _HEADER_SIZE
+    for type_name, shape in header:
+        dtype = np.dtype(_NUMPY_TYPES[type_name])
+        count = int(np.prod(shape))
+        array = getattr(flex, type_name)(
+            np.frombuffer(buf, dtype=dtype, count=count, offset=offset).copy()
+        )
+        array.reshape(flex.grid(shape))
+        data.append(array)
+        offset += count * dtype.itemsize
+    return tuple(data)
+
+
+class MappedFrameStore(object):
+    """
+    A store of frames in files in a scratch directory, read through memory
+    maps.
+
+    Each frame is a file with a header of the types and sizes of the panel
+    arrays, followed by the contents of the arrays. Files are written under a
+    temporary name and then renamed, so a concurrent reader never sees a
+    partially written frame. When the store exceeds its size limit the least
+    recently read frames, by modification time, are removed.
+    """
+
+    def __init__(self, directory, max_bytes):
+        assert max_bytes > 0
+        self.directory = directory
+        self.max_bytes = max_bytes
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        self._nbytes = None
+
+    def filename(self, key):
+        return os.path.join(self.directory, key + ".frame")
+
+    def get(self, key):
+        """Return the frame for a key, or None if it is not stored"""
+        filename = self.filename(key)
+        try:
+            with open(filename, "rb") as fh:
+                buf = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError):
+            return None
+        try:
+            data = _read_frame(buf)
+        except Exception:
+            logger.debug("Unable to read cached frame %s", filename)
+            return None
+        finally:
+            buf.close()
+        try:
+            # mark the frame as recently read
+            os.utime(filename, None)
+        except OSError:
+            pass
+        return data
+
+    def put(self, key, data):
+        """Add a frame to the store, removing the least recently read frames if
+        the size limit is exceeded"""
+        if not all(_type(a) in _NUMPY_TYPES for a in data):
+            return
+        header = json.dumps([(_type(a), list(a.all())) for a in data])
+        header = header.encode("utf-8")
+        if len(header) > _HEADER_SIZE:
+            return
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(header.ljust(_HEADER_SIZE, b"\0"))
+                for a in data:
+                    fh.write(
+                        a.as_numpy_array().astype(_NUMPY_TYPES[_type(a)]).tobytes()
+                    )
+            os.rename(tmp, self.filename(key))
+        except Exception:
+            os.remove(tmp)
+            raise
+        if self._nbytes is not None:
+            self._nbytes += _HEADER_SIZE + _nbytes(data)
+        if self._nbytes is None or self._nbytes > self.max_bytes:
+            self._limit_size()
+
+    def _limit_size(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".frame"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+        entries.sort()
+        self._nbytes = sum(size for _, size, _ in entries)
+        for _, size, name in entries:
+            if self._nbytes <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            self._nbytes -= size
+
+
+class FrameCache(object):
+    """
+    A cache of the raw and corrected data of the frames of imagesets, in
+    memory and optionally in a scratch directory, with the number of hits in
+    each and of misses.
+    """
+
+    def __init__(self, memory_bytes=0, directory=None, directory_bytes=None):
+        """
+        :param memory_bytes: The size of the memory cache in bytes, or 0 for
+                             no memory cache
+        :param directory: The scratch directory, or None for no store of frames
+                          in files
+        :param directory_bytes: The size limit of the scratch directory in bytes
+        """
+        self.memory = MemoryFrameCache(memory_bytes) if memory_bytes > 0 else None
+        self.store = None
+        if directory is not None:
+            if directory_bytes is None:
+                directory_bytes = DEFAULT_DIRECTORY_MB * 1000000
+            self.store = MappedFrameStore(directory, directory_bytes)
+        self.memory_hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.memory is not None or self.store is not None
+
+    def _count(self, attribute):
+        with self._lock:
+            setattr(self, attribute, getattr(self, attribute) + 1)
+
+    def _get(self, imageset, index, corrected):
+        read = imageset.get_corrected_data if corrected else imageset.get_raw_data
+        key = frame_key(imageset, index, corrected) if self.enabled else None
+        if key is None:
+            return read(index)
+        if self.memory is not None:
+            data = self.memory.get(key)
+            if data is not None:
+                self._count("memory_hits")
+                return _copy(data)
+        data = self.store.get(key) if self.store is not None else None
+        if data is not None:
+            self._count("store_hits")
+        else:
+            self._count("misses")
+            data = _as_tuple(read(index))
+            if self.store is not None:
+                self.store.put(key, data)
+        if self.memory is not None:
+            self.memory.put(key, _copy(data))
+        return data
+
+    def get_raw_data(self, imageset, index):
+        """The raw data of an image of an imageset, as imageset.get_raw_data"""
+        return self._get(imageset, index, corrected=False)
+
+    def get_corrected_data(self, imageset, index):
+        """The corrected data of an image of an imageset, as
+        imageset.get_corrected_data"""
+        return self._get(imageset, index, corrected=True)
+
+    def stats(self, since=None):
+        """
+        The numbers of hits in memory and in the scratch directory, and of
+        misses.
+
+        :param since: The stats returned earlier, to count only the hits and
+                      misses since then
+        :return: A dictionary of the counts
+
+        """
+        stats = {
+            "memory_hits": self.memory_hits,
+            "store_hits": self.store_hits,
+            "misses": self.misses,
+        }
+        if since is not None:
+            for name in stats:
+                stats[name] -= since[name]
+        return stats
+
+    def log_stats(self, stats=None):
+        """
+        Log the hits and misses, if the cache is enabled.
+
+        :param stats: The counts to log, e.g. summed over the processes which
+                      read the frames, or None for the counts of this cache
+
+        """
+        if stats is None:
+            stats = self.stats()
+        if self.enabled:
+            logger.info(
+                "Frame cache: %(memory_hits)d hits in memory, %(store_hits)d hits "
+                "in the scratch directory, %(misses)d misses" % stats
+            )
+
+
+_frame_cache = None
+
+
+def configure(memory_mb=0, directory=None, directory_mb=DEFAULT_DIRECTORY_MB):
+    """
+    Configure the frame cache of this process.
+
+    :param memory_mb: The size of the memory cache in MB, or 0 for none
+    :param directory: The scratch directory, or None for none
+    :param directory_mb: The size limit of the scratch directory in MB
+    :return: The frame cache
+
+    """
+    global _frame_cache
+    _frame_cache = FrameCache(
+        memory_bytes=int(memory_mb * 1000000),
+        directory=directory,
+        directory_bytes=int(directory_mb * 1000000),
+    )
+    return _frame_cache
+
+
+def frame_cache():
+    """The frame cache of this process, configured from the environment
+    variables on first use"""
+    if _frame_cache is None:
+        configure(
+            memory_mb=float(os.getenv("DIALS_FRAME_CACHE_MB", 0)),
+            directory=os.getenv("DIALS_FRAME_CACHE_DIR") or None,
+            directory_mb=float(
+                os.getenv("DIALS_FRAME_CACHE_DIR_MB", DEFAULT_DIRECTORY_MB)
+            ),
+        )
+    return _frame_cache
+
+
+def get_raw_data(imageset, index):
+    """The raw data of an image of an imageset, through the frame cache"""
+    return frame_cache().get_raw_data(imageset, index)
+
+
+def get_corrected_data(imageset, index):
+    """The corrected data of an image of an imageset, through the frame cache"""
+    return frame_cache().get_corrected_data(imageset, index)
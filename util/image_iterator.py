@@ -0,0 +1,131 @@
+"""
+Iterate over the images of an imageset with the reading and processing of the
+images overlapped.
+
+Images are read ahead in a thread and processed in a pool of worker processes,
+while the results are returned in the order of the images. The
+number of images that have been read but whose results have not yet been
+returned is bounded, so the memory used does not depend on the length of the
+imageset.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import collections
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+from dials.util import frame_cache
+
+
+def imap_ordered(read, func, items, nthreads=1, nproc=1, max_queued=None):
+    """
+    Read and process a sequence of items, yielding the results in order.
+
+    :param read: Called as read(item) in a thread to read an item
+    :param func: Called as func(item, data) to process the data read for an
+                 item. If nproc > 1 this must be picklable, e.g. a module level
+                 function or a functools.partial of one. If None, the data is
+                 returned as the result.
+    :param items: The items to read
+    :param nthreads: The number of threads reading items. With more than one,
+                     read must be thread safe, e.g. each item a separate file
+    :param nproc: The number of worker processes (with 1, items are processed in
+                  this process)
+    :param max_queued: The maximum number of items read ahead of the results
+                       being consumed (by default twice the number of threads
+                       and processes)
+    :return: A generator of (item, result) in the order of the items
+
+    """
+    assert nthreads > 0
+    assert nproc > 0
+    if max_queued is None:
+        max_queued = 2 * (nthreads + nproc)
+    assert max_queued > 0
+
+    items = iter(items)
+
+    # start the worker processes before the threads, so no threads are forked
+    workers = None
+    if func is not None and nproc > 1:
+        workers = multiprocessing.Pool(processes=nproc)
+    readers = ThreadPool(processes=nthreads)
+
+    # items being read, and items read and being processed, both in order
+    reading = collections.deque()
+    processing = collections.deque()
+    finished = False
+    try:
+        while True:
+
+            # keep the queue full
+            while not finished and len(reading) + len(processing) < max_queued:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    finished = True
+                    break
+                reading.append((item, readers.apply_async(read, (item,))))
+
+            # pass the items that have been read, in order, to the workers. Wait
+            # for the next read if there is nothing else to do
+            while reading and (reading[0][1].ready() or not processing):
+                item, result = reading.popleft()
+                data = result.get()
+                if workers is not None:
+                    data = workers.apply_async(func, (item, data))
+                processing.append((item, data))
+
+            if not processing:
+                break
+            item, data = processing.popleft()
+            if workers is not None:
+                yield item, data.get()
+            elif func is not None:
+                yield item, func(item, data)
+            else:
+                yield item, data
+    finally:
+        readers.terminate()
+        if workers is not None:
+            workers.terminate()
+            workers.join()
+        readers.join()
+
+
+def _read_raw_data(imageset, index):
+    return frame_cache.get_raw_data(imageset, index)
+
+
+def iterate_imageset(
+    imageset, func=None, indices=None, read=None, nproc=1, max_queued=None
+):
+    """
+    Iterate over the images of an imageset, reading ahead in a thread and
+    processing the images in worker processes. The imageset and its format
+    reader are not thread safe, so all the images are read by one thread.
+
+    :param imageset: The imageset
+    :param func: Called as func(index, data) to process each image, see
+                 imap_ordered. If None the data is returned.
+    :param indices: The indices of the images in the imageset (default all)
+    :param read: Called as read(imageset, index) to read each image (by
+                 default the raw data)
+    :param nproc: The number of worker processes
+    :param max_queued: The maximum number of images read ahead
+    :return: A generator of (index, result) in the order of the indices
+
+    """
+    if indices is None:
+        indices = range(len(imageset))
+    if read is None:
+        read = _read_raw_data
+    return imap_ordered(
+        lambda index: read(imageset, index),
+        func,
+        indices,
+        nthreads=1,
+        nproc=nproc,
+        max_queued=max_queued,
+    )
@@ -157,14 +157,12 @@ def OnRestoreMetrology(self, event):
                 # Update the view, trigger redraw.  XXX Duplication
                 # w.r.t. OnUpdateQuad().
                 tiles = frame.pyslip.tiles
-                tiles.flex_image = frame.pyslip.tiles.raw_image.get_flex_image(
-                    brightness=tiles.current_brightness / 100
+                tiles.set_flex_image(
+                    frame.pyslip.tiles.raw_image.get_flex_image(
+                        brightness=tiles.current_brightness / 100
+                    )
                 )
                 tiles.flex_image.adjust(color_scheme=tiles.current_color_scheme)
-
-                tiles.reset_the_cache()
-                tiles.tile_cache = tiles.cache[tiles.zoom_level]
-                tiles.tile_list = tiles.lru[tiles.zoom_level]
                 frame.pyslip.Update()
 
                 # Update the controls, remember to reset the default values
@@ -275,10 +273,6 @@ def OnUpdateQuad(self, event):
         tiles = frame.pyslip.tiles
         tiles.set_image(tiles.raw_image)
         tiles.flex_image.adjust(color_scheme=tiles.current_color_scheme)
-
-        tiles.reset_the_cache()
-        tiles.tile_cache = tiles.cache[tiles.zoom_level]
-        tiles.tile_list = tiles.lru[tiles.zoom_level]
         frame.pyslip.Update()
 
     def OnSpinAmount(self, event):
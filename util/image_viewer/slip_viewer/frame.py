@@ -15,6 +15,7 @@
 from ..rstbx_frame import XrayFrame as XFBaseClass
 from rstbx.viewer import settings as rv_settings, image as rv_image
 from wxtbx import bitmaps
+from dials.util import frame_cache
 
 from .slip_display import AppFrame
 
@@ -44,7 +45,7 @@ def get_mask(self):
 
     def get_raw_data(self):
         if self._raw_data is None:
-            return self.image_set[self.index]
+            return frame_cache.get_corrected_data(self.image_set, self.index)
         return self._raw_data
 
     def set_raw_data(self, raw_data):
@@ -123,6 +124,7 @@ def __init__(self, *args, **kwds):
         self.SetSize((720, 720))
 
         self.Bind(EVT_EXTERNAL_UPDATE, self.OnExternalUpdate)
+        self.Bind(wx.EVT_IDLE, self.OnIdle)
 
         self.Bind(wx.EVT_UPDATE_UI, self.OnUpdateUICalibration, id=self._id_calibration)
         self.Bind(wx.EVT_UPDATE_UI, self.OnUpdateUINext, id=wx.ID_FORWARD)
@@ -316,9 +318,12 @@ def get_beam_center_px(self):
 
         return panel_id, beam_pixel_fast, beam_pixel_slow
 
-    def load_image(self, file_name_or_data, get_raw_data=None, show_untrusted=False):
+    def load_image(
+        self, file_name_or_data, get_raw_data=None, show_untrusted=False, frame_key=None
+    ):
         """The load_image() function displays the image from @p
-        file_name_or_data.  The chooser is updated appropriately.
+        file_name_or_data.  The chooser is updated appropriately.  If @p
+        frame_key is given, an image prefetched with the same key is reused.
         """
 
         # Due to a bug in wxPython 3.0.2 for Linux
@@ -359,6 +364,7 @@ def load_image(self, file_name_or_data, get_raw_data=None, show_untrusted=False)
             file_name_or_data=img,
             metrology_matrices=self.metrology_matrices,
             get_raw_data=get_raw_data,
+            frame_key=frame_key,
         )
 
         # Initialise position zoom level for first image.  XXX Why do we
@@ -587,6 +593,13 @@ def OnPlugin(event):
 
         return OnPlugin
 
+    def OnIdle(self, event):
+        # Render the tiles of the prefetched images a few at a time, so that
+        # the viewer stays responsive
+        if self.pyslip is not None and self.pyslip.tiles.process_prefetch():
+            event.RequestMore()
+        event.Skip()
+
     def OnUpdateUICalibration(self, event):
         # If quadrant calibration is not supported for this image, disable
         # the corresponding menu item.  Toggle the menu item text
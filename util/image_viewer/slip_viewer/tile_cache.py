@@ -0,0 +1,184 @@
+"""
+Caching and prefetching of rendered tiles for the slip viewer.
+
+This module does not depend on wx, so that the tile generation can be run and
+timed headless. Tiles are held as RGB strings in a bounded least recently used
+cache shared between frames, zoom levels and display settings. The
+FlexImages for each frame are held in a TilePyramid, with a binned FlexImage
+for each zoomed out level, so that tiles at low zoom levels are rendered from
+a small image instead of from the full resolution image. Work for frames that
+are not yet displayed is held in a PrefetchQueue, to be run in small steps
+while the viewer is idle.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import collections
+import threading
+import time
+
+# The size of a tile in pixels
+TILE_SIZE = 256
+
+
+class LRUCache(object):
+    """A bounded least recently used cache, with hit and miss counts"""
+
+    def __init__(self, maxsize):
+        assert maxsize > 0
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the value for a key, marking it as recently used"""
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Add a value, evicting the least recently used values if full"""
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard(self, predicate):
+        """Remove all the values whose keys satisfy the predicate"""
+        with self._lock:
+            for key in [k for k in self._data if predicate(k)]:
+                del self._data[key]
+
+    def keys(self):
+        """Return the keys, from the least to the most recently used"""
+        with self._lock:
+            return list(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+
+def render_tile(flex_image, zoom, x, y, fraction, antialias=False):
+    """Render the tile at tile coordinates (x, y) from a FlexImage at a zoom
+    level, where each tile covers a fraction of the picture, returning the RGB
+    string of TILE_SIZE x TILE_SIZE pixels"""
+
+    if antialias:
+        # much more computationally intensive to prepare nice-looking pictures
+        # of tilted readout: render at twice the size and scale down
+        try:
+            import PIL.Image as Image
+        except ImportError:
+            import Image
+
+        flex_image.setZoom(zoom + 1)
+        flex_image.setWindowCart(y, x, fraction)
+        flex_image.prep_string()
+        w, h = flex_image.ex_size2(), flex_image.ex_size1()
+        assert w == h == 2 * TILE_SIZE
+        try:
+            I = Image.fromstring("RGB", (w, h), flex_image.export_string)
+        except NotImplementedError:
+            I = Image.frombytes("RGB", (w, h), flex_image.export_string)
+        J = I.resize((TILE_SIZE, TILE_SIZE), Image.ANTIALIAS)
+        return J.tobytes()
+
+    flex_image.setZoom(zoom)
+    flex_image.setWindowCart(y, x, fraction)
+    flex_image.prep_string()
+    w, h = flex_image.ex_size2(), flex_image.ex_size1()
+    assert w == h == TILE_SIZE
+    return flex_image.export_string
+
+
+class TilePyramid(object):
+    """
+    The FlexImages used to render the tiles of one frame. Level 0 and above
+    are rendered from the full resolution image. For a zoomed out level n < 0
+    a FlexImage binned by 2**-n is created on first use, if the image supports
+    binning, and rendered at zoom level 0. Each tile covers the same fraction
+    of the picture whichever image it is rendered from, so the tile
+    coordinates do not depend on the binning.
+    """
+
+    def __init__(self, flex_image, make_binned=None, raw_data=None):
+        """
+        :param flex_image: The full resolution FlexImage
+        :param make_binned: Called as make_binned(binning) to create a binned
+                            FlexImage, or None if binning is not supported
+        :param raw_data: The raw data the images were created from
+        """
+        self.flex_image = flex_image
+        self.raw_data = raw_data
+        self._make_binned = make_binned
+        self._binned = {}
+        # FlexImage rendering changes the state of the image, so only one
+        # tile of the pyramid may be rendered at a time
+        self._lock = threading.Lock()
+
+    def image_for_level(self, level):
+        """Return the FlexImage and zoom to render tiles of a level"""
+        if level >= 0 or self._make_binned is None:
+            return self.flex_image, level
+        binning = 2 ** -level
+        if binning not in self._binned:
+            self._binned[binning] = self._make_binned(binning)
+        return self._binned[binning], 0
+
+    def render(self, level, x, y, antialias=False):
+        """Render the RGB string of the tile at (x, y) on a zoom level"""
+        fraction = TILE_SIZE / self.flex_image.size1() / (2 ** level)
+        with self._lock:
+            flex_image, zoom = self.image_for_level(level)
+            return render_tile(flex_image, zoom, x, y, fraction, antialias=antialias)
+
+
+class PrefetchQueue(object):
+    """
+    An ordered queue of jobs that are run a few at a time, for example when a
+    GUI is idle. Jobs are keyed so that the same work is only queued once; a
+    job may queue further jobs.
+    """
+
+    def __init__(self):
+        self._jobs = collections.OrderedDict()
+
+    def add(self, key, job):
+        """Queue a job, unless a job with the same key is already queued"""
+        if key not in self._jobs:
+            self._jobs[key] = job
+
+    def cancel(self):
+        """Drop all the queued jobs"""
+        self._jobs.clear()
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def run(self, max_time=0.05):
+        """Run queued jobs in order until the time (in seconds) is used up,
+        returning True if there are jobs remaining"""
+        t0 = time.time()
+        while self._jobs:
+            key, job = self._jobs.popitem(last=False)
+            job()
+            if time.time() - t0 >= max_time:
+                break
+        return len(self._jobs) > 0
@@ -5,9 +5,18 @@
 from __future__ import absolute_import, division, print_function
 from six.moves import range
 
+import functools
 import math
+
 import wx
 
+from .tile_cache import (
+    TILE_SIZE,
+    LRUCache,
+    PrefetchQueue,
+    TilePyramid,
+)
+
 ######
 # Base class for a tile object - handles access to tiles.
 ######
@@ -252,200 +261,262 @@ def _get_flex_image_multipanel(
 
 
 class _Tiles(object):
-    # maximum number of tiles held in each level cache
+    # maximum number of tiles held in the cache, shared between all the
+    # frames, levels and display settings
     MaxTileList = 512
+    # maximum number of frames (with their display settings) whose images are
+    # held, so that the current image and its neighbours may be kept
+    MaxPyramidList = 4
+    # number of recently displayed tiles that are rendered for a prefetched
+    # frame
+    MaxPrefetchTiles = 64
 
     def __init__(self, filename):
-        (self.tile_size_x, self.tile_size_y) = (256, 256)
+        (self.tile_size_x, self.tile_size_y) = (TILE_SIZE, TILE_SIZE)
         self.levels = [-3, -2, -1, 0, 1, 2, 3, 4, 5]
 
         # set min and max tile levels
         self.min_level = -3
         self.max_level = 5
         self.extent = (-180.0, 180.0, -166.66, 166.66)  # longitude & latitude limits
-        self.set_image(filename)
         self.current_brightness = 1.0
         self.current_color_scheme = 0
         self.user_requests_antialiasing = False
 
         self.show_untrusted = False
 
-    def set_image(self, file_name_or_data, metrology_matrices=None, get_raw_data=None):
-
+        self.prefetch_queue = PrefetchQueue()
         self.reset_the_cache()
-        if file_name_or_data is None:
-            self.raw_image = None
-            return
-        if type(file_name_or_data) is type(""):
-            from iotbx.detectors import ImageFactory
-
-            self.raw_image = ImageFactory(file_name_or_data)
-            self.raw_image.read()
-        else:
-            try:
-                self.raw_image = file_name_or_data._raw
-            except AttributeError:
-                self.raw_image = file_name_or_data
-        # print "SETTING NEW IMAGE",self.raw_image.filename
+        self.set_image(filename)
 
-        # XXX Since there doesn't seem to be a good way to refresh the
-        # image (yet), the metrology has to be applied here, and not
-        # in frame.py.
+    def _display_key(self):
+        return (self.current_brightness, self.current_color_scheme, self.show_untrusted)
 
-        detector = self.raw_image.get_detector()
+    def _get_raw_image(self, file_name_or_data):
+        if type(file_name_or_data) is type(""):
+            from iotbx.detectors import ImageFactory
 
-        if len(detector) > 1 and metrology_matrices is not None:
-            self.raw_image.apply_metrology_from_matrices(metrology_matrices)
+            raw_image = ImageFactory(file_name_or_data)
+            raw_image.read()
+            return raw_image
+        try:
+            return file_name_or_data._raw
+        except AttributeError:
+            return file_name_or_data
 
-        if get_raw_data is not None:
-            self.raw_image.set_raw_data(get_raw_data(self.raw_image))
-        raw_data = self.raw_image.get_raw_data()
+    def _make_pyramid(self, raw_image, raw_data, adjust=True):
+        """Create the TilePyramid for raw data with the current display
+        settings"""
         if not isinstance(raw_data, tuple):
             raw_data = (raw_data,)
+        brightness = self.current_brightness / 100
+        color_scheme = self.current_color_scheme
+        show_untrusted = self.show_untrusted
+        detector = raw_image.get_detector()
 
         if len(detector) > 1:
-            self.flex_image = _get_flex_image_multipanel(
-                brightness=self.current_brightness / 100,
+            # XXX Special-case read of new-style images until multitile
+            # images are fully supported in dxtbx.  Binning is not supported
+            # for multipanel images, so all levels use the full image.
+            flex_image = _get_flex_image_multipanel(
+                brightness=brightness,
                 panels=detector,
-                show_untrusted=self.show_untrusted,
+                show_untrusted=show_untrusted,
                 raw_data=raw_data,
-                beam=self.raw_image.get_beam(),
-                color_scheme=self.current_color_scheme,
+                beam=raw_image.get_beam(),
+                color_scheme=color_scheme,
             )
+            make_binned = None
         else:
-            self.flex_image = _get_flex_image(
-                brightness=self.current_brightness / 100,
-                data=raw_data[0],
-                saturation=self.raw_image.get_detector()[0].get_trusted_range()[1],
-                vendortype=self.raw_image.get_vendortype(),
-                show_untrusted=self.show_untrusted,
-                color_scheme=self.current_color_scheme,
-            )
 
-        if self.zoom_level >= 0:
-            self.flex_image.adjust(color_scheme=self.current_color_scheme)
+            def make_binned(binning=1):
+                flex_image = _get_flex_image(
+                    brightness=brightness,
+                    data=raw_data[0],
+                    binning=binning,
+                    saturation=detector[0].get_trusted_range()[1],
+                    vendortype=raw_image.get_vendortype(),
+                    show_untrusted=show_untrusted,
+                    color_scheme=color_scheme,
+                )
+                if binning > 1:
+                    flex_image.adjust(color_scheme=color_scheme)
+                return flex_image
+
+            flex_image = make_binned()
+
+        if adjust:
+            flex_image.adjust(color_scheme=color_scheme)
+        return TilePyramid(flex_image, make_binned=make_binned, raw_data=raw_data)
+
+    def _load_pyramid(
+        self, frame_key, raw_image, metrology_matrices=None, get_raw_data=None
+    ):
+        """Return the TilePyramid of a frame with the current display settings,
+        reading and caching it if necessary"""
+        key = (frame_key, self._display_key())
+        pyramid = self._pyramids.get(key)
+        if pyramid is not None:
+            return pyramid
 
-    def set_image_data(self, raw_image_data):
-        self.reset_the_cache()
         # XXX Since there doesn't seem to be a good way to refresh the
         # image (yet), the metrology has to be applied here, and not
         # in frame.py.
 
-        detector = self.raw_image.get_detector()
-        self.raw_image.set_raw_data(raw_image_data)
-        if len(detector) == 1 and len(raw_image_data) == 1:
-            raw_image_data = raw_image_data[0]
+        detector = raw_image.get_detector()
 
-        if len(detector) > 1:
-            self.flex_image = _get_flex_image_multipanel(
-                brightness=self.current_brightness / 100,
-                panels=detector,
-                raw_data=raw_image_data,
-                beam=self.raw_image.get_beam(),
-            )
-        else:
-            self.flex_image = _get_flex_image(
-                brightness=self.current_brightness / 100,
-                data=raw_image_data,
-                saturation=self.raw_image.get_detector()[0].get_trusted_range()[1],
-                vendortype=self.raw_image.get_vendortype(),
-                show_untrusted=self.show_untrusted,
-            )
+        if len(detector) > 1 and metrology_matrices is not None:
+            raw_image.apply_metrology_from_matrices(metrology_matrices)
 
-        self.flex_image.adjust(color_scheme=self.current_color_scheme)
+        if get_raw_data is not None:
+            raw_data = get_raw_data(raw_image)
+        else:
+            raw_data = raw_image.get_raw_data()
+        pyramid = self._make_pyramid(
+            raw_image, raw_data, adjust=getattr(self, "zoom_level", 0) >= 0
+        )
+        self._pyramids.put(key, pyramid)
+        return pyramid
+
+    def _use_pyramid(self, frame_key, pyramid):
+        self.frame_key = frame_key
+        self.pyramid = pyramid
+        self.flex_image = pyramid.flex_image
+
+    def set_image(
+        self,
+        file_name_or_data,
+        metrology_matrices=None,
+        get_raw_data=None,
+        frame_key=None,
+    ):
+        """Display an image.
+
+        file_name_or_data   The image file name or image object
+        metrology_matrices  The metrology to apply to multipanel images
+        get_raw_data        Called as get_raw_data(raw_image) to get the data
+                            to display, instead of the raw data
+        frame_key           A key identifying the image and the data returned
+                            by get_raw_data, used to reuse an image that has
+                            been prefetched.  If None the image is not reused.
+        """
+        if frame_key is None:
+            frame_key = object()
+        if file_name_or_data is None:
+            self.raw_image = None
+            self.frame_key = frame_key
+            return
+        self.raw_image = self._get_raw_image(file_name_or_data)
+        # print "SETTING NEW IMAGE",self.raw_image.filename
+        pyramid = self._load_pyramid(
+            frame_key, self.raw_image, metrology_matrices, get_raw_data
+        )
+        if get_raw_data is not None:
+            self.raw_image.set_raw_data(pyramid.raw_data)
+        self._use_pyramid(frame_key, pyramid)
 
-    def update_brightness(self, b, color_scheme=0):
-        raw_data = self.raw_image.get_raw_data()
-        if not isinstance(raw_data, tuple):
-            raw_data = (raw_data,)
+    def set_image_data(self, raw_image_data):
+        # XXX Since there doesn't seem to be a good way to refresh the
+        # image (yet), the metrology has to be applied here, and not
+        # in frame.py.
 
-        if len(self.raw_image.get_detector()) > 1:
-            # XXX Special-case read of new-style images until multitile
-            # images are fully supported in dxtbx.
-            self.flex_image = _get_flex_image_multipanel(
-                brightness=b / 100,
-                panels=self.raw_image.get_detector(),
-                show_untrusted=self.show_untrusted,
-                raw_data=raw_data,
-                beam=self.raw_image.get_beam(),
-                color_scheme=color_scheme,
-            )
-        else:
-            self.flex_image = _get_flex_image(
-                brightness=b / 100,
-                data=raw_data[0],
-                saturation=self.raw_image.get_detector()[0].get_trusted_range()[1],
-                vendortype=self.raw_image.get_vendortype(),
-                show_untrusted=self.show_untrusted,
-                color_scheme=color_scheme,
-            )
+        self.raw_image.set_raw_data(raw_image_data)
+        frame_key = object()
+        pyramid = self._make_pyramid(self.raw_image, raw_image_data)
+        self._pyramids.put((frame_key, self._display_key()), pyramid)
+        self._use_pyramid(frame_key, pyramid)
+
+    def set_flex_image(self, flex_image):
+        """Display a FlexImage created from the current raw image, e.g. after
+        the metrology has changed"""
+        self._use_pyramid(
+            object(), TilePyramid(flex_image, raw_data=self.pyramid.raw_data)
+        )
 
-        self.reset_the_cache()
-        self.UseLevel(self.zoom_level)
+    def update_brightness(self, b, color_scheme=0):
+        # The tiles are cached for each brightness and color scheme, so
+        # returning to previous settings does not render the tiles again
         self.current_color_scheme = color_scheme
         self.current_brightness = b
-        self.flex_image.adjust(color_scheme)
+        key = (self.frame_key, self._display_key())
+        pyramid = self._pyramids.get(key)
+        if pyramid is None:
+            pyramid = self._make_pyramid(self.raw_image, self.pyramid.raw_data)
+            self._pyramids.put(key, pyramid)
+        self._use_pyramid(self.frame_key, pyramid)
+        self.UseLevel(self.zoom_level)
 
     def update_color_scheme(self, color_scheme=0):
-        self.flex_image.adjust(color_scheme)
-        self.reset_the_cache()
-        self.UseLevel(self.zoom_level)
-        self.current_color_scheme = color_scheme
+        self.update_brightness(self.current_brightness, color_scheme)
 
     def reset_the_cache(self):
 
-        # setup the tile caches and Least Recently Used lists
-        self.cache = {}
-        self.lru = {}
-        for l in self.levels:
-            self.cache[l] = {}
-            self.lru[l] = []
+        # setup the tile cache and the images of the cached frames
+        self.tile_cache = LRUCache(self.MaxTileList)
+        self._pyramids = LRUCache(self.MaxPyramidList)
+        self._recent_tiles = LRUCache(self.MaxPrefetchTiles)
+        self.prefetch_queue.cancel()
 
-    def flex_image_get_tile(self, x, y):
+    def _antialias(self, pyramid, level):
         # The supports_rotated_tiles_antialiasing_recommended flag in
         # the C++ FlexImage class indicates whether the underlying image
         # instance supports tilted readouts.  Anti-aliasing only makes
         # sense if it does.
-        if (
-            self.raw_image is not None
-            and self.zoom_level >= 2
-            and self.flex_image.supports_rotated_tiles_antialiasing_recommended
+        return (
+            level >= 2
+            and pyramid.flex_image.supports_rotated_tiles_antialiasing_recommended
             and self.user_requests_antialiasing
-        ):
-            # much more computationally intensive to prepare nice-looking pictures of tilted readout
-            self.flex_image.setZoom(self.zoom_level + 1)
-            fraction = 512.0 / self.flex_image.size1() / (2 ** (self.zoom_level + 1))
-            self.flex_image.setWindowCart(y, x, fraction)
-            self.flex_image.prep_string()
-            w, h = self.flex_image.ex_size2(), self.flex_image.ex_size1()
-            assert w == 512
-            assert h == 512
-            wx_image = wx.EmptyImage(w / 2, h / 2)
-            try:
-                import PIL.Image as Image
-            except ImportError:
-                import Image
-            try:
-                I = Image.fromstring("RGB", (512, 512), self.flex_image.export_string)
-            except NotImplementedError:
-                I = Image.frombytes("RGB", (512, 512), self.flex_image.export_string)
-            J = I.resize((256, 256), Image.ANTIALIAS)
-            wx_image.SetData(J.tostring())
-            return wx_image.ConvertToBitmap()
-        elif self.raw_image is not None:
-            self.flex_image.setZoom(self.zoom_level)
-            fraction = 256.0 / self.flex_image.size1() / (2 ** self.zoom_level)
-            self.flex_image.setWindowCart(y, x, fraction)
-            self.flex_image.prep_string()
-            w, h = self.flex_image.ex_size2(), self.flex_image.ex_size1()
-            assert w == 256
-            assert h == 256
-            wx_image = wx.EmptyImage(w, h)
-            wx_image.SetData(self.flex_image.export_string)
-            return wx_image.ConvertToBitmap()
-        else:
-            wx_image = wx.EmptyImage(256, 256)
-            return wx_image.ConvertToBitmap()
+        )
+
+    def _get_tile_data(self, frame_key, pyramid, level, x, y):
+        """Return the RGB string of a tile, from the cache if possible"""
+        antialias = self._antialias(pyramid, level)
+        key = (frame_key, self._display_key(), level, x, y, antialias)
+        data = self.tile_cache.get(key)
+        if data is None:
+            data = pyramid.render(level, x, y, antialias=antialias)
+            self.tile_cache.put(key, data)
+        return data
+
+    def flex_image_get_tile(self, x, y):
+        wx_image = wx.EmptyImage(TILE_SIZE, TILE_SIZE)
+        if self.raw_image is not None:
+            wx_image.SetData(
+                self._get_tile_data(self.frame_key, self.pyramid, self.zoom_level, x, y)
+            )
+        return wx_image.ConvertToBitmap()
+
+    def prefetch(
+        self, frame_key, file_name_or_data, metrology_matrices=None, get_raw_data=None
+    ):
+        """Queue the reading of another frame, and the rendering of its tiles
+        that are in view, to be done by process_prefetch().  The arguments are
+        as for set_image().
+        """
+        display_key = self._display_key()
+        tiles = self._recent_tiles.keys()[::-1]
+
+        def load():
+            if display_key != self._display_key():
+                return
+            raw_image = self._get_raw_image(file_name_or_data)
+            pyramid = self._load_pyramid(
+                frame_key, raw_image, metrology_matrices, get_raw_data
+            )
+            for level, x, y in tiles:
+                self.prefetch_queue.add(
+                    (frame_key, display_key, level, x, y),
+                    functools.partial(
+                        self._get_tile_data, frame_key, pyramid, level, x, y
+                    ),
+                )
+
+        self.prefetch_queue.add((frame_key, display_key), load)
+
+    def process_prefetch(self, max_time=0.05):
+        """Do the queued prefetching for up to max_time seconds, returning
+        True if there is more to do"""
+        return self.prefetch_queue.run(max_time=max_time)
 
     def get_binning(self):
         if self.zoom_level >= 0:
@@ -463,10 +534,7 @@ def UseLevel(self, n):
         """
         # try to get cache for this level, no cache means no level
         # print "IN USE LEVEL",n
-        try:
-            self.tile_cache = self.cache[n]
-            self.tile_list = self.lru[n]
-        except KeyError:
+        if n not in self.levels:
             return None
         self.zoom_level = n
         if self.raw_image is None:  # dummy values if there is no image
@@ -531,20 +599,8 @@ def GetTile(self, x, y):
         Returns bitmap object containing the tile image.
         Tile coordinates are measured from map top-left.
         """
-        try:
-            # if tile in cache, return it from there
-            pic = self.tile_cache[(x, y)]
-            index = self.tile_list.index((x, y))
-            del self.tile_list[index]
-        except KeyError:
-            pic = self.flex_image_get_tile(x, y)
-            self.tile_cache[(x, y)] = pic
-
-        self.tile_list.insert(0, (x, y))
-        if len(self.tile_cache) >= self.MaxTileList:
-            del self.tile_cache[self.tile_list[-1]]
-            del self.tile_list[-1]
-        return pic
+        self._recent_tiles.put((self.zoom_level, x, y), None)
+        return self.flex_image_get_tile(x, y)
 
     def get_flex_pixel_coordinates(self, lon, lat):
         fast_picture_coord_pixel_scale, slow_picture_coord_pixel_scale = self.lon_lat_to_picture_fast_slow(
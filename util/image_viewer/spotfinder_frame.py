@@ -79,6 +79,9 @@ def __init__(self, *args, **kwds):
 
         # Store the list of images we can view
         self.images = ImageCollectionWithSelection()
+        # Incremented whenever the data displayed for an image changes, so that
+        # images prefetched with old display settings are not reused
+        self._display_generation = 0
 
         super(SpotFrame, self).__init__(*args, **kwds)
 
@@ -566,9 +569,29 @@ def load_file_event(self, evt):
 
     def reload_image(self):
         """Re-load the currently displayed image"""
+        self._display_generation += 1
         with wx.BusyCursor():
             self.load_image(self.images.selected, refresh=True)
 
+    def _frame_key(self, image):
+        """The key identifying the displayed data of an image, for prefetching"""
+        return (image.full_path, image.index, self._display_generation)
+
+    def prefetch_neighbours(self):
+        """Queue the previous and next images to be read and rendered while the
+        viewer is idle, so that stepping through the images is fast"""
+        tiles = self.pyslip.tiles
+        tiles.prefetch_queue.cancel()
+        for i in (self.images.selected_index + 1, self.images.selected_index - 1):
+            if 0 <= i < len(self.images):
+                image = self.images[i]
+                tiles.prefetch(
+                    self._frame_key(image),
+                    image,
+                    metrology_matrices=self.metrology_matrices,
+                    get_raw_data=self.get_raw_data,
+                )
+
     def load_image(self, file_name_or_data, refresh=False):
         """
         Load and display an image.
@@ -613,6 +636,7 @@ def load_image(self, file_name_or_data, refresh=False):
             file_name_or_data,
             get_raw_data=self.get_raw_data,
             show_untrusted=show_untrusted,
+            frame_key=self._frame_key(file_name_or_data),
         )
 
         # Update the navigation UI controls to reflect this loaded image
@@ -627,6 +651,8 @@ def load_image(self, file_name_or_data, refresh=False):
         ):
             previously_selected_image.set_raw_data(None)
 
+        self.prefetch_neighbours()
+
     def OnShowSettings(self, event):
         if self.settings_frame is None:
             frame_rect = self.GetRect()
@@ -1014,7 +1040,7 @@ def get_raw_data(self, image):
 
         raw_data = tuple(raw_data)
         if self.params.show_mask:
-            self.mask_raw_data(raw_data)
+            self.mask_raw_data(raw_data, image)
         return raw_data
 
     def show_filters(self):
@@ -1261,8 +1287,10 @@ def get_mask(self, image):
         assert mask is not None, "Mask should never be None here"
         return mask
 
-    def mask_raw_data(self, raw_data):
-        mask = self.get_mask(self.pyslip.tiles.raw_image)
+    def mask_raw_data(self, raw_data, image=None):
+        if image is None:
+            image = self.pyslip.tiles.raw_image
+        mask = self.get_mask(image)
         for rd, m in zip(raw_data, mask):
             rd.set_selected(~m, -2)
 
@@ -57,12 +57,10 @@ def parse_multiple_datasets(reflections):
                 "containing %s datasets. \n",
                 len(dataset_ids),
             )
-            ##FIXME fix split_by_experiment_id so that don't need to filter
-            # unindxeded reflections here to get rid of id = -1
-            if -1 in refl_table["id"]:
-                refl_table = refl_table.select(refl_table["id"] != -1)
-            result = refl_table.split_by_experiment_id()
-            single_reflection_tables.extend(result)
+            # split with one sort of the ids, ignoring unindexed reflections
+            # (id = -1), copying only the reflections of each dataset
+            views = refl_table.split_views_by_experiment_id()
+            single_reflection_tables.extend(view.table() for view in views.values())
         else:
             single_reflection_tables.append(refl_table)
     if len(dataset_id_list) != len(set(dataset_id_list)):  # need to reset some ids
@@ -133,6 +133,26 @@
 """
 )
 
+file_reading_phil_scope = libtbx.phil.parse(
+    """
+file_reading
+  .help = "Options for reading experiment list and reflection files"
+  .expert_level = 2
+{
+  processes = Auto
+    .type = int(value_min=1)
+    .help = "The number of processes used to read experiment list and"
+            "reflection files, preserving the order of the files. If Auto,"
+            "the available cores are used when there are many files."
+  experiment_cache = None
+    .type = path
+    .help = "A directory in which to cache decoded experiment list files,"
+            "keyed on the path, modification time and size of each file, so"
+            "that reading the files again is faster. No cache is used if None."
+}
+"""
+)
+
 
 class ConfigWriter(object):
     """Class to write configuration to file."""
@@ -188,6 +208,8 @@ def __init__(
         compare_goniometer=None,
         scan_tolerance=None,
         format_kwargs=None,
+        nproc=None,
+        cache_dir=None,
     ):
         """
         Parse the arguments. Populates its instance attributes in an intelligent way
@@ -207,6 +229,11 @@ def __init__(
         :param read_experiments_from_images: Try to read the experiments from images
         :param check_format: Check the format when reading images
         :param verbose: True/False print out some stuff
+        :param nproc: The number of processes used to read experiment and
+                      reflection files (by default chosen from the number of
+                      files)
+        :param cache_dir: A directory in which to cache decoded experiment
+                          list files, or None
 
         """
 
@@ -214,6 +241,8 @@ def __init__(
         self.experiments = []
         self.reflections = []
         self.unhandled = args
+        self._nproc = nproc
+        self._cache_dir = cache_dir
         # Keep track of any errors whilst handling arguments
         self.handling_errors = defaultdict(list)
 
@@ -239,19 +268,43 @@ def __init__(
         if read_reflections:
             self.unhandled = self.try_read_reflections(self.unhandled, verbose)
 
-    def _handle_converter_error(self, argument, exception, type, validation=False):
+    def _handle_converter_error(
+        self, argument, exception, type, validation=False, formatted_traceback=None
+    ):
         "Record information about errors that occured processing an argument"
+        if formatted_traceback is None:
+            formatted_traceback = traceback.format_exc()
         self.handling_errors[argument].append(
             ArgumentHandlingErrorInfo(
                 name=argument,
                 validation=validation,
                 message=str(exception),
-                traceback=traceback.format_exc(),
+                traceback=formatted_traceback,
                 type=type,
                 exception=exception,
             )
         )
 
+    def _files_to_read(self, args, cache, skip_extensions):
+        """Return the arguments that are files to read, i.e. that exist, have
+        not been read already and are not known to be of another type"""
+        from dials.util.file_reading import has_extension
+
+        return [
+            argument
+            for argument in args
+            if argument not in cache
+            and os.path.isfile(argument)
+            and not has_extension(argument, skip_extensions)
+        ]
+
+    def _nproc_for(self, filenames):
+        from dials.util.file_reading import default_nproc
+
+        if self._nproc is None:
+            return default_nproc(len(filenames))
+        return self._nproc
+
     def try_read_experiments_from_images(
         self,
         args,
@@ -272,6 +325,11 @@ def try_read_experiments_from_images(
         """
         from dxtbx.model.experiment_list import ExperimentListFactory
         from dials.util.phil import FilenameDataWrapper, ExperimentListConverters
+        from dials.util.file_reading import (
+            has_extension,
+            EXPERIMENT_LIST_EXTENSIONS,
+            REFLECTION_TABLE_EXTENSIONS,
+        )
         from glob import glob
 
         # If filenames contain wildcards, expand
@@ -283,17 +341,31 @@ def try_read_experiments_from_images(
                 args_new.append(arg)
         args = args_new
 
-        unhandled = []
+        # Experiment list and reflection files are not images, so don't search
+        # for a format class to read them with
+        known = EXPERIMENT_LIST_EXTENSIONS + REFLECTION_TABLE_EXTENSIONS
+        images = [arg for arg in args if not has_extension(arg, known)]
+
+        unhandled_images = []
         experiments = ExperimentListFactory.from_filenames(
-            args,
+            images,
             verbose=verbose,
-            unhandled=unhandled,
+            unhandled=unhandled_images,
             compare_beam=compare_beam,
             compare_detector=compare_detector,
             compare_goniometer=compare_goniometer,
             scan_tolerance=scan_tolerance,
             format_kwargs=format_kwargs,
         )
+        if len(images) < len(args):
+            unhandled_images = set(unhandled_images)
+            unhandled = [
+                arg
+                for arg in args
+                if arg in unhandled_images or has_extension(arg, known)
+            ]
+        else:
+            unhandled = unhandled_images
         if len(experiments) > 0:
             filename = "<image files>"
             obj = FilenameDataWrapper(filename, experiments)
@@ -311,23 +383,68 @@ def try_read_experiments(self, args, check_format, verbose):
         :returns: Unhandled arguments
 
         """
-        from dials.util.phil import ExperimentListConverters
-        from dxtbx.model.experiment_list import InvalidExperimentListError
+        from dials.util.phil import ExperimentListConverters, FilenameDataWrapper
+        from dials.util.file_reading import (
+            has_extension,
+            read_experiment_list_dicts,
+            REFLECTION_TABLE_EXTENSIONS,
+        )
+        from dxtbx.model.experiment_list import (
+            ExperimentListFactory,
+            InvalidExperimentListError,
+        )
 
         converter = ExperimentListConverters(check_format)
+
+        # Read and decode the files in parallel, in order
+        filenames = self._files_to_read(
+            args, converter.cache, REFLECTION_TABLE_EXTENSIONS
+        )
+        decoded = read_experiment_list_dicts(
+            filenames, nproc=self._nproc_for(filenames), cache_dir=self._cache_dir
+        )
+        filenames = set(filenames)
+
         unhandled = []
         for argument in args:
+            if has_extension(argument, REFLECTION_TABLE_EXTENSIONS):
+                unhandled.append(argument)
+                continue
+            formatted_traceback = None
             try:
+                if argument in filenames:
+                    _, obj, error = next(decoded)
+                    if error is not None:
+                        exception, formatted_traceback = error
+                        raise exception
+                    experiments = ExperimentListFactory.from_dict(
+                        obj,
+                        check_format=check_format,
+                        directory=os.path.dirname(os.path.abspath(argument)),
+                    )
+                    converter.cache[argument] = FilenameDataWrapper(
+                        argument, experiments
+                    )
                 self.experiments.append(converter.from_string(argument))
             except InvalidExperimentListError as e:
                 # This is a validation-related error: The file appears not to be in the correct format
                 self._handle_converter_error(
-                    argument, e, type="ExperimentList", validation=True
+                    argument,
+                    e,
+                    type="ExperimentList",
+                    validation=True,
+                    formatted_traceback=formatted_traceback,
                 )
                 unhandled.append(argument)
             except Exception as e:
-                self._handle_converter_error(argument, e, type="ExperimentList")
+                self._handle_converter_error(
+                    argument,
+                    e,
+                    type="ExperimentList",
+                    formatted_traceback=formatted_traceback,
+                )
                 unhandled.append(argument)
+        decoded.close()
         return unhandled
 
     def try_read_reflections(self, args, verbose):
@@ -338,12 +455,35 @@ def try_read_reflections(self, args, verbose):
         :returns: Unhandled arguments
 
         """
-        from dials.util.phil import ReflectionTableConverters
+        from dials.util.phil import ReflectionTableConverters, FilenameDataWrapper
+        from dials.util.file_reading import (
+            has_extension,
+            read_reflection_tables,
+            EXPERIMENT_LIST_EXTENSIONS,
+        )
 
         converter = ReflectionTableConverters()
+
+        # Read the files in parallel, in order
+        filenames = self._files_to_read(
+            args, converter.cache, EXPERIMENT_LIST_EXTENSIONS
+        )
+        tables = read_reflection_tables(filenames, nproc=self._nproc_for(filenames))
+        filenames = set(filenames)
+
         unhandled = []
         for argument in args:
+            if has_extension(argument, EXPERIMENT_LIST_EXTENSIONS):
+                unhandled.append(argument)
+                continue
+            formatted_traceback = None
             try:
+                if argument in filenames:
+                    _, table, error = next(tables)
+                    if error is not None:
+                        exception, formatted_traceback = error
+                        raise exception
+                    converter.cache[argument] = FilenameDataWrapper(argument, table)
                 self.reflections.append(converter.from_string(argument))
             except pickle_errors as e:
                 self._handle_converter_error(
@@ -351,11 +491,18 @@ def try_read_reflections(self, args, verbose):
                     pickle.UnpicklingError("Appears to be an invalid pickle file"),
                     type="Reflections",
                     validation=True,
+                    formatted_traceback=formatted_traceback,
                 )
                 unhandled.append(argument)
             except Exception as e:
-                self._handle_converter_error(argument, e, type="Reflections")
+                self._handle_converter_error(
+                    argument,
+                    e,
+                    type="Reflections",
+                    formatted_traceback=formatted_traceback,
+                )
                 unhandled.append(argument)
+        tables.close()
         return unhandled
 
 
@@ -535,6 +682,14 @@ def parse_args(
             scan_tolerance = None
             format_kwargs = None
 
+        # The options for reading experiment list and reflection files
+        if self._read_experiments or self._read_reflections:
+            nproc = params.input.file_reading.processes
+            cache_dir = params.input.file_reading.experiment_cache
+        else:
+            nproc = None
+            cache_dir = None
+
         # Try to import everything
         importer = Importer(
             unhandled,
@@ -548,6 +703,8 @@ def parse_args(
             compare_goniometer=compare_goniometer,
             scan_tolerance=scan_tolerance,
             format_kwargs=format_kwargs,
+            nproc=nproc,
+            cache_dir=cache_dir,
         )
 
         # Grab a copy of the errors that occured in case the caller wants them
@@ -615,6 +772,10 @@ def _generate_input_scope(self):
             )
             main_scope.adopt_scope(phil_scope)
 
+        # Add the options for reading files
+        if self._read_experiments or self._read_reflections:
+            main_scope.adopt_scope(file_reading_phil_scope)
+
         # Return the input scope
         return input_phil_scope
 
@@ -108,24 +108,28 @@ def main(in_images, out_images):
         write_image(o, pixel, header)
 
 
-def main_sum(in_images, out_image):
-    n = len(in_images)
+def main_sum(in_images, out_image, nthreads=4):
+    from dials.util.image_iterator import imap_ordered
+
     import os
 
     for i in in_images:
         assert os.path.exists(i)
     assert not os.path.exists(out_image)
 
-    in_image_data = []
-    in_image_headers = []
-
-    for i in in_images:
-        print("Reading %s" % i)
-        pixel, header = read_image(i)
-        in_image_data.append(pixel)
-        in_image_headers.append(header)
-
-    sum_image = merge_counts(in_image_data)
+    # read the images ahead in threads, adding each to the sum as it arrives
+    # rather than holding all the images in memory
+    sum_image = None
+    for i, (pixel, header) in imap_ordered(
+        read_image, None, in_images, nthreads=nthreads
+    ):
+        print("Read %s" % i)
+        if sum_image is None:
+            first_image, first_header = pixel, header
+            sum_image = pixel.deep_copy()
+        else:
+            sum_image += pixel
+    sum_image.as_1d().set_selected(first_image.as_1d() < 0, first_image.as_1d())
 
     print("Writing %s" % out_image)
-    write_image(out_image, sum_image, in_image_headers[0])
+    write_image(out_image, sum_image, first_header)
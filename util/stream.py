@@ -171,22 +171,24 @@ def __init__(self, frames, header):
 
         super(Image, self).__init__()
 
-        # Load stuff
+        # Load stuff. The image data frame is kept as received, with the
+        # buffer being a view of the zmq message memory so no copy is made.
         head = json.loads(frames[0].bytes)
         info = json.loads(frames[1].bytes)
-        data = frames[2].bytes
         time = json.loads(frames[3].bytes)
 
         # The image number and data
         self.count = head["frame"]
-        self.data = data
+        self.frame = frames[2]
+        self.buffer = frames[2].buffer
         self.info = info
 
         # The dimensions
         shape = info["shape"]
-        dtype = info["type"]
-        denco = info["encoding"]
-        dsize = info["size"]
+        self.shape = shape
+        self.dtype = info["type"]
+        self.encoding = info["encoding"]
+        self.size = info["size"]
 
         # The timing info
         self.start_time = time["start_time"]
@@ -206,6 +208,60 @@ def __init__(self, frames, header):
         # else:
         #   raise RuntimeError('Unknown compression')
 
+    @property
+    def data(self):
+        """
+        Return a copy of the raw (possibly compressed) image data as bytes
+
+        """
+        return self.frame.bytes
+
+    def as_numpy_array(self):
+        """
+        Return the image data as a 2D numpy array. For uncompressed data this is
+        a read-only view of the zmq message memory, otherwise the data is
+        decompressed into a new array.
+
+        """
+        import numpy
+
+        dtype = numpy.dtype(self.dtype).newbyteorder(self.encoding[-1])
+        shape = tuple(self.shape)
+        if self.encoding in ("<", ">"):
+            array = numpy.frombuffer(self.buffer, dtype=dtype)
+        elif self.encoding.startswith("lz4"):
+            import lz4.block
+
+            array = numpy.frombuffer(
+                lz4.block.decompress(self.buffer, uncompressed_size=self.size),
+                dtype=dtype,
+            )
+        elif self.encoding.startswith("bs"):
+            import bitshuffle
+
+            # Skip the 12 byte header of total size and block size
+            array = bitshuffle.decompress_lz4(
+                numpy.frombuffer(self.buffer, dtype=numpy.uint8)[12:], shape, dtype
+            )
+        else:
+            raise RuntimeError("Unknown encoding %s" % self.encoding)
+        return array.reshape(shape)
+
+    def as_flex(self):
+        """
+        Return the image data as a 2D flex.double array for processing. A flex
+        array owns its memory, so the data are converted to double in one copy,
+        directly from the zmq message memory or the decompressed buffer. Data in
+        the non-native byte order are first swapped, which is a second copy.
+
+        """
+        from scitbx.array_family import flex
+
+        array = self.as_numpy_array()
+        if not array.dtype.isnative:
+            array = array.astype(array.dtype.newbyteorder("="))
+        return flex.double(array)
+
     def is_image(self):
         """
         Return that the object is an image